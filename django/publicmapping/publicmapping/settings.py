@@ -77,6 +77,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
+    'redistricting.middleware.VersionMemoMiddleware',
 ]
 
 ROLLBAR_CLIENT_TOKEN = os.getenv('ROLLBAR_CLIENT_TOKEN', None)
@@ -238,6 +239,17 @@ MAP_SERVER = os.getenv('MAP_SERVER_HOST')
 MAP_SERVER_USER = os.getenv('MAP_SERVER_ADMIN_USER')
 MAP_SERVER_PASS = os.getenv('MAP_SERVER_ADMIN_PASSWORD')
 
+# The number of keep-alive connections to the map server kept open by the
+# proxy, and how long (in seconds) the proxy waits for the map server
+PROXY_POOL_SIZE = int(os.getenv('PROXY_POOL_SIZE', 10))
+PROXY_TIMEOUT = int(os.getenv('PROXY_TIMEOUT', 300))
+
+# How long (in seconds) identical GetFeature and GetMap responses are served
+# from the cache by the proxy, and the largest response (in bytes) cached.
+# Proxy caching is disabled when the timeout is 0.
+PROXY_CACHE_TIMEOUT = int(os.getenv('PROXY_CACHE_TIMEOUT', 0))
+PROXY_CACHE_MAX_SIZE = int(os.getenv('PROXY_CACHE_MAX_SIZE', 1048576))
+
 if DEBUG:
     # Print emails to the console
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -259,6 +271,46 @@ SLD_ROOT = '/opt/sld/'
 
 WEB_TEMP = '/tmp'
 
+# How long (in seconds) the base geounit assignments of a plan version stay
+# cached between edits
+ASSIGNMENT_INDEX_TIMEOUT = int(os.getenv('ASSIGNMENT_INDEX_TIMEOUT', 3600))
+
+# The prefix of the keys of the registry of active sessions in redis
+SESSION_REGISTRY_PREFIX = os.getenv('SESSION_REGISTRY_PREFIX',
+                                    'sessionregistry')
+
+# The number of worker processes used to score districts in parallel with
+# geometry-only calculators. Parallel scoring is disabled when this is 0 or 1.
+# A pool is started for each list of districts, outside of transactions and
+# celery workers, and closed once they are scored.
+SCORE_CONCURRENCY = int(os.getenv('SCORE_CONCURRENCY', 0))
+
+# The number of worker processes used to union geounit geometries when
+# renesting geolevels. Parallel unions are disabled when this is 0 or 1.
+RENEST_CONCURRENCY = int(os.getenv('RENEST_CONCURRENCY', 0))
+
+# The directory that district vector tiles are cached in, and the size (in
+# bytes) that the tiles may grow to before the least recently used are
+# evicted. The directory is shared by the django and celery containers.
+TILE_CACHE_DIR = os.getenv('TILE_CACHE_DIR', '/tmp/tiles/')
+TILE_CACHE_MAX_SIZE = int(os.getenv('TILE_CACHE_MAX_SIZE', 536870912))
+
+# How long (in seconds) the splits of a plan version by another layer stay
+# cached
+SPLITS_CACHE_TIMEOUT = int(os.getenv('SPLITS_CACHE_TIMEOUT', 86400))
+
+# How long (in seconds) the per-district terms of plan scores stay cached
+DISTRICT_TERMS_TIMEOUT = int(os.getenv('DISTRICT_TERMS_TIMEOUT', 86400))
+
+# How long (in seconds) an export of a district file may hold its lock
+# before another export of the same plan version is allowed to start
+DISTRICT_FILE_LOCK_TIMEOUT = int(os.getenv('DISTRICT_FILE_LOCK_TIMEOUT', 3600))
+
+# The directory that the costs between pairs of base geounits are compiled
+# into by setup, and read from by the Adjacency calculator. The directory
+# is a volume shared by the django and celery containers.
+ADJACENCY_STORE = os.getenv('ADJACENCY_STORE', '/opt/adjacency/')
+
 SITE_ID = 2
 
 REPORTS_ENABLED = 'CALC'
@@ -24,6 +24,7 @@ Author:
 """
 
 from django.conf import settings
+from django.core.cache import caches
 from django.core.mail import send_mail
 from django.contrib.sessions.models import Session
 from django.contrib.auth import authenticate, login, logout
@@ -34,10 +35,12 @@ from django.contrib.sites.models import Site
 from django.db import transaction
 from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponseRedirect, HttpResponse, HttpResponseNotFound
+from django.http import (HttpResponseRedirect, HttpResponse,
+                         HttpResponseNotFound, StreamingHttpResponse)
 from django.shortcuts import render
 from django.template import loader, RequestContext
 from hashlib import sha1
+from redistricting import sessionregistry
 from django.utils.translation import ugettext as _, get_language
 import json
 
@@ -45,7 +48,8 @@ import json
 import cgi
 import os
 import sys
-import urllib2
+import urlparse
+import requests
 
 # for password reminders
 from random import choice
@@ -53,6 +57,21 @@ from random import choice
 import logging
 logger = logging.getLogger(__name__)
 
+# The size of the chunks that proxied responses are streamed in
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# The request headers passed on to the map server, and their META keys
+PROXY_REQUEST_HEADERS = (
+    ('If-None-Match', 'HTTP_IF_NONE_MATCH'),
+    ('If-Modified-Since', 'HTTP_IF_MODIFIED_SINCE'),
+)
+
+# The response headers passed back from the map server
+PROXY_RESPONSE_HEADERS = ('ETag', 'Last-Modified')
+
+# The HTTP session to the map server, created on first use
+_proxy_session = None
+
 
 def index(request):
     """
@@ -69,8 +88,8 @@ def index(request):
     """
 
     count = 0
-    if 'count' in request.session:
-        count = request.session['count']
+    if request.user.is_authenticated():
+        count = sessionregistry.count_user_sessions(request.user.id)
 
     avail = True
     if 'avail' in request.session:
@@ -239,6 +258,8 @@ def userlogout(request):
     key = request.session.session_key
     logout(request)
     Session.objects.filter(session_key=key).delete()
+    if key is not None:
+        sessionregistry.unregister(key)
     if 'next' in request.GET:
         return HttpResponseRedirect(request.GET['next'])
     else:
@@ -335,6 +356,109 @@ def forgotpassword(request):
     return HttpResponse(json.dumps(status))
 
 
+def get_proxy_session():
+    """
+    Get the HTTP session used to proxy requests to the map server. The
+    session keeps a pool of keep-alive connections to the map server.
+
+    Returns:
+        A requests.Session.
+    """
+    global _proxy_session
+
+    if _proxy_session is None:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.PROXY_POOL_SIZE)
+        _proxy_session = requests.Session()
+        _proxy_session.mount('http://', adapter)
+        _proxy_session.mount('https://', adapter)
+
+    return _proxy_session
+
+
+def get_proxy_cache_key(request, url):
+    """
+    Get the key that a proxied response is cached under. Only GetFeature
+    and GetMap requests are cached, and only when PROXY_CACHE_TIMEOUT is
+    set.
+
+    Parameters:
+        request -- An HttpRequest.
+        url -- The URL of the map server request.
+
+    Returns:
+        The cache key, or None if the response should not be cached.
+    """
+    if settings.PROXY_CACHE_TIMEOUT <= 0 or request.method != 'GET':
+        return None
+
+    query = urlparse.parse_qs(urlparse.urlsplit(url).query)
+    operation = dict((k.lower(), v) for k, v in query.items()).get(
+        'request', [''])[0]
+    if operation.lower() not in ('getfeature', 'getmap'):
+        return None
+
+    return 'proxy:%s' % sha1(url.encode('utf-8')).hexdigest()
+
+
+def stream_proxy_response(upstream, cache_key=None):
+    """
+    Stream the body of a map server response, closing the response when
+    it has been read, and caching the body if it is small enough.
+
+    Parameters:
+        upstream -- A streamed requests.Response.
+        cache_key -- Optional. The key to cache the response under.
+    """
+    body = [] if cache_key else None
+    size = 0
+    try:
+        for chunk in upstream.iter_content(PROXY_CHUNK_SIZE):
+            if body is not None:
+                size += len(chunk)
+                if size <= settings.PROXY_CACHE_MAX_SIZE:
+                    body.append(chunk)
+                else:
+                    body = None
+            yield chunk
+    finally:
+        upstream.close()
+
+    if body is not None:
+        content = ''.join(body)
+        caches['default'].set(cache_key, {
+            'status': upstream.status_code,
+            'content_type': upstream.headers.get('Content-Type', 'text/plain'),
+            'etag': '"%s"' % sha1(content).hexdigest(),
+            'last_modified': upstream.headers.get('Last-Modified'),
+            'content': content,
+        }, settings.PROXY_CACHE_TIMEOUT)
+
+
+def cached_proxy_response(request, cached):
+    """
+    Create a response from a cached map server response.
+
+    Parameters:
+        request -- An HttpRequest.
+        cached -- The cached response, as stored by stream_proxy_response.
+
+    Returns:
+        An HttpResponse, which is a 304 if the client already has the
+        content.
+    """
+    if request.META.get('HTTP_IF_NONE_MATCH') == cached['etag']:
+        httprsp = HttpResponse(status=304)
+    else:
+        httprsp = HttpResponse(cached['content'], status=cached['status'])
+        httprsp['Content-Type'] = cached['content_type']
+
+    httprsp['ETag'] = cached['etag']
+    if cached['last_modified']:
+        httprsp['Last-Modified'] = cached['last_modified']
+    return httprsp
+
+
 @login_required
 @cache_control(no_cache=True)
 def proxy(request):
@@ -345,6 +469,11 @@ def proxy(request):
     is on a different port, and browser javascript is restricted to
     same origin policies.
 
+    Responses are streamed to the client as they are read from the map
+    server, over pooled keep-alive connections. Conditional request
+    headers are passed on to the map server, and identical GetFeature and
+    GetMap requests may be answered from a short-lived cache.
+
     Parameters:
         request -- An HttpRequest, with an URL parameter.
 
@@ -356,21 +485,49 @@ def proxy(request):
     if not url.startswith(settings.MAP_SERVER):
         return HttpResponseNotFound()
 
-    if request.method == 'POST':
-        rsp = urllib2.urlopen(
-            urllib2.Request(url, request.raw_post_data, {
-                'Content-Type': request.META['CONTENT_TYPE']
-            }))
-    else:
-        rsp = urllib2.urlopen(url)
+    cache_key = get_proxy_cache_key(request, url)
+    if cache_key:
+        cached = caches['default'].get(cache_key)
+        if cached is not None:
+            return cached_proxy_response(request, cached)
 
-    httprsp = HttpResponse(rsp.read())
-    if rsp.info().has_key('Content-Type'):
-        httprsp['Content-Type'] = rsp.info()['Content-Type']
-    else:
-        httprsp['Content-Type'] = 'text/plain'
+    headers = {}
+    for header, meta in PROXY_REQUEST_HEADERS:
+        if meta in request.META:
+            headers[header] = request.META[meta]
 
-    rsp.close()
+    try:
+        if request.method == 'POST':
+            headers['Content-Type'] = request.META['CONTENT_TYPE']
+            upstream = get_proxy_session().post(
+                url,
+                data=request.body,
+                headers=headers,
+                stream=True,
+                timeout=settings.PROXY_TIMEOUT)
+        else:
+            upstream = get_proxy_session().get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=settings.PROXY_TIMEOUT)
+    except requests.exceptions.RequestException, ex:
+        logger.info('Could not proxy request to the map server.')
+        logger.debug('Reason: %s', ex)
+        return HttpResponse(status=502)
+
+    # Only cache complete responses
+    if upstream.status_code != 200:
+        cache_key = None
+
+    httprsp = StreamingHttpResponse(
+        stream_proxy_response(upstream, cache_key),
+        status=upstream.status_code)
+    httprsp['Content-Type'] = upstream.headers.get('Content-Type',
+                                                   'text/plain')
+    for header in PROXY_RESPONSE_HEADERS:
+        if header in upstream.headers:
+            httprsp[header] = upstream.headers[header]
 
     return httprsp
 
@@ -386,13 +543,10 @@ def session(request):
         status['message'] = 'No user found.'
         return HttpResponse(json.dumps(status))
 
-    sessions = Session.objects.all()
-    count = 0
-    for session in sessions:
-        decoded = session.get_decoded()
-        if '_auth_user_id' in decoded and decoded['_auth_user_id'] == user.id:
-            Session.objects.filter(session_key=session.session_key).delete()
-            count += 1
+    keys = sessionregistry.get_user_sessions(user.id).keys()
+    count, deleted = Session.objects.filter(session_key__in=keys).delete()
+    for key in keys:
+        sessionregistry.unregister(key)
 
     status['success'] = True
     status['message'] = 'Deleted %d sessions.' % count
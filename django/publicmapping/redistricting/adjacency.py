@@ -0,0 +1,468 @@
+"""
+A compact store of the costs between pairs of base geounits.
+
+The Adjacency calculator averages the cost (such as the travel time)
+between every pair of base geounits in a district. The costs are kept in
+a sparse matrix in compressed sparse row (CSR) form, indexed by the
+sorted portable ids of the geounits. Each pair is stored once, in the row
+of the geounit with the smaller portable id. The arrays of the matrix are
+saved as .npy files in the ADJACENCY_STORE directory, and memory-mapped
+by every process that opens them, so the costs are shared by all workers
+without copying them into each one. The average cost of each region is
+saved alongside them.
+
+Each adjacency file is first compiled into a part, which records the size
+and modification time of the file it was read from. Parts of files that
+haven't changed are reused, so an interrupted compile resumes where it
+stopped.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import csv
+import json
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The arrays that make up a store, each saved in a .npy file
+ARRAYS = ('portable_ids', 'indptr', 'indices', 'data')
+
+# The file of the average cost of each region
+REGIONS_FILE = 'regions.json'
+
+# The directory of the compiled parts of each adjacency file
+PARTS_DIRECTORY = 'parts'
+
+# The number of rows of the matrix reduced at a time
+ROW_CHUNK_SIZE = 1024
+
+# The opened store, and the modification time of its files
+_store = None
+_store_mtime = None
+
+
+class AdjacencyStore(object):
+    """
+    The costs between pairs of base geounits, as a sparse matrix.
+    """
+
+    def __init__(self, portable_ids, indptr, indices, data, regions=None):
+        """
+        Create a store from the arrays of a CSR matrix.
+
+        Parameters:
+            portable_ids -- A sorted array of the portable ids of the
+                geounits, which index the rows and columns of the matrix.
+            indptr -- The offsets of each row in indices and data.
+            indices -- The columns of the costs.
+            data -- The costs.
+            regions -- Optional. A dictionary of the average cost of each
+                region, by region name.
+        """
+        self.portable_ids = portable_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.regions = regions or {}
+
+    @staticmethod
+    def build(rows, regions=None):
+        """
+        Build a store from pairs of portable ids and their costs.
+
+        Parameters:
+            rows -- An iterable of (portable id, portable id, cost)
+                tuples. Pairs may be given in either order; if a pair is
+                given more than once, the last cost is kept.
+            regions -- Optional. A dictionary of the average cost of each
+                region, by region name.
+
+        Returns:
+            An AdjacencyStore.
+        """
+        portable_ids, first, second, costs = read_pairs(rows)
+        return AdjacencyStore.from_pairs(portable_ids, first, second, costs,
+                                         regions)
+
+    @staticmethod
+    def from_pairs(portable_ids, first, second, costs, regions=None):
+        """
+        Build a store from arrays of pairs of geounits.
+
+        Parameters:
+            portable_ids -- A sorted array of portable ids.
+            first -- The index in portable_ids of one geounit of each pair.
+            second -- The index in portable_ids of the other geounit.
+            costs -- The cost of each pair. If a pair is given more than
+                once, the last cost is kept.
+            regions -- Optional. A dictionary of the average cost of each
+                region, by region name.
+
+        Returns:
+            An AdjacencyStore.
+        """
+        size = len(portable_ids)
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        costs = np.asarray(costs, dtype=np.float64)
+
+        # Store each pair in the row of the smaller portable id, once
+        rows = np.minimum(first, second)
+        cols = np.maximum(first, second)
+        distinct = rows != cols
+        keys = (rows * size + cols)[distinct][::-1]
+        costs = costs[distinct][::-1]
+
+        # np.unique keeps the first of each key, which is the last given
+        keys, first_index = np.unique(keys, return_index=True)
+        costs = costs[first_index]
+
+        rows = keys // size
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+
+        return AdjacencyStore(portable_ids, indptr,
+                              (keys % size).astype(np.int32), costs, regions)
+
+    @staticmethod
+    def compile(adjacencies, directory):
+        """
+        Build a store from tab separated adjacency files, and save it.
+
+        Files that have already been compiled into parts, and haven't
+        changed since, aren't read again.
+
+        Parameters:
+            adjacencies -- A list of tuples of the path to a file with
+                rows of two portable ids and the cost between them, and
+                the name of the region of the file.
+            directory -- The directory to save the store in.
+
+        Returns:
+            An AdjacencyStore.
+        """
+        parts_directory = os.path.join(directory, PARTS_DIRECTORY)
+        if not os.path.exists(parts_directory):
+            os.makedirs(parts_directory)
+
+        parts = []
+        for i, (path, region) in enumerate(adjacencies):
+            part_path = os.path.join(parts_directory, '%d.npz' % i)
+            part = load_part(part_path, path, region)
+            if part is None:
+                logger.info('Compiling adjacency file %s of %s (%s)', i + 1,
+                            len(adjacencies), path)
+                part = compile_part(path, region, part_path)
+            else:
+                logger.info('Adjacency file %s of %s (%s) already compiled',
+                            i + 1, len(adjacencies), path)
+            parts.append(part)
+
+        # Average the costs of all the files of each region
+        totals = {}
+        for part in parts:
+            total, count = totals.get(part['region'], (0.0, 0))
+            totals[part['region']] = (total + part['total'],
+                                      count + part['count'])
+        regions = dict((region, total / count)
+                       for region, (total, count) in totals.iteritems()
+                       if count > 0)
+
+        # Index the pairs of every part by the portable ids of all parts
+        portable_ids = np.unique(
+            np.concatenate([np.array([], dtype=str)] +
+                           [part['portable_ids'] for part in parts]))
+        first, second, costs = [], [], []
+        for part in parts:
+            codes = np.searchsorted(portable_ids, part['portable_ids'])
+            first.append(codes[part['first']])
+            second.append(codes[part['second']])
+            costs.append(part['costs'])
+
+        store = AdjacencyStore.from_pairs(
+            portable_ids,
+            np.concatenate([np.array([], dtype=np.int64)] + first),
+            np.concatenate([np.array([], dtype=np.int64)] + second),
+            np.concatenate([np.array([], dtype=np.float64)] + costs),
+            regions)
+        store.save(directory)
+        return store
+
+    def save(self, directory):
+        """
+        Save the arrays of this store as .npy files.
+
+        Parameters:
+            directory -- The directory to save the store in.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        for name in ARRAYS:
+            # Write to a temporary file, so readers never see partial files
+            path = os.path.join(directory, '%s.npy' % name)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.rename(path + '.tmp', path)
+
+        path = os.path.join(directory, REGIONS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.regions, f)
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(directory):
+        """
+        Open a saved store, memory-mapping its arrays.
+
+        Parameters:
+            directory -- The directory the store was saved in.
+
+        Returns:
+            An AdjacencyStore.
+        """
+        arrays = [
+            np.load(os.path.join(directory, '%s.npy' % name), mmap_mode='r')
+            for name in ARRAYS
+        ]
+
+        regions = {}
+        path = os.path.join(directory, REGIONS_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                regions = json.load(f)
+
+        return AdjacencyStore(*arrays, regions=regions)
+
+    def lookup(self, portable_ids):
+        """
+        Find the rows of geounits in the matrix.
+
+        Parameters:
+            portable_ids -- A list of portable ids.
+
+        Returns:
+            A sorted array of the distinct rows of the portable ids that
+            are in this store.
+        """
+        if len(portable_ids) == 0 or len(self.portable_ids) == 0:
+            return np.array([], dtype=np.int64)
+
+        wanted = np.array([str(pid) for pid in portable_ids])
+        found = np.searchsorted(self.portable_ids, wanted)
+        found = np.minimum(found, len(self.portable_ids) - 1)
+        found = found[self.portable_ids[found] == wanted]
+        return np.unique(found)
+
+    def pair_cost(self, portable_ids):
+        """
+        Sum the costs between every pair of a set of geounits.
+
+        Parameters:
+            portable_ids -- A list of portable ids.
+
+        Returns:
+            The total cost of all pairs. Pairs without a cost count as 0.
+        """
+        found = self.lookup(portable_ids)
+        if len(found) < 2:
+            return 0.0
+
+        member = np.zeros(len(self.portable_ids), dtype=bool)
+        member[found] = True
+
+        total = 0.0
+        for i in range(0, len(found), ROW_CHUNK_SIZE):
+            chunk = found[i:i + ROW_CHUNK_SIZE]
+            starts = self.indptr[chunk]
+            lengths = self.indptr[chunk + 1] - starts
+            count = lengths.sum()
+            if count == 0:
+                continue
+
+            # The positions of every cost in the rows of the chunk
+            offsets = np.cumsum(lengths) - lengths
+            positions = np.repeat(starts - offsets, lengths) + np.arange(count)
+            inside = member[self.indices[positions]]
+            total += float(self.data[positions][inside].sum())
+
+        return total
+
+
+def read_pairs(rows):
+    """
+    Read pairs of geounits and their costs into arrays.
+
+    Parameters:
+        rows -- An iterable of (portable id, portable id, cost) tuples.
+
+    Returns:
+        A tuple of a sorted array of the portable ids, arrays of the
+        index of the first and second geounit of each pair, and an array
+        of the costs.
+    """
+    first, second, costs = [], [], []
+    for row in rows:
+        first.append(row[0])
+        second.append(row[1])
+        costs.append(float(row[2]))
+
+    portable_ids, codes = np.unique(
+        np.array(first + second, dtype=str), return_inverse=True)
+    codes = codes.astype(np.int64)
+    return (
+        portable_ids,
+        codes[:len(first)],
+        codes[len(first):],
+        np.array(costs, dtype=np.float64),
+    )
+
+
+def compile_part(path, region, part_path):
+    """
+    Compile one adjacency file into a part.
+
+    Parameters:
+        path -- The path of the tab separated adjacency file.
+        region -- The name of the region of the file.
+        part_path -- The path to save the part to.
+
+    Returns:
+        A dictionary of the arrays and totals of the part.
+    """
+    with open(path, 'r') as f:
+        rows = (row for row in csv.reader(f, delimiter='\t')
+                if len(row) >= 3)
+        portable_ids, first, second, costs = read_pairs(rows)
+
+    stat = os.stat(path)
+    part = {
+        'source': path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'region': region,
+        'total': float(costs.sum()),
+        'count': len(costs),
+        'portable_ids': portable_ids,
+        'first': first,
+        'second': second,
+        'costs': costs,
+    }
+
+    # Write to a temporary file, so an interrupted compile leaves no part
+    with open(part_path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            meta=np.array(
+                json.dumps(
+                    dict((k, v) for k, v in part.iteritems()
+                         if not isinstance(v, np.ndarray)))),
+            portable_ids=portable_ids,
+            first=first,
+            second=second,
+            costs=costs)
+    os.rename(part_path + '.tmp', part_path)
+
+    return part
+
+
+def load_part(part_path, path, region):
+    """
+    Load a compiled part, if it was compiled from the current contents
+    of an adjacency file.
+
+    Parameters:
+        part_path -- The path of the part.
+        path -- The path of the tab separated adjacency file.
+        region -- The name of the region of the file.
+
+    Returns:
+        A dictionary of the arrays and totals of the part, or None if the
+        file needs to be compiled.
+    """
+    if not os.path.exists(part_path):
+        return None
+
+    try:
+        with np.load(part_path) as arrays:
+            part = json.loads(str(arrays['meta']))
+            stat = os.stat(path)
+            if part['source'] != path or part['region'] != region or \
+                    part['size'] != stat.st_size or \
+                    part['mtime'] != stat.st_mtime:
+                return None
+
+            for name in ('portable_ids', 'first', 'second', 'costs'):
+                part[name] = arrays[name]
+        return part
+    except Exception as ex:
+        logger.info('Could not read compiled adjacency part %s.', part_path)
+        logger.debug('Reason: %s', ex)
+        return None
+
+
+def get_store():
+    """
+    Get the store in the ADJACENCY_STORE directory. The store is opened
+    once per process, and opened again when it is compiled again.
+
+    Returns:
+        An AdjacencyStore, or None if no store has been compiled.
+    """
+    global _store, _store_mtime
+
+    directory = getattr(settings, 'ADJACENCY_STORE', None)
+    if not directory:
+        return None
+
+    try:
+        mtime = max(
+            os.path.getmtime(os.path.join(directory, '%s.npy' % name))
+            for name in ARRAYS)
+    except OSError:
+        return None
+
+    if _store is None or _store_mtime != mtime:
+        try:
+            _store = AdjacencyStore.load(directory)
+            _store_mtime = mtime
+        except Exception as ex:
+            logger.info('Could not open the adjacency store.')
+            logger.debug('Reason: %s', ex)
+            return None
+
+    return _store
+
+
+def get_store_version():
+    """
+    Get a token that changes whenever the store is compiled again, to
+    key cached costs with.
+
+    Returns:
+        A string, or None if no store has been compiled.
+    """
+    if get_store() is None:
+        return None
+    return '%d' % (_store_mtime * 1000)
@@ -0,0 +1,162 @@
+"""
+An in-memory index of the base geounit assignments in a plan.
+
+Editing a plan needs to know which district each base geounit in a
+selection belongs to. Finding that out spatially takes a multipass search
+against the database for every district that is touched, so instead the
+assignments of every base geounit are kept in a compact, array-backed
+index, cached per plan version, and carried forward incrementally with
+each edit.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import hashlib
+import numpy as np
+
+# The district_id reported for base geounits that are not in any district
+NO_DISTRICT = -1
+
+
+class AssignmentIndex(object):
+    """
+    A mapping of base Geounit IDs to the district_ids they are assigned to.
+
+    The index is stored as two parallel numpy arrays sorted by geounit ID,
+    so looking up a selection is a binary search, and deriving the index
+    for the next plan version is a single array copy.
+    """
+
+    def __init__(self, geounit_ids, district_ids):
+        """
+        Create a new index.
+
+        Parameters:
+            geounit_ids -- A sequence of base Geounit IDs.
+            district_ids -- A sequence of the district_ids (NOT the ids)
+                the geounits are assigned to, parallel to geounit_ids.
+        """
+        geounit_ids = np.asarray(geounit_ids, dtype=np.int64)
+        district_ids = np.asarray(district_ids, dtype=np.int32)
+        order = np.argsort(geounit_ids, kind='mergesort')
+        self.geounit_ids = geounit_ids[order]
+        self.district_ids = district_ids[order]
+
+    def __len__(self):
+        return len(self.geounit_ids)
+
+    @staticmethod
+    def cache_key(plan_id, version, district_pks):
+        """
+        Get the key an index is cached under.
+
+        The primary keys of the districts in the plan at the version are
+        part of the key, so an index can never be mistaken for one that
+        was built for a version that has since been purged and reused.
+
+        Parameters:
+            plan_id -- The ID of the Plan.
+            version -- The version of the Plan.
+            district_pks -- The ids (NOT the district_ids) of the Districts
+                in the plan at the version.
+
+        Returns:
+            A key for the cache.
+        """
+        digest = hashlib.md5(','.join(
+            str(pk) for pk in sorted(district_pks))).hexdigest()
+        return 'assignments:plan:%d:version:%d:%s' % (plan_id, version,
+                                                      digest)
+
+    def _positions(self, geounit_ids):
+        """
+        Find where geounits are stored in the index.
+
+        Returns:
+            A tuple of the positions of the geounits in the index, and a
+            mask of the geounits that are actually in the index.
+        """
+        geounit_ids = np.asarray(geounit_ids, dtype=np.int64)
+        if len(self.geounit_ids) == 0:
+            return (np.zeros(len(geounit_ids), dtype=np.intp),
+                    np.zeros(len(geounit_ids), dtype=bool))
+
+        positions = np.searchsorted(self.geounit_ids, geounit_ids)
+        positions = np.minimum(positions, len(self.geounit_ids) - 1)
+        return positions, self.geounit_ids[positions] == geounit_ids
+
+    def lookup(self, geounit_ids):
+        """
+        Get the district_ids that geounits are assigned to.
+
+        Parameters:
+            geounit_ids -- A sequence of base Geounit IDs.
+
+        Returns:
+            A numpy array of district_ids, parallel to geounit_ids. Geounits
+            that are not assigned to any district are reported as
+            NO_DISTRICT.
+        """
+        positions, found = self._positions(geounit_ids)
+        if len(self.district_ids) == 0:
+            return np.repeat(np.int32(NO_DISTRICT), len(positions))
+        return np.where(found, self.district_ids[positions], NO_DISTRICT)
+
+    def get_geounits(self, district_id):
+        """
+        Get the base geounits assigned to a district.
+
+        Parameters:
+            district_id -- The district_id (NOT the id) of the District.
+
+        Returns:
+            A numpy array of base Geounit IDs.
+        """
+        return self.geounit_ids[self.district_ids == district_id]
+
+    def assign(self, geounit_ids, district_id):
+        """
+        Derive a new index with geounits moved to a district. This index
+        is left unchanged, since it still describes the previous version.
+
+        Parameters:
+            geounit_ids -- A sequence of base Geounit IDs.
+            district_id -- The district_id (NOT the id) of the District
+                the geounits are moving to.
+
+        Returns:
+            A new AssignmentIndex.
+        """
+        geounit_ids = np.asarray(geounit_ids, dtype=np.int64)
+        positions, found = self._positions(geounit_ids)
+
+        district_ids = self.district_ids.copy()
+        district_ids[positions[found]] = district_id
+
+        missing = np.unique(geounit_ids[~found])
+        if len(missing) == 0:
+            index = AssignmentIndex([], [])
+            index.geounit_ids = self.geounit_ids
+            index.district_ids = district_ids
+            return index
+
+        return AssignmentIndex(
+            np.concatenate((self.geounit_ids, missing)),
+            np.concatenate((district_ids,
+                            np.repeat(np.int32(district_id), len(missing)))))
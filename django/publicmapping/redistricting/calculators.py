@@ -29,22 +29,20 @@ Author:
 """
 
 from math import sqrt, pi
-from django.contrib.gis.geos import Point, LineString
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core.cache import caches
 from django.utils.translation import ugettext as _
 from django.template import Template, Context
 from decimal import Decimal
-from copy import copy
-import random
 
 from django.db.models import Q
 import operator
-import itertools
 import json
+import logging
 from django.conf import settings
-from redisutils import key_gen
-redis_settings = settings.KEY_VALUE_STORE
+from redistricting import adjacency, contiguity, geometrymetrics
+
+logger = logging.getLogger(__name__)
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -71,6 +69,25 @@ class CalculatorBase(object):
     #
     arg_dict = {}
 
+    # Whether this calculator only reads the geometry, district_id and
+    # num_members of a district, and can be run in a worker process
+    # without database access.
+    parallel_safe = False
+
+    # Whether this calculator reads the contiguity overrides of a district.
+    uses_contiguity_overrides = False
+
+    # Whether this calculator reads the geometry of a district. Calculators
+    # that only read the stored measures of the geometry don't, so their
+    # districts are fetched without it.
+    reads_geometry = True
+
+    # Whether the plan score of this calculator is built from independent
+    # per-district terms. Decomposable calculators implement district_term
+    # and combine_terms, so a plan score can reuse the terms of districts
+    # that haven't changed since the previous version of the plan.
+    decomposable = False
+
     def __init__(self):
         """
         Initialize the result and argument dictionary.
@@ -85,6 +102,42 @@ class CalculatorBase(object):
         """
         pass
 
+    def district_term(self, district):
+        """
+        Compute the term that a single district contributes to the score
+        of its plan. The term depends only on the district and the
+        arguments of this calculator.
+
+        @param district: A L{District} in the plan.
+
+        @return: The term of the district, or None if the district does not
+            contribute to the plan score.
+        """
+        return None
+
+    def combine_terms(self, terms):
+        """
+        Set the result of this calculator from the terms of all the
+        districts in a plan.
+
+        @param terms: A list of the terms of every district in the plan, as
+            returned by district_term.
+        """
+        pass
+
+    def prefetch(self, plans, version=None):
+        """
+        Prepare to compute the scores of many plans, such as for a
+        leaderboard, before each plan is computed in turn. Calculators that
+        can do the work of many plans at once, and cache it, override this.
+        The base class prepares nothing.
+
+        @param plans: A list of the L{Plan}s that will be computed.
+        @param version: Optional. The version of the plans, defaults to the
+            most recent version of each plan.
+        """
+        pass
+
     def sortkey(self):
         """
         Generate a key used to sort this calculator relative to all other
@@ -253,6 +306,10 @@ class Schwartzberg(CalculatorBase):
     districts in a plan.
     """
 
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
+
     def compute(self, **kwargs):
         """
         Calculate the Schwartzberg measure of compactness.
@@ -267,7 +324,7 @@ class Schwartzberg(CalculatorBase):
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -275,29 +332,43 @@ class Schwartzberg(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        compactness = 0
-        for district in districts:
-            if district.district_id == 0:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
 
-            if district.geom.empty:
-                continue
+    def district_term(self, district):
+        """
+        Calculate the Schwartzberg compactness of one district.
 
-            if district.geom.length == 0:
-                continue
+        @param district: A L{District} in the plan.
+
+        @return: The compactness of the district, or None for empty and
+            unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
+
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
 
-            r = sqrt(district.geom.area / pi)
-            circumference = 2 * pi * r
-            compactness += circumference / district.geom.length
-            num += 1
+        r = sqrt(metrics.area / pi)
+        circumference = 2 * pi * r
+        return circumference / metrics.perimeter
 
-        self.result = {'value': (compactness / num) if num > 0 else 0}
+    def combine_terms(self, terms):
+        """
+        Average the compactness of the districts in a plan.
+
+        @param terms: The compactness of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        self.result = {
+            'value': (sum(terms) / len(terms)) if len(terms) > 0 else 0
+        }
 
     def html(self):
         """
@@ -323,7 +394,10 @@ class Roeck(CalculatorBase):
     district, or it will average the compactness scores of all districts
     in a plan.
     """
-    rec = 0
+
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
 
     def compute(self, **kwargs):
         """
@@ -336,11 +410,10 @@ class Roeck(CalculatorBase):
         @keyword version: Optional. The version of the plan, defaults to
             the most recent version.
         """
-        random.seed()
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -348,269 +421,60 @@ class Roeck(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        compactness = 0
-        for district in districts:
-            if district.district_id == 0:
-                continue
-
-            if district.geom.empty:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
 
-            # Convert the coordinates in the convex hull to a list of GEOS Points
-            hull = map(lambda x: Point(x[0], x[1]),
-                       list(district.geom.convex_hull.coords[0]))
-            disk = self.minidisk(hull)
-
-            cir_area = pi * disk.r * disk.r
+    def district_term(self, district):
+        """
+        Calculate the Roeck compactness of one district.
 
-            compactness += district.geom.area / cir_area
-            num += 1
+        @param district: A L{District} in the plan.
 
-        try:
-            self.result = {'value': compactness / num if num > 0 else 0}
-        except:
-            self.result = {'value': _('n/a')}
+        @return: The compactness of the district, or None for empty and
+            unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
 
-    class Circle:
-        """
-        Helper class for the Roeck calculator. A Circle class can create circles based
-        on 1, 2, or 3 coordinates. A circle has a center and a radius. A circle also
-        can test if another point lies within the area of itself.
-        """
-        cx = None
-        cy = None
-        r = None
-
-        def __init__(self, pts):
-            """
-            Create a new Circle helper. Constructing a Circle with one coordinate
-            creates a 0 diameter circle, centered on the coordinate. Constructing
-            a Circle with two coordinates creates a circle positioned between the
-            two coordinates, with the diameter set to the distance between the
-            points. Constructing a Circle with three coordinates creates a circle
-            that passes through all three points.
-
-            @param pts: A set of points that lay on the perimeter of this circle.
-
-            @return: A calculated Circle that contains the coordinates.
-            """
-            if len(pts) == 1:
-                # Create a zero diameter circle at the coordinate location
-                self.cx = pts[0].coords[0]
-                self.cy = pts[0].coords[1]
-                self.r = 0
-            elif len(pts) == 2:
-                # Create a circle between the coordinates, with the diameter
-                # set to the distance between the points.
-                ls = LineString(pts)
-                self.cx = ls.centroid.x
-                self.cy = ls.centroid.y
-                self.r = ls.length / 2
-            elif len(pts) == 3:
-                # Create a circle that contains all three points
-                try:
-                    (
-                        p1,
-                        p2,
-                        p3,
-                    ) = self.deperpendicularize(pts)
-                except ValueError:
-                    # If the coordinates cannot be deperpendicularized, assume
-                    # that they are colinear.
-                    ls = LineString(pts)
-                    self.cx = ls.centroid.x
-                    self.cy = ls.centroid.y
-                    self.r = ls.length / 2
-                    return
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
 
-                # If the coordinates describe a pair of lines that are perpendicular
-                # and are parallel to the X and Y axes, the center of that rectangle
-                # is the center of the circle.
-                if abs(p2.coords[0] - p1.coords[0]) == 0 and abs(
-                        p3.coords[1] - p2.coords[1]) == 0:
-                    self.cx = (p2.coords[0] + p3.coords[0]) / 2
-                    self.cy = (p1.coords[1] + p2.coords[1]) / 2
-                    ls = LineString([p1, Point(self.cx, self.cy)])
-                    self.r = ls.length
-                    return
+        cir_area = pi * metrics.circle_radius * metrics.circle_radius
 
-                # Determination of the center point is described pretty well here:
-                #
-                # "Equation of a Circle from 3 Points (2 dimensions)"
-                # http://paulbourke.net/geometry/circlefrom3/
-                #
-                m1 = (p2.coords[1] - p1.coords[1]) / (
-                    p2.coords[0] - p1.coords[0])
-                m2 = (p3.coords[1] - p2.coords[1]) / (
-                    p3.coords[0] - p2.coords[0])
-
-                self.cx = (m1 * m2 * (p1.coords[1] - p3.coords[1]) + \
-                    m2 * (p1.coords[0] + p2.coords[0]) - \
-                    m1 * (p2.coords[0] + p3.coords[0]) ) / \
-                    (2 * (m2-m1) )
-                self.cy = -1 * (self.cx - (p1.coords[0]+p2.coords[0]) / 2.0) / m1 + \
-                    (p1.coords[1] + p2.coords[1]) / 2.0
-                lsR = LineString(pts[0], (
-                    self.cx,
-                    self.cy,
-                ))
-                self.r = lsR.length
-            else:
-                # Creating a circle with 0 or > 3 coordinates is not supported.
-                self.cx = None
-                self.cy = None
-                self.r = None
-
-        def deperpendicularize(self, pts):
-            """
-            Reorder coordinates to ensure that they are not perpendicular
-            in a way that may cause divide by zero exceptions. This tests
-            all 6 permutations of the point set, testing it with the
-            isperpendicular method.
-
-            @params pts: A set of points, passed in as an array
-            @return: A 3 element tuple with the reordered points.
-            """
-            if not self.isperpendicular(pts[0], pts[1], pts[2]):
-                return (
-                    pts[0],
-                    pts[1],
-                    pts[2],
-                )
-            if not self.isperpendicular(pts[0], pts[2], pts[1]):
-                return (
-                    pts[0],
-                    pts[2],
-                    pts[1],
-                )
-            if not self.isperpendicular(pts[1], pts[0], pts[2]):
-                return (
-                    pts[1],
-                    pts[0],
-                    pts[2],
-                )
-            if not self.isperpendicular(pts[1], pts[2], pts[0]):
-                return (
-                    pts[1],
-                    pts[2],
-                    pts[0],
-                )
-            if not self.isperpendicular(pts[2], pts[1], pts[0]):
-                return (
-                    pts[2],
-                    pts[1],
-                    pts[0],
-                )
-            if not self.isperpendicular(pts[2], pts[0], pts[1]):
-                return (
-                    pts[2],
-                    pts[0],
-                    pts[1],
-                )
-
-            # Raise a general exception here, and fall back to
-            # estimating a 2 point circle.
-            raise ValueError('All combinations are perpendicular.')
-
-        def isperpendicular(self, pt1, pt2, pt3):
-            """
-            Test a set of points to see if they are perpendicular.
-            Points are deemed perpendicular if they describe two
-            different lines that are parallel to the X and Y axes.
-
-            @param pt1: The first point to test.
-            @param pt2: The second point to test.
-            @param pt3: The third point to test.
-
-            @return: A boolean flag indicating if the points describe
-            a set of perpendicular lines that are parallel with the
-            X and Y axes.
-            """
-            dy1 = pt2.coords[1] - pt1.coords[1]
-            dx1 = pt2.coords[0] - pt1.coords[0]
-            dy2 = pt3.coords[1] - pt2.coords[1]
-            dx2 = pt3.coords[0] - pt2.coords[0]
-
-            if abs(dx1) == 0 and abs(dy2) == 0:
-                return False
-            elif abs(dy1) == 0:
-                return True
-            elif abs(dy2) == 0:
-                return True
-            elif abs(dx1) == 0:
-                return True
-            elif abs(dx2) == 0:
-                return True
+        return metrics.area / cir_area
 
-            return False
-
-        def contains(self, pt):
-            """
-            Does this circle contain a specified point.
+    def combine_terms(self, terms):
+        """
+        Average the compactness of the districts in a plan.
 
-            @param: pt The specified point
-            @return: A boolean flag indicating if the specified point lies
-                     within the area of the Circle.
-            """
-            ls = LineString([pt, Point(self.cx, self.cy)])
-            return ls.length <= self.r
+        @param terms: The compactness of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        try:
+            self.result = {
+                'value': sum(terms) / len(terms) if len(terms) > 0 else 0
+            }
+        except:
+            self.result = {'value': _('n/a')}
 
     def minidisk(self, points):
         """
-        A recursive minimum enclosing disk algorithm. Based on E. Welzl,
-        "Smallest enclosing disks (balls and ellipsoids)", 1991.
-
-        This code borrows some patterns from the applet source here:
-        http://www.sunshine2k.de/stuff/Java/Welzl/Welzl.html
+        Find the minimum enclosing disk of a set of points.
 
         @param points: An array of points, from a GEOSGeometry.
-        @return: A L{Roeck.Circle} minimum enclosing disk for the points.
-        """
-        self.rec = 0
-        shuffled = copy(points[1:])
-        random.shuffle(shuffled)
-        return self.b_minidisk(shuffled, len(shuffled), [None, None, None], 0)
-
-    def b_minidisk(self, points, npts, boundary, nbnd):
-        """
-        A recursive minimum enclosing disk algorithm. Based on E. Welzl,
-        "Smallest enclosing disks (balls and ellipsoids)", 1991.
-
-        This code borrows some patterns from the applet source here:
-        http://www.sunshine2k.de/stuff/Java/Welzl/Welzl.html
-
-        @param points: A random array of non-duplicating points.
-        @param npts: The position in the point array for searching.
-        @param boundary: The farthest outliers on or in the smallest disk.
-        @param nbnd: The index of the boundary list for the next boundary point.
-        @return: A L{Roeck.Circle} minimum enclosing disk for the points.
-        """
-        if npts == 1 and nbnd == 0:
-            disk = Roeck.Circle([points[0]])
-        elif npts == 1 and nbnd == 1:
-            disk = Roeck.Circle([points[0], boundary[0]])
-        elif npts == 0 and nbnd == 2:
-            disk = Roeck.Circle(boundary[0:2])
-        elif nbnd == 3:
-            disk = Roeck.Circle(boundary)
-        else:
-            self.rec += 1
-            disk = self.b_minidisk(points, npts - 1, boundary, nbnd)
-
-            if not disk.contains(points[npts - 1]):
-                boundary[nbnd] = points[npts - 1]
-
-                self.rec += 1
-                disk = self.b_minidisk(points, npts - 1, boundary, nbnd + 1)
-
-        self.rec -= 1
-        return disk
+        @return: A L{geometrymetrics.Circle} minimum enclosing disk for the
+            points.
+        """
+        coords = [p.coords[0:2] for p in points]
+        # A closed ring repeats its first point
+        if len(coords) > 1 and coords[0] == coords[-1]:
+            coords = coords[:-1]
+        return geometrymetrics.minimum_enclosing_circle(coords)
 
     def html(self):
         """
@@ -637,6 +501,10 @@ class PolsbyPopper(CalculatorBase):
     in a plan.
     """
 
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
+
     def compute(self, **kwargs):
         """
         Calculate the Polsby-Popper measure of compactness.
@@ -651,7 +519,7 @@ class PolsbyPopper(CalculatorBase):
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -659,29 +527,40 @@ class PolsbyPopper(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        compactness = 0
-        for district in districts:
-            if district.district_id == 0:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
 
-            if district.geom.empty:
-                continue
+    def district_term(self, district):
+        """
+        Calculate the Polsby-Popper compactness of one district.
 
-            perimeter = 0
-            for poly in district.geom:
-                for linestring in poly:
-                    perimeter += linestring.length
+        @param district: A L{District} in the plan.
 
-            compactness += 4 * pi * district.geom.area / perimeter / perimeter
-            num += 1
+        @return: The compactness of the district, or None for empty and
+            unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
 
-        self.result = {'value': compactness / num}
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
+
+        perimeter = metrics.perimeter
+        return 4 * pi * metrics.area / perimeter / perimeter
+
+    def combine_terms(self, terms):
+        """
+        Average the compactness of the districts in a plan.
+
+        @param terms: The compactness of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        self.result = {'value': sum(terms) / len(terms)}
 
     def html(self):
         """
@@ -708,6 +587,10 @@ class Gravelius(CalculatorBase):
     in a plan.
     """
 
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
+
     def compute(self, **kwargs):
         """
         Calculate the Gravelius measure of compactness.
@@ -722,7 +605,7 @@ class Gravelius(CalculatorBase):
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -730,36 +613,48 @@ class Gravelius(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        compactness = 0
-        for district in districts:
-            if district.district_id == 0:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
 
-            if district.geom.empty:
-                continue
+    def district_term(self, district):
+        """
+        Calculate the Gravelius compactness of one district.
+
+        @param district: A L{District} in the plan.
+
+        @return: The compactness of the district, or None for empty and
+            unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
+
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
 
-            perimeter = 0
-            for poly in district.geom:
-                for linestring in poly:
-                    perimeter += linestring.length
+        perimeter = metrics.perimeter
 
-            # Calculate the radius of a circle with the same area as the district
-            radius = sqrt(district.geom.area / pi)
-            circumference = 2 * pi * radius
-            # The compactness is the ratio of perimeter to circumference
-            compactness += perimeter / circumference
-            num += 1
+        # Calculate the radius of a circle with the same area as the district
+        radius = sqrt(metrics.area / pi)
+        circumference = 2 * pi * radius
+        # The compactness is the ratio of perimeter to circumference
+        return perimeter / circumference
+
+    def combine_terms(self, terms):
+        """
+        Average the compactness of the districts in a plan.
 
-        if num == 0:
+        @param terms: The compactness of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        if len(terms) == 0:
             val = 0
         else:
-            val = compactness / num
+            val = sum(terms) / len(terms)
 
         self.result = {'value': val}
 
@@ -789,6 +684,10 @@ class LengthWidthCompactness(CalculatorBase):
     in a plan.
     """
 
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
+
     def compute(self, **kwargs):
         """
         Calculate the Length/Width measure of compactness.
@@ -803,7 +702,7 @@ class LengthWidthCompactness(CalculatorBase):
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -811,29 +710,45 @@ class LengthWidthCompactness(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        compactness = 0
-        for district in districts:
-            if district.district_id == 0:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
 
-            if district.geom.empty:
-                continue
+    def district_term(self, district):
+        """
+        Calculate the Length/Width compactness of one district.
 
-            bbox = district.geom.extent
-            lw = (bbox[3] - bbox[1]) / (bbox[2] - bbox[0])
-            if lw > 1:
-                lw = 1 / lw
+        @param district: A L{District} in the plan.
 
-            compactness += lw
-            num += 1
+        @return: The compactness of the district, or None for empty and
+            unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
 
-        self.result = {'value': compactness / num if num > 0 else 0}
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
+
+        lw = metrics.height / metrics.width
+        if lw > 1:
+            lw = 1 / lw
+
+        return lw
+
+    def combine_terms(self, terms):
+        """
+        Average the compactness of the districts in a plan.
+
+        @param terms: The compactness of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        self.result = {
+            'value': sum(terms) / len(terms) if len(terms) > 0 else 0
+        }
 
     def html(self):
         """
@@ -1099,6 +1014,8 @@ class Range(CalculatorBase):
     range.
     """
 
+    decomposable = True
+
     def compute(self, **kwargs):
         """
         Calculate and determine if a value lies within a range.
@@ -1125,32 +1042,48 @@ class Range(CalculatorBase):
         else:
             return
 
-        count = 0
+        self.combine_terms([self.district_term(d) for d in districts])
+
+    def district_term(self, district):
+        """
+        Determine if the value of one district lies within the range.
+
+        @param district: A L{District} in the plan.
+
+        @return: 1 if the value is within the range, 0 if not, or None if
+            the district is unassigned or has no value.
+        """
+        if district.district_id == 0:
+            return None
 
         if 'apply_num_members' in self.arg_dict:
             apply_num_members = int(self.arg_dict['apply_num_members'][1]) == 1
         else:
             apply_num_members = False
 
-        for district in districts:
-            if district.district_id == 0:
-                continue
+        val = self.get_value('value', district)
 
-            val = self.get_value('value', district)
+        if apply_num_members and district.num_members > 1:
+            val = float(val) / district.num_members
 
-            if apply_num_members and district.num_members > 1:
-                val = float(val) / district.num_members
+        minval = self.get_value('min', district)
+        maxval = self.get_value('max', district)
 
-            minval = self.get_value('min', district)
-            maxval = self.get_value('max', district)
+        if val is None or minval is None or maxval is None:
+            return None
 
-            if val is None or minval is None or maxval is None:
-                continue
+        if float(val) > float(minval) and float(val) < float(maxval):
+            return 1
 
-            if float(val) > float(minval) and float(val) < float(maxval):
-                count += 1
+        return 0
 
-        self.result = {'value': count}
+    def combine_terms(self, terms):
+        """
+        Count the districts that lie within the range.
+
+        @param terms: The range test of every district in the plan.
+        """
+        self.result = {'value': sum(t for t in terms if t is not None)}
 
 
 class Contiguity(CalculatorBase):
@@ -1179,8 +1112,17 @@ class Contiguity(CalculatorBase):
     If this calculator is called with a plan, it will tally up the number
     of districts that are contiguous.
 
+    Once the setup command has built the adjacency of the base geounits,
+    districts are checked over the adjacency graph, and every district of
+    a plan is checked at once. Otherwise, and in worker processes without
+    database access, the parts of the district geometry are compared.
+
     """
 
+    parallel_safe = True
+    uses_contiguity_overrides = True
+    decomposable = True
+
     def compute(self, **kwargs):
         """
         Determine if a district is contiguous.
@@ -1201,80 +1143,153 @@ class Contiguity(CalculatorBase):
             plan = kwargs['plan']
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
+
+            graph = contiguity.get_graph(
+                plan.legislative_body.get_base_geolevel())
+            if graph is not None:
+                self.combine_terms(self.plan_terms(plan, version, graph))
+                return
+
             districts = plan.get_districts_at_version(
                 version, include_geom=True)
 
         else:
             return
 
-        if 'allow_single_point' in self.arg_dict:
-            allow_single = int(self.arg_dict['allow_single_point'][1]) == 1
+        if 'district' in kwargs:
+            self.combine_terms(
+                [1 if self.is_contiguous(d) else 0 for d in districts])
         else:
-            allow_single = False
+            self.combine_terms([self.district_term(d) for d in districts])
 
-        count = 0
-        for district in districts:
-            if len(district.geom) == 1 and district.district_id != 0:
-                count += 1
-            else:
-                if district.district_id == 0:
-                    # for plan summations of contiguity, ignore the unassigned in the tally
-                    if 'plan' in kwargs:
-                        continue
-                    elif len(district.geom) == 1:
-                        count += 1
-                        continue
-
-                # if the district has no geometry, i.e. an empty unassigned district,
-                # treat it as contiguous
-                if len(district.geom) == 0:
-                    count += 1
-                    continue
+    def allows_single_point(self):
+        """
+        Determine if polygons connected by a single point are contiguous.
+
+        @return: True if the 'allow_single_point' argument is set.
+        """
+        if 'allow_single_point' in self.arg_dict:
+            return int(self.arg_dict['allow_single_point'][1]) == 1
+        return False
+
+    def plan_terms(self, plan, version, graph):
+        """
+        Determine the contiguity of every district in a plan at once, over
+        the adjacency graph of the base geounits.
+
+        @param plan: A L{Plan} to evaluate.
+        @param version: The version of the plan.
+        @param graph: The L{ContiguityGraph} of the base geolevel of the
+            plan.
+
+        @return: The contiguity of every district in the plan, as
+            returned by district_term.
+        """
+        index = plan.get_assignment_index(version)
+        pieces = graph.count_pieces(index.geounit_ids, index.district_ids,
+                                    self.allows_single_point())
+
+        return [
+            None if d.district_id == 0 else
+            (1 if pieces.get(d.district_id, 0) <= 1 else 0)
+            for d in plan.get_districts_at_version(
+                version, include_geom=False)
+        ]
+
+    def is_contiguous(self, district):
+        """
+        Determine if a single district is contiguous.
+
+        @param district: A L{District} to evaluate.
+
+        @return: True if the district is contiguous.
+        """
+        allow_single = self.allows_single_point()
+
+        # districts passed to worker processes have no plan, and are
+        # checked by their geometry
+        graph = None
+        if getattr(district, 'plan_id', None) is not None:
+            graph = contiguity.get_graph(
+                district.plan.legislative_body.get_base_geolevel())
+
+        # the pieces of the district are counted over the same graph as
+        # in plan_terms, so a base geounit of many polygons is one piece
+        if graph is not None:
+            geounit_ids = [g[0] for g in district.get_base_geounits()]
+            pieces = graph.count_pieces(geounit_ids, [0] * len(geounit_ids),
+                                        allow_single)
+            return pieces.get(0, 0) <= 1
+
+        if len(district.geom) == 1:
+            return True
 
-                # obtain the contiguity overrides that need to be applied
-                overrides = district.get_contiguity_overrides()
-
-                if allow_single or len(overrides) > 0:
-                    # create a running union of of polygons that are linked, seeded with the first.
-                    # loop through remaining polygons and add any that either touch the union,
-                    # or do so virtually with a contiguity override. repeat until either:
-                    #   - the remaining list is empty: contiguous
-                    #   - no matches were found in a pass: discontiguous
-                    union = district.geom[0]
-                    remaining = district.geom[1:]
-                    contiguous = True
-
-                    while (len(remaining) > 0):
-                        if len(district.geom) == 0:
-                            continue
-
-                        match_in_pass = False
-                        for geom in remaining:
-                            linked = False
-                            if allow_single and geom.touches(union):
-                                linked = True
-                            else:
-                                for override in overrides:
-                                    o = override.override_geounit.geom
-                                    c = override.connect_to_geounit.geom
-                                    if (geom.contains(o) and union.contains(c)
-                                        ) or (geom.contains(c)
-                                              and union.contains(o)):
-                                        linked = True
-                                        overrides.remove(override)
-                                        break
-
-                            if linked:
-                                remaining.remove(geom)
-                                union = geom.union(union)
-                                match_in_pass = True
-
-                        if not match_in_pass:
-                            contiguous = False
+        # if the district has no geometry, i.e. an empty unassigned district,
+        # treat it as contiguous
+        if len(district.geom) == 0:
+            return True
+
+        # obtain the contiguity overrides that need to be applied
+        overrides = district.get_contiguity_overrides()
+
+        if not (allow_single or len(overrides) > 0):
+            return False
+
+        # create a running union of of polygons that are linked, seeded with the first.
+        # loop through remaining polygons and add any that either touch the union,
+        # or do so virtually with a contiguity override. repeat until either:
+        #   - the remaining list is empty: contiguous
+        #   - no matches were found in a pass: discontiguous
+        union = district.geom[0]
+        remaining = district.geom[1:]
+
+        while (len(remaining) > 0):
+            match_in_pass = False
+            for geom in remaining:
+                linked = False
+                if allow_single and geom.touches(union):
+                    linked = True
+                else:
+                    for override in overrides:
+                        o = override.override_geounit.geom
+                        c = override.connect_to_geounit.geom
+                        if (geom.contains(o) and union.contains(c)) or (
+                                geom.contains(c) and union.contains(o)):
+                            linked = True
+                            overrides.remove(override)
                             break
 
-                    if contiguous:
-                        count += 1
+                if linked:
+                    remaining.remove(geom)
+                    union = geom.union(union)
+                    match_in_pass = True
+
+            if not match_in_pass:
+                return False
+
+        return True
+
+    def district_term(self, district):
+        """
+        Determine if a district in a plan is contiguous.
+
+        @param district: A L{District} in the plan.
+
+        @return: 1 if the district is contiguous, 0 if not, or None for
+            the unassigned district, which is ignored in plan tallies.
+        """
+        if district.district_id == 0:
+            return None
+
+        return 1 if self.is_contiguous(district) else 0
+
+    def combine_terms(self, terms):
+        """
+        Tally the number of contiguous districts.
+
+        @param terms: The contiguity of every district in the plan.
+        """
+        count = sum(t for t in terms if t is not None)
 
         self.result = {'value': count}
         try:
@@ -1309,6 +1324,27 @@ class Contiguity(CalculatorBase):
         return '<span>%s</span>' % self.result
 
 
+def get_plan_contiguity(calculator, **kwargs):
+    """
+    Tally the contiguous districts of a plan with the Contiguity
+    calculator, passing along the 'allow_single_point' argument.
+
+    @param calculator: The calculator that needs the tally.
+    @keyword plan: A L{Plan} whose set of districts should be
+        evaluated for contiguity.
+    @keyword version: Optional. The version of the plan, defaults to
+        the most recent version.
+
+    @return: The computed L{Contiguity} calculator.
+    """
+    calc = Contiguity()
+    if 'allow_single_point' in calculator.arg_dict:
+        calc.arg_dict['allow_single_point'] = calculator.arg_dict[
+            'allow_single_point']
+    calc.compute(**kwargs)
+    return calc
+
+
 class AllContiguous(CalculatorBase):
     """
     Determine if all the districts in a plan are contiguous.
@@ -1336,8 +1372,7 @@ class AllContiguous(CalculatorBase):
         version = kwargs['version'] if 'version' in kwargs else plan.version
         districts = plan.get_districts_at_version(version, include_geom=False)
 
-        calc = Contiguity()
-        calc.compute(**kwargs)
+        calc = get_plan_contiguity(self, **kwargs)
 
         self.result = {'value': (len(districts) - 1) == calc.result['value']}
 
@@ -1369,11 +1404,12 @@ class NonContiguous(CalculatorBase):
         version = kwargs['version'] if 'version' in kwargs else plan.version
         districts = plan.get_districts_at_version(version, include_geom=False)
 
-        calc = Contiguity()
-        calc.compute(**kwargs)
+        calc = get_plan_contiguity(self, **kwargs)
 
-        count = len(districts) - calc.result
+        # The unassigned district is not counted
+        count = (len(districts) - 1) - calc.result['value']
 
+        self.result = {'value': count}
         try:
             target = self.get_value('target')
             if target != None:
@@ -1384,7 +1420,7 @@ class NonContiguous(CalculatorBase):
                     }
                 }
         except:
-            self.result = {'value': count}
+            pass
 
 
 class Interval(CalculatorBase):
@@ -1853,6 +1889,8 @@ class Equipopulation(CalculatorBase):
     This calculator only operates on Plans.
     """
 
+    decomposable = True
+
     def compute(self, **kwargs):
         """
         Determine if all the districts in a plan fall within a target
@@ -1872,12 +1910,32 @@ class Equipopulation(CalculatorBase):
 
         plan = kwargs['plan']
 
+        version = kwargs['version'] if 'version' in kwargs else plan.version
+        districts = plan.get_districts_at_version(version, include_geom=False)
+
+        self.combine_terms([self.district_term(d) for d in districts])
+
+    def district_term(self, district):
+        """
+        Determine if one district falls within the target range.
+
+        @param district: A L{District} in the plan.
+
+        @return: The term of the district from a L{Range} calculator.
+        """
         inrange = Range()
         inrange.arg_dict = self.arg_dict
-        inrange.compute(**kwargs)
+        return inrange.district_term(district)
 
-        version = kwargs['version'] if 'version' in kwargs else plan.version
-        districts = plan.get_districts_at_version(version, include_geom=False)
+    def combine_terms(self, terms):
+        """
+        Count the districts that fall within the target range.
+
+        @param terms: The range test of every district in the plan.
+        """
+        inrange = Range()
+        inrange.arg_dict = self.arg_dict
+        inrange.combine_terms(terms)
 
         try:
             target = self.get_value('target')
@@ -1887,7 +1945,7 @@ class Equipopulation(CalculatorBase):
                 # should never be at the target.
 
                 self.result = {
-                    'value': inrange.result['value'] == (len(districts) - 1)
+                    'value': inrange.result['value'] == (len(terms) - 1)
                 }
             elif target != None:
                 self.result = {
@@ -2394,6 +2452,27 @@ class SplitCounter(CalculatorBase):
             'only_total': only_total
         }
 
+    def prefetch(self, plans, version=None):
+        """
+        Find the splits of many plans at once, so that each plan is
+        computed from the cached splits. Like compute, this uses the
+        "version" argument of the calculator, if any, rather than the
+        version of the plans.
+
+        @param plans: A list of the L{Plan}s that will be computed.
+        @param version: Ignored.
+        """
+        target = self.get_value('boundary_id')
+        inverse = self.get_value('inverse') == 1
+        if target is None or len(plans) < 2:
+            return
+
+        plans[0].find_many_splits(
+            plans,
+            target,
+            version=self.get_value('version'),
+            inverse=inverse)
+
     def html(self):
         """
         Generate an HTML representation of the split report. This is
@@ -2481,6 +2560,10 @@ class ConvexHullRatio(CalculatorBase):
     or the average convex hull ratio of all districts.
     """
 
+    parallel_safe = True
+    decomposable = True
+    reads_geometry = False
+
     def compute(self, **kwargs):
         """
         Calculate the convex hull ratio of a district or a plan.
@@ -2495,7 +2578,7 @@ class ConvexHullRatio(CalculatorBase):
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
-            if districts[0].geom.empty:
+            if geometrymetrics.get_metrics(districts[0]).perimeter == 0:
                 return
 
         elif 'plan' in kwargs:
@@ -2503,21 +2586,41 @@ class ConvexHullRatio(CalculatorBase):
             version = kwargs[
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(
-                version, include_geom=True)
+                version, include_geom=False)
 
         else:
             return
 
-        num = 0
-        ratios = 0.0
-        for district in districts:
-            if district.geom.empty or district.geom.length == 0 or district.district_id == 0:
-                continue
+        self.combine_terms([self.district_term(d) for d in districts])
+
+    def district_term(self, district):
+        """
+        Calculate the convex hull ratio of one district.
 
-            ratios += district.geom.area / district.geom.convex_hull.area
-            num += 1
+        @param district: A L{District} in the plan.
 
-        self.result = {'value': (ratios / num) if num > 0 else 0}
+        @return: The convex hull ratio of the district, or None for empty
+            and unassigned districts.
+        """
+        if district.district_id == 0:
+            return None
+
+        metrics = geometrymetrics.get_metrics(district)
+        if metrics.perimeter == 0:
+            return None
+
+        return metrics.area / metrics.hull_area
+
+    def combine_terms(self, terms):
+        """
+        Average the convex hull ratios of the districts in a plan.
+
+        @param terms: The convex hull ratio of every district in the plan.
+        """
+        terms = [t for t in terms if t is not None]
+        self.result = {
+            'value': (sum(terms, 0.0) / len(terms)) if len(terms) > 0 else 0
+        }
 
     def html(self):
         """
@@ -2538,37 +2641,53 @@ class Adjacency(CalculatorBase):
     travel time.
     """
 
-    def _district_calculator(self, district):
-        def sum_query(query):
-            return sum(
-                map(lambda x: float(x) if x else 0,
-                    self.cache.get_many(query)))
-
-        geounit_ids = [geo[1] for geo in district.get_base_geounits()]
-        geounit_ids.sort()
-        geounit_id_combos = itertools.combinations(geounit_ids, 2)
-        redis_query = []
-        total = 0
-        num_queries = 0
-        for count, ids in enumerate(geounit_id_combos):
-            num_queries += 1
-            if count % 10000 == 0 and count > 0:
-                total += sum_query(redis_query)
-                redis_query = []
-
-            redis_query.append(
-                key_gen(**{
-                    'geounit1': ids[0],
-                    'geounit2': ids[1]
-                }))
-
-        total += sum_query(redis_query)
+    def _district_calculator(self, district, store):
+        """
+        Average the cost between every pair of base geounits in a
+        district.
+
+        @param district: A L{District}.
+        @param store: The L{AdjacencyStore} of the costs.
+
+        @return: The average cost, or 0 for districts of fewer than two
+            base geounits.
+        """
+        portable_ids = [geo[1] for geo in district.get_base_geounits()]
+        num_pairs = len(portable_ids) * (len(portable_ids) - 1) / 2
 
         # return 0 to prevent a divide-by-zero error
-        if num_queries == 0:
+        if num_pairs == 0:
             return 0
 
-        return total / num_queries
+        return store.pair_cost(portable_ids) / num_pairs
+
+    def _district_costs(self, districts, store):
+        """
+        Get the average costs of districts. The cost of each version of
+        a district is cached, so only new versions are computed.
+
+        @param districts: A list of L{District}s.
+        @param store: The L{AdjacencyStore} of the costs.
+
+        @return: A list of the average costs, in the same order.
+        """
+        version = adjacency.get_store_version()
+        keys = dict((d.id, 'adjacency:%s:district:%d' % (version, d.id))
+                    for d in districts)
+
+        cache = caches['default']
+        cached = cache.get_many(keys.values())
+        computed = {}
+        for district in districts:
+            if keys[district.id] not in cached:
+                computed[keys[district.id]] = self._district_calculator(
+                    district, store)
+
+        if computed:
+            cache.set_many(computed, settings.DISTRICT_TERMS_TIMEOUT)
+            cached.update(computed)
+
+        return [cached[keys[d.id]] for d in districts]
 
     def compute(self, **kwargs):
         """
@@ -2584,19 +2703,7 @@ class Adjacency(CalculatorBase):
 
         @keyword version: Optional. The version of the plan, defaults to
         the most recent version.
-
-        @keyword host: Optional. The host to connect to redis, defaults to value in settings.
-
-        @keyword port: Optional. The port to connect to redis, defaults to value in settings.
-
-        @keyword redis_db: Optional. The redis database number to connect to, defaults to value in settings.
         """
-        # Get Redis Connection - might as well re-use it
-        redis_host = kwargs.get('host', redis_settings['HOST'])
-        redis_port = int(kwargs.get('port', redis_settings['PORT']))
-        redis_db = int(kwargs.get('db', redis_settings['DB']))
-        self.cache = caches['calculations']
-
         districts = []
         if 'district' in kwargs:
             districts = [kwargs['district']]
@@ -2609,25 +2716,32 @@ class Adjacency(CalculatorBase):
                 'version'] if 'version' in kwargs else plan.version
             districts = plan.get_districts_at_version(version)
 
+        # The costs are only read from the compiled store
+        store = adjacency.get_store()
+        if store is None:
+            logger.error('Could not score adjacency: there is no adjacency '
+                         'store in %s.', settings.ADJACENCY_STORE)
+            self.result = {'value': _('n/a')}
+            return
+
         score = 0
 
         if len(districts) == 1:
-            score = 0 if districts[
-                0].district_id == 0 else self._district_calculator(
-                    districts[0])
+            score = 0 if districts[0].district_id == 0 else \
+                self._district_costs(districts, store)[0]
 
         elif len(districts) > 1:
-            district_scores = []
-            for district in districts:
-                if district.district_id == 0:
-                    continue
-                district_score = self._district_calculator(district)
-                district_scores.append(district_score)
+            district_scores = self._district_costs(
+                [d for d in districts if d.district_id != 0], store)
 
             region = districts[0].plan.legislative_body.region.name
+            if region not in store.regions:
+                logger.error('Could not score adjacency: the adjacency '
+                             'store has no costs for the region %s.', region)
+                self.result = {'value': _('n/a')}
+                return
 
-            region_key = key_gen(**{'region': region})
-            region_score = float(self.cache.get(region_key))
+            region_score = store.regions[region]
             num_districts = len(district_scores)
 
             for district in district_scores:
@@ -2645,6 +2759,8 @@ class Adjacency(CalculatorBase):
         @return: A number formatted similar to "10.01"
         """
         if not self.result is None and 'value' in self.result:
+            if self.result['value'] == _('n/a'):
+                return self.result['value']
             t = Template('{{ result_value|floatformat:2 }}')
             c = Context({'result_value': self.result['value']})
             return t.render(c)
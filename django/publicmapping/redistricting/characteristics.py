@@ -0,0 +1,175 @@
+"""
+An in-memory matrix of the Characteristic values of all geounits.
+
+Aggregating the Characteristics of a set of geounits with the ORM takes
+one query per Subject. Instead, every Characteristic is loaded once per
+worker into a geounit by subject matrix, and the aggregate for any set of
+geounits becomes a single indexed sum.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from decimal import Decimal
+import logging
+import uuid
+
+import numpy as np
+from django.core.cache import caches
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# The key of the stamp that identifies the current set of Characteristics
+STAMP_KEY = 'characteristics:stamp'
+
+# Characteristic values have four decimal places; they are stored scaled
+# to integers, so sums are exact.
+SCALE = 10000
+
+# The number of rows fetched from the database at a time while loading
+FETCH_SIZE = 100000
+
+# The matrix loaded by this worker
+_matrix = None
+
+
+class CharacteristicMatrix(object):
+    """
+    A matrix of Characteristic values, with a row per geounit and a column
+    per subject.
+    """
+
+    def __init__(self, geounit_ids, subject_ids, values, present, stamp=None):
+        """
+        Create a new matrix.
+
+        Parameters:
+            geounit_ids -- A sorted numpy array of the Geounit IDs of the rows.
+            subject_ids -- A sorted numpy array of the Subject IDs of the
+                columns.
+            values -- A 2D numpy array of the Characteristic numbers,
+                multiplied by SCALE.
+            present -- A 2D boolean numpy array, marking the values that
+                have a Characteristic.
+            stamp -- Optional. The stamp of the Characteristics loaded.
+        """
+        self.geounit_ids = geounit_ids
+        self.subject_ids = subject_ids
+        self.values = values
+        self.present = present
+        self.stamp = stamp
+
+    @staticmethod
+    def load(stamp=None):
+        """
+        Load all the Characteristics from the database.
+
+        Parameters:
+            stamp -- Optional. The stamp of the Characteristics loaded.
+
+        Returns:
+            A new CharacteristicMatrix.
+        """
+        cursor = connection.cursor()
+        cursor.execute('SELECT id FROM redistricting_geounit ORDER BY id')
+        geounit_ids = np.array(
+            [row[0] for row in cursor.fetchall()], dtype=np.int64)
+        cursor.execute('SELECT id FROM redistricting_subject ORDER BY id')
+        subject_ids = np.array(
+            [row[0] for row in cursor.fetchall()], dtype=np.int64)
+
+        values = np.zeros((len(geounit_ids), len(subject_ids)), dtype=np.int64)
+        present = np.zeros(values.shape, dtype=bool)
+
+        cursor.execute('SELECT geounit_id, subject_id, '
+                       'ROUND(number * %d)::bigint '
+                       'FROM redistricting_characteristic' % SCALE)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            rows = np.array(rows, dtype=np.int64)
+            geounits = np.searchsorted(geounit_ids, rows[:, 0])
+            subjects = np.searchsorted(subject_ids, rows[:, 1])
+            values[geounits, subjects] = rows[:, 2]
+            present[geounits, subjects] = True
+
+        logger.debug('Loaded characteristics of %d geounits, %d subjects',
+                     len(geounit_ids), len(subject_ids))
+
+        return CharacteristicMatrix(geounit_ids, subject_ids, values, present,
+                                    stamp)
+
+    def aggregate(self, geounit_ids):
+        """
+        Sum the Characteristics of a set of geounits.
+
+        Parameters:
+            geounit_ids -- A sequence of Geounit IDs. Repeated IDs are only
+                counted once.
+
+        Returns:
+            A dict of Decimal sums, keyed on Subject ID. Subjects that
+            have no Characteristics for any of the geounits are omitted.
+        """
+        geounit_ids = np.unique(np.asarray(geounit_ids, dtype=np.int64))
+        if len(geounit_ids) == 0 or len(self.geounit_ids) == 0:
+            return {}
+
+        positions = np.searchsorted(self.geounit_ids, geounit_ids)
+        positions = np.minimum(positions, len(self.geounit_ids) - 1)
+        positions = positions[self.geounit_ids[positions] == geounit_ids]
+
+        sums = self.values[positions].sum(axis=0)
+        found = self.present[positions].any(axis=0)
+
+        return dict((int(subject_id), Decimal(int(total)) / SCALE)
+                    for subject_id, total, has_value in zip(
+                        self.subject_ids, sums, found) if has_value)
+
+
+def get_characteristic_matrix():
+    """
+    Get the matrix of Characteristic values, loading it if this worker
+    doesn't have it yet, or if the Characteristics have changed since it
+    was loaded.
+
+    Returns:
+        A CharacteristicMatrix.
+    """
+    global _matrix
+
+    cache = caches['default']
+    stamp = cache.get(STAMP_KEY)
+    if stamp is None:
+        cache.add(STAMP_KEY, uuid.uuid4().hex, None)
+        stamp = cache.get(STAMP_KEY)
+
+    if _matrix is None or _matrix.stamp != stamp:
+        _matrix = CharacteristicMatrix.load(stamp)
+
+    return _matrix
+
+
+def invalidate_characteristic_matrix():
+    """
+    Signal all workers to reload the Characteristic values. This must be
+    called whenever Characteristics are created, changed or deleted.
+    """
+    caches['default'].set(STAMP_KEY, uuid.uuid4().hex, None)
@@ -46,6 +46,7 @@ from django.contrib.sessions.models import Session
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Avg, Model
 from django.utils.translation import ugettext as _
+from redistricting import contiguity, labels, sessionregistry
 from redistricting.models import (
     ContiguityOverride,
     Geolevel,
@@ -141,6 +142,7 @@ class Utils:
 
         try:
             qset.delete()
+            sessionregistry.clear()
         except Exception:
             logger.info('Could not delete sessions.')
             return False
@@ -1005,6 +1007,9 @@ class ConfigImporter:
                 logger.debug('ContiguityOverride "%s" already exists',
                              str(co_obj))
 
+        # Have every worker reload the overrides with the adjacency graphs
+        contiguity.invalidate_contiguity_graph()
+
         return True
 
 
@@ -1929,6 +1934,7 @@ class PoUtils:
         Create a new utility object for a specific locale.
         """
 
+        self.locale = locale
         self.popath = 'locale/%(locale)s/LC_MESSAGES/xmlconfig.po' % {
             'locale': locale
         }
@@ -1962,6 +1968,12 @@ class PoUtils:
                     '%s <%s>' % (settings.ADMINS[0][0], settings.ADMINS[0][1]),
                 })
 
+        # Index the entries, rather than searching the file for each one
+        self.entries = {}
+        for entry in self.pofile:
+            if not entry.obsolete:
+                self.entries.setdefault(entry.msgid, entry)
+
     def add_or_update(self, msgid='', msgstr='', occurs=[]):
         """
         Add a POEntry to the .po file, or update it if it already exists.
@@ -1969,11 +1981,12 @@ class PoUtils:
         @keyword msgid: The .po msgid
         @keyword msgstr: The .po msgstr
         """
-        entry = self.pofile.find(msgid)
+        entry = self.entries.get(msgid)
         if entry is None:
             entry = polib.POEntry(
                 msgid=msgid, msgstr=msgstr, occurrences=occurs)
             self.pofile.append(entry)
+            self.entries[msgid] = entry
         else:
             entry.msgstr = msgstr
             entry.occurences = occurs
@@ -1988,6 +2001,8 @@ class PoUtils:
         logger.debug('Saving file %(mo)s.', {'mo': self.mopath})
         self.pofile.save_as_mofile(self.mopath)
 
+        labels.invalidate_catalog(self.locale)
+
 
 class UTC(tzinfo):
     """UTC"""
@@ -0,0 +1,291 @@
+"""
+The contiguity of districts, over the adjacency graph of base geounits.
+
+Checking the contiguity of a district from its geometry compares every
+part of the district with the union of the other parts, and every
+ContiguityOverride with the parts it might link. Instead, the pairs of
+adjacent base geounits are found once by the setup command and stored as
+GeounitAdjacency rows. Each worker loads them once per base geolevel into
+an edge list, along with the ContiguityOverrides, and the pieces of every
+district in a plan are found with a single connected components pass over
+the edges that join units of the same district.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from collections import defaultdict
+import logging
+import uuid
+
+import numpy as np
+from django.core.cache import caches
+from django.db import connection
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+logger = logging.getLogger(__name__)
+
+# The key of the stamp that identifies the current adjacency and overrides
+STAMP_KEY = 'contiguity:stamp'
+
+# The number of rows fetched from the database at a time while loading
+FETCH_SIZE = 100000
+
+# The graphs loaded by this worker, keyed on the id of the base geolevel
+_graphs = {}
+
+
+class ContiguityGraph(object):
+    """
+    The adjacency of the base geounits of a geolevel, as arrays of edges
+    between the positions of the geounits.
+    """
+
+    def __init__(self,
+                 geounit_ids,
+                 rook_edges,
+                 point_edges,
+                 overrides,
+                 built,
+                 stamp=None):
+        """
+        Create a new graph.
+
+        Parameters:
+            geounit_ids -- A sorted numpy array of the Geounit IDs of the
+                nodes.
+            rook_edges -- A tuple of two numpy arrays of node positions,
+                the pairs of geounits that share a boundary line.
+            point_edges -- A tuple of two numpy arrays of node positions,
+                the pairs of geounits that only meet at points.
+            overrides -- A list of numpy arrays of node positions, the base
+                geounits of each ContiguityOverride.
+            built -- Whether the adjacency of the geolevel has been built.
+            stamp -- Optional. The stamp of the adjacency loaded.
+        """
+        self.geounit_ids = geounit_ids
+        self.rook_edges = rook_edges
+        self.point_edges = point_edges
+        self.overrides = overrides
+        self.built = built
+        self.stamp = stamp
+
+    @staticmethod
+    def load(geolevel_id, stamp=None):
+        """
+        Load the adjacency of the geounits of a geolevel, and the
+        ContiguityOverrides, from the database.
+
+        Parameters:
+            geolevel_id -- The id of the base Geolevel.
+            stamp -- Optional. The stamp of the adjacency loaded.
+
+        Returns:
+            A new ContiguityGraph.
+        """
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT geounit_id FROM redistricting_geounit_geolevel '
+            'WHERE geolevel_id = %s ORDER BY geounit_id', [geolevel_id])
+        geounit_ids = np.array(
+            [row[0] for row in cursor.fetchall()], dtype=np.int64)
+
+        cursor.execute(
+            'SELECT geounit_id, neighbor_id, rook::integer '
+            'FROM redistricting_geounitadjacency WHERE geolevel_id = %s',
+            [geolevel_id])
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+        rows = np.concatenate(chunks) if chunks else np.zeros(
+            (0, 3), dtype=np.int64)
+
+        heads = np.searchsorted(geounit_ids, rows[:, 0]).astype(np.int32)
+        tails = np.searchsorted(geounit_ids, rows[:, 1]).astype(np.int32)
+        rook = rows[:, 2] == 1
+
+        graph = ContiguityGraph(geounit_ids, (heads[rook], tails[rook]),
+                                (heads[~rook], tails[~rook]), [],
+                                len(rows) > 0, stamp)
+        graph.overrides = graph.load_overrides(geolevel_id)
+
+        logger.debug('Loaded adjacency of %d geounits, %d edges, %d overrides',
+                     len(geounit_ids), len(rows), len(graph.overrides))
+
+        return graph
+
+    def load_overrides(self, geolevel_id):
+        """
+        Load the ContiguityOverrides, as the base geounits they link.
+        Overrides between geounits of larger geolevels link all of the base
+        geounits nested in them.
+
+        Parameters:
+            geolevel_id -- The id of the base Geolevel.
+
+        Returns:
+            A list of numpy arrays of node positions.
+        """
+        cursor = connection.cursor()
+        cursor.execute('SELECT override_geounit_id, connect_to_geounit_id '
+                       'FROM redistricting_contiguityoverride')
+        pairs = cursor.fetchall()
+        if len(pairs) == 0:
+            return []
+
+        geounits = list(set(gid for pair in pairs for gid in pair))
+        cursor.execute(
+            'SELECT ancestor_id, descendant_id '
+            'FROM redistricting_geounithierarchy '
+            'WHERE geolevel_id = %s AND ancestor_id = ANY(%s)',
+            [geolevel_id, geounits])
+        descendants = defaultdict(list)
+        for ancestor, descendant in cursor.fetchall():
+            descendants[ancestor].append(descendant)
+
+        overrides = []
+        for pair in pairs:
+            members = []
+            for gid in pair:
+                members.extend(descendants.get(gid, [gid]))
+            positions, found = self._positions(members)
+            positions = np.unique(positions[found])
+            if len(positions) > 1:
+                overrides.append(positions)
+
+        return overrides
+
+    def _positions(self, geounit_ids):
+        """
+        Find the nodes of geounits.
+
+        Returns:
+            A tuple of the positions of the geounits in the graph, and a
+            mask of the geounits that are actually in the graph.
+        """
+        geounit_ids = np.asarray(geounit_ids, dtype=np.int64)
+        if len(self.geounit_ids) == 0:
+            return (np.zeros(len(geounit_ids), dtype=np.intp),
+                    np.zeros(len(geounit_ids), dtype=bool))
+
+        positions = np.searchsorted(self.geounit_ids, geounit_ids)
+        positions = np.minimum(positions, len(self.geounit_ids) - 1)
+        return positions, self.geounit_ids[positions] == geounit_ids
+
+    def count_pieces(self, geounit_ids, district_ids, allow_single_point=False):
+        """
+        Count the connected pieces of districts.
+
+        Parameters:
+            geounit_ids -- A sequence of base Geounit IDs.
+            district_ids -- A sequence of the district_ids the geounits are
+                assigned to, parallel to geounit_ids. Geounits with a
+                negative district_id are not in any district.
+            allow_single_point -- Optional. Whether geounits that only meet
+                at a point are connected.
+
+        Returns:
+            A dict of the number of pieces of each district, keyed on
+            district_id. Districts without geounits are omitted.
+        """
+        size = len(self.geounit_ids)
+        labels = np.repeat(np.int64(-1), size)
+        district_ids = np.asarray(district_ids, dtype=np.int64)
+        positions, found = self._positions(geounit_ids)
+        found &= district_ids >= 0
+        labels[positions[found]] = district_ids[found]
+
+        heads, tails = self.rook_edges
+        if allow_single_point:
+            heads = np.concatenate([heads, self.point_edges[0]])
+            tails = np.concatenate([tails, self.point_edges[1]])
+        inside = (labels[heads] >= 0) & (labels[heads] == labels[tails])
+        heads = [heads[inside]]
+        tails = [tails[inside]]
+
+        # An override links its geounits when they are all in one district
+        for members in self.overrides:
+            owners = labels[members]
+            if owners[0] >= 0 and (owners == owners[0]).all():
+                heads.append(np.repeat(members[0], len(members) - 1))
+                tails.append(members[1:])
+
+        heads = np.concatenate(heads)
+        tails = np.concatenate(tails)
+        matrix = coo_matrix(
+            (np.ones(len(heads), dtype=np.int8), (heads, tails)),
+            shape=(size, size))
+        count, components = connected_components(matrix, directed=False)
+
+        nodes = np.flatnonzero(labels >= 0)
+        pieces = np.unique(labels[nodes] * size + components[nodes])
+        districts, counts = np.unique(pieces // size, return_counts=True)
+        return dict(zip(districts.tolist(), counts.tolist()))
+
+
+def get_graph(geolevel_id):
+    """
+    Get the adjacency graph of a base geolevel, loading it if this worker
+    doesn't have it yet, or if the adjacency or the ContiguityOverrides
+    have changed since it was loaded.
+
+    Parameters:
+        geolevel_id -- The id of the base Geolevel.
+
+    Returns:
+        A ContiguityGraph, or None if the adjacency of the geolevel has not
+        been built.
+    """
+    stamp = get_stamp()
+    graph = _graphs.get(geolevel_id)
+    if graph is None or graph.stamp != stamp:
+        graph = ContiguityGraph.load(geolevel_id, stamp)
+        _graphs[geolevel_id] = graph
+
+    return graph if graph.built else None
+
+
+def get_stamp():
+    """
+    Get the stamp of the current adjacency and ContiguityOverrides. The
+    stamp changes whenever either of them changes, so anything derived
+    from them can be keyed with it.
+
+    Returns:
+        A string.
+    """
+    cache = caches['default']
+    stamp = cache.get(STAMP_KEY)
+    if stamp is None:
+        cache.add(STAMP_KEY, uuid.uuid4().hex, None)
+        stamp = cache.get(STAMP_KEY)
+    return stamp
+
+
+def invalidate_contiguity_graph():
+    """
+    Signal all workers to reload the adjacency graphs, and discard the
+    cached plan score terms of calculators that use ContiguityOverrides.
+    This must be called whenever the GeounitAdjacency or
+    ContiguityOverrides change.
+    """
+    caches['default'].set(STAMP_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,237 @@
+"""
+Measures of the shape of district geometries, for compactness scores.
+
+The compactness calculators compare the area and perimeter of a district
+with its convex hull, its minimum enclosing circle and its bounding box.
+All of these are measured at once into GeometryMetrics, which Districts
+store whenever they are saved with a new geometry, so the calculators
+read a few numbers rather than the geometry of each district.
+
+The hull and circle come from the coordinates of the convex hull, taken
+from GEOS as a numpy array. The minimum enclosing circle is found with
+Welzl's algorithm, in its iterative form, where each pass over the points
+is a single numpy comparison.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from collections import namedtuple
+from math import hypot
+
+import numpy as np
+
+# A circle, given by its center and radius
+Circle = namedtuple('Circle', ['cx', 'cy', 'r'])
+
+# The measures of a geometry: its area and perimeter, the area of its
+# convex hull, the radius of its minimum enclosing circle, and the width
+# and height of its bounding box. Every measure of an empty geometry is 0.
+GeometryMetrics = namedtuple('GeometryMetrics', [
+    'area', 'perimeter', 'hull_area', 'circle_radius', 'width', 'height'
+])
+
+# Points this far outside a circle, relative to its radius, are inside it;
+# this keeps rounding errors from adding points to the boundary forever
+TOLERANCE = 1e-12
+
+# The seed of the shuffle of the points. The expected running time only
+# depends on the order being random, and a fixed seed makes the results
+# of scores repeatable.
+SEED = 0
+
+
+def hull_coordinates(geom):
+    """
+    Get the coordinates of the convex hull of a geometry.
+
+    Parameters:
+        geom -- A GEOSGeometry.
+
+    Returns:
+        A numpy array with a row of x and y for every vertex of the convex
+        hull, without repeating the first vertex. Empty geometries have no
+        rows.
+    """
+    if geom.empty:
+        return np.zeros((0, 2))
+
+    hull = geom.convex_hull
+    if hull.geom_type == 'Polygon':
+        coords = np.asarray(hull[0].tuple, dtype=float)[:-1]
+    elif hull.geom_type == 'Point':
+        coords = np.asarray([hull.tuple], dtype=float)
+    else:
+        coords = np.asarray(hull.tuple, dtype=float)
+
+    return coords[:, :2]
+
+
+def polygon_area(coords):
+    """
+    Get the area of a polygon with the shoelace formula.
+
+    Parameters:
+        coords -- A numpy array of the vertices of the polygon, in order,
+            without repeating the first vertex.
+
+    Returns:
+        The area of the polygon.
+    """
+    if len(coords) < 3:
+        return 0.0
+
+    x = coords[:, 0] - coords[0, 0]
+    y = coords[:, 1] - coords[0, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0
+
+
+def _circle_of_two(a, b):
+    return Circle((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0,
+                  hypot(a[0] - b[0], a[1] - b[1]) / 2.0)
+
+
+def _circle_of_three(a, b, c):
+    bx, by = b[0] - a[0], b[1] - a[1]
+    cx, cy = c[0] - a[0], c[1] - a[1]
+    d = 2.0 * (bx * cy - by * cx)
+    if d == 0:
+        # The points are colinear, so the farthest two are a diameter
+        return max([_circle_of_two(a, b), _circle_of_two(a, c),
+                    _circle_of_two(b, c)], key=lambda circle: circle.r)
+
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (cy * b2 - by * c2) / d
+    uy = (bx * c2 - cx * b2) / d
+    return Circle(a[0] + ux, a[1] + uy, hypot(ux, uy))
+
+
+def _first_outside(points, start, stop, circle):
+    """
+    Find the first of a range of points that lies outside a circle.
+
+    Returns:
+        The index of the point, or None if every point is in the circle.
+    """
+    if start >= stop:
+        return None
+
+    dx = points[start:stop, 0] - circle.cx
+    dy = points[start:stop, 1] - circle.cy
+    limit = (circle.r * (1 + TOLERANCE))**2
+    outside = np.flatnonzero(dx * dx + dy * dy > limit)
+    if len(outside) == 0:
+        return None
+    return start + outside[0]
+
+
+def _circle_with_two(points, stop, p, q):
+    # The smallest circle around points[:stop] with p and q on its boundary
+    circle = _circle_of_two(p, q)
+    k = _first_outside(points, 0, stop, circle)
+    while k is not None:
+        circle = _circle_of_three(p, q, points[k])
+        k = _first_outside(points, k + 1, stop, circle)
+    return circle
+
+
+def _circle_with_one(points, stop, p):
+    # The smallest circle around points[:stop] with p on its boundary
+    circle = Circle(p[0], p[1], 0.0)
+    j = _first_outside(points, 0, stop, circle)
+    while j is not None:
+        circle = _circle_with_two(points, j, p, points[j])
+        j = _first_outside(points, j + 1, stop, circle)
+    return circle
+
+
+def minimum_enclosing_circle(coords):
+    """
+    Find the smallest circle that contains a set of points. Based on E.
+    Welzl, "Smallest enclosing disks (balls and ellipsoids)", 1991.
+
+    Parameters:
+        coords -- A sequence or numpy array of x and y coordinates. The
+            coordinates of a convex hull are enough to find the circle
+            of a whole geometry.
+
+    Returns:
+        A Circle, or None if there are no points.
+    """
+    points = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return None
+
+    points = points[np.random.RandomState(SEED).permutation(len(points))]
+
+    circle = Circle(points[0, 0], points[0, 1], 0.0)
+    i = _first_outside(points, 1, len(points), circle)
+    while i is not None:
+        circle = _circle_with_one(points, i, points[i])
+        i = _first_outside(points, i + 1, len(points), circle)
+
+    return Circle(float(circle.cx), float(circle.cy), float(circle.r))
+
+
+def measure(geom):
+    """
+    Measure a geometry.
+
+    Parameters:
+        geom -- A GEOSGeometry, or None.
+
+    Returns:
+        A GeometryMetrics.
+    """
+    if geom is None or geom.empty:
+        return GeometryMetrics(0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+    xmin, ymin, xmax, ymax = geom.extent
+    area, perimeter = geom.area, geom.length
+    width, height = xmax - xmin, ymax - ymin
+    coords = hull_coordinates(geom)
+    circle = minimum_enclosing_circle(coords)
+    return GeometryMetrics(area, perimeter, polygon_area(coords), circle.r,
+                           width, height)
+
+
+def get_metrics(district):
+    """
+    Get the measures of the geometry of a district. Districts keep their
+    measures in the database; other objects with a geometry, such as
+    districts passed to worker processes, are measured once, and their
+    measures are kept on the object until its geometry is replaced.
+
+    Parameters:
+        district -- A District, or any object with a 'geom'.
+
+    Returns:
+        A GeometryMetrics.
+    """
+    getter = getattr(district, 'get_geometry_metrics', None)
+    if getter is not None:
+        return getter()
+
+    cached = getattr(district, '_geometry_metrics', None)
+    if cached is not None and cached[0] is district.geom:
+        return cached[1]
+
+    metrics = measure(district.geom)
+    district._geometry_metrics = (district.geom, metrics)
+    return metrics
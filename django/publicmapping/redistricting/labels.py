@@ -0,0 +1,226 @@
+"""
+The catalog of translated labels from the configuration.
+
+The labels, titles and descriptions of Subjects, Geolevels, Legislative
+Bodies, Score Functions and other configured objects are translated in the
+xmlconfig message catalog of each language. Rather than searching the
+catalog for each label, the messages of each language are loaded once per
+worker into a dict. A catalog is loaded again when its message file
+changes, which happens when PoUtils saves it or makelanguagefiles compiles
+it.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+import os
+import time
+
+import polib
+from django.conf import settings
+from django.utils import translation
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) a worker checks whether a message file has changed
+CHECK_INTERVAL = 5
+
+# The catalogs loaded by this worker, keyed on language
+_catalogs = {}
+
+
+class LabelCatalog(object):
+    """
+    The translated messages of one language, indexed by msgid.
+    """
+
+    def __init__(self, lang, messages, path=None, mtime=None):
+        """
+        Create a new catalog.
+
+        Parameters:
+            lang -- The language of the messages.
+            messages -- A dict of translated messages, keyed on msgid.
+            path -- Optional. The message file the messages were read from.
+            mtime -- Optional. The modification time of the message file.
+        """
+        self.lang = lang
+        self.messages = messages
+        self.path = path
+        self.mtime = mtime
+        self.checked = time.time()
+
+    @staticmethod
+    def get_paths(lang):
+        """
+        Get the paths of the compiled and source message files of a
+        language.
+
+        Parameters:
+            lang -- The language.
+
+        Returns:
+            A list of paths, with the compiled message file first.
+        """
+        return [
+            os.path.normpath(
+                os.path.join(settings.STATIC_ROOT,
+                             '../locale/%s/LC_MESSAGES/xmlconfig.%s' %
+                             (lang, ext))) for ext in ['mo', 'po']
+        ]
+
+    @staticmethod
+    def load(lang):
+        """
+        Load the catalog of a language from its compiled message file, or
+        from its source message file if it hasn't been compiled.
+
+        Parameters:
+            lang -- The language.
+
+        Returns:
+            A LabelCatalog. It is empty if there are no message files.
+        """
+        for path in LabelCatalog.get_paths(lang):
+            try:
+                mtime = os.path.getmtime(path)
+                catalog = polib.mofile(path) if path.endswith(
+                    '.mo') else polib.pofile(path)
+            except Exception, ex:
+                logger.debug('Could not read message file %s', path)
+                logger.debug('Reason: %s', ex)
+                continue
+
+            # Keep the first of any duplicated messages, like a search
+            messages = {}
+            for entry in catalog:
+                if not entry.obsolete:
+                    messages.setdefault(entry.msgid, entry.msgstr)
+
+            return LabelCatalog(lang, messages, path, mtime)
+
+        logger.info('Could not find a message catalog for %s.', lang)
+        return LabelCatalog(lang, {})
+
+    def is_stale(self):
+        """
+        Check whether the message file of this catalog has changed since
+        it was loaded. The file is checked at most every CHECK_INTERVAL
+        seconds.
+
+        Returns:
+            True if the catalog should be loaded again.
+        """
+        now = time.time()
+        if now - self.checked < CHECK_INTERVAL:
+            return False
+        self.checked = now
+
+        paths = LabelCatalog.get_paths(self.lang)
+        if self.path is None:
+            return any(os.path.exists(path) for path in paths)
+
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return True
+
+    def get(self, msgid):
+        """
+        Get a translated message.
+
+        Parameters:
+            msgid -- The msgid of the message.
+
+        Returns:
+            The translated message, or the msgid if it isn't in the catalog.
+        """
+        try:
+            return self.messages[msgid]
+        except KeyError:
+            logger.debug('Cannot find msgid %s, fallback to msgid', msgid)
+            return msgid
+
+
+def get_catalog(lang=None):
+    """
+    Get the catalog of a language, loading it if this worker doesn't have
+    it yet, or if its message file has changed since it was loaded.
+
+    Parameters:
+        lang -- Optional. The language, defaults to the active language.
+
+    Returns:
+        A LabelCatalog.
+    """
+    # Hardcoding to avoid a bug in Django 1.8 get_language
+    # (refer to https://github.com/django-parler/django-parler/issues/90)
+    lang = lang or translation.get_language() or settings.LANGUAGE_CODE
+
+    catalog = _catalogs.get(lang)
+    if catalog is None or catalog.is_stale():
+        catalog = LabelCatalog.load(lang)
+        _catalogs[lang] = catalog
+
+    return catalog
+
+
+def invalidate_catalog(lang=None):
+    """
+    Load the catalog of a language again when it is next used, because its
+    message file has been changed by this worker.
+
+    Parameters:
+        lang -- Optional. The language. If omitted, every catalog is loaded
+            again.
+    """
+    if lang is None:
+        _catalogs.clear()
+    else:
+        _catalogs.pop(lang, None)
+
+
+def translate(msgid, lang=None):
+    """
+    Translate a message.
+
+    Parameters:
+        msgid -- The msgid of the message.
+        lang -- Optional. The language, defaults to the active language.
+
+    Returns:
+        The translated message, or the msgid if it isn't in the catalog.
+    """
+    return get_catalog(lang).get(msgid)
+
+
+def translate_many(msgids, lang=None):
+    """
+    Translate many messages at once.
+
+    Parameters:
+        msgids -- A list of the msgids of the messages.
+        lang -- Optional. The language, defaults to the active language.
+
+    Returns:
+        A list of the translated messages, in the same order as the
+        msgids. Messages that aren't in the catalog are their msgid.
+    """
+    catalog = get_catalog(lang)
+    return [catalog.get(msgid) for msgid in msgids]
@@ -0,0 +1,382 @@
+#!/usr/bin/python
+"""
+Benchmark the minimum enclosing circles of the Roeck calculator on the
+districts in the DistrictBuilder database.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from copy import copy
+from math import pi
+import random
+import time
+
+from django.contrib.gis.geos import Point, LineString
+from django.core.management.base import BaseCommand
+from django.db import connection
+from redistricting import geometrymetrics
+from redistricting.models import District
+
+
+class Roeck(object):
+    """
+    The minimum enclosing circle of the Roeck calculator before it was
+    replaced by geometrymetrics, copied unchanged as the reference for
+    the benchmark.
+    """
+
+    rec = 0
+
+    class Circle:
+        """
+        Helper class for the Roeck calculator. A Circle class can create circles based
+        on 1, 2, or 3 coordinates. A circle has a center and a radius. A circle also
+        can test if another point lies within the area of itself.
+        """
+        cx = None
+        cy = None
+        r = None
+
+        def __init__(self, pts):
+            """
+            Create a new Circle helper. Constructing a Circle with one coordinate
+            creates a 0 diameter circle, centered on the coordinate. Constructing
+            a Circle with two coordinates creates a circle positioned between the
+            two coordinates, with the diameter set to the distance between the
+            points. Constructing a Circle with three coordinates creates a circle
+            that passes through all three points.
+
+            @param pts: A set of points that lay on the perimeter of this circle.
+
+            @return: A calculated Circle that contains the coordinates.
+            """
+            if len(pts) == 1:
+                # Create a zero diameter circle at the coordinate location
+                self.cx = pts[0].coords[0]
+                self.cy = pts[0].coords[1]
+                self.r = 0
+            elif len(pts) == 2:
+                # Create a circle between the coordinates, with the diameter
+                # set to the distance between the points.
+                ls = LineString(pts)
+                self.cx = ls.centroid.x
+                self.cy = ls.centroid.y
+                self.r = ls.length / 2
+            elif len(pts) == 3:
+                # Create a circle that contains all three points
+                try:
+                    (
+                        p1,
+                        p2,
+                        p3,
+                    ) = self.deperpendicularize(pts)
+                except ValueError:
+                    # If the coordinates cannot be deperpendicularized, assume
+                    # that they are colinear.
+                    ls = LineString(pts)
+                    self.cx = ls.centroid.x
+                    self.cy = ls.centroid.y
+                    self.r = ls.length / 2
+                    return
+
+                # If the coordinates describe a pair of lines that are perpendicular
+                # and are parallel to the X and Y axes, the center of that rectangle
+                # is the center of the circle.
+                if abs(p2.coords[0] - p1.coords[0]) == 0 and abs(
+                        p3.coords[1] - p2.coords[1]) == 0:
+                    self.cx = (p2.coords[0] + p3.coords[0]) / 2
+                    self.cy = (p1.coords[1] + p2.coords[1]) / 2
+                    ls = LineString([p1, Point(self.cx, self.cy)])
+                    self.r = ls.length
+                    return
+
+                # Determination of the center point is described pretty well here:
+                #
+                # "Equation of a Circle from 3 Points (2 dimensions)"
+                # http://paulbourke.net/geometry/circlefrom3/
+                #
+                m1 = (p2.coords[1] - p1.coords[1]) / (
+                    p2.coords[0] - p1.coords[0])
+                m2 = (p3.coords[1] - p2.coords[1]) / (
+                    p3.coords[0] - p2.coords[0])
+
+                self.cx = (m1 * m2 * (p1.coords[1] - p3.coords[1]) + \
+                    m2 * (p1.coords[0] + p2.coords[0]) - \
+                    m1 * (p2.coords[0] + p3.coords[0]) ) / \
+                    (2 * (m2-m1) )
+                self.cy = -1 * (self.cx - (p1.coords[0]+p2.coords[0]) / 2.0) / m1 + \
+                    (p1.coords[1] + p2.coords[1]) / 2.0
+                lsR = LineString(pts[0], (
+                    self.cx,
+                    self.cy,
+                ))
+                self.r = lsR.length
+            else:
+                # Creating a circle with 0 or > 3 coordinates is not supported.
+                self.cx = None
+                self.cy = None
+                self.r = None
+
+        def deperpendicularize(self, pts):
+            """
+            Reorder coordinates to ensure that they are not perpendicular
+            in a way that may cause divide by zero exceptions. This tests
+            all 6 permutations of the point set, testing it with the
+            isperpendicular method.
+
+            @params pts: A set of points, passed in as an array
+            @return: A 3 element tuple with the reordered points.
+            """
+            if not self.isperpendicular(pts[0], pts[1], pts[2]):
+                return (
+                    pts[0],
+                    pts[1],
+                    pts[2],
+                )
+            if not self.isperpendicular(pts[0], pts[2], pts[1]):
+                return (
+                    pts[0],
+                    pts[2],
+                    pts[1],
+                )
+            if not self.isperpendicular(pts[1], pts[0], pts[2]):
+                return (
+                    pts[1],
+                    pts[0],
+                    pts[2],
+                )
+            if not self.isperpendicular(pts[1], pts[2], pts[0]):
+                return (
+                    pts[1],
+                    pts[2],
+                    pts[0],
+                )
+            if not self.isperpendicular(pts[2], pts[1], pts[0]):
+                return (
+                    pts[2],
+                    pts[1],
+                    pts[0],
+                )
+            if not self.isperpendicular(pts[2], pts[0], pts[1]):
+                return (
+                    pts[2],
+                    pts[0],
+                    pts[1],
+                )
+
+            # Raise a general exception here, and fall back to
+            # estimating a 2 point circle.
+            raise ValueError('All combinations are perpendicular.')
+
+        def isperpendicular(self, pt1, pt2, pt3):
+            """
+            Test a set of points to see if they are perpendicular.
+            Points are deemed perpendicular if they describe two
+            different lines that are parallel to the X and Y axes.
+
+            @param pt1: The first point to test.
+            @param pt2: The second point to test.
+            @param pt3: The third point to test.
+
+            @return: A boolean flag indicating if the points describe
+            a set of perpendicular lines that are parallel with the
+            X and Y axes.
+            """
+            dy1 = pt2.coords[1] - pt1.coords[1]
+            dx1 = pt2.coords[0] - pt1.coords[0]
+            dy2 = pt3.coords[1] - pt2.coords[1]
+            dx2 = pt3.coords[0] - pt2.coords[0]
+
+            if abs(dx1) == 0 and abs(dy2) == 0:
+                return False
+            elif abs(dy1) == 0:
+                return True
+            elif abs(dy2) == 0:
+                return True
+            elif abs(dx1) == 0:
+                return True
+            elif abs(dx2) == 0:
+                return True
+
+            return False
+
+        def contains(self, pt):
+            """
+            Does this circle contain a specified point.
+
+            @param: pt The specified point
+            @return: A boolean flag indicating if the specified point lies
+                     within the area of the Circle.
+            """
+            ls = LineString([pt, Point(self.cx, self.cy)])
+            return ls.length <= self.r
+
+    def minidisk(self, points):
+        """
+        A recursive minimum enclosing disk algorithm. Based on E. Welzl,
+        "Smallest enclosing disks (balls and ellipsoids)", 1991.
+
+        This code borrows some patterns from the applet source here:
+        http://www.sunshine2k.de/stuff/Java/Welzl/Welzl.html
+
+        @param points: An array of points, from a GEOSGeometry.
+        @return: A L{Roeck.Circle} minimum enclosing disk for the points.
+        """
+        self.rec = 0
+        shuffled = copy(points[1:])
+        random.shuffle(shuffled)
+        return self.b_minidisk(shuffled, len(shuffled), [None, None, None], 0)
+
+    def b_minidisk(self, points, npts, boundary, nbnd):
+        """
+        A recursive minimum enclosing disk algorithm. Based on E. Welzl,
+        "Smallest enclosing disks (balls and ellipsoids)", 1991.
+
+        This code borrows some patterns from the applet source here:
+        http://www.sunshine2k.de/stuff/Java/Welzl/Welzl.html
+
+        @param points: A random array of non-duplicating points.
+        @param npts: The position in the point array for searching.
+        @param boundary: The farthest outliers on or in the smallest disk.
+        @param nbnd: The index of the boundary list for the next boundary point.
+        @return: A L{Roeck.Circle} minimum enclosing disk for the points.
+        """
+        if npts == 1 and nbnd == 0:
+            disk = Roeck.Circle([points[0]])
+        elif npts == 1 and nbnd == 1:
+            disk = Roeck.Circle([points[0], boundary[0]])
+        elif npts == 0 and nbnd == 2:
+            disk = Roeck.Circle(boundary[0:2])
+        elif nbnd == 3:
+            disk = Roeck.Circle(boundary)
+        else:
+            self.rec += 1
+            disk = self.b_minidisk(points, npts - 1, boundary, nbnd)
+
+            if not disk.contains(points[npts - 1]):
+                boundary[nbnd] = points[npts - 1]
+
+                self.rec += 1
+                disk = self.b_minidisk(points, npts - 1, boundary, nbnd + 1)
+
+        self.rec -= 1
+        return disk
+
+
+class Command(BaseCommand):
+    """
+    This command compares the Roeck scores and running times of the numpy
+    minimum enclosing circle with the recursive GEOS one it replaced, and with the radius
+    PostGIS finds, on real district shapes.
+    """
+    args = None
+    help = 'Benchmark the minimum enclosing circles of the Roeck calculator'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-p',
+            '--plan',
+            dest='plan_ids',
+            default=[],
+            action='append',
+            help='Only benchmark the districts of this plan (repeatable)')
+        parser.add_argument(
+            '-n',
+            '--limit',
+            dest='limit',
+            default=200,
+            type=int,
+            action='store',
+            help='The number of districts to benchmark')
+        parser.add_argument(
+            '-r',
+            '--repeat',
+            dest='repeat',
+            default=5,
+            type=int,
+            action='store',
+            help='The number of times to time each district')
+
+    def handle(self, *args, **options):
+        """
+        Benchmark the minimum enclosing circles
+        """
+        districts = District.objects.exclude(district_id=0)
+        if options.get('plan_ids'):
+            districts = districts.filter(plan_id__in=options.get('plan_ids'))
+        districts = list(districts.order_by('-id')[:options.get('limit')])
+        districts = [d for d in districts if d.geom and not d.geom.empty]
+        if len(districts) == 0:
+            self.stdout.write('No districts to benchmark.\n')
+            return
+
+        repeat = max(1, options.get('repeat'))
+        hull_time = numpy_time = roeck_time = 0.0
+        points = 0
+        max_difference = 0.0
+        radii = {}
+        roeck = Roeck()
+        random.seed()
+        for district in districts:
+            start = time.time()
+            coords = geometrymetrics.hull_coordinates(district.geom)
+            hull_time += time.time() - start
+            points += len(coords)
+
+            start = time.time()
+            for i in range(repeat):
+                circle = geometrymetrics.minimum_enclosing_circle(coords)
+            numpy_time += (time.time() - start) / repeat
+
+            hull = map(lambda x: Point(x[0], x[1]),
+                       list(district.geom.convex_hull.coords[0]))
+            start = time.time()
+            for i in range(repeat):
+                reference = roeck.minidisk(hull)
+            roeck_time += (time.time() - start) / repeat
+
+            area = district.geom.area
+            difference = abs(area / (pi * circle.r**2) -
+                             area / (pi * reference.r**2))
+            max_difference = max(max_difference, difference)
+            radii[district.id] = circle.r
+
+        self.stdout.write('Districts: %d, hull points: %d\n' %
+                          (len(districts), points))
+        self.stdout.write('Convex hulls:     %8.2f ms\n' % (hull_time * 1000))
+        self.stdout.write('Numpy circles:    %8.2f ms\n' % (numpy_time * 1000))
+        self.stdout.write('Original circles: %8.2f ms\n' %
+                          (roeck_time * 1000))
+        self.stdout.write('Largest difference in Roeck score: %g\n' %
+                          max_difference)
+
+        # PostGIS finds the exact radius since version 2.3
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                'SELECT id, (ST_MinimumBoundingRadius(geom)).radius '
+                'FROM redistricting_district WHERE id = ANY(%s)',
+                [radii.keys()])
+            error = max(
+                abs(radii[pk] - radius) / radius
+                for pk, radius in cursor.fetchall() if radius > 0)
+            self.stdout.write('Largest relative difference from the PostGIS '
+                              'radius: %g\n' % error)
+        except Exception, ex:
+            self.stdout.write('Could not compare with PostGIS: %s\n' % ex)
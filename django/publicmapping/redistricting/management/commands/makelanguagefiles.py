@@ -29,6 +29,7 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.core import management
 from optparse import make_option
+from redistricting import labels
 
 
 class Command(BaseCommand):
@@ -109,3 +110,6 @@ class Command(BaseCommand):
                     locale=[locale],
                     interactive=False,
                     verbosity=options.get('verbosity'))
+
+                # The configuration labels are read from the compiled files
+                labels.invalidate_catalog(locale)
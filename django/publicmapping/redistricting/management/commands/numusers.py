@@ -24,9 +24,9 @@ License:
         Andrew Jennings, David Zwarg
 """
 
-from datetime import datetime, time, timedelta
 from django.core.management.base import BaseCommand
 from optparse import make_option
+from redistricting import sessionregistry
 from redistricting.models import *
 from redistricting.utils import *
 
@@ -50,14 +50,7 @@ class Command(BaseCommand):
         Print the number of active users
         """
         minutes = int(options.get('minutes'))
-        users = 0
-        for session in Session.objects.all():
-            decoded = session.get_decoded()
-            if 'activity_time' in decoded and (
-                    decoded['activity_time'] -
-                    timedelta(0, 0, 0, 0, settings.SESSION_TIMEOUT)) > (
-                        datetime.now() - timedelta(0, 0, 0, 0, minutes)):
-                users += 1
+        users = sessionregistry.count_active_since(minutes)
 
         self.stdout.write(
             'Number of active users over the last %d minute(s): %d\n' %
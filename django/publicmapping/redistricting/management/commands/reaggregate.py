@@ -25,9 +25,19 @@ License:
 """
 
 from datetime import datetime
+from multiprocessing import Pool
 from django.core.management.base import BaseCommand
-from optparse import make_option
+from django.db import connection
 from redistricting.models import *
+from redistricting.tasks import reaggregate_plan
+
+
+def _reaggregate(job):
+    """
+    Reaggregate one plan in a worker process.
+    """
+    plan_id, latest_only = job
+    return plan_id, reaggregate_plan(plan_id, latest_only=latest_only)
 
 
 class Command(BaseCommand):
@@ -36,96 +46,137 @@ class Command(BaseCommand):
     """
     args = None
     help = 'Reaggregate data for a give district or plan'
-    option_list = BaseCommand.option_list + (
-        make_option(
+
+    def add_arguments(self, parser):
+        parser.add_argument(
             '-d',
             '--district',
             dest='district_id',
             default=None,
             action='store',
-            help='Choose a single district to update'),
-        make_option(
+            help='Choose a single district to update')
+        parser.add_argument(
             '-p',
             '--plan',
             dest='plan_id',
             default=None,
             action='store',
-            help='Choose a single plan to update'),
-        make_option(
-            '-t',
-            '--thread',
-            dest='thread',
+            help='Choose a single plan to update')
+        parser.add_argument(
+            '-l',
+            '--latest',
+            dest='latest_only',
+            default=False,
+            action='store_true',
+            help='Only update the current version of each plan')
+        parser.add_argument(
+            '-P',
+            '--processes',
+            dest='processes',
             default=1,
-            type='int',
+            type=int,
             action='store',
-            help='Which thread to use? 1-4'),
-    )
+            help='Number of processes to reaggregate plans with')
+        parser.add_argument(
+            '-c',
+            '--celery',
+            dest='celery',
+            default=False,
+            action='store_true',
+            help='Queue a reaggregation task for each plan')
 
     def handle(self, *args, **options):
         """
         Reaggregate the district stats
         """
-        global verbosity
-        global geolevel
-        global geounit_ids
-
         verbosity = int(options.get('verbosity'))
         plan_id = options.get('plan_id')
         district_id = options.get('district_id')
+        latest_only = options.get('latest_only')
 
         if verbosity > 0:
             self.stdout.write(
                 'Reaggregating data - start at %s\n' % datetime.now())
 
-        # Grab all of the plans from the database
-        if (plan_id != None):
-            plans = Plan.objects.filter(pk=plan_id)
-            if plans.count() == 0 and verbosity > 0:
-                self.stdout.write('Sorry, no plan with ID %s\n' % plan_id)
-                return
-        elif (district_id != None):
+        if district_id != None:
             districts = District.objects.filter(pk=district_id)
-            if districts.count() == 0 and verbosity > 0:
-                self.stdout.write(
-                    'Sorry, no district with ID %s\n' % district_id)
+            if districts.count() == 0:
+                if verbosity > 0:
+                    self.stdout.write(
+                        'Sorry, no district with ID %s\n' % district_id)
                 return
-            plans = (districts[0].plan, )
-        else:
-            plans = Plan.objects.all()
-            plancount = plans.count()
-            begin = int((options.get('thread') - 1) * (plancount / 4))
-            end = int(options.get('thread') * (plancount / 4))
-            plans = plans[begin:end]
-
-        # Counts of the updated geounits
-        updated_plans = 0
-        updated_districts = 0
-
-        for p in plans:
-            if district_id is None:
-                all_districts = p.district_set.all()
-            else:
-                all_districts = District.objects.filter(pk=district_id)
+            districts[0].reaggregate()
             if verbosity > 0:
-                self.stdout.write('Plan ID: %d; %d districts in %s\n' %
-                                  (p.id, len(all_districts), p.name))
+                self.stdout.write('Fixed 1 district in plan: "%s"\n' %
+                                  districts[0].plan.name)
+                self.stdout.write('finished at %s\n' % datetime.now())
+            return
 
-            if district_id is None:
-                result = p.reaggregate()
-                updated_districts += result
-                updated_plans += 1
-                if verbosity > 0:
-                    self.stdout.write('Fixed %d districts in plan: "%s"\n' %
-                                      (result, p.name))
-            else:
-                all_districts[0].reaggregate()
-                updated_districts += 1
-                updated_plans += 1
+        # Grab all of the plans from the database
+        plans = Plan.objects.all()
+        if plan_id != None:
+            plans = plans.filter(pk=plan_id)
+            if plans.count() == 0:
                 if verbosity > 0:
-                    self.stdout.write(
-                        'Fixed 1 district in plan: "%s"\n' % p.name)
+                    self.stdout.write('Sorry, no plan with ID %s\n' % plan_id)
+                return
+        plan_ids = list(plans.order_by('id').values_list('id', flat=True))
+
+        if options.get('celery'):
+            for pid in plan_ids:
+                reaggregate_plan.delay(pid, latest_only=latest_only)
+            if verbosity > 0:
+                self.stdout.write('Queued %d plans for reaggregation\n' %
+                                  len(plan_ids))
+            return
+
+        jobs = [(pid, latest_only) for pid in plan_ids]
+        processes = max(1, options.get('processes'))
+        if processes > 1 and len(jobs) > 1:
+            # Each worker opens its own database connection
+            connection.close()
+            pool = Pool(processes=processes)
+            try:
+                results = pool.imap_unordered(_reaggregate, jobs)
+                updated_districts, updated_plans = self.report(
+                    results, verbosity)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            updated_districts, updated_plans = self.report(
+                (_reaggregate(job) for job in jobs), verbosity)
 
         if verbosity > 0:
             self.stdout.write('Fixed %d districts in %d plans - ' %
                               (updated_districts, updated_plans))
             self.stdout.write('finished at %s\n' % datetime.now())
+
+    def report(self, results, verbosity):
+        """
+        Count the districts and plans reaggregated.
+
+        Parameters:
+            results -- An iterable of tuples of plan ids and the number of
+                districts reaggregated in the plan, or None if the plan
+                failed.
+            verbosity -- The verbosity of the command.
+
+        Returns:
+            A tuple of the number of districts and plans reaggregated.
+        """
+        updated_districts = 0
+        updated_plans = 0
+        for pid, result in results:
+            if result is None:
+                if verbosity > 0:
+                    self.stdout.write('Could not reaggregate plan %d\n' % pid)
+                continue
+
+            updated_districts += result
+            updated_plans += 1
+            if verbosity > 0:
+                self.stdout.write('Fixed %d districts in plan %d\n' %
+                                  (result, pid))
+
+        return updated_districts, updated_plans
@@ -27,22 +27,25 @@ Author:
     Andrew Jennings, David Zwarg, Kenny Shepard
 """
 
+from cStringIO import StringIO
 from decimal import Decimal
+from multiprocessing import Pool
 from django.contrib.gis.gdal import (DataSource, SpatialReference)
-from django.contrib.gis.geos import (MultiPolygon, LineString, MultiLineString)
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
 from django.contrib.auth.models import User
-from django.core.cache import caches
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.utils import translation
+from django.db import connection, transaction
+from django.utils import six, translation
 from django.utils.translation import ugettext as _, activate
 from os.path import exists
 from lxml.etree import parse, XSLT
+from redistricting.adjacency import AdjacencyStore
+from redistricting.characteristics import invalidate_characteristic_matrix
 from redistricting.config import Utils, SpatialUtils
-from redistricting.models import (Geolevel, Geounit, Subject, Characteristic,
-                                  LegislativeBody, Plan, ProcessingState,
-                                  configure_views)
+from redistricting.models import (Geolevel, Geounit, Subject, LegislativeBody,
+                                  Plan, ProcessingState, configure_views)
 from redistricting.config import ConfigImporter
 from district_builder_config import StoredConfig
 from redistricting.tasks import DistrictIndexFile
@@ -52,11 +55,92 @@ import sys
 import csv
 import types
 
-from redisutils import key_gen
-
 logger = logging.getLogger()
 logger.addHandler(logging.StreamHandler())
 
+# The number of features imported at a time
+IMPORT_BATCH_SIZE = 1000
+
+# The limits of the number and percentage columns of Characteristics
+MAX_NUMBER = Decimal('1E8')
+MAX_PERCENTAGE = Decimal('1E4')
+
+
+def _prepare_geometry(job):
+    """
+    Clean and simplify the geometry of a feature, and find a point inside
+    of it.
+
+    Parameters:
+        job -- A tuple of the WKB and SRID of the geometry, the
+            simplification tolerance, and the SRID of the geounits.
+
+    Returns:
+        A tuple of a tuple of the HEXEWKB of the geometry, the simplified
+        geometry and the center, and None; or None and the reason the
+        geometry could not be prepared.
+    """
+    wkb, srid, tolerance, target_srid = job
+    try:
+        # Buffer by 0 to get rid of any self-intersections which may make
+        # this geometry invalid.
+        geom = GEOSGeometry(six.memoryview(wkb)).buffer(0)
+        # Coerce the geometry into a MultiPolygon
+        if geom.geom_type == 'Polygon':
+            geom = MultiPolygon(geom)
+        elif geom.geom_type != 'MultiPolygon':
+            raise ValueError('Cannot import a %s' % geom.geom_type)
+
+        simple = geom.simplify(tolerance=tolerance, preserve_topology=True)
+        if simple.geom_type != 'MultiPolygon':
+            simple = MultiPolygon(simple)
+
+        # Ensure the center is within the geometry
+        center = geom.centroid
+        if not center.within(geom):
+            center = geom.point_on_surface
+
+        prepared = []
+        for g in (geom, simple, center):
+            g.srid = srid or target_srid
+            if g.srid != target_srid:
+                g.transform(target_srid)
+            prepared.append(g.hexewkb)
+
+        return (
+            tuple(prepared),
+            None,
+        )
+    except Exception:
+        return (
+            None,
+            traceback.format_exc(),
+        )
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    Write rows to a table with COPY.
+
+    Parameters:
+        cursor -- A database cursor.
+        table -- The name of the table.
+        columns -- A list of the names of the columns of the rows.
+        rows -- A list of tuples of values.
+    """
+    data = StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([
+            v.encode('utf-8') if isinstance(v, unicode) else v for v in row
+        ])
+    data.seek(0)
+
+    # Empty strings are values, not NULLs
+    cursor.copy_expert(
+        'COPY %s (%s) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (%s))' %
+        (table, ', '.join(columns), ', '.join(columns)), data)
+
 
 class Command(BaseCommand):
     """
@@ -66,6 +150,7 @@ class Command(BaseCommand):
     help = 'Sets up DistrictBuilder based on the main XML configuration.'
 
     force = False
+    processes = 1
 
     def add_arguments(self, parser):
         """Add arguments and options to the base command parser"""
@@ -140,6 +225,13 @@ class Command(BaseCommand):
             dest="updatefield",
             action="append",
             help="Subject field to update.")
+        parser.add_argument(
+            '-p',
+            '--processes',
+            dest="processes",
+            default=1,
+            type=int,
+            help="Number of processes to prepare geometries with.")
 
     def setup_logging(self, verbosity):
         """
@@ -156,6 +248,7 @@ class Command(BaseCommand):
         """
         self.setup_logging(int(options.get('verbosity')))
         force = options.get('force')
+        self.processes = max(1, options.get('processes') or 1)
 
         translation.activate('en')
 
@@ -243,11 +336,26 @@ file and try again.
                         nestme = nestme or (i in nestlevels)
                         if nestme:
                             geoutil.renest_geolevel(geolevel)
+
+                # Build the nesting of the geounits in every geolevel
+                for geolevel in Geolevel.objects.all():
+                    geolevel.build_hierarchy()
+
+                # Build the adjacency of the geounits in every base geolevel,
+                # for checking contiguity
+                base_levels = set(body.get_base_geolevel()
+                                  for body in LegislativeBody.objects.all())
+                for geolevel in Geolevel.objects.filter(id__in=base_levels):
+                    geolevel.build_adjacency()
         except:
             all_ok = False
             logger.info('ERROR importing geolevels.')
             logger.info(traceback.format_exc())
 
+        # Characteristics may have been imported or renested, so have every
+        # worker reload them
+        invalidate_characteristic_matrix()
+
         # Do this once after processing the geolevels
         config.import_contiguity_overrides()
 
@@ -379,6 +487,11 @@ ERROR:
         """
         Import a shapefile, based on a config.
 
+        Features are read in batches. The geometries of each batch are
+        cleaned, simplified and given an interior point in a pool of
+        worker processes, and the geounits, their geolevels and their
+        characteristics are written with COPY.
+
         Parameters:
             config -- A dictionary with 'shapepath', 'geolevel', 'name_field', 'region_filters' and 'subject_fields' keys.
         """
@@ -415,9 +528,50 @@ ERROR:
             else:
                 return str(strname)
 
-        for h, shapefile in enumerate(config['shapefiles']):
-            if not exists(shapefile.get('path')):
-                logger.info("""
+        level = Geolevel.objects.get(name=config['geolevel'].lower()[:50])
+
+        # Create the subjects we need
+        subject_objects = {}
+        for sconfig in config['subject_fields']:
+            attr_name = sconfig.get('field')
+            foundalias = False
+            for elem in sconfig.getchildren():
+                if elem.tag == 'Subject':
+                    foundalias = True
+                    sub = Subject.objects.get(
+                        name=elem.get('id').lower()[:50])
+            if not foundalias:
+                sub = Subject.objects.get(name=sconfig.get('id').lower()[:50])
+            subject_objects[attr_name] = sub
+            subject_objects['%s_by_id' % sub.name] = attr_name
+
+        # The regional geolevels that features of this geolevel may be in
+        geolevel_xpath = '/DistrictBuilder/GeoLevels/GeoLevel[@name="%s"]' % config[
+            'geolevel']
+        geolevel_config = store.data.xpath(geolevel_xpath)
+        region_levels = []
+        for region, filter_list in config['region_filters'].iteritems():
+            geolevel_region_xpath = '/DistrictBuilder/Regions/Region[@name="%s"]/GeoLevels//GeoLevel[@ref="%s"]' % (
+                region, geolevel_config[0].get('id'))
+            if len(store.data.xpath(geolevel_region_xpath)) > 0:
+                region_level = Geolevel.objects.get(
+                    name='%s_%s' % (region, level.name))
+                region_levels.append((region_level, filter_list))
+
+        # The geounits that have already been imported, by name, portable
+        # id and tree code
+        all_levels = [level] + [rl for rl, filter_list in region_levels]
+        existing = {}
+        for gid, name, portable_id, tree_code in Geounit.objects.filter(
+                geolevel__in=all_levels).values_list(
+                    'id', 'name', 'portable_id', 'tree_code').distinct():
+            existing[(name, portable_id, tree_code)] = gid
+
+        pool = self.get_pool()
+        try:
+            for h, shapefile in enumerate(config['shapefiles']):
+                if not exists(shapefile.get('path')):
+                    logger.info("""
 ERROR:
 
     The filename specified by the configuration:
@@ -426,139 +580,65 @@ ERROR:
 
     Could not be found. Please check the configuration and try again.
 """, shapefile.get('path'))
-                raise IOError(
-                    'Cannot find the file "%s"' % shapefile.get('path'))
-
-            ds = DataSource(shapefile.get('path'))
-
-            logger.info('Importing from %s, %d of %d shapefiles...', ds, h + 1,
-                        len(config['shapefiles']))
-
-            lyr = ds[0]
-            logger.info('%d objects in shapefile', len(lyr))
-
-            level = Geolevel.objects.get(name=config['geolevel'].lower()[:50])
-            # Create the subjects we need
-            subject_objects = {}
-            for sconfig in config['subject_fields']:
-                attr_name = sconfig.get('field')
-                foundalias = False
-                for elem in sconfig.getchildren():
-                    if elem.tag == 'Subject':
-                        foundalias = True
-                        sub = Subject.objects.get(
-                            name=elem.get('id').lower()[:50])
-                if not foundalias:
-                    sub = Subject.objects.get(
-                        name=sconfig.get('id').lower()[:50])
-                subject_objects[attr_name] = sub
-                subject_objects['%s_by_id' % sub.name] = attr_name
+                    raise IOError(
+                        'Cannot find the file "%s"' % shapefile.get('path'))
 
-            progress = 0.0
-            logger.info('0% .. ')
-            for i, feat in enumerate(lyr):
-                if (float(i) / len(lyr)) > (progress + 0.1):
-                    progress += 0.1
-                    logger.info('%2.0f%% .. ', progress * 100)
-
-                levels = [level]
-                for region, filter_list in config[
-                        'region_filters'].iteritems():
-                    # Check for applicability of the function by examining the config
-                    geolevel_xpath = '/DistrictBuilder/GeoLevels/GeoLevel[@name="%s"]' % config[
-                        'geolevel']
-                    geolevel_config = store.data.xpath(geolevel_xpath)
-                    geolevel_region_xpath = '/DistrictBuilder/Regions/Region[@name="%s"]/GeoLevels//GeoLevel[@ref="%s"]' % (
-                        region, geolevel_config[0].get('id'))
-                    if len(store.data.xpath(geolevel_region_xpath)) > 0:
-                        # If the geolevel is in the region, check the filters
+                ds = DataSource(shapefile.get('path'))
+
+                logger.info('Importing from %s, %d of %d shapefiles...', ds,
+                            h + 1, len(config['shapefiles']))
+
+                lyr = ds[0]
+                logger.info('%d objects in shapefile', len(lyr))
+
+                progress = 0.0
+                logger.info('0% .. ')
+                batch = []
+                for i, feat in enumerate(lyr):
+                    if (float(i) / len(lyr)) > (progress + 0.1):
+                        progress += 0.1
+                        logger.info('%2.0f%% .. ', progress * 100)
+
+                    levels = [level.id]
+                    for region_level, filter_list in region_levels:
                         for f in filter_list:
                             if f(feat) is True:
-                                levels.append(
-                                    Geolevel.objects.get(
-                                        name='%s_%s' % (region, level.name)))
-                shape_name = get_shape_name(shapefile, feat)
-                shape_portable_id = get_shape_portable(shapefile, feat)
-                shape_tree_code = get_shape_tree(shapefile, feat)
-                prefetch = Geounit.objects.filter(
-                    name=shape_name,
-                    geolevel__in=levels,
-                    portable_id=shape_portable_id,
-                    tree_code=shape_tree_code)
-                should_create = prefetch.count() == 0
-                if should_create:
-                    try:
-                        # Store the geos geometry
-                        # Buffer by 0 to get rid of any self-intersections which may make this geometry invalid.
-                        geos = feat.geom.geos.buffer(0)
-                        # Coerce the geometry into a MultiPolygon
-                        if geos.geom_type == 'MultiPolygon':
-                            my_geom = geos
-                        elif geos.geom_type == 'Polygon':
-                            my_geom = MultiPolygon(geos)
-                        simple = my_geom.simplify(
-                            tolerance=Decimal(config['tolerance']),
-                            preserve_topology=True)
-                        if simple.geom_type != 'MultiPolygon':
-                            simple = MultiPolygon(simple)
-                        center = my_geom.centroid
-
-                        geos = None
-
-                        # Ensure the centroid is within the geometry
-                        if not center.within(my_geom):
-                            # Get the first polygon in the multipolygon
-                            first_poly = my_geom[0]
-                            # Get the extent of the first poly
-                            first_poly_extent = first_poly.extent
-                            min_x = first_poly_extent[0]
-                            max_x = first_poly_extent[2]
-                            # Create a line through the bbox and the poly center
-                            my_y = first_poly.centroid.y
-                            centerline = LineString((min_x, my_y),
-                                                    (max_x, my_y))
-                            # Get the intersection of that line and the poly
-                            intersection = centerline.intersection(first_poly)
-                            if type(intersection) is MultiLineString:
-                                intersection = intersection[0]
-                            # the center of that line is my within-the-poly centroid.
-                            center = intersection.centroid
-                            first_poly = first_poly_extent = min_x = max_x = my_y = centerline = intersection = None
-                        g = Geounit(
-                            geom=my_geom,
-                            name=shape_name,
-                            simple=simple,
-                            center=center,
-                            portable_id=shape_portable_id,
-                            tree_code=shape_tree_code)
-                        g.save()
-                        g.geolevel = levels
-                        g.save()
-
-                    except:
-                        logger.info('Failed to import geometry for feature %d',
-                                    feat.fid)
-                        logger.info(traceback.format_exc())
-                        continue
-                else:
-                    g = prefetch[0]
-                    g.geolevel = levels
-                    g.save()
-
-                if not config['attributes']:
-                    # If we created a new Geounit, we can let this function know that it doesn't
-                    # need to check for existing Characteristics, which will speed things up
-                    # significantly.
-                    self.set_geounit_characteristic(
-                        g,
-                        subject_objects,
-                        feat,
-                        not should_create,
-                        updatefield)
-
-            logger.info('100%')
+                                levels.append(region_level.id)
+
+                    values = []
+                    if not config['attributes']:
+                        values = self.get_characteristic_values(
+                            subject_objects, feat, updatefield)
+
+                    batch.append({
+                        'fid': feat.fid,
+                        'key': (get_shape_name(shapefile, feat),
+                                get_shape_portable(shapefile, feat),
+                                get_shape_tree(shapefile, feat)),
+                        'levels': levels,
+                        'geom': (bytes(feat.geom.wkb), feat.geom.srid),
+                        'values': values,
+                    })
+
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        self.import_batch(batch, existing, config, pool)
+                        batch = []
+
+                if batch:
+                    self.import_batch(batch, existing, config, pool)
+
+                logger.info('100%')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         if config['attributes']:
+            # Join the attributes to the geounits by tree code
+            tree_codes = dict(
+                Geounit.objects.filter(geolevel=level).values_list(
+                    'tree_code', 'id'))
+
             progress = 0
             logger.info("Assigning subject values to imported geography...")
             logger.info('0% .. ')
@@ -578,31 +658,180 @@ ERROR:
 
                 lyr = DataSource(attrconfig.get('path'))[0]
 
+                rows = {}
                 for i, feat in enumerate(lyr):
                     if (float(i) / len(lyr)) > (progress + 0.1):
                         progress += 0.1
                         logger.info('%2.0f%% .. ', progress * 100)
 
-                    gid = get_shape_tree(attrconfig, feat)
-                    g = Geounit.objects.filter(tree_code=gid)
+                    gid = tree_codes.get(get_shape_tree(attrconfig, feat))
+                    if gid is None:
+                        continue
+
+                    for subject_id, number, percentage in \
+                            self.get_characteristic_values(
+                                subject_objects, feat, updatefield):
+                        rows[(gid, subject_id)] = (number, percentage)
 
-                    if g.count() > 0:
-                        self.set_geounit_characteristic(
-                            g[0],
-                            subject_objects,
-                            feat,
-                            True,
-                            updatefield)
+                    if len(rows) >= IMPORT_BATCH_SIZE:
+                        self.write_characteristics(rows)
+                        rows = {}
+
+                if rows:
+                    self.write_characteristics(rows)
 
             logger.info('100%')
 
-    def set_geounit_characteristic(self,
-                                   g,
-                                   subject_objects,
-                                   feat,
-                                   updates_possible,
-                                   updatefield):
-        to_be_inserted = []
+    def get_pool(self):
+        """
+        Get a pool of worker processes to prepare geometries with.
+
+        Returns:
+            A multiprocessing Pool, or None if geometries are prepared in
+            this process.
+        """
+        if self.processes < 2:
+            return None
+
+        # The workers never use the database, so don't share the connection
+        connection.close()
+        return Pool(processes=self.processes)
+
+    def import_batch(self, batch, existing, config, pool):
+        """
+        Write a batch of features as geounits.
+
+        Features that have not been imported before are created as new
+        geounits. Features that have been are linked to their geolevels
+        again, and their characteristics are updated.
+
+        Parameters:
+            batch -- A list of dictionaries of the features' fid, key of
+                name, portable id and tree code, geolevel ids, geometry
+                WKB and SRID, and characteristic values.
+            existing -- A dictionary of the ids of the geounits that have
+                been imported, by key. New geounits are added to it.
+            config -- The configuration dict of the geolevel.
+            pool -- Optional. The pool of worker processes.
+        """
+        # Later features with the same key replace the geolevels and
+        # values of earlier ones
+        features = {}
+        for feature in batch:
+            if feature['key'] in features:
+                features[feature['key']].update(
+                    levels=feature['levels'], values=feature['values'])
+            else:
+                features[feature['key']] = feature
+
+        new = [f for k, f in features.iteritems() if k not in existing]
+        old = [f for k, f in features.iteritems() if k in existing]
+
+        target_srid = Geounit._meta.get_field('geom').srid
+        tolerance = float(config['tolerance'])
+        jobs = [(f['geom'][0], f['geom'][1], tolerance, target_srid)
+                for f in new]
+        if pool is not None and len(jobs) > 1:
+            results = pool.map(_prepare_geometry, jobs,
+                               max(1, len(jobs) // (self.processes * 4)))
+        else:
+            results = [_prepare_geometry(job) for job in jobs]
+
+        prepared = []
+        for feature, (geoms, error) in zip(new, results):
+            if geoms is None:
+                logger.info('Failed to import geometry for feature %d',
+                            feature['fid'])
+                logger.info(error)
+            else:
+                prepared.append((feature, geoms))
+
+        with transaction.atomic():
+            cursor = connection.cursor()
+
+            geounits = []
+            if prepared:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence("
+                    "'redistricting_geounit', 'id')) "
+                    "FROM generate_series(1, %s)", [len(prepared)])
+                ids = [row[0] for row in cursor.fetchall()]
+
+                for gid, (feature, geoms) in zip(ids, prepared):
+                    feature['id'] = gid
+                    existing[feature['key']] = gid
+                    geounits.append((gid, ) + feature['key'] + geoms)
+
+                copy_rows(cursor, 'redistricting_geounit',
+                          ('id', 'name', 'portable_id', 'tree_code', 'geom',
+                           'simple', 'center'), geounits)
+
+            for feature in old:
+                feature['id'] = existing[feature['key']]
+
+            if old:
+                cursor.execute(
+                    'DELETE FROM redistricting_geounit_geolevel '
+                    'WHERE geounit_id = ANY(%s)',
+                    [[f['id'] for f in old]])
+
+            imported = [f for f, geoms in prepared] + old
+            copy_rows(cursor, 'redistricting_geounit_geolevel',
+                      ('geounit_id', 'geolevel_id'),
+                      [(f['id'], lid) for f in imported
+                       for lid in set(f['levels'])])
+
+            rows = {}
+            for feature in imported:
+                for subject_id, number, percentage in feature['values']:
+                    rows[(feature['id'], subject_id)] = (number, percentage)
+            if rows:
+                self.write_characteristics(rows)
+
+        logger.debug('Imported %d new and %d existing geounits',
+                     len(prepared), len(old))
+
+    def write_characteristics(self, rows):
+        """
+        Create or update many characteristics at once.
+
+        Parameters:
+            rows -- A dictionary of (number, percentage) tuples, by
+                (geounit id, subject id) tuples.
+        """
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS setup_characteristic '
+                '(geounit_id integer, subject_id integer, '
+                'number numeric(12, 4), percentage numeric(12, 8))')
+            cursor.execute('TRUNCATE setup_characteristic')
+            copy_rows(cursor, 'setup_characteristic',
+                      ('geounit_id', 'subject_id', 'number', 'percentage'),
+                      [key + value for key, value in rows.iteritems()])
+            cursor.execute(
+                'INSERT INTO redistricting_characteristic '
+                '(geounit_id, subject_id, number, percentage) '
+                'SELECT geounit_id, subject_id, number, percentage '
+                'FROM setup_characteristic '
+                'ON CONFLICT (subject_id, geounit_id) DO UPDATE '
+                'SET number = EXCLUDED.number, '
+                'percentage = EXCLUDED.percentage')
+
+    def get_characteristic_values(self, subject_objects, feat, updatefield):
+        """
+        Get the characteristics of a feature.
+
+        Parameters:
+            subject_objects -- A dictionary of subjects by attribute name,
+                and attribute names by '<subject name>_by_id'.
+            feat -- The feature.
+            updatefield -- Optional. The only attribute to read.
+
+        Returns:
+            A list of (subject id, number, percentage) tuples.
+        """
+        values = []
         for attr, obj in subject_objects.iteritems():
             if attr.endswith('_by_id'):
                 continue
@@ -615,7 +844,7 @@ ERROR:
             except:
                 # logger.info('No attribute "%s" on feature %d' , attr, feat.fid)
                 continue
-            percentage = '0000.00000000'
+            percentage = Decimal('0000.00000000')
             if obj.percentage_denominator:
                 denominator_field = subject_objects[
                     '%s_by_id' % obj.percentage_denominator.name]
@@ -624,32 +853,14 @@ ERROR:
                 if denominator_value > 0:
                     percentage = value / denominator_value
 
-            should_create = True
-            if updates_possible:
-                query = Characteristic.objects.filter(subject=obj, geounit=g)
-                if query.count() > 0:
-                    should_create = False
-                    c = query[0]
-                    c.number = value
-                    c.percentage = percentage
-                    try:
-                        c.save()
-                    except:
-                        c.number = '0.0'
-                        c.save()
-                        logger.info(
-                            'Failed to set value "%s" to %d in feature "%s"',
-                            attr, feat.get(attr), g.name)
-                        logger.info(traceback.format_exc())
-            if should_create:
-                to_be_inserted.append(
-                    Characteristic(
-                        subject=obj,
-                        geounit=g,
-                        number=value,
-                        percentage=percentage))
-        if to_be_inserted:
-            Characteristic.objects.bulk_create(to_be_inserted)
+            if abs(value) >= MAX_NUMBER or abs(percentage) >= MAX_PERCENTAGE:
+                logger.info('Failed to set value "%s" to %s in feature %d',
+                            attr, feat.get(attr), feat.fid)
+                value = Decimal('0.0')
+                percentage = Decimal('0000.00000000')
+
+            values.append((obj.id, value, percentage))
+        return values
 
     def create_filter_functions(self, store):
         """
@@ -770,49 +981,21 @@ ERROR:
 
     def import_adjacency(self, config):
         """
-        Imports adjacency files into database using settings from the xml config.
+        Compile the adjacency files in the xml config into the adjacency
+        store, along with the average cost of each region.
 
-        Writes a temporary template with SQL commands for the import
+        Files that were compiled by an earlier run, and haven't changed
+        since, are not read again.
         """
         logger.info("Loading adjacency data")
         adjacencies = config.xpath('//DistrictBuilder/Adjacencies/*')
 
-        # Instantiate redis connection with settings from XML config
-        cache = caches['default']
-
-        # Read and load data into redis #
-        data_dict = {}
-        file_numbers = len(adjacencies)
-        for counter, adjacency in enumerate(adjacencies):
-            path = adjacency.get('path')
-            logger.info('Processing file %s of %s (%s)' % (counter + 1,
-                                                           file_numbers, path))
-            region = adjacency.get(
-                'regionref')  # Grab region id to cache avg. cost for region
-            f = open(path, 'r')
-            csv_reader = csv.reader(f, delimiter='\t')
-            c = 0  # Row counter to keep track of when to load data
-            region_sum = 0
-            for row in csv_reader:
-                c += 1
-                region_sum += float(row[2])
-                if c % 10000 == 0:
-                    # Upload 10,000 at a time, otherwise redis complains
-                    cache.set_many(data_dict)
-                    data_dict = {}
-                key = key_gen(**{'geounit1': row[0], 'geounit2': row[1]})
-                data_dict[key] = row[2]
-
-            # Need to send left over data < 10000 to redis
-            cache.set_many(data_dict)
-
-            # Cache region totals in redis
-            region_cost = region_sum / float(c)
-            key = key_gen(**{'region': region})
-            cache.set(key, region_cost)
-
-        logger.info(
-            'Finished processing files and loading data into key value store')
+        AdjacencyStore.compile(
+            [(a.get('path'), a.get('regionref')) for a in adjacencies],
+            settings.ADJACENCY_STORE)
+
+        logger.info('Finished compiling adjacency store in %s',
+                    settings.ADJACENCY_STORE)
 
     def create_report_templates(self, config):
         """
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('redistricting', '0002_auto_20180125_1940'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeounitHierarchy',
+            fields=[
+                ('id',
+                 models.AutoField(
+                     auto_created=True,
+                     primary_key=True,
+                     serialize=False,
+                     verbose_name='ID')),
+                ('ancestor',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     related_name='descendant_set',
+                     to='redistricting.Geounit')),
+                ('descendant',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     related_name='ancestor_set',
+                     to='redistricting.Geounit')),
+                ('geolevel',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     to='redistricting.Geolevel')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='geounithierarchy',
+            unique_together=set([('ancestor', 'descendant', 'geolevel')]),
+        ),
+    ]
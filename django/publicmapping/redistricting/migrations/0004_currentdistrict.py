@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Finds the latest row of each district in a plan, for DISTINCT ON queries
+# and for keeping the CurrentDistrict pointers up to date
+DISTRICT_INDEX_SQL = """
+CREATE INDEX redistricting_district_plan_latest
+    ON redistricting_district (plan_id, district_id, id DESC);
+"""
+
+DROP_DISTRICT_INDEX_SQL = """
+DROP INDEX IF EXISTS redistricting_district_plan_latest;
+"""
+
+# Point a plan's district at its latest row whenever district rows are
+# inserted, moved to another version, or deleted
+TRIGGER_SQL = """
+CREATE FUNCTION redistricting_refresh_currentdistrict(
+    p_plan_id integer, p_district_id integer) RETURNS void AS $$
+DECLARE
+    latest record;
+BEGIN
+    SELECT id, version INTO latest FROM redistricting_district
+        WHERE plan_id = p_plan_id AND district_id = p_district_id
+        ORDER BY id DESC LIMIT 1;
+
+    IF NOT FOUND THEN
+        DELETE FROM redistricting_currentdistrict
+            WHERE plan_id = p_plan_id AND district_id = p_district_id;
+    ELSE
+        INSERT INTO redistricting_currentdistrict
+            (plan_id, district_id, latest_id, version)
+            VALUES (p_plan_id, p_district_id, latest.id, latest.version)
+        ON CONFLICT (plan_id, district_id) DO UPDATE
+            SET latest_id = EXCLUDED.latest_id, version = EXCLUDED.version;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_district_currentdistrict() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM redistricting_refresh_currentdistrict(
+            OLD.plan_id, OLD.district_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM redistricting_refresh_currentdistrict(
+            NEW.plan_id, NEW.district_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER redistricting_district_currentdistrict
+    AFTER INSERT OR DELETE OR UPDATE OF plan_id, district_id, version
+    ON redistricting_district
+    FOR EACH ROW EXECUTE PROCEDURE redistricting_district_currentdistrict();
+
+INSERT INTO redistricting_currentdistrict
+    (plan_id, district_id, latest_id, version)
+    SELECT DISTINCT ON (plan_id, district_id)
+        plan_id, district_id, id, version
+    FROM redistricting_district
+    ORDER BY plan_id, district_id, id DESC;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS redistricting_district_currentdistrict
+    ON redistricting_district;
+DROP FUNCTION IF EXISTS redistricting_district_currentdistrict();
+DROP FUNCTION IF EXISTS redistricting_refresh_currentdistrict(integer, integer);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('redistricting', '0003_geounithierarchy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentDistrict',
+            fields=[
+                ('id',
+                 models.AutoField(
+                     auto_created=True,
+                     primary_key=True,
+                     serialize=False,
+                     verbose_name='ID')),
+                ('district_id', models.PositiveIntegerField()),
+                ('version', models.PositiveIntegerField()),
+                ('latest',
+                 models.ForeignKey(
+                     db_constraint=False,
+                     on_delete=django.db.models.deletion.DO_NOTHING,
+                     related_name='+',
+                     to='redistricting.District')),
+                ('plan',
+                 models.ForeignKey(
+                     db_constraint=False,
+                     on_delete=django.db.models.deletion.DO_NOTHING,
+                     related_name='+',
+                     to='redistricting.Plan')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='currentdistrict',
+            unique_together=set([('plan', 'district_id')]),
+        ),
+        migrations.RunSQL(DISTRICT_INDEX_SQL, DROP_DISTRICT_INDEX_SQL),
+        migrations.RunSQL(TRIGGER_SQL, DROP_TRIGGER_SQL),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('redistricting', '0004_currentdistrict'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeounitAdjacency',
+            fields=[
+                ('id',
+                 models.AutoField(
+                     auto_created=True,
+                     primary_key=True,
+                     serialize=False,
+                     verbose_name='ID')),
+                ('rook', models.BooleanField(default=True)),
+                ('geolevel',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     to='redistricting.Geolevel')),
+                ('geounit',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     related_name='+',
+                     to='redistricting.Geounit')),
+                ('neighbor',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     related_name='+',
+                     to='redistricting.Geounit')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='geounitadjacency',
+            unique_together=set([('geounit', 'neighbor', 'geolevel')]),
+        ),
+    ]
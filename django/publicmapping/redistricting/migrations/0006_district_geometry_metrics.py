@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('redistricting', '0005_geounitadjacency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='district',
+            name='geom_area',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='geom_perimeter',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='hull_area',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='circle_radius',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='bbox_width',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='bbox_height',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
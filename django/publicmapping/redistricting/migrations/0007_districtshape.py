@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Views that read the district or characteristic tables, such as the
+# simple_district views made by configure_views, are dropped while the
+# tables are split or joined, and made again from their saved definitions
+# afterwards. The definitions are saved before any table is renamed, so
+# they name the relations they will be made over again.
+SAVE_DEPENDENTS_SQL = """
+CREATE TEMPORARY TABLE redistricting_dependent_views ON COMMIT DROP AS
+    SELECT DISTINCT v.oid::regclass::text AS name,
+        pg_get_viewdef(v.oid) AS definition
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    JOIN pg_class v ON v.oid = r.ev_class
+    WHERE d.classid = 'pg_rewrite'::regclass
+        AND d.refobjid IN ('redistricting_district'::regclass,
+            'redistricting_computedcharacteristic'::regclass)
+        AND v.oid <> d.refobjid;
+
+DO $$
+DECLARE
+    dependent record;
+BEGIN
+    FOR dependent IN SELECT name FROM redistricting_dependent_views LOOP
+        EXECUTE 'DROP VIEW ' || dependent.name;
+    END LOOP;
+END;
+$$;
+"""
+
+RESTORE_DEPENDENTS_SQL = """
+DO $$
+DECLARE
+    dependent record;
+BEGIN
+    FOR dependent IN
+            SELECT name, definition FROM redistricting_dependent_views LOOP
+        EXECUTE 'CREATE VIEW ' || dependent.name || ' AS ' ||
+            dependent.definition;
+    END LOOP;
+END;
+$$;
+
+DROP TABLE redistricting_dependent_views;
+"""
+
+# Move the geometry, simplified geometry and measures of each district row
+# to a shape, and key the characteristics on the shape. Every existing row
+# starts with a shape of its own, with the same id.
+SPLIT_SQL = """
+ALTER TABLE redistricting_district
+    RENAME TO redistricting_districtversion;
+ALTER TABLE redistricting_computedcharacteristic
+    RENAME TO redistricting_districtshapecharacteristic;
+
+CREATE TABLE redistricting_districtshape (
+    id serial PRIMARY KEY,
+    geom geometry(MultiPolygon, 3785) NOT NULL,
+    simple geometry(GeometryCollection, 3785) NOT NULL,
+    geom_area double precision NULL,
+    geom_perimeter double precision NULL,
+    hull_area double precision NULL,
+    circle_radius double precision NULL,
+    bbox_width double precision NULL,
+    bbox_height double precision NULL
+);
+
+INSERT INTO redistricting_districtshape
+    (id, geom, simple, geom_area, geom_perimeter, hull_area, circle_radius,
+     bbox_width, bbox_height)
+    SELECT id, geom, simple, geom_area, geom_perimeter, hull_area,
+        circle_radius, bbox_width, bbox_height
+    FROM redistricting_districtversion;
+
+SELECT setval('redistricting_districtshape_id_seq', coalesce(max(id), 0) + 1,
+              false)
+    FROM redistricting_districtshape;
+
+CREATE INDEX redistricting_districtshape_geom_id
+    ON redistricting_districtshape USING GIST (geom);
+CREATE INDEX redistricting_districtshape_simple_id
+    ON redistricting_districtshape USING GIST (simple);
+
+ALTER TABLE redistricting_districtversion ADD COLUMN shape_id integer;
+UPDATE redistricting_districtversion SET shape_id = id;
+ALTER TABLE redistricting_districtversion
+    ALTER COLUMN shape_id SET NOT NULL,
+    ADD CONSTRAINT redistricting_districtversion_shape_id_fk
+        FOREIGN KEY (shape_id) REFERENCES redistricting_districtshape (id)
+        DEFERRABLE INITIALLY DEFERRED,
+    DROP COLUMN geom,
+    DROP COLUMN simple,
+    DROP COLUMN geom_area,
+    DROP COLUMN geom_perimeter,
+    DROP COLUMN hull_area,
+    DROP COLUMN circle_radius,
+    DROP COLUMN bbox_width,
+    DROP COLUMN bbox_height;
+CREATE INDEX redistricting_districtversion_shape_id
+    ON redistricting_districtversion (shape_id);
+
+ALTER TABLE redistricting_districtshapecharacteristic
+    ADD COLUMN shape_id integer;
+UPDATE redistricting_districtshapecharacteristic SET shape_id = district_id;
+
+-- Keep the latest of the rows of a district that share a subject
+DELETE FROM redistricting_districtshapecharacteristic a
+    USING redistricting_districtshapecharacteristic b
+    WHERE a.shape_id = b.shape_id AND a.subject_id = b.subject_id
+        AND a.id < b.id;
+
+ALTER TABLE redistricting_districtshapecharacteristic
+    ALTER COLUMN shape_id SET NOT NULL,
+    DROP COLUMN district_id,
+    ADD CONSTRAINT redistricting_districtshapecharacteristic_shape_id_fk
+        FOREIGN KEY (shape_id) REFERENCES redistricting_districtshape (id)
+        ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    ADD CONSTRAINT redistricting_districtshapecharacteristic_shape_subject
+        UNIQUE (shape_id, subject_id);
+"""
+
+# The district and characteristic tables the models read and write are
+# views over the versions and their shapes. Writes through the views are
+# made by these triggers:
+#
+# - a district inserted with the shape_id of a shape with the same
+#   geometry, or with no geometry at all, shares that shape;
+# - a district whose geometry is updated while other districts share its
+#   shape is given a copy of the shape and its characteristics first;
+# - a shape is deleted with the last district that shares it;
+# - characteristics are written to the shape of their district, and are
+#   only deleted with the last district that shares the shape.
+VIEWS_SQL = """
+CREATE VIEW redistricting_district AS
+    SELECT v.id, v.district_id, v.short_label, v.long_label, v.plan_id,
+        s.geom, s.simple, v.version, v.is_locked, v.num_members,
+        s.geom_area, s.geom_perimeter, s.hull_area, s.circle_radius,
+        s.bbox_width, s.bbox_height, v.shape_id
+    FROM redistricting_districtversion v
+    LEFT JOIN redistricting_districtshape s ON s.id = v.shape_id;
+
+ALTER VIEW redistricting_district
+    ALTER COLUMN id SET DEFAULT nextval('redistricting_district_id_seq');
+
+CREATE VIEW redistricting_computedcharacteristic AS
+    SELECT c.id, c.number, c.percentage, v.id AS district_id, c.subject_id
+    FROM redistricting_districtversion v
+    JOIN redistricting_districtshapecharacteristic c
+        ON c.shape_id = v.shape_id;
+
+ALTER VIEW redistricting_computedcharacteristic
+    ALTER COLUMN id SET DEFAULT
+        nextval('redistricting_computedcharacteristic_id_seq');
+
+CREATE FUNCTION redistricting_create_districtshape(
+    district redistricting_district) RETURNS integer AS $$
+DECLARE
+    created integer;
+BEGIN
+    INSERT INTO redistricting_districtshape
+        (geom, simple, geom_area, geom_perimeter, hull_area, circle_radius,
+         bbox_width, bbox_height)
+        VALUES (district.geom, district.simple, district.geom_area,
+            district.geom_perimeter, district.hull_area,
+            district.circle_radius, district.bbox_width,
+            district.bbox_height)
+        RETURNING id INTO created;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_district_insert() RETURNS trigger AS $$
+BEGIN
+    IF NEW.shape_id IS NOT NULL AND NEW.geom IS NOT NULL THEN
+        PERFORM 1 FROM redistricting_districtshape
+            WHERE id = NEW.shape_id AND geom ~= NEW.geom
+                AND ST_AsEWKB(geom) = ST_AsEWKB(NEW.geom);
+        IF NOT FOUND THEN
+            NEW.shape_id := NULL;
+        END IF;
+    END IF;
+
+    IF NEW.shape_id IS NULL THEN
+        NEW.shape_id := redistricting_create_districtshape(NEW);
+    END IF;
+
+    INSERT INTO redistricting_districtversion
+        (id, district_id, short_label, long_label, plan_id, version,
+         is_locked, num_members, shape_id)
+        VALUES (NEW.id, NEW.district_id, NEW.short_label, NEW.long_label,
+            NEW.plan_id, NEW.version, NEW.is_locked, NEW.num_members,
+            NEW.shape_id);
+
+    -- Rows inserted with their own ids, as fixtures are, move the sequence
+    PERFORM setval('redistricting_district_id_seq', NEW.id)
+        WHERE NEW.id > (SELECT last_value FROM redistricting_district_id_seq);
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_district_update() RETURNS trigger AS $$
+DECLARE
+    reshaped boolean;
+BEGIN
+    reshaped := coalesce(NOT (NEW.geom ~= OLD.geom AND
+        ST_AsEWKB(NEW.geom) = ST_AsEWKB(OLD.geom)), true);
+
+    IF reshaped AND EXISTS (
+            SELECT 1 FROM redistricting_districtversion
+            WHERE shape_id = OLD.shape_id AND id <> OLD.id) THEN
+        NEW.shape_id := redistricting_create_districtshape(NEW);
+        INSERT INTO redistricting_districtshapecharacteristic
+            (shape_id, subject_id, number, percentage)
+            SELECT NEW.shape_id, subject_id, number, percentage
+            FROM redistricting_districtshapecharacteristic
+            WHERE shape_id = OLD.shape_id;
+    ELSE
+        NEW.shape_id := OLD.shape_id;
+        UPDATE redistricting_districtshape
+            SET geom = NEW.geom, simple = NEW.simple,
+                geom_area = NEW.geom_area,
+                geom_perimeter = NEW.geom_perimeter,
+                hull_area = NEW.hull_area,
+                circle_radius = NEW.circle_radius,
+                bbox_width = NEW.bbox_width, bbox_height = NEW.bbox_height
+            WHERE id = OLD.shape_id AND (reshaped
+                OR ST_AsEWKB(NEW.simple) IS DISTINCT FROM ST_AsEWKB(OLD.simple)
+                OR (NEW.geom_area, NEW.geom_perimeter, NEW.hull_area,
+                    NEW.circle_radius, NEW.bbox_width, NEW.bbox_height)
+                    IS DISTINCT FROM
+                    (OLD.geom_area, OLD.geom_perimeter, OLD.hull_area,
+                     OLD.circle_radius, OLD.bbox_width, OLD.bbox_height));
+    END IF;
+
+    UPDATE redistricting_districtversion
+        SET id = NEW.id, district_id = NEW.district_id,
+            short_label = NEW.short_label, long_label = NEW.long_label,
+            plan_id = NEW.plan_id, version = NEW.version,
+            is_locked = NEW.is_locked, num_members = NEW.num_members,
+            shape_id = NEW.shape_id
+        WHERE id = OLD.id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_district_delete() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM redistricting_districtversion WHERE id = OLD.id;
+    DELETE FROM redistricting_districtshape
+        WHERE id = OLD.shape_id AND NOT EXISTS (
+            SELECT 1 FROM redistricting_districtversion
+            WHERE shape_id = OLD.shape_id);
+
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_computedcharacteristic_insert()
+    RETURNS trigger AS $$
+BEGIN
+    INSERT INTO redistricting_districtshapecharacteristic
+        (id, shape_id, subject_id, number, percentage)
+        SELECT NEW.id, shape_id, NEW.subject_id, NEW.number, NEW.percentage
+        FROM redistricting_districtversion WHERE id = NEW.district_id
+    ON CONFLICT (shape_id, subject_id) DO UPDATE
+        SET number = EXCLUDED.number, percentage = EXCLUDED.percentage
+    RETURNING id INTO NEW.id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'District % does not exist', NEW.district_id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+
+    PERFORM setval('redistricting_computedcharacteristic_id_seq', NEW.id)
+        WHERE NEW.id > (SELECT last_value
+                        FROM redistricting_computedcharacteristic_id_seq);
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_computedcharacteristic_update()
+    RETURNS trigger AS $$
+BEGIN
+    UPDATE redistricting_districtshapecharacteristic
+        SET subject_id = NEW.subject_id, number = NEW.number,
+            percentage = NEW.percentage
+        WHERE id = OLD.id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION redistricting_computedcharacteristic_delete()
+    RETURNS trigger AS $$
+BEGIN
+    DELETE FROM redistricting_districtshapecharacteristic c
+        WHERE c.id = OLD.id AND NOT EXISTS (
+            SELECT 1 FROM redistricting_districtversion v
+            WHERE v.shape_id = c.shape_id AND v.id <> OLD.district_id);
+
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER redistricting_district_insert
+    INSTEAD OF INSERT ON redistricting_district
+    FOR EACH ROW EXECUTE PROCEDURE redistricting_district_insert();
+CREATE TRIGGER redistricting_district_update
+    INSTEAD OF UPDATE ON redistricting_district
+    FOR EACH ROW EXECUTE PROCEDURE redistricting_district_update();
+CREATE TRIGGER redistricting_district_delete
+    INSTEAD OF DELETE ON redistricting_district
+    FOR EACH ROW EXECUTE PROCEDURE redistricting_district_delete();
+
+CREATE TRIGGER redistricting_computedcharacteristic_insert
+    INSTEAD OF INSERT ON redistricting_computedcharacteristic
+    FOR EACH ROW EXECUTE PROCEDURE
+        redistricting_computedcharacteristic_insert();
+CREATE TRIGGER redistricting_computedcharacteristic_update
+    INSTEAD OF UPDATE ON redistricting_computedcharacteristic
+    FOR EACH ROW EXECUTE PROCEDURE
+        redistricting_computedcharacteristic_update();
+CREATE TRIGGER redistricting_computedcharacteristic_delete
+    INSTEAD OF DELETE ON redistricting_computedcharacteristic
+    FOR EACH ROW EXECUTE PROCEDURE
+        redistricting_computedcharacteristic_delete();
+"""
+
+DROP_VIEWS_SQL = """
+DROP FUNCTION redistricting_create_districtshape(redistricting_district);
+
+DROP VIEW redistricting_computedcharacteristic;
+DROP VIEW redistricting_district;
+
+DROP FUNCTION redistricting_computedcharacteristic_delete();
+DROP FUNCTION redistricting_computedcharacteristic_update();
+DROP FUNCTION redistricting_computedcharacteristic_insert();
+DROP FUNCTION redistricting_district_delete();
+DROP FUNCTION redistricting_district_update();
+DROP FUNCTION redistricting_district_insert();
+"""
+
+# Copy the shapes and characteristics back to every row that shares them
+JOIN_SQL = """
+ALTER TABLE redistricting_districtversion
+    ADD COLUMN geom geometry(MultiPolygon, 3785),
+    ADD COLUMN simple geometry(GeometryCollection, 3785),
+    ADD COLUMN geom_area double precision NULL,
+    ADD COLUMN geom_perimeter double precision NULL,
+    ADD COLUMN hull_area double precision NULL,
+    ADD COLUMN circle_radius double precision NULL,
+    ADD COLUMN bbox_width double precision NULL,
+    ADD COLUMN bbox_height double precision NULL;
+UPDATE redistricting_districtversion v
+    SET geom = s.geom, simple = s.simple, geom_area = s.geom_area,
+        geom_perimeter = s.geom_perimeter, hull_area = s.hull_area,
+        circle_radius = s.circle_radius, bbox_width = s.bbox_width,
+        bbox_height = s.bbox_height
+    FROM redistricting_districtshape s
+    WHERE s.id = v.shape_id;
+ALTER TABLE redistricting_districtversion
+    ALTER COLUMN geom SET NOT NULL,
+    ALTER COLUMN simple SET NOT NULL;
+CREATE INDEX redistricting_district_geom_id
+    ON redistricting_districtversion USING GIST (geom);
+CREATE INDEX redistricting_district_simple_id
+    ON redistricting_districtversion USING GIST (simple);
+
+ALTER TABLE redistricting_districtshapecharacteristic
+    DROP CONSTRAINT redistricting_districtshapecharacteristic_shape_subject,
+    ADD COLUMN district_id integer;
+INSERT INTO redistricting_districtshapecharacteristic
+    (number, percentage, subject_id, shape_id, district_id)
+    SELECT c.number, c.percentage, c.subject_id, c.shape_id, v.id
+    FROM redistricting_districtversion v
+    JOIN redistricting_districtshapecharacteristic c
+        ON c.shape_id = v.shape_id;
+DELETE FROM redistricting_districtshapecharacteristic
+    WHERE district_id IS NULL;
+ALTER TABLE redistricting_districtshapecharacteristic
+    DROP COLUMN shape_id,
+    ALTER COLUMN district_id SET NOT NULL,
+    ADD CONSTRAINT redistricting_computedcharacteristic_district_id_fk
+        FOREIGN KEY (district_id)
+        REFERENCES redistricting_districtversion (id)
+        DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX redistricting_computedcharacteristic_district_id
+    ON redistricting_districtshapecharacteristic (district_id);
+
+ALTER TABLE redistricting_districtversion DROP COLUMN shape_id;
+DROP TABLE redistricting_districtshape;
+
+ALTER TABLE redistricting_districtshapecharacteristic
+    RENAME TO redistricting_computedcharacteristic;
+ALTER TABLE redistricting_districtversion
+    RENAME TO redistricting_district;
+"""
+
+
+class Migration(migrations.Migration):
+    """
+    Share the shapes and characteristics of districts between versions.
+
+    The district and characteristic tables become views, so any later
+    migration that alters their columns must alter the tables under them.
+    """
+
+    dependencies = [
+        ('redistricting', '0006_district_geometry_metrics'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    SAVE_DEPENDENTS_SQL + SPLIT_SQL + VIEWS_SQL +
+                    RESTORE_DEPENDENTS_SQL, SAVE_DEPENDENTS_SQL +
+                    DROP_VIEWS_SQL + JOIN_SQL + RESTORE_DEPENDENTS_SQL),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='district',
+                    name='shape_id',
+                    field=models.PositiveIntegerField(
+                        blank=True, editable=False, null=True),
+                ),
+            ]),
+    ]
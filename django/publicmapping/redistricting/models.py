@@ -37,17 +37,24 @@ from django.contrib.gis.db.models.query import GeoQuerySet
 from django.contrib.gis.db.models import Collect, Extent
 from django.contrib.auth.models import User
 from django.db.models import Sum, Max, Q, Count
-from django.db.models.signals import pre_save, post_save, m2m_changed
-from django.db import connection, transaction
+from django.db.models.signals import (pre_save, post_save, post_delete,
+                                      m2m_changed)
+from django.db import connection, transaction, IntegrityError
 from django.forms import ModelForm
 from django.conf import settings
-from django.utils import translation
+from django.core.cache import caches
 from django.utils.translation import ugettext as _
 from django.template.loader import render_to_string
 from django_comments.models import Comment
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import title
 from redistricting.calculators import Schwartzberg, Contiguity, SumValues
+from redistricting import (contiguity, geometrymetrics, labels, nesting,
+                           parallel, splits, tilecache, vectortiles,
+                           versionmemo)
+from redistricting.assignments import AssignmentIndex, NO_DISTRICT
+from redistricting.characteristics import (get_characteristic_matrix,
+                                           invalidate_characteristic_matrix)
 from tagging.models import TaggedItem, Tag
 from tagging.registry import register
 from datetime import datetime
@@ -55,55 +62,24 @@ from copy import copy
 import json
 from decimal import *
 from operator import attrgetter
-import polib
+import numpy as np
 from traceback import format_exc
 import os, sys, cPickle, types, tagging, re, logging
+import hashlib
 
 logger = logging.getLogger(__name__)
 
-# Caches for po files
-I18N_CACHE = {}
-
-
 class BaseModel(models.Model):
     """
     A base class for models that have short labels, labels, and long descriptions.
     Any class that extends this base class must have a 'name' field.
     """
 
-    def __init__(self, *args, **kwargs):
-        """
-        Initialize the message file cache.
-        """
-        super(BaseModel, self).__init__(*args, **kwargs)
-        # Hardcoding to avoid a bug in Django 1.8 get_language
-        # (refer to https://github.com/django-parler/django-parler/issues/90)
-        lang = translation.get_language() or settings.LANGUAGE_CODE
-        if not lang in I18N_CACHE:
-            try:
-                path = os.path.join(
-                    settings.STATIC_ROOT,
-                    '../locale/%s/LC_MESSAGES/xmlconfig.mo' % lang)
-                path = os.path.normpath(path)
-                I18N_CACHE[lang] = polib.mofile(path)
-            except Exception, ex:
-                path = os.path.join(
-                    settings.STATIC_ROOT,
-                    '../locale/%s/LC_MESSAGES/xmlconfig.po' % lang)
-                path = os.path.normpath(path)
-                I18N_CACHE[lang] = polib.pofile(path)
-
     def get_short_label(self):
         """
         Get the short label (a.k.a. title) of the object.
         """
-        msgid = u'%s short label' % self.name
-        try:
-            lang = translation.get_language()
-            return I18N_CACHE[lang].find(msgid).msgstr
-        except Exception, ex:
-            logger.debug('Cannot find msgid %s, fallback to msgid', msgid)
-            return msgid
+        return labels.translate(u'%s short label' % self.name)
 
     def get_label(self):
         """
@@ -111,26 +87,29 @@ class BaseModel(models.Model):
         shorter than the description. Most often, this is the default text
         representation of an object.
         """
-        msgid = u'%s label' % self.name
-        try:
-            lang = translation.get_language()
-            return I18N_CACHE[lang].find(msgid).msgstr
-        except Exception, ex:
-            logger.debug('Cannot find msgid %s, fallback to msgid', msgid)
-            return msgid
+        return labels.translate(u'%s label' % self.name)
 
     def get_long_description(self):
         """
         Get the description of the object. This is a verbose description of the
         object.
         """
-        msgid = u'%s long description' % self.name
-        try:
-            lang = translation.get_language()
-            return I18N_CACHE[lang].find(msgid).msgstr
-        except Exception, ex:
-            logger.debug('Cannot find msgid %s, fallback to msgid', msgid)
-            return msgid
+        return labels.translate(u'%s long description' % self.name)
+
+    def get_labels(self):
+        """
+        Get the short label, label and long description of the object at
+        once.
+
+        Returns:
+            A tuple of the short label, label and long description.
+        """
+        return tuple(
+            labels.translate_many([
+                u'%s short label' % self.name,
+                u'%s label' % self.name,
+                u'%s long description' % self.name
+            ]))
 
     class Meta:
         abstract = True
@@ -355,13 +334,7 @@ class LegislativeBody(BaseModel):
         """
         Get the label for this legislative body's members.
         """
-        msgid = u'%s members' % self.name
-        try:
-            lang = translation.get_language()
-            return I18N_CACHE[lang].find(msgid).msgstr
-        except Exception, ex:
-            logger.debug('Cannot find msgid %s, fallback to msgid', msgid)
-            return msgid
+        return labels.translate(u'%s members' % self.name)
 
     def get_default_subject(self):
         """
@@ -463,6 +436,19 @@ class LegislativeBody(BaseModel):
             long_description = title(self.name)
         return long_description
 
+    def get_labels(self):
+        """
+        Get the short label, label and long description of the
+        LegislativeBody at once. Labels that have not been translated
+        fall back to the district formats and the title of the name, as
+        they do when they are read one at a time.
+
+        Returns:
+            A tuple of the short label, label and long description.
+        """
+        return (self.get_short_label(), self.get_label(),
+                self.get_long_description())
+
     class Meta:
         """
         Additional information about the LegislativeBody model.
@@ -516,7 +502,8 @@ class Geolevel(BaseModel):
         """
         return self.get_label()
 
-    def renest(self, parent, subject=None, spatial=True):
+    def renest(self, parent, subject=None, spatial=True, bulk=True,
+               progress=None):
         """
         Renest all geounits in this geolevel, based on the parent (smaller!)
         geography in the parent.
@@ -527,23 +514,70 @@ class Geolevel(BaseModel):
                 aggregate all subjects.
             spatial -- A flag indicating that the spatial aggregates should be
                 computed as well as the numerical aggregates.
+            bulk -- Optional. Aggregate all geounits at once with set-based
+                queries, matching parent geounits by their tree_code
+                prefix. If False, aggregate each geounit in turn.
+            progress -- Optional. A function that is called with a message,
+                the number of geounits processed, and the total number of
+                geounits as the geometries are aggregated.
         """
         if parent is None:
             return True
 
-        progress = 0
+        if bulk:
+            geomods, nummods = self.aggregate_geounits(parent, subject,
+                                                       spatial, progress)
+        else:
+            geomods, nummods = self.aggregate_each_geounit(
+                parent, subject, spatial, progress)
+
+        logger.debug("Geounits modified: (geometry: %d, data values: %d)",
+                     geomods, nummods)
+
+        if nummods > 0:
+            invalidate_characteristic_matrix()
+
+        # The geometries have changed, so the nesting may have, too
+        if geomods > 0:
+            self.build_hierarchy()
+
+        return True
+
+    def aggregate_each_geounit(self, parent, subject=None, spatial=True,
+                               progress=None):
+        """
+        Aggregate each geounit in this geolevel in turn, with
+        Geounit.aggregate.
+
+        Parameters:
+            parent -- The geolevel of the smaller geounits that comprise
+                the geounits in this geolevel.
+            subject -- Optional. The subject to aggregate. If omitted, all
+                subjects are aggregated.
+            spatial -- Aggregate the geometries as well as the numbers.
+            progress -- Optional. A function called with a message, the
+                number of geounits processed, and the total number of
+                geounits.
+
+        Returns:
+            A tuple of the number of geometries and the number of
+            characteristics modified.
+        """
         logger.info("Recomputing geometric and numerical aggregates...")
         logger.info('0% .. ')
 
         geomods = 0
         nummods = 0
+        reported = 0
 
         unitqset = self.geounit_set.all()
         count = unitqset.count()
         for i, geounit in enumerate(unitqset):
-            if (float(i) / unitqset.count()) > (progress + 0.1):
-                progress += 0.1
-                logger.info('%2.0f%% .. ', (progress * 100))
+            if (float(i) / count) > (reported + 0.1):
+                reported += 0.1
+                logger.info('%2.0f%% .. ', (reported * 100))
+                if progress is not None:
+                    progress('Aggregating geounits', i, count)
 
             geo, num = geounit.aggregate(parent, subject, spatial)
 
@@ -551,11 +585,231 @@ class Geolevel(BaseModel):
             nummods += num
 
         logger.info('100%')
+        if progress is not None:
+            progress('Aggregating geounits', count, count)
 
-        logger.debug("Geounits modified: (geometry: %d, data values: %d)",
-                     geomods, nummods)
+        return (
+            geomods,
+            nummods,
+        )
 
-        return True
+    def aggregate_geounits(self, parent, subject=None, spatial=True,
+                           progress=None):
+        """
+        Aggregate all geounits in this geolevel at once.
+
+        Parent geounits belong to the geounit in this geolevel whose
+        tree_code is a prefix of theirs. The characteristics of all
+        subjects are summed and written with one grouped statement per
+        tree_code length, and the geometries are unioned by PostGIS in
+        batches, which are spread over RENEST_CONCURRENCY worker processes
+        when it is greater than 1.
+
+        Parameters:
+            parent -- The geolevel of the smaller geounits that comprise
+                the geounits in this geolevel.
+            subject -- Optional. The subject to aggregate. If omitted, all
+                subjects are aggregated.
+            spatial -- Aggregate the geometries as well as the numbers.
+            progress -- Optional. A function called with a message, the
+                number of geounits processed, and the total number of
+                geounits.
+
+        Returns:
+            A tuple of the number of geometries and the number of
+            characteristics modified.
+        """
+        if subject is None:
+            subjects = Subject.objects.all()
+        elif isinstance(subject, Subject):
+            subjects = [subject]
+        elif isinstance(subject, basestring):
+            subjects = Subject.objects.filter(name=subject)
+        else:
+            subjects = Subject.objects.filter(id=subject)
+
+        subject_ids = [s.id for s in subjects]
+        # The denominators are summed too, to compute the percentages
+        summed_ids = list(
+            set(subject_ids) | set(s.percentage_denominator_id
+                                   for s in subjects
+                                   if s.percentage_denominator_id))
+
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT DISTINCT length(g.tree_code) '
+            'FROM redistricting_geounit g '
+            'JOIN redistricting_geounit_geolevel gl ON gl.geounit_id = g.id '
+            'WHERE gl.geolevel_id = %s AND g.tree_code IS NOT NULL', [self.id])
+        lengths = [row[0] for row in cursor.fetchall()]
+
+        geomods = 0
+        nummods = 0
+        nested = []
+        for length in lengths:
+            params = {
+                'child': self.id,
+                'parent': parent.id,
+                'length': length,
+                'ids': None,
+                'subjects': subject_ids,
+                'summed': summed_ids,
+            }
+
+            cursor.execute(nesting.MEMBERS_SQL + nesting.CHILD_SQL, params)
+            if subject_ids:
+                cursor.execute(
+                    nesting.MEMBERS_SQL + nesting.CHARACTERISTIC_SQL, params)
+                nummods += cursor.rowcount
+
+            cursor.execute(
+                nesting.MEMBERS_SQL +
+                'SELECT DISTINCT child_id FROM members ORDER BY child_id',
+                params)
+            nested.extend((length, row[0]) for row in cursor.fetchall())
+
+        logger.info('Aggregated %d characteristics of %d geounits',
+                    nummods, len(nested))
+        if progress is not None:
+            progress('Aggregating characteristics', len(nested), len(nested))
+
+        if spatial and nested:
+            geomods = self._union_geounits(parent, nested, progress)
+
+        return (
+            geomods,
+            nummods,
+        )
+
+    def _union_geounits(self, parent, nested, progress=None):
+        """
+        Union the geometries of the parent geounits of each geounit.
+
+        Parameters:
+            parent -- The geolevel of the smaller geounits.
+            nested -- A list of (tree_code length, geounit id) tuples of
+                the geounits to aggregate.
+            progress -- Optional. A function called with a message, the
+                number of geounits processed, and the total number of
+                geounits.
+
+        Returns:
+            The number of geometries modified.
+        """
+        jobs = []
+        for i in range(0, len(nested), nesting.BATCH_SIZE):
+            batch = nested[i:i + nesting.BATCH_SIZE]
+            for length in sorted(set(l for l, gid in batch)):
+                jobs.append((self.id, parent.id, length, self.tolerance,
+                             [gid for l, gid in batch if l == length]))
+
+        total = len(nested)
+        processed = 0
+        geomods = 0
+        logger.info("Recomputing geometric aggregates...")
+
+        for modified, count in nesting.union_geounits(jobs):
+            geomods += modified
+            processed += count
+            logger.info('%2.0f%% .. ', (100.0 * processed / total))
+            if progress is not None:
+                progress('Aggregating geometries', processed, total)
+
+        return geomods
+
+    def get_nested_geolevels(self):
+        """
+        Get the geolevels that nest inside this geolevel in any
+        legislative body.
+
+        Returns:
+            A list of Geolevel IDs.
+        """
+        nested = set()
+        for llevel in self.legislativelevel_set.all():
+            parent = llevel.parent
+            while parent is not None:
+                nested.add(parent.geolevel_id)
+                parent = parent.parent
+
+        nested.discard(self.id)
+        return list(nested)
+
+    def build_hierarchy(self):
+        """
+        Rebuild the GeounitHierarchy of the geounits in this geolevel.
+        Geounits in nested geolevels are descendants of the geounit in
+        this geolevel that contains their centroid.
+
+        Returns:
+            The number of GeounitHierarchy rows created.
+        """
+        cursor = connection.cursor()
+        cursor.execute(
+            'DELETE FROM redistricting_geounithierarchy h '
+            'USING redistricting_geounit_geolevel gl '
+            'WHERE h.ancestor_id = gl.geounit_id AND gl.geolevel_id = %s',
+            [self.id])
+
+        created = 0
+        for nested in self.get_nested_geolevels():
+            cursor.execute(
+                'INSERT INTO redistricting_geounithierarchy '
+                '(ancestor_id, descendant_id, geolevel_id) '
+                'SELECT a.id, d.id, dl.geolevel_id '
+                'FROM redistricting_geounit a '
+                'JOIN redistricting_geounit_geolevel al '
+                'ON al.geounit_id = a.id '
+                'JOIN redistricting_geounit d '
+                'ON ST_Intersects(a.geom, d.center) '
+                'JOIN redistricting_geounit_geolevel dl '
+                'ON dl.geounit_id = d.id '
+                'WHERE al.geolevel_id = %s AND dl.geolevel_id = %s',
+                [self.id, nested])
+            created += cursor.rowcount
+
+        logger.debug('Built hierarchy of %d nested geounits in geolevel %s',
+                     created, self.name)
+
+        return created
+
+    def build_adjacency(self):
+        """
+        Rebuild the GeounitAdjacency of the geounits in this geolevel.
+        Geounits are adjacent if they intersect; they are rook adjacent
+        if they share a boundary line, or overlap.
+
+        Returns:
+            The number of GeounitAdjacency rows created.
+        """
+        cursor = connection.cursor()
+        cursor.execute(
+            'DELETE FROM redistricting_geounitadjacency WHERE geolevel_id = %s',
+            [self.id])
+        cursor.execute(
+            'INSERT INTO redistricting_geounitadjacency '
+            '(geounit_id, neighbor_id, geolevel_id, rook) '
+            'SELECT a.id, b.id, al.geolevel_id, '
+            "ST_Relate(a.geom, b.geom, '****1****') "
+            "OR ST_Relate(a.geom, b.geom, 'T********') "
+            'FROM redistricting_geounit a '
+            'JOIN redistricting_geounit_geolevel al '
+            'ON al.geounit_id = a.id '
+            'JOIN redistricting_geounit b '
+            'ON a.geom && b.geom AND a.id < b.id '
+            'AND ST_Intersects(a.geom, b.geom) '
+            'JOIN redistricting_geounit_geolevel bl '
+            'ON bl.geounit_id = b.id '
+            'WHERE al.geolevel_id = %s AND bl.geolevel_id = %s',
+            [self.id, self.id])
+        created = cursor.rowcount
+
+        contiguity.invalidate_contiguity_graph()
+
+        logger.debug('Built adjacency of %d geounit pairs in geolevel %s',
+                     created, self.name)
+
+        return created
 
     def calc_extent(self):
         """
@@ -664,6 +918,103 @@ class Geounit(models.Model):
     def get_mixed_geounits(geounit_ids, legislative_body, geolevel, boundary,
                            inside):
         """
+        Search for the largest Geounits inside or outside a boundary.
+
+        The Geounits selected are tested against the boundary first. Those
+        that lie completely inside or outside of it are resolved, and only
+        the Geounits split by the boundary are replaced by their children
+        in the next smaller Geolevel, found in the GeounitHierarchy, and
+        tested in turn, until the base Geolevel is reached.
+
+        If the GeounitHierarchy hasn't been built, this falls back to the
+        multipass spatial search in get_mixed_geounits_spatial.
+
+        Parameters:
+            geounit_ids -- A list of Geounit IDs.
+            legislative_body -- The LegislativeBody that contains this
+                geolevel.
+            geolevel -- The ID of the Geolevel that contains geounit_ids
+            boundary -- The GEOSGeometry that defines the edge of the
+                spatial search area.
+            inside -- True or False to search inside or outside of the
+                boundary, respectively.
+
+        Returns:
+            A list of Geounit objects, with the ID, child, geolevel,
+            and Geometry fields populated.
+        """
+        if not boundary and inside:
+            # there are 0 geounits inside a non-existent boundary
+            return []
+
+        if not boundary:
+            # all geounits are outside a non-existent boundary
+            return list(Geounit.objects.filter(id__in=geounit_ids))
+
+        # Make sure the geolevel is a number
+        geolevel = int(geolevel)
+        levels = legislative_body.get_geolevels()
+        level_ids = [level.id for level in levels]
+        if not geolevel in level_ids:
+            return []
+        levels = levels[level_ids.index(geolevel):]
+        base_geolevel = levels[-1]
+
+        units = []
+        candidates = set(map(int, geounit_ids))
+        for i, level in enumerate(levels):
+            if len(candidates) == 0:
+                break
+
+            qset = Geounit.objects.filter(id__in=candidates)
+            if inside:
+                if level == base_geolevel:
+                    # Search by centroid
+                    found = qset.filter(center__intersects=boundary)
+                else:
+                    found = qset.filter(geom__within=boundary)
+                    resolved = qset.filter(
+                        geom__relate=(boundary, 'F********'))
+            else:
+                if level == base_geolevel and i > 0:
+                    # Search the pieces of split geounits by centroid
+                    found = qset.exclude(
+                        center__relate=(boundary, 'T********'))
+                else:
+                    found = qset.filter(geom__relate=(boundary, 'F********'))
+                if level != base_geolevel:
+                    resolved = qset.filter(geom__within=boundary)
+
+            found = list(found)
+            units += found
+            logger.debug('Found %d geounits in boundary at level %s',
+                         len(found), level)
+
+            if level == base_geolevel:
+                break
+
+            # Only the geounits split by the boundary are searched further
+            split = candidates - set(unit.id for unit in found) - set(
+                resolved.values_list('id', flat=True))
+            if len(split) == 0:
+                break
+
+            candidates = GeounitHierarchy.get_descendant_ids(
+                split, levels[i + 1].id)
+            if len(candidates) == 0:
+                logger.info(
+                    'No geounit hierarchy for geolevel %s, searching '
+                    'spatially. Run setup to build the hierarchy.', level)
+                return Geounit.get_mixed_geounits_spatial(
+                    geounit_ids, legislative_body, geolevel, boundary, inside)
+
+        # Send back the collected Geounits
+        return units
+
+    @staticmethod
+    def get_mixed_geounits_spatial(geounit_ids, legislative_body, geolevel,
+                                   boundary, inside):
+        """
         Spatially search for the largest Geounits inside or outside a
         boundary.
 
@@ -822,6 +1173,48 @@ class Geounit(models.Model):
         # Send back the collected Geounits
         return units
 
+    @staticmethod
+    def get_base_geounit_ids(geounit_ids,
+                             legislative_body,
+                             geolevel,
+                             selection=None):
+        """
+        Get the IDs of the base Geounits that comprise a selection of
+        Geounits. These are found in the GeounitHierarchy, or if it hasn't
+        been built, by the base Geounits whose centroids lie within the
+        selection, the same test get_mixed_geounits uses at the base
+        Geolevel.
+
+        Parameters:
+            geounit_ids -- A list of Geounit IDs.
+            legislative_body -- The LegislativeBody that contains this
+                geolevel.
+            geolevel -- The ID of the Geolevel that contains geounit_ids
+            selection -- Optional. The union of the geounit_ids geometries,
+                if it has already been computed.
+
+        Returns:
+            A list of base Geounit IDs.
+        """
+        base_geolevel = legislative_body.get_base_geolevel()
+        if int(geolevel) == base_geolevel:
+            return map(int, geounit_ids)
+
+        base_ids = GeounitHierarchy.get_descendant_ids(geounit_ids,
+                                                       base_geolevel)
+        if len(base_ids) > 0:
+            return list(base_ids)
+
+        if selection is None:
+            selection = safe_union(Geounit.objects.filter(id__in=geounit_ids))
+            if selection is None:
+                return []
+
+        return list(
+            Geounit.objects.filter(
+                geolevel=base_geolevel,
+                center__intersects=selection).values_list('id', flat=True))
+
     def __unicode__(self):
         """
         Represent the Geounit as a unicode string. This is the Geounit's
@@ -977,6 +1370,84 @@ class Characteristic(models.Model):
         return u'%s for %s: %s' % (self.subject, self.geounit, self.number)
 
 
+class GeounitHierarchy(models.Model):
+    """
+    The nesting of Geounits, as a closure table.
+
+    There is one GeounitHierarchy for every Geounit nested anywhere inside
+    a larger Geounit, at any depth, so all of the descendants of a Geounit
+    at any Geolevel can be found without a spatial query. The hierarchy is
+    built by the setup command, and rebuilt when a Geolevel is renested.
+    """
+
+    # The larger Geounit
+    ancestor = models.ForeignKey(Geounit, related_name='descendant_set')
+
+    # The smaller Geounit, nested inside the ancestor
+    descendant = models.ForeignKey(Geounit, related_name='ancestor_set')
+
+    # The Geolevel of the descendant
+    geolevel = models.ForeignKey(Geolevel)
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant', 'geolevel')
+
+    def __unicode__(self):
+        """
+        Represent the GeounitHierarchy as a unicode string.
+        """
+        return u'%s in %s' % (self.descendant, self.ancestor)
+
+    @staticmethod
+    def get_descendant_ids(ancestor_ids, geolevel):
+        """
+        Get the IDs of the Geounits nested in a set of Geounits.
+
+        Parameters:
+            ancestor_ids -- A list of Geounit IDs.
+            geolevel -- The ID of the Geolevel of the descendants.
+
+        Returns:
+            A set of Geounit IDs.
+        """
+        return set(
+            GeounitHierarchy.objects.filter(
+                ancestor__in=ancestor_ids, geolevel=geolevel).values_list(
+                    'descendant_id', flat=True))
+
+
+class GeounitAdjacency(models.Model):
+    """
+    A pair of Geounits in the same Geolevel that share a boundary.
+
+    Each pair is stored once, with the lower Geounit ID first, so the
+    contiguity of districts can be found from the adjacency graph of the
+    base geounits without a spatial query. The adjacency is built by the
+    setup command.
+    """
+
+    # The Geounit with the lower ID
+    geounit = models.ForeignKey(Geounit, related_name='+')
+
+    # The Geounit with the higher ID
+    neighbor = models.ForeignKey(Geounit, related_name='+')
+
+    # The Geolevel of both Geounits
+    geolevel = models.ForeignKey(Geolevel)
+
+    # Whether the Geounits share a boundary line, rather than only points
+    rook = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = ('geounit', 'neighbor', 'geolevel')
+
+    def __unicode__(self):
+        """
+        Represent the GeounitAdjacency as a unicode string.
+        """
+        return u'%s next to %s' % (self.geounit, self.neighbor)
+
+
 # Enumerated type used for determining a plan's state of processing
 ProcessingState = ChoicesEnum(
     UNKNOWN=(-1, 'Unknown'),
@@ -1151,6 +1622,9 @@ class Plan(models.Model):
         # delete all districts at once
         deleteme.delete()
 
+        # the tiles of the purged versions can't be requested anymore
+        tilecache.purge_plan(self.id, before=before, after=after)
+
     def purge_beyond_nth_step(self, steps):
         """
         Purge portions of this plan's history that
@@ -1176,15 +1650,9 @@ class Plan(models.Model):
             num_members -- The new number of representatives for the district
         """
 
-        # Clone the district to a new version, with new num_members
-        district_copy = copy(district)
-        district_copy.version = self.version
-        district_copy.num_members = num_members
-        district_copy.id = None
-        district_copy.save()
-
-        # Clone the characteristics, comments and tags to this new version
-        district_copy.clone_relations_from(district)
+        # Clone the district to a new version, with new num_members. The
+        # characteristics, comments and tags are cloned to this new version.
+        district.clone_version(version=self.version, num_members=num_members)
 
     @transaction.atomic
     def add_geounits(self,
@@ -1249,6 +1717,17 @@ class Plan(models.Model):
                for ds in districts):
             return False
 
+        # Look up the districts that the base geounits of the selection are
+        # currently assigned to. Geounits in locked districts never move.
+        assignments = self.get_assignment_index(version)
+        base_ids = np.array(
+            Geounit.get_base_geounit_ids(geounit_ids, self.legislative_body,
+                                         geolevel, incremental),
+            dtype=np.int64)
+        current = assignments.lookup(base_ids)
+        movable = ~np.in1d(
+            current, [d.district_id for d in districts if d.is_locked])
+
         # Collect locked district geometries, and remove locked sections
         locked = safe_union(
             District.objects.filter(
@@ -1276,26 +1755,18 @@ class Plan(models.Model):
                 # if this district has later edits, REVERT them to
                 # this version of the district
                 if not district.is_latest_version():
-                    # Clone the district to a new version, with a different
-                    # shape
-                    district_copy = copy(district)
-                    district_copy.version = self.version + 1
-                    district_copy.id = None
-                    district_copy.save()
-
-                    # Clone the characteristics, comments, and tags to this
-                    # new version
-                    district_copy.clone_relations_from(district)
+                    # Clone the district to a new version, with the same
+                    # shape, characteristics, comments, and tags
+                    district.clone_version(version=self.version + 1)
 
                     fixed = True
 
                 # go onto the next district
                 continue
 
-            # compute the geounits before changing the boundary
-            geounits = Geounit.get_mixed_geounits(
-                geounit_ids, self.legislative_body, geolevel, district.geom,
-                True)
+            # the geounits leaving this district
+            geounits = base_ids[movable
+                                & (current == district.district_id)].tolist()
 
             # Set the flag to indicate that the districts have been fixed
             if len(geounits) > 0:
@@ -1318,7 +1789,6 @@ class Plan(models.Model):
             district_copy = copy(district)
             district_copy.version = self.version + 1
             district_copy.id = None
-            district_copy.save()  # this auto-generates a district_id
 
             # There is always a geometry for the district copy
             district_copy.simplify()  # implicit save
@@ -1341,21 +1811,10 @@ class Plan(models.Model):
             target.save()
             new_target = True
 
-        # If there are locked districts: augment the district boundary with the
-        # boundary of the locked area, because get_mixed_geounits is getting
-        # the geounits that lie outside of the provided geometry, but
-        # within the boundaries of the geounit ids.
-        if locked:
-            if target.geom:
-                bounds = target.geom.union(locked)
-            else:
-                bounds = locked
-        else:
-            bounds = target.geom
-
-        # get the geounits before changing the target geometry
-        geounits = Geounit.get_mixed_geounits(
-            geounit_ids, self.legislative_body, geolevel, bounds, False)
+        # the geounits joining the target, which are all the geounits in the
+        # selection that aren't already in the target or in a locked district
+        moved = base_ids[movable & (current != districtid)]
+        geounits = moved.tolist()
 
         # set the fixed flag, since the target has changed
         if len(geounits) > 0:
@@ -1407,9 +1866,90 @@ class Plan(models.Model):
         if new_target:
             District.objects.filter(id=target.id).delete()
 
+        # carry the assignments forward to the new version
+        self.set_assignment_index(assignments.assign(moved, districtid))
+
         # Return a flag indicating any districts changed
         return fixed
 
+    def get_assignment_index(self, version=None):
+        """
+        Get the index of base geounit assignments in this plan. The index
+        is cached per version, and built from the district geometries if
+        it isn't in the cache.
+
+        Parameters:
+            version -- Optional. The version of the Plan. Defaults to the
+                current version.
+
+        Returns:
+            An AssignmentIndex of the base geounits in this plan.
+        """
+        if version is None:
+            version = self.version
+        version = int(version)
+
+        key = AssignmentIndex.cache_key(
+            self.id, version, self.get_district_ids_at_version(version))
+        cache = caches['default']
+        index = cache.get(key)
+        if index is None:
+            index = self.build_assignment_index(version)
+            cache.set(key, index, settings.ASSIGNMENT_INDEX_TIMEOUT)
+
+        return index
+
+    def set_assignment_index(self, index, version=None):
+        """
+        Cache the index of base geounit assignments in this plan.
+
+        Parameters:
+            index -- The AssignmentIndex of the plan at the version.
+            version -- Optional. The version of the Plan. Defaults to the
+                current version.
+        """
+        if version is None:
+            version = self.version
+        version = int(version)
+
+        key = AssignmentIndex.cache_key(
+            self.id, version, self.get_district_ids_at_version(version))
+        caches['default'].set(key, index, settings.ASSIGNMENT_INDEX_TIMEOUT)
+
+    def build_assignment_index(self, version=None):
+        """
+        Build the index of base geounit assignments in this plan from the
+        district geometries. Base geounits are assigned to the district
+        that contains their centroid.
+
+        Parameters:
+            version -- Optional. The version of the Plan. Defaults to the
+                current version.
+
+        Returns:
+            An AssignmentIndex of the base geounits in this plan.
+        """
+        if version is None:
+            version = self.version
+
+        district_pks = list(self.get_district_ids_at_version(version))
+        query = ('SELECT gl.geounit_id, d.district_id '
+                 'FROM redistricting_geounit_geolevel gl '
+                 'JOIN redistricting_geounit g ON g.id = gl.geounit_id '
+                 'LEFT JOIN redistricting_district d ON d.id = ANY(%s) '
+                 'AND ST_Intersects(d.geom, g.center) '
+                 'WHERE gl.geolevel_id = %s')
+
+        cursor = connection.cursor()
+        cursor.execute(
+            query, [district_pks,
+                    self.legislative_body.get_base_geolevel()])
+        rows = cursor.fetchall()
+
+        return AssignmentIndex(
+            [row[0] for row in rows],
+            [NO_DISTRICT if row[1] is None else row[1] for row in rows])
+
     def get_biggest_geolevel(self):
         """
         A convenience method to get the "biggest" geolevel that could
@@ -1525,6 +2065,7 @@ class Plan(models.Model):
             district_id=slot,
             geom=district.geom,
             simple=district.simple,
+            shape_id=district.shape_id,
             version=new_version,
             num_members=district.num_members)
         pasted.save()
@@ -1583,14 +2124,13 @@ class Plan(models.Model):
                     if first_run == True:
                         new_district = copy(existing)
                         new_district.id = None
-                        new_district.save()
-                        new_district.clone_relations_from(existing)
                     else:
                         new_district = existing
                     new_district.geom = difference
                     new_district.version = new_version
-                    new_district.simplify()
-                    new_district.save()
+                    new_district.simplify()  # implicit save
+                    if first_run == True:
+                        new_district.clone_relations_from(existing)
 
                     # If we've edited the district, pop it on the new_district list
                     edited_districts.pop()
@@ -1673,36 +2213,64 @@ class Plan(models.Model):
         if exclude_unassigned:
             qset = qset.filter(~Q(district_id=0))
 
+        districts = list(qset)
+        properties = self.get_district_properties(districts, subject_id)
+
         features = []
+        for district in districts:
+            features.append({
+                'id': district.id,
+                'properties': properties[district.id],
+                'geometry': json.loads(GEOSGeometry(district.chop).geojson)
+            })
+
+        # Return a python dict, which gets serialized into geojson
+        return features
+
+    def get_district_properties(self, districts, subject_id):
+        """
+        Get the properties of districts that are displayed on the map.
+
+        Parameters:
+            districts -- A list of Districts.
+            subject_id -- The Subject attributes to attach to the districts.
 
+        Returns:
+            A dict of feature properties, keyed on District id.
+        """
         subj = Subject.objects.get(id=int(subject_id))
 
         # Grab ScoreFunctions so we can use cached scores for districts if they exist
-        computed_district_score = ComputedDistrictScore()
         schwartzberg_function = ScoreFunction.objects.get(
             name='district_schwartzberg')
         contiguity_function = ScoreFunction.objects.get(
             name='district_contiguous')
+        functions = [schwartzberg_function, contiguity_function]
 
         # Need to use filter for optional calculators because they may not be in database
         # if they are not in config.xml
-        convex_function = ScoreFunction.objects.filter(name='district_convex')
-        adjacency_function = ScoreFunction.objects.filter(
-            name='district_adjacency')
-
-        for district in qset:
-            computed_compactness = computed_district_score.compute(
-                schwartzberg_function, district=district)
-            computed_contiguity = computed_district_score.compute(
-                contiguity_function, district=district)
-
-            # Optional Choropleths/Calculators
-            if settings.CONVEX_CHOROPLETH:
-                computed_convex = computed_district_score.compute(
-                    convex_function[0], district=district)
-            if settings.ADJACENCY:
-                computed_adjacency = computed_district_score.compute(
-                    adjacency_function[0], district=district)
+        if settings.CONVEX_CHOROPLETH:
+            convex_function = ScoreFunction.objects.get(
+                name='district_convex')
+            functions.append(convex_function)
+        if settings.ADJACENCY:
+            adjacency_function = ScoreFunction.objects.get(
+                name='district_adjacency')
+            functions.append(adjacency_function)
+
+        # Fetch or compute all of the district scores at once
+        scores = ComputedDistrictScore.compute_many(functions, districts)
+        numbers = dict(
+            ComputedCharacteristic.objects.filter(
+                district__in=districts, subject=subj).values_list(
+                    'district_id', 'number'))
+
+        properties = {}
+        for district in districts:
+            computed_compactness = scores[(schwartzberg_function.id,
+                                           district.id)]
+            computed_contiguity = scores[(contiguity_function.id,
+                                          district.id)]
 
             # If this district contains multiple members, change the label
             label = district.translated_label
@@ -1712,59 +2280,139 @@ class Plan(models.Model):
                 label = format.format(
                     name=label, num_members=district.num_members)
 
-            features_dict = {
-                'id': district.id,
-                'properties': {
-                    'district_id':
-                    district.district_id,
-                    'name':
-                    district.long_label,
-                    'label':
-                    label,
-                    'is_locked':
-                    district.is_locked,
-                    'version':
-                    district.version,
-                    'number':
-                    str(
-                        district.computedcharacteristic_set.get(
-                            subject=subj).number),
-                    'contiguous':
-                    computed_contiguity['value'],
-                    'compactness':
-                    computed_compactness['value'],
-                    'num_members':
-                    district.num_members
-                },
-                'geometry': json.loads(GEOSGeometry(district.chop).geojson)
+            properties[district.id] = {
+                'district_id': district.district_id,
+                'name': district.long_label,
+                'label': label,
+                'is_locked': district.is_locked,
+                'version': district.version,
+                'number': str(numbers[district.id]),
+                'contiguous': computed_contiguity['value'],
+                'compactness': computed_compactness['value'],
+                'num_members': district.num_members
             }
 
+            # Optional Choropleths/Calculators
             if settings.ADJACENCY:
-                features_dict['properties']['adjacency'] = computed_adjacency[
-                    'value']
+                properties[district.id]['adjacency'] = scores[(
+                    adjacency_function.id, district.id)]['value']
             if settings.CONVEX_CHOROPLETH:
-                features_dict['properties']['convexhull'] = computed_convex[
-                    'value']
-            features.append(features_dict)
+                properties[district.id]['convexhull'] = scores[(
+                    convex_function.id, district.id)]['value']
 
-        # Return a python dict, which gets serialized into geojson
-        return features
+        return properties
+
+    def get_district_tile(self, version, subject_id, geolevel, z, x, y):
+        """
+        Get the districts in this plan as a vector tile.
+
+        Only the districts in the tile are encoded, using the simplified
+        geometry of the geolevel. Tiles are cached on disk for each version
+        of the plan, until the version is purged.
+
+        Parameters:
+            version -- The Plan version.
+            subject_id -- The Subject attributes to attach to the districts.
+            geolevel -- The id of the Geolevel of the simplified geometry.
+            z -- The zoom level of the tile.
+            x -- The column of the tile.
+            y -- The row of the tile, counted from the top.
+
+        Returns:
+            The encoded Mapbox Vector Tile.
+        """
+        version = int(version)
+        key = (self.id, version, 'districts_%d' % geolevel,
+               'subject_%d' % int(subject_id), z, x, y)
+        tile = tilecache.get(*key)
+        if tile is not None:
+            return tile
+
+        district_pks = list(self.get_district_ids_at_version(version))
+
+        xmin, ymin, xmax, ymax = vectortiles.tile_bounds(z, x, y)
+        scale = vectortiles.EXTENT / (xmax - xmin)
+        margin = vectortiles.BUFFER / scale
+
+        bounds = Polygon.from_bbox((xmin - margin, ymin - margin,
+                                    xmax + margin, ymax + margin))
+        bounds.srid = 3785
+
+        # Clip, scale and snap the geometry to the tile grid
+        qset = self.district_set.filter(id__in=district_pks).exclude(
+            district_id=0)
+        qset = qset.extra(
+            select={
+                'tile':
+                "st_asbinary(st_snaptogrid(st_transscale(st_clipbybox2d("
+                "st_geometryn(simple,%s),st_geomfromewkt(%s)),"
+                "%s,%s,%s,%s),1))"
+            },
+            select_params=(geolevel, bounds.ewkt, -xmin, -ymax, scale,
+                           -scale),
+            where=[
+                "st_intersects(st_geometryn(simple,%s),st_geomfromewkt(%s))"
+            ],
+            params=(geolevel, bounds.ewkt))
+        qset = qset.defer('geom', 'simple')
+
+        districts = list(qset)
+        properties = self.get_district_properties(districts, subject_id)
+
+        features = []
+        for district in districts:
+            if district.tile is None:
+                continue
+            features.append((district.id, GEOSGeometry(district.tile),
+                             properties[district.id]))
+
+        tile = vectortiles.encode_tile(
+            [vectortiles.encode_layer('districts', features)])
+        tilecache.put(tile, *key)
+        return tile
 
     def get_district_ids_at_version(self, version):
         """
         Get IDs of Districts in this Plan at a specified version.
 
+        The latest district rows of the plan are read from the
+        CurrentDistrict pointers when none of them are newer than the
+        version, which is always the case for the current version unless
+        edits have been undone. Otherwise, the latest row of each district
+        at the version is found with an index-backed DISTINCT ON query.
+
         Parameters:
             version -- The version of the Districts to fetch.
 
         Returns:
-            An unevaluated QuerySet that gets the IDs of the Districts
-            in this plan at the specified version.
+            A list of the IDs of the Districts in this plan at the
+            specified version.
         """
-        qset = self.district_set.filter(version__lte=version)
-        qset = qset.values('district_id')
-        qset = qset.annotate(latest=Max('version'), max_id=Max('id'))
-        return qset.values_list('max_id', flat=True)
+        version = int(version)
+        district_ids = versionmemo.get(self.id, version)
+        if district_ids is not None:
+            return district_ids
+
+        cursor = connection.cursor()
+        district_ids = None
+        if version >= self.version:
+            cursor.execute(
+                'SELECT latest_id, version FROM redistricting_currentdistrict '
+                'WHERE plan_id = %s', [self.id])
+            pointers = cursor.fetchall()
+            if all(v <= version for pk, v in pointers):
+                district_ids = [pk for pk, v in pointers]
+
+        if district_ids is None:
+            cursor.execute(
+                'SELECT DISTINCT ON (district_id) id '
+                'FROM redistricting_district '
+                'WHERE plan_id = %s AND version <= %s '
+                'ORDER BY district_id, id DESC', [self.id, version])
+            district_ids = [row[0] for row in cursor.fetchall()]
+
+        versionmemo.remember(self.id, version, district_ids)
+        return district_ids
 
     def get_districts_at_version(self,
                                  version,
@@ -1790,16 +2438,19 @@ class Plan(models.Model):
         if not include_geom:
             qset = qset.defer('geom', 'simple')
 
-        districts = sorted(list(qset), key=lambda d: d.sortKey())
-        simplest_level = self.legislative_body.get_geolevels()[-1]
-
         if filter_empty:
-            # Don't return any districts that are empty (asside from the Unassigned district)
-            return filter(
-                lambda x: x.district_id == 0 or x.simple[simplest_level.id - 1].num_coords > 0,
-                districts)
-        else:
-            return districts
+            # Don't return any districts that are empty (asside from the
+            # Unassigned district). This is checked in the database, so the
+            # simplified geometries don't need to be fetched.
+            simplest_level = self.legislative_body.get_geolevels()[-1]
+            qset = qset.extra(
+                where=[
+                    'district_id = 0 OR '
+                    'st_npoints(st_geometryn(simple, %s)) > 0'
+                ],
+                params=[simplest_level.id])
+
+        return sorted(list(qset), key=lambda d: d.sortKey())
 
     @staticmethod
     def create_default(name,
@@ -1916,7 +2567,52 @@ class Plan(models.Model):
                                   district.num_members)
                                  for (gid, pid) in districtunits])
 
-        return geounits
+        return geounits
+
+    def get_base_geounit_assignments(self, version=None, fetch_size=10000):
+        """
+        Get the district of every assigned base geounit in this plan, in a
+        single query. Base geounits are assigned to the district that
+        contains their centroid.
+
+        The rows are read from the database in chunks, so this may be used
+        to stream plans of any size.
+
+        Parameters:
+            version -- Optional. The version of the Plan. Defaults to the
+                current version.
+            fetch_size -- Optional. The number of rows read at a time.
+
+        Returns:
+            An iterator of tuples containing portable ids, district ids,
+            and num_members, ordered by district id.
+        """
+        if version is None:
+            version = self.version
+
+        district_pks = list(self.get_district_ids_at_version(version))
+        query = ('SELECT g.portable_id, d.district_id, d.num_members '
+                 'FROM redistricting_district d '
+                 'JOIN redistricting_geounit g '
+                 'ON ST_Intersects(d.geom, g.center) '
+                 'JOIN redistricting_geounit_geolevel gl '
+                 'ON gl.geounit_id = g.id AND gl.geolevel_id = %s '
+                 'WHERE d.id = ANY(%s) AND d.district_id > 0 '
+                 'ORDER BY d.district_id, g.portable_id')
+
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(
+                query,
+                [self.legislative_body.get_base_geolevel(), district_pks])
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
 
     def get_assigned_geounits(self, threshold=100, version=None):
         """
@@ -1990,7 +2686,7 @@ class Plan(models.Model):
 
         return available_districts - current_districts + 1  #add one for unassigned
 
-    def fix_unassigned(self, version=None, threshold=100):
+    def fix_unassigned(self, version=None, threshold=100, progress=None):
         """
         Assign unassigned base geounits that are fully contained within
         or adjacent to another district
@@ -2002,6 +2698,8 @@ class Plan(models.Model):
         Parameters:
             version -- The version of the Plan that is being fixed.
             threshold - distance threshold used for buffer in/out optimization
+            progress -- Optional. A function called with a message, the
+                number of steps done, and the total number of steps.
 
         Returns:
             Whether or not the fix was successful, and a message
@@ -2010,6 +2708,10 @@ class Plan(models.Model):
         if version == None:
             version = self.version
 
+        def report(message, current, total=5):
+            if progress is not None:
+                progress(message, current, total)
+
         num_unassigned = 0
         geolevel = Geolevel.objects.get(
             id=self.legislative_body.get_base_geolevel())
@@ -2031,14 +2733,35 @@ class Plan(models.Model):
         # Storage for geounits that need to be added. Map of tuples: geounitid -> (district_id, dist_val)
         to_add = {}
 
-        # Check if any unassigned clusters are within the exterior of a district
+        # Index the exteriors of the districts by their bounding boxes, and
+        # prepare them for repeated containment tests
+        report('Finding enclosed units', 0)
+        exteriors = []
+        extents = []
+        for district in districts:
+            for poly in district.geom:
+                exterior = Polygon(poly.exterior_ring)
+                exteriors.append((district.district_id, exterior.prepared))
+                extents.append(exterior.extent)
+        extents = np.array(extents, dtype=np.float64).reshape(-1, 4)
+
+        # Check if any unassigned clusters are within the exterior of a
+        # district. Only exteriors whose bounding box holds the cluster's
+        # can contain it.
         for unassigned_poly in unassigned_geom:
-            for district in districts:
-                for poly in district.geom:
-                    if unassigned_poly.within(Polygon(poly.exterior_ring)):
-                        for tup in self.get_base_geounits_in_geom(
-                                unassigned_poly, threshold=threshold):
-                            to_add[tup[0]] = (district.district_id, 0)
+            xmin, ymin, xmax, ymax = unassigned_poly.extent
+            candidates = np.flatnonzero((extents[:, 0] <= xmin)
+                                        & (extents[:, 1] <= ymin)
+                                        & (extents[:, 2] >= xmax)
+                                        & (extents[:, 3] >= ymax))
+            enclosing = [
+                exteriors[i][0] for i in candidates
+                if exteriors[i][1].contains(unassigned_poly)
+            ]
+            if enclosing:
+                for tup in self.get_base_geounits_in_geom(
+                        unassigned_poly, threshold=threshold):
+                    to_add[tup[0]] = (enclosing[-1], 0)
 
         # Check if all districts have been assigned
         num_districts = len(
@@ -2052,6 +2775,7 @@ class Plan(models.Model):
         # Only check for adjacent geounits if all districts are assigned
         if not not_all_districts_assigned:
             # Get unassigned geounits, and subtract out any that have been added to to_add
+            report('Finding unassigned units', 1)
             unassigned = self.get_unassigned_geounits(
                 threshold=threshold, version=version)
             unassigned = [t[0] for t in unassigned]
@@ -2071,41 +2795,54 @@ class Plan(models.Model):
                     ) + str(settings.FIX_UNASSIGNED_MIN_PERCENT)
 
             if not below_min_pct:
-                # Get the unassigned geounits from the ids
-                unassigned = list(Geounit.objects.filter(pk__in=unassigned))
-
-                # Remove any unassigned geounits that aren't on the edge
-                temp = []
-                for poly in unassigned_geom:
-                    exterior = Polygon(poly.exterior_ring)
-                    for g in unassigned:
-                        if not g in temp and g.geom.intersects(
-                                unassigned_geom):
-                            temp.append(g)
-                unassigned = temp
+                # Find the unlocked districts that each unassigned geounit
+                # on the edge of the unassigned area touches, with one
+                # spatially indexed query
+                report('Finding adjacent units', 2)
+                cursor = connection.cursor()
+                cursor.execute(
+                    'SELECT g.id, d.district_id '
+                    'FROM redistricting_geounit g '
+                    'JOIN redistricting_district u ON u.id = %s '
+                    'AND ST_Intersects(g.geom, u.geom) '
+                    'JOIN (SELECT district_id, ST_MakePolygon('
+                    'ST_ExteriorRing(dump.geom)) AS exterior '
+                    'FROM redistricting_district, ST_Dump(geom) AS dump '
+                    'WHERE id = ANY(%s::integer[])) d '
+                    'ON g.geom && d.exterior '
+                    'AND ST_Touches(g.geom, d.exterior) '
+                    'WHERE g.id = ANY(%s::integer[])', [
+                        unassigned_district.id, [d.id for d in districts],
+                        unassigned
+                    ])
+                touching = cursor.fetchall()
 
                 # Set up calculator/storage for comparator values (most likely population)
+                report('Comparing districts', 3)
                 calculator = SumValues()
                 calculator.arg_dict['value1'] = (
                     'subject', settings.FIX_UNASSIGNED_COMPARATOR_SUBJECT)
 
-                # Test each unassigned geounit with each unlocked district to see if it should be assigned
+                # Calculate the comparator value of each touched district
+                touched = set(district_id for gid, district_id in touching)
+                dist_vals = {}
                 for district in districts:
-                    # Calculate the comparator value for the district
-                    calculator.compute(district=district)
-                    dist_val = calculator.result['value']
-
-                    # Check if geounits are touching the district
-                    for poly in district.geom:
-                        exterior = Polygon(poly.exterior_ring)
-                        for geounit in unassigned:
-                            if geounit.geom.touches(exterior):
-                                if (geounit.id not in to_add
-                                        or dist_val < to_add[geounit.id][1]):
-                                    to_add[geounit.id] = (district.district_id,
-                                                          dist_val)
+                    if district.district_id in touched:
+                        calculator.compute(district=district)
+                        dist_vals[district.district_id] = calculator.result[
+                            'value']
+
+                # Assign each geounit to the touching district with the
+                # lowest comparator value, and on ties to the first district
+                order = dict(
+                    (d.district_id, i) for i, d in enumerate(districts))
+                for gid, district_id in sorted(
+                        touching, key=lambda t: (dist_vals[t[1]], order[t[1]])):
+                    if gid not in to_add:
+                        to_add[gid] = (district_id, dist_vals[district_id])
 
         # Add all geounits that need to be fixed
+        report('Assigning units', 4)
         if to_add:
             # Compile lists of geounits to add per district
             district_units = {}
@@ -2189,31 +2926,13 @@ class Plan(models.Model):
         try:
             target.id = None
             target.version = version + 1
-            target.save()
 
             # Combine the stats for all of the districts
-            all_characteristics = ComputedCharacteristic.objects.filter(
-                district__in=district_keys)
-            all_subjects = Subject.objects.order_by(
-                '-percentage_denominator').all()
-            for subject in all_subjects:
-                relevant_characteristics = filter(
-                    lambda c: c.subject == subject, all_characteristics)
-                number = sum(map(lambda c: c.number, relevant_characteristics))
-                percentage = Decimal('0000.00000000')
-                if subject.percentage_denominator:
-                    denominator = ComputedCharacteristic.objects.get(
-                        subject=subject.percentage_denominator,
-                        district=target)
-                    if denominator:
-                        if denominator.number > 0:
-                            percentage = number / denominator.number
-                cc = ComputedCharacteristic(
-                    district=target,
-                    subject=subject,
-                    number=number,
-                    percentage=percentage)
-                cc.save()
+            numbers = {}
+            for subject_id, number in ComputedCharacteristic.objects.filter(
+                    district__in=district_keys).values_list(
+                        'subject_id', 'number'):
+                numbers[subject_id] = numbers.get(subject_id, 0) + number
 
             # Create a new copy of the target geometry
             all_geometry = map(lambda d: d.geom, components)
@@ -2222,7 +2941,22 @@ class Plan(models.Model):
                 safe_union(
                     GeometryCollection(all_geometry, srid=target.geom.srid)),
                 collapse=True)
-            target.simplify()
+            target.simplify()  # implicit save
+
+            computed = []
+            for subject in Subject.objects.all():
+                number = numbers.get(subject.id, 0)
+                percentage = Decimal('0000.00000000')
+                denominator = numbers.get(subject.percentage_denominator_id)
+                if subject.percentage_denominator_id and denominator > 0:
+                    percentage = number / denominator
+                computed.append(
+                    ComputedCharacteristic(
+                        district=target,
+                        subject=subject,
+                        number=number,
+                        percentage=percentage))
+            ComputedCharacteristic.bulk_upsert(computed)
 
             # Eliminate the component districts from the version
             for component in components:
@@ -2601,6 +3335,51 @@ CROSS JOIN (
                 names[d], ', '.join(types[d])) if d in types else names[d]
         return name_dict
 
+    @staticmethod
+    def get_split_layer(target):
+        """
+        Get the layer that plans are compared with to find splits.
+
+        Parameters:
+            target -- The id of the layer, in the form of either 'plan.XXX'
+                or 'geolevel.XXX'. The current version of a plan is used.
+
+        Returns:
+            A splits.Layer.
+        """
+        id = int(target[target.find('.') + 1:])
+        if target.startswith('geolevel'):
+            return splits.geolevel_layer(id)
+        return splits.plan_layer(Plan.objects.get(pk=id))
+
+    @staticmethod
+    def find_many_splits(plans, target, version=None, inverse=False):
+        """
+        Find the splits of many plans by the same layer at once. The
+        plans whose splits aren't cached are related to the layer with a
+        single query.
+
+        Parameters:
+            plans -- A list of Plans.
+            target -- The id of the layer, in the form of either
+                'plan.XXX' or 'geolevel.XXX'.
+            version -- Optional; the version of the plans. Defaults to the
+                current version of each plan.
+            inverse -- Optional; if specified, performs the inverse split
+                operation.
+
+        Returns:
+            A dict keyed on the id of each Plan, of dicts with the 'splits'
+            and 'interiors' of the plan. Each is a list of relationships,
+            given as tuples in the form returned by find_relationships.
+        """
+        if len(plans) == 0:
+            return {}
+
+        subjects = [splits.plan_layer(plan, version) for plan in plans]
+        return splits.find_splits(
+            subjects, Plan.get_split_layer(target), inverse=inverse)
+
     def compute_splits(self, target, version=None, inverse=None,
                        extended=None):
         results = {
@@ -2622,26 +3401,26 @@ CROSS JOIN (
             results['other_name'] = Geolevel.objects.get(
                 pk=id).get_short_label()
             results['is_geolevel'] = True
-            results['splits'] = self.find_geolevel_splits(
-                id, version=version, inverse=inverse)
-            if extended is True:
-                results['interiors'] = self.find_geolevel_components(
-                    id, version=version, inverse=inverse)
+            layer = splits.geolevel_layer(id)
         elif target.startswith('plan'):
             other_plan = Plan.objects.get(pk=id)
             results['other_name'] = other_plan.name
             if self.is_community():
                 results['is_community'] = True
 
-            results['splits'] = self.find_plan_splits(
-                other_plan, version=version, inverse=inverse)
-            if extended is True:
-                results['interiors'] = self.find_plan_components(
-                    other_plan, version=version, inverse=inverse)
+            layer = splits.plan_layer(other_plan)
             other_names = dict((d.district_id, d.long_label)
                                for d in other_plan.get_districts_at_version(
                                    other_plan.version))
 
+        # The splits and interiors are found together, and cached
+        found = splits.find_splits(
+            [splits.plan_layer(self, version)], layer,
+            inverse=inverse)[self.id]
+        results['splits'] = found['splits']
+        if extended is True:
+            results['interiors'] = found['interiors']
+
         community_types = self.get_community_types(version=version)
         my_names = Plan.tag_plan_names(my_names, community_types)
 
@@ -2784,32 +3563,156 @@ CROSS JOIN (
                 geolevel = l.geolevel
         return geolevel
 
-    def reaggregate(self):
+    def aggregate_districts(self, district_pks):
+        """
+        Aggregate the characteristics of many districts in this plan with
+        a single query.
+
+        Each district is made up of the largest geounits that lie inside
+        of it, like L{Geounit.get_mixed_geounits}: base geounits belong to
+        the district that contains their centroid, and a larger geounit is
+        used in place of its base geounits when all of them belong to the
+        district. Larger geounits are found through the GeounitHierarchy.
+
+        Parameters:
+            district_pks -- A list of the ids (NOT the district_ids) of the
+                Districts to aggregate.
+
+        Returns:
+            A dictionary of District ids to dictionaries of Subject ids to
+            aggregate values. Districts that contain no geounits are
+            omitted.
+        """
+        district_pks = list(district_pks)
+        if len(district_pks) == 0:
+            return {}
+
+        level_ids = [level.id for level in self.legislative_body.get_geolevels()]
+
+        query = (
+            # The base geounits in each district
+            'WITH base AS ('
+            ' SELECT d.id AS district_id, g.id AS geounit_id'
+            ' FROM redistricting_district d'
+            ' JOIN redistricting_geounit g ON ST_Intersects(d.geom, g.center)'
+            ' JOIN redistricting_geounit_geolevel gl'
+            ' ON gl.geounit_id = g.id AND gl.geolevel_id = %(base)s'
+            ' WHERE d.id = ANY(%(districts)s)), '
+            # The larger geounits with all of their base geounits in a
+            # district
+            'covered AS ('
+            ' SELECT b.district_id, h.ancestor_id, agl.geolevel_id'
+            ' FROM base b'
+            ' JOIN redistricting_geounithierarchy h'
+            ' ON h.descendant_id = b.geounit_id AND h.geolevel_id = %(base)s'
+            ' JOIN redistricting_geounit_geolevel agl'
+            ' ON agl.geounit_id = h.ancestor_id'
+            ' AND agl.geolevel_id = ANY(%(levels)s)'
+            ' GROUP BY b.district_id, h.ancestor_id, agl.geolevel_id'
+            ' HAVING count(*) = (SELECT count(*)'
+            '  FROM redistricting_geounithierarchy s'
+            '  WHERE s.ancestor_id = h.ancestor_id'
+            '  AND s.geolevel_id = %(base)s)), '
+            # The largest geounit covering each base geounit
+            'tops AS ('
+            ' SELECT DISTINCT ON (b.district_id, b.geounit_id)'
+            ' b.district_id, COALESCE(c.ancestor_id, b.geounit_id) AS geounit_id'
+            ' FROM base b'
+            ' LEFT JOIN redistricting_geounithierarchy h'
+            ' ON h.descendant_id = b.geounit_id AND h.geolevel_id = %(base)s'
+            ' LEFT JOIN covered c'
+            ' ON c.district_id = b.district_id AND c.ancestor_id = h.ancestor_id'
+            ' ORDER BY b.district_id, b.geounit_id,'
+            ' array_position(%(levels)s, c.geolevel_id) NULLS LAST) '
+            'SELECT t.district_id, c.subject_id, SUM(c.number)'
+            ' FROM (SELECT DISTINCT district_id, geounit_id FROM tops) t'
+            ' JOIN redistricting_characteristic c ON c.geounit_id = t.geounit_id'
+            ' GROUP BY t.district_id, c.subject_id')
+
+        cursor = connection.cursor()
+        cursor.execute(query, {
+            'base': level_ids[-1],
+            'levels': level_ids,
+            'districts': district_pks
+        })
+
+        aggregates = {}
+        for district_pk, subject_id, number in cursor.fetchall():
+            aggregates.setdefault(district_pk, {})[subject_id] = number
+        return aggregates
+
+    def reaggregate(self, latest_only=False):
         """
         Reaggregate all computed characteristics for each district in this plan.
 
+        The districts are aggregated together with one query, if the
+        GeounitHierarchy has been built. Otherwise, each district is
+        searched spatially.
+
+        @param latest_only: Optional. Only reaggregate the districts in the
+            current version of the plan, leaving the history of the plan
+            as it is.
         @return: An integer count of the number of districts reaggregated
         """
         # Set the reaggregating flag
         self.processing_state = ProcessingState.REAGGREGATING
         self.save()
 
+        updated = 0
         try:
-            # Find the geolevel relevant to this plan that has the largest geounits
-            geolevel = self.get_largest_geolevel()
+            if latest_only:
+                districts = self.get_districts_at_version(
+                    self.version, filter_empty=False)
+            else:
+                districts = list(self.district_set.defer('geom', 'simple'))
+
+            if GeounitHierarchy.objects.exists():
+                aggregates = self.aggregate_districts(
+                    [d.id for d in districts])
+
+                subjects = dict(Subject.objects.values_list(
+                    'id', 'percentage_denominator_id'))
+                computed = list(
+                    ComputedCharacteristic.objects.filter(
+                        district__in=[d.id for d in districts]))
+                by_district = {}
+                for cc in computed:
+                    by_district.setdefault(cc.district_id, {})[
+                        cc.subject_id] = cc
+
+                for cc in computed:
+                    cc.number = aggregates.get(cc.district_id, {}).get(
+                        cc.subject_id) or Decimal('00000000.0000')
+                for cc in computed:
+                    cc.percentage = Decimal('0000.00000000')
+                    denominator = by_district[cc.district_id].get(
+                        subjects.get(cc.subject_id))
+                    if denominator and cc.number and denominator.number:
+                        cc.percentage = cc.number / denominator.number
+
+                ComputedCharacteristic.bulk_upsert(computed)
+                caches['default'].delete_many(
+                    [District.get_terms_cache_key(d.id) for d in districts])
+                updated = len(districts)
+            else:
+                # Find the geolevel relevant to this plan that has the largest geounits
+                geolevel = self.get_largest_geolevel()
 
-            # Get all of the geounit_ids for that geolevel
-            geounit_ids = map(
-                str,
-                Geounit.objects.filter(geolevel=geolevel).values_list(
-                    'id', flat=True))
+                # Get all of the geounit_ids for that geolevel
+                geounit_ids = map(
+                    str,
+                    Geounit.objects.filter(geolevel=geolevel).values_list(
+                        'id', flat=True))
 
-            # Cycle through each district and update the statistics
-            updated = 0
-            for d in self.district_set.all():
-                success = d.reaggregate(geounit_ids=geounit_ids)
-                if success == True:
-                    updated += 1
+                # Cycle through each district and update the statistics
+                for d in District.objects.filter(
+                        id__in=[d.id for d in districts]):
+                    success = d.reaggregate(geounit_ids=geounit_ids)
+                    if success == True:
+                        updated += 1
+
+            # The cached tiles of the plan show the old characteristics
+            tilecache.purge_plan(self.id)
 
             # Reaggregation successful, unset the reaggregating flag
             self.processing_state = ProcessingState.READY
@@ -2848,6 +3751,11 @@ class District(models.Model):
     A District is a part of a Plan, and is composed of many Geounits.
     Districts have geometry, simplified geometry, and pre-computed data
     values for Characteristics.
+
+    The geometry, simplified geometry, measures and characteristics of a
+    district are kept in a shape, which is shared by every version of the
+    district with the same geometry. A version is given a shape of its own
+    when its geometry is changed.
     """
 
     class Meta:
@@ -2888,9 +3796,80 @@ class District(models.Model):
     # The number of representatives configured for this district
     num_members = models.PositiveIntegerField(default=1)
 
+    # The measures of the geometry of this district, for compactness
+    # scores. They are updated whenever the district is saved with its
+    # geometry, and are null for districts saved before they were kept.
+    geom_area = models.FloatField(null=True, blank=True)
+    geom_perimeter = models.FloatField(null=True, blank=True)
+    hull_area = models.FloatField(null=True, blank=True)
+    circle_radius = models.FloatField(null=True, blank=True)
+    bbox_width = models.FloatField(null=True, blank=True)
+    bbox_height = models.FloatField(null=True, blank=True)
+
+    # The fields of the measures, in the order of GeometryMetrics
+    METRIC_FIELDS = ('geom_area', 'geom_perimeter', 'hull_area',
+                     'circle_radius', 'bbox_width', 'bbox_height')
+
+    # The id of the shape of this district. A district saved with the
+    # shape_id of another district shares its shape if their geometries
+    # are the same, and is given a new shape otherwise.
+    shape_id = models.PositiveIntegerField(
+        null=True, blank=True, editable=False)
+
+    # The fields kept in the shape of the district
+    SHAPE_FIELDS = ('geom', 'simple') + METRIC_FIELDS
+
     # This is a geographic model, so use the geomanager for objects
     objects = models.GeoManager()
 
+    def save(self, *args, **kwargs):
+        """
+        Save the district. If its geometry is saved too, the measures of
+        the geometry are brought up to date.
+        """
+        update_fields = kwargs.get('update_fields')
+        if 'geom' not in self.get_deferred_fields() and (
+                update_fields is None or 'geom' in update_fields):
+            self.measure_geometry()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(
+                    District.METRIC_FIELDS)
+
+        super(District, self).save(*args, **kwargs)
+
+    def measure_geometry(self):
+        """
+        Measure the geometry of this district.
+
+        Returns:
+            The GeometryMetrics of the district.
+        """
+        metrics = geometrymetrics.measure(self.geom)
+        for field, value in zip(District.METRIC_FIELDS, metrics):
+            setattr(self, field, value)
+
+        return metrics
+
+    def get_geometry_metrics(self):
+        """
+        Get the measures of the geometry of this district. Districts saved
+        before the measures were kept are measured now, and their measures
+        are stored.
+
+        Returns:
+            The GeometryMetrics of the district.
+        """
+        values = [getattr(self, field) for field in District.METRIC_FIELDS]
+        if None not in values:
+            return geometrymetrics.GeometryMetrics(*values)
+
+        metrics = self.measure_geometry()
+        if self.id is not None:
+            District.objects.filter(id=self.id).update(
+                **dict(zip(District.METRIC_FIELDS, metrics)))
+
+        return metrics
+
     def sortKey(self):
         """
         Sort districts by name, with numbered districts first.
@@ -2972,56 +3951,70 @@ class District(models.Model):
 
         Parameters:
             geounits -- The Geounits to add or remove to this districts
-                ComputedCharacteristic value.
+                ComputedCharacteristic value. These may be Geounits, Geounit
+                IDs, or a QuerySet of Geounits.
             combine -- The aggregate value computed should be added or
                 removed from the ComputedCharacteristicValue
 
         Returns:
             True if the stats for this district have changed.
         """
+        # Aggregate all Geounits Characteristic values
+        if isinstance(geounits, models.QuerySet):
+            geounit_ids = list(geounits.values_list('id', flat=True))
+        else:
+            geounit_ids = [int(getattr(g, 'id', g)) for g in geounits]
+        aggregates = get_characteristic_matrix().aggregate(geounit_ids)
+
+        # If there are no aggregate values for the geounits, nothing changes
+        if not aggregates:
+            return False
+
         # Get the subjects that don't rely on others first - that will save us
         # from computing characteristics for denominators twice
         all_subjects = Subject.objects.order_by(
             '-percentage_denominator').all()
-        changed = False
 
-        # For all subjects
+        # Get the pre-computed values
+        computed = dict((cc.subject_id, cc)
+                        for cc in self.computedcharacteristic_set.all())
+        changed = []
+
+        # For all subjects with aggregate values for the geounits
         for subject in all_subjects:
-            # Aggregate all Geounits Characteristic values
-            aggregate = Characteristic.objects.filter(
-                geounit__in=geounits, subject__exact=subject).aggregate(
-                    Sum('number'))['number__sum']
-            # If there are aggregate values for the subject and geounits.
-            if not aggregate is None:
-                # Get the pre-computed values
-                defaults = {'number': Decimal('0000.00000000')}
-                computed, created = ComputedCharacteristic.objects.get_or_create(
-                    subject=subject, district=self, defaults=defaults)
-
-                if combine:
-                    # Add the aggregate to the computed value
-                    computed.number += aggregate
+            if not subject.id in aggregates:
+                continue
+
+            cc = computed.get(subject.id)
+            if cc is None:
+                cc = ComputedCharacteristic(
+                    subject=subject,
+                    district=self,
+                    number=Decimal('0000.00000000'))
+                computed[subject.id] = cc
+
+            if combine:
+                # Add the aggregate to the computed value
+                cc.number += aggregates[subject.id]
+            else:
+                # Subtract the aggregate from the computed value
+                cc.number -= aggregates[subject.id]
+
+            # If this subject is viewable as a percentage, do the math
+            # using the already calculated value for the denominator
+            denominator = computed.get(subject.percentage_denominator_id)
+            if subject.percentage_denominator_id and denominator:
+                if denominator.number > 0:
+                    cc.percentage = cc.number / denominator.number
                 else:
-                    # Subtract the aggregate from the computed value
-                    computed.number -= aggregate
-
-                # If this subject is viewable as a percentage, do the math
-                # using the already calculated value for the denominator
-                if subject.percentage_denominator:
-                    denominator = ComputedCharacteristic.objects.get(
-                        subject=subject.percentage_denominator, district=self)
-                    if denominator:
-                        if denominator.number > 0:
-                            computed.percentage = computed.number / denominator.number
-                        else:
-                            computed.percentage = '0000.00000000'
+                    cc.percentage = Decimal('0000.00000000')
 
-                # If there are aggregate values for the subject & geounits.
-                computed.save()
+            changed.append(cc)
 
-                changed = True
+        ComputedCharacteristic.bulk_upsert(changed)
+        self.invalidate_terms()
 
-        return changed
+        return True
 
     def reset_stats(self):
         """
@@ -3065,25 +4058,103 @@ class District(models.Model):
         Parameters:
             origin -- The source District.
         """
-        cc = ComputedCharacteristic.objects.filter(district=origin)
-        for c in cc:
-            c.id = None
-            c.district = self
-            c.save()
+        District.clone_relations([(origin.id, self.id)])
+
+    @staticmethod
+    def clone_relations(pairs):
+        """
+        Copy the computed characteristics, comments, and tags of many
+        districts at once. The characteristics are copied within the
+        database with one statement, and only to districts that do not
+        share the shape of their source. The comments and tags are each
+        inserted with one statement.
+
+        Parameters:
+            pairs -- A list of tuples of the id of a source District and the
+                id of the District to copy its relations to.
+        """
+        if len(pairs) == 0:
+            return
+
+        origins = [origin for origin, clone in pairs]
+        clones = dict(pairs)
+
+        cursor = connection.cursor()
+        cursor.execute(
+            'INSERT INTO redistricting_computedcharacteristic '
+            '(subject_id, district_id, number, percentage) '
+            'SELECT cc.subject_id, p.clone, cc.number, cc.percentage '
+            'FROM redistricting_computedcharacteristic AS cc '
+            'JOIN unnest(%s::integer[], %s::integer[]) AS p(origin, clone) '
+            'ON cc.district_id = p.origin '
+            'JOIN redistricting_district AS o ON o.id = p.origin '
+            'JOIN redistricting_district AS c ON c.id = p.clone '
+            'WHERE o.shape_id <> c.shape_id',
+            [origins, [clone for origin, clone in pairs]])
 
         ct = ContentType.objects.get(
             app_label='redistricting', model='district')
-        cmts = Comment.objects.filter(object_pk=origin.id, content_type=ct)
+        cmts = list(
+            Comment.objects.filter(
+                object_pk__in=map(str, origins), content_type=ct))
         for cmt in cmts:
             cmt.id = None
-            cmt.object_pk = self.id
-            cmt.save()
+            cmt.object_pk = str(clones[int(cmt.object_pk)])
+        if cmts:
+            Comment.objects.bulk_create(cmts)
 
-        items = TaggedItem.objects.filter(object_id=origin.id, content_type=ct)
+        items = list(
+            TaggedItem.objects.filter(object_id__in=origins, content_type=ct))
         for item in items:
             item.id = None
-            item.object_id = self.id
-            item.save()
+            item.object_id = clones[item.object_id]
+        if items:
+            TaggedItem.objects.bulk_create(items)
+
+    def clone_version(self, **changes):
+        """
+        Copy this district to a new row without changing its shape. The
+        copy shares the shape of this district, so the geometry, simplified
+        geometry and characteristics are neither copied nor simplified
+        again, and the comments and tags of the district are cloned in bulk.
+
+        Parameters:
+            changes -- The values of the fields that differ in the copy,
+                keyed by attribute name (for example, version or plan_id).
+
+        Returns:
+            The new District, with its geometries deferred.
+        """
+        columns = []
+        values = []
+        params = []
+        for field in District._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            columns.append(field.column)
+            if field.attname in changes:
+                values.append('%s')
+                params.append(
+                    field.get_db_prep_save(changes[field.attname], connection))
+            elif field.attname in District.SHAPE_FIELDS:
+                # The clone is given the shape of this district by shape_id
+                values.append('NULL')
+            else:
+                values.append(field.column)
+
+        query = ('INSERT INTO redistricting_district (%s) SELECT %s '
+                 'FROM redistricting_district WHERE id = %%s RETURNING id') % (
+                     ', '.join(columns), ', '.join(values))
+        cursor = connection.cursor()
+        cursor.execute(query, params + [self.id])
+        clone_id = cursor.fetchone()[0]
+
+        District.clone_relations([(self.id, clone_id)])
+
+        # Note the edit, as saving a district would
+        note_plan_edited(changes.get('plan_id', self.plan_id))
+
+        return District.objects.defer('geom', 'simple').get(id=clone_id)
 
     def get_base_geounits(self, threshold=100):
         """
@@ -3102,6 +4173,28 @@ class District(models.Model):
         """
         return self.plan.get_base_geounits_in_geom(self.geom, threshold)
 
+    @staticmethod
+    def get_terms_cache_key(district_pk):
+        """
+        Get the key that the plan score terms of a district are cached
+        under. The terms of all the score functions of a district are
+        cached together, so they can be invalidated at once.
+
+        Parameters:
+            district_pk -- The id (NOT the district_id) of the District.
+
+        Returns:
+            A key for the cache.
+        """
+        return 'districtterms:district:%d' % district_pk
+
+    def invalidate_terms(self):
+        """
+        Discard the cached plan score terms of this district. This must be
+        called whenever the characteristics of the district change.
+        """
+        caches['default'].delete(District.get_terms_cache_key(self.id))
+
     def get_contiguity_overrides(self):
         """
         Retrieve any contiguity overrides that are applicable
@@ -3259,24 +4352,27 @@ class District(models.Model):
             body = self.plan.legislative_body
             geounits = Geounit.get_mixed_geounits(geounit_ids, body,
                                                   geolevel.id, self.geom, True)
+            aggregates = get_characteristic_matrix().aggregate(
+                [g.id for g in geounits])
 
             # Grab all the computedcharacteristics for the district and reaggregate
-            for cc in self.computedcharacteristic_set.order_by(
-                    '-subject__percentage_denominator'):
-                cs = Characteristic.objects.filter(
-                    subject=cc.subject, geounit__in=geounits)
-                agg = cs.aggregate(Sum('number'))
-                cc.number = agg['number__sum']
-                cc.percentage = '0000.00000000'
-                if cc.subject.percentage_denominator:
-                    c = self.computedcharacteristic_set.get(
-                        subject=cc.subject.percentage_denominator)
-                    denominator = c.number
-                    if cc.number and denominator:
-                        cc.percentage = cc.number / denominator
+            computed = list(
+                self.computedcharacteristic_set.select_related('subject')
+                .order_by('-subject__percentage_denominator'))
+            by_subject = dict((cc.subject_id, cc) for cc in computed)
+            for cc in computed:
+                cc.number = aggregates.get(cc.subject_id)
+                cc.percentage = Decimal('0000.00000000')
+                denominator = by_subject.get(
+                    cc.subject.percentage_denominator_id)
+                if cc.subject.percentage_denominator_id and denominator:
+                    if cc.number and denominator.number:
+                        cc.percentage = cc.number / denominator.number
                 if not cc.number:
-                    cc.number = '00000000.0000'
-                cc.save()
+                    cc.number = Decimal('00000000.0000')
+
+            ComputedCharacteristic.bulk_upsert(computed)
+            self.invalidate_terms()
             return True
         except Exception as ex:
             logger.info('Unable to reaggreagate district "%s"',
@@ -3300,6 +4396,37 @@ class District(models.Model):
         return cursor.fetchone()[0]
 
 
+class CurrentDistrict(models.Model):
+    """
+    A pointer to the latest row of each district in a plan.
+
+    Each edit to a plan adds new rows for the districts that changed, so
+    finding the current districts of a plan otherwise means searching all
+    of its history. Pointers are maintained by a trigger on the district
+    table (see migration 0004), so districts inserted, updated or purged
+    in any way keep them up to date.
+    """
+
+    # The plan of the district
+    plan = models.ForeignKey(
+        Plan, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+
+    # The district_id (NOT the id) of the district
+    district_id = models.PositiveIntegerField()
+
+    # The latest row of the district
+    latest = models.ForeignKey(
+        District, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+
+    # The version of the latest row of the district
+    version = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (('plan', 'district_id'), )
+
+
 class ComputedCharacteristic(models.Model):
     """
     ComputedCharacteristics are cached, aggregate values of Characteristics
@@ -3308,6 +4435,10 @@ class ComputedCharacteristic(models.Model):
     ComputedCharacteristics represent the sum of the Characteristic values
     for all Geounits in a District. There will be one
     ComputedCharacteristic per District per Subject.
+
+    ComputedCharacteristics are kept with the shape of their District, so
+    the Districts that share a shape share its ComputedCharacteristics,
+    and their ids.
     """
 
     # The subject
@@ -3329,6 +4460,41 @@ class ComputedCharacteristic(models.Model):
         """
         ordering = ['subject']
 
+    @staticmethod
+    def bulk_upsert(computed):
+        """
+        Save many ComputedCharacteristics at once. New ones are inserted
+        with one statement, and existing ones are updated with another.
+
+        Parameters:
+            computed -- A list of ComputedCharacteristics. New ones have no
+                id yet.
+        """
+        new = [cc for cc in computed if cc.id is None]
+        existing = [cc for cc in computed if not cc.id is None]
+
+        if new:
+            ComputedCharacteristic.objects.bulk_create(new)
+
+        if existing:
+            values = ', '.join(['(%s, %s, %s::numeric, %s::numeric)'] *
+                               len(existing))
+            params = []
+            for cc in existing:
+                params.extend(
+                    [cc.id, cc.district_id, cc.number, cc.percentage])
+
+            # Match the district too, so a shared characteristic is
+            # written once rather than once per district that shares it
+            query = ('UPDATE redistricting_computedcharacteristic AS cc '
+                     'SET number = v.number, percentage = v.percentage '
+                     'FROM (VALUES %s) AS v(id, district_id, number, '
+                     'percentage) '
+                     'WHERE cc.id = v.id AND cc.district_id = v.district_id'
+                     ) % values
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+
 
 class Profile(models.Model):
     """
@@ -3390,14 +4556,39 @@ def set_district_id(sender, **kwargs):
                     return
 
 
+def forget_plan_versions(sender, **kwargs):
+    """
+    Forget the remembered versions of a plan whenever one of its districts
+    is deleted.
+    """
+    versionmemo.forget(kwargs['instance'].plan_id)
+
+
+def purge_plan_tiles(sender, **kwargs):
+    """
+    Remove the cached tiles of a plan when the plan is deleted.
+    """
+    tilecache.purge_plan(kwargs['instance'].id)
+
+
+def note_plan_edited(plan_id):
+    """
+    Note that the districts of a plan have changed. The remembered
+    versions of the plan are forgotten, and the time that the plan was
+    edited is updated.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+    """
+    versionmemo.forget(plan_id)
+    Plan.objects.filter(id=plan_id).update(edited=datetime.now())
+
+
 def update_plan_edited_time(sender, **kwargs):
     """
-    Update the time that the plan was edited whenever the plan is saved.
+    Note the edit of a plan whenever one of its districts is saved.
     """
-    district = kwargs['instance']
-    plan = district.plan
-    plan.edited = datetime.now()
-    plan.save()
+    note_plan_edited(kwargs['instance'].plan_id)
 
 
 def create_unassigned_district(sender, **kwargs):
@@ -3459,6 +4650,11 @@ post_save.connect(
 pre_save.connect(set_district_id, sender=District)
 # Connect the post_save signal to the update_plan_edited_time helper method
 post_save.connect(update_plan_edited_time, sender=District)
+# Connect the post_delete signal to the forget_plan_versions helper method
+post_delete.connect(forget_plan_versions, sender=District)
+# Connect the post_delete signal from a Plan object to the purge_plan_tiles
+# helper method
+post_delete.connect(purge_plan_tiles, sender=Plan)
 # Connect the post_save signal from a Plan object to the
 # create_unassigned_district helper method (don't remove the dispatch_uid or
 # this signal is sent twice)
@@ -3642,13 +4838,30 @@ class ScoreFunction(BaseModel):
         Returns:
             An instance of the requested calculator.
         """
-        parts = self.calculator.split('.')
-        module = ".".join(parts[:-1])
-        m = __import__(module)
-        for comp in parts[1:]:
-            m = getattr(m, comp)
-        return m()
+        return parallel.load_calculator(self.calculator)()
+
+    def prefetch(self, plans, version=None):
+        """
+        Let the calculator prepare to score many plans at once, before
+        they are scored in turn.
+
+        Parameters:
+            plans -- A list of Plans that will be scored.
+            version -- Optional; the version of the plans. Defaults to the
+                current version of each plan.
+        """
+        calc = self.get_calculator()
+        for arg in ScoreArgument.objects.filter(function=self):
+            if arg.type != 'score':
+                calc.arg_dict[arg.argument] = (arg.type, arg.value)
+
+        try:
+            calc.prefetch(plans, version=version)
+        except Exception, ex:
+            logger.info('Could not prefetch scores of %s.', self.name)
+            logger.debug('Reason: %s', ex)
 
+    @versionmemo.memoized
     def score(self,
               districts_or_plans,
               format='raw',
@@ -3680,6 +4893,27 @@ class ScoreFunction(BaseModel):
         # Is districts_or_plans a list, or a single district/plan?
         is_list = isinstance(districts_or_plans, list)
 
+        # Score a list of districts over the process pool, if enabled
+        if is_list and not self.is_planscore and \
+            parallel.get_concurrency() > 1:
+            if score_arguments is not None:
+                args = score_arguments
+            else:
+                args = ScoreArgument.objects.filter(function=self)
+            arg_dict = dict((arg.argument, (arg.type, arg.value))
+                            for arg in args)
+            scores = parallel.score_districts(self.calculator, arg_dict,
+                                              districts_or_plans)
+            if scores is not None:
+                calc.arg_dict = arg_dict
+                fl = format.lower()
+                results = []
+                for score in scores:
+                    calc.result = score
+                    results.append(calc.html() if fl == 'html' else (
+                        calc.json() if fl == 'json' else calc.result))
+                return results
+
         # Calculate results for every item in the list
         results = []
         for dp in (districts_or_plans if is_list else [districts_or_plans]):
@@ -3708,9 +4942,9 @@ class ScoreFunction(BaseModel):
                                                            version=version))
                     else:
                         version = dp.version if version is None else version
-                        for d in dp.get_districts_at_version(version):
-                            res = score_fn.score(
-                                d, format=format, version=version)
+                        districts = list(dp.get_districts_at_version(version))
+                        for res in score_fn.score(
+                                districts, format=format, version=version):
                             if isinstance(res, dict) and 'value' in res:
                                 res = res['value']
                             arg_lst.append(res)
@@ -3726,8 +4960,13 @@ class ScoreFunction(BaseModel):
             else:
                 kwargs = {'district': dp}
 
-            # Ask the calculator instance to compute the result
-            calc.compute(**kwargs)
+            # Ask the calculator instance to compute the result, reusing
+            # the terms of unchanged districts if the score decomposes
+            if self.is_planscore and len(arg_lst) == 0 and getattr(
+                    calc, 'decomposable', False):
+                self.score_district_terms(calc, dp, kwargs['version'])
+            else:
+                calc.compute(**kwargs)
 
             # Format the result
             fl = format.lower()
@@ -3737,6 +4976,82 @@ class ScoreFunction(BaseModel):
 
         return results if is_list else results[0]
 
+    def score_district_terms(self, calc, plan, version):
+        """
+        Compute a decomposable plan score from the terms of each district.
+
+        The term of a district depends only on that district, and a
+        district that is unchanged by an edit keeps its id in the new
+        version of the plan. Terms are therefore cached by district, so
+        only the districts changed since the previous version are scored.
+
+        Parameters:
+            calc -- A decomposable calculator, with its arguments set.
+            plan -- The Plan to score.
+            version -- The version of the plan to score.
+        """
+        districts = plan.get_districts_at_version(version, include_geom=False)
+
+        # Terms that depend on the adjacency and contiguity overrides are
+        # keyed by their stamp, so they are discarded when either changes
+        stamp = None
+        if getattr(calc, 'uses_contiguity_overrides', False):
+            stamp = contiguity.get_stamp()
+        digest = hashlib.md5('%s:%r:%s' % (
+            self.calculator, sorted(calc.arg_dict.items()),
+            stamp)).hexdigest()
+        keys = dict((d.id, District.get_terms_cache_key(d.id))
+                    for d in districts)
+
+        cache = caches['default']
+        cached = cache.get_many(keys.values())
+        missing = [
+            pk for pk, key in keys.items()
+            if not digest in cached.get(key, {})
+        ]
+
+        # Only the districts without a cached term need their geometry,
+        # unless the calculator reads the stored measures of it instead
+        changed = {}
+        if len(missing) > 0:
+            qset = District.objects.filter(id__in=missing)
+            if not getattr(calc, 'reads_geometry', True):
+                qset = qset.defer('geom', 'simple')
+            for district in qset:
+                key = keys[district.id]
+                entry = cached.get(key, {})
+                entry[digest] = calc.district_term(district)
+                cached[key] = changed[key] = entry
+            cache.set_many(changed, settings.DISTRICT_TERMS_TIMEOUT)
+
+        calc.combine_terms([cached[keys[d.id]][digest] for d in districts])
+
+    def format_score(self, score, format='raw'):
+        """
+        Format a raw score computed by this score function.
+
+        Parameters:
+            score -- The raw score.
+            format -- One of 'raw', 'html', 'json', or 'sort'.
+
+        Returns:
+            The formatted score, or None if the format isn't recognized.
+        """
+        if format == 'raw':
+            return score
+
+        calc = self.get_calculator()
+        calc.result = score
+        if format == 'html':
+            return calc.html()
+        elif format == 'json':
+            return calc.json()
+        elif format == 'sort':
+            return calc.sortkey()
+        else:
+            # Unrecognized format!
+            return None
+
     def __unicode__(self):
         """
         Get a unicode representation of this object. This is the
@@ -3885,6 +5200,7 @@ class ScoreDisplay(BaseModel):
 
         return self
 
+    @versionmemo.memoized
     def render(self,
                dorp,
                context=None,
@@ -4003,6 +5319,7 @@ class ScorePanel(BaseModel):
         else:
             return self.get_short_label()
 
+    @versionmemo.memoized
     def render(self,
                dorp,
                context=None,
@@ -4065,15 +5382,25 @@ class ScorePanel(BaseModel):
 
             planscores = []
 
+            # Fetch the score functions once, and fetch or compute the
+            # cached scores of all the plans at once
+            if function_override:
+                functions = map(lambda f: f[0], components)
+            else:
+                functions = list(
+                    self.score_functions.filter(
+                        is_planscore=True).order_by('name'))
+                scores = ComputedPlanScore.compute_many(
+                    [
+                        f for f in functions
+                        if not function_ids or f.id in function_ids
+                    ],
+                    plans,
+                    version=version)
+
             for plan in plans:
                 plan_version = version if version is not None else plan.version
 
-                if function_override:
-                    functions = map(lambda f: f[0], components)
-                else:
-                    functions = self.score_functions.filter(
-                        is_planscore=True).order_by('name')
-
                 for function in functions:
                     # Don't process this function if it isn't in the inclusion list
                     if function_ids and not function.id in function_ids:
@@ -4091,26 +5418,20 @@ class ScorePanel(BaseModel):
                         sort = score
 
                     else:
-                        score = ComputedPlanScore.compute(
-                            function,
-                            plan,
-                            format='html',
-                            version=plan_version)
-                        sort = ComputedPlanScore.compute(
-                            function,
-                            plan,
-                            format='sort',
-                            version=plan_version)
+                        raw = scores[(function.id, plan.id)]
+                        score = function.format_score(raw, format='html')
+                        sort = function.format_score(raw, format='sort')
 
+                    short_label, label, description = function.get_labels()
                     planscores.append({
                         'plan':
                         plan,
                         'name':
-                        function.get_short_label(),
+                        short_label,
                         'label':
-                        function.get_label(),
+                        label,
                         'description':
-                        function.get_long_description(),
+                        description,
                         'score':
                         score,
                         'sort':
@@ -4143,6 +5464,16 @@ class ScorePanel(BaseModel):
 
             districtscores = []
             functions = []
+
+            # Fetch or compute the cached scores of all the districts at once
+            if not function_override:
+                district_functions = list(
+                    self.score_functions.filter(is_planscore=False))
+                scores = ComputedDistrictScore.compute_many([
+                    f for f in district_functions
+                    if not function_ids or f.id in function_ids
+                ], districts)
+
             for district in districts:
                 districtscore = {'district': district, 'scores': []}
 
@@ -4150,10 +5481,6 @@ class ScorePanel(BaseModel):
                     district_functions = reduce(
                         lambda c: not c[0].is_planscore, components)
 
-                else:
-                    district_functions = self.score_functions.filter(
-                        is_planscore=False)
-
                 for function in district_functions:
                     # Don't process this function if it isn't in the inclusion list
                     if function_ids and not function.id in function_ids:
@@ -4166,20 +5493,23 @@ class ScorePanel(BaseModel):
                         score = function.score(
                             district, format='html', score_arguments=arguments)
                     else:
-                        if not function.get_label() in functions:
-                            functions.append(function.get_label())
-                        score = ComputedDistrictScore.compute(
-                            function, district, format='html')
+                        score = function.format_score(
+                            scores[(function.id, district.id)],
+                            format='html')
+
+                    short_label, label, description = function.get_labels()
+                    if not function_override and not label in functions:
+                        functions.append(label)
 
                     districtscore['scores'].append({
                         'district':
                         district,
                         'name':
-                        function.get_short_label(),
+                        short_label,
                         'label':
-                        function.get_label(),
+                        label,
                         'description':
-                        function.get_long_description(),
+                        description,
                         'score':
                         score
                     })
@@ -4278,43 +5608,75 @@ class ComputedDistrictScore(models.Model):
         Returns:
             The cached value for the district.
         """
-        created = False
-        try:
-            defaults = {'value': ''}
-            cache, created = ComputedDistrictScore.objects.get_or_create(
-                function=function, district=district, defaults=defaults)
-
-        except Exception as ex:
-            logger.info(
-                'Could not retrieve nor create computed district score for district %d.',
-                district.id)
-            logger.debug('Reason:', ex)
+        scores = ComputedDistrictScore.compute_many([function], [district])
+        if not (function.id, district.id) in scores:
             return None
 
-        if created == True:
-            score = function.score(district, format='raw')
-            cache.value = cPickle.dumps(score)
-            cache.save()
-        else:
+        return function.format_score(scores[(function.id, district.id)],
+                                     format)
+
+    @staticmethod
+    def compute_many(functions, districts):
+        """
+        Get the computed values of many score functions for many districts.
+        All of the cached scores are fetched with one query, only the
+        missing scores are computed, and those are cached with one insert.
+
+        Parameters:
+            functions -- A list of ScoreFunctions to compute with
+            districts -- A list of Districts to compute on
+
+        Returns:
+            A dict of raw scores, keyed on (ScoreFunction id, District id)
+            tuples.
+        """
+        scores = {}
+        if len(functions) == 0 or len(districts) == 0:
+            return scores
+
+        cached = ComputedDistrictScore.objects.filter(
+            function__in=functions, district__in=districts)
+        stale = {}
+        for cache in cached:
+            key = (cache.function_id, cache.district_id)
             try:
-                score = cPickle.loads(str(cache.value))
+                scores[key] = cPickle.loads(str(cache.value))
             except:
-                score = function.score(district, format='raw')
-
-        if format != 'raw':
-            calc = function.get_calculator()
-            calc.result = score
-            if format == 'html':
-                return calc.html()
-            elif format == 'json':
-                return calc.json()
-            elif format == 'sort':
-                return calc.sortkey()
-            else:
-                # Unrecognized format!
-                return None
+                stale[key] = cache
+
+        created = []
+        for function in functions:
+            for district in districts:
+                key = (function.id, district.id)
+                if key in scores:
+                    continue
+
+                scores[key] = function.score(district, format='raw')
+                if key in stale:
+                    stale[key].value = cPickle.dumps(scores[key])
+                    stale[key].save()
+                else:
+                    created.append(
+                        ComputedDistrictScore(
+                            function=function,
+                            district=district,
+                            value=cPickle.dumps(scores[key])))
+
+        try:
+            with transaction.atomic():
+                ComputedDistrictScore.objects.bulk_create(created)
+        except IntegrityError:
+            # Another request cached some of these scores first
+            for cache in created:
+                ComputedDistrictScore.objects.get_or_create(
+                    function=cache.function,
+                    district=cache.district,
+                    defaults={'value': cache.value})
+        except Exception as ex:
+            logger.info('Could not cache computed district scores.')
+            logger.debug('Reason: %s', ex)
 
-        return score
+        return scores
 
     class Meta:
         unique_together = (('function', 'district'), )
@@ -4360,49 +5722,91 @@ class ComputedPlanScore(models.Model):
         Returns:
             The cached value for the plan.
         """
-        created = False
-        plan_version = version if version is not None else plan.version
-        try:
-            defaults = {'value': ''}
-            cache, created = ComputedPlanScore.objects.get_or_create(
-                function=function,
-                plan=plan,
-                version=plan_version,
-                defaults=defaults)
-
-        except:
-            logger.exception(
-                'Could not retrieve nor create ComputedPlanScore for plan %d',
-                plan.id)
+        scores = ComputedPlanScore.compute_many([function], [plan],
+                                                version=version)
+        if not (function.id, plan.id) in scores:
             return None
 
-        if created:
-            score = function.score(plan, format='raw', version=plan_version)
-            cache.value = cPickle.dumps(score)
-            cache.save()
-        else:
+        return function.format_score(scores[(function.id, plan.id)], format)
+
+    @staticmethod
+    def compute_many(functions, plans, version=None):
+        """
+        Get the computed values of many score functions for many plans.
+        All of the cached scores are fetched with one query, only the
+        missing scores are computed, and those are cached with one insert.
+
+        Parameters:
+            functions -- A list of ScoreFunctions to compute with
+            plans -- A list of Plans to compute on
+            version -- Optional; the version of the plans to compute.
+                Defaults to the current version of each plan.
+
+        Returns:
+            A dict of raw scores, keyed on (ScoreFunction id, Plan id)
+            tuples.
+        """
+        scores = {}
+        if len(functions) == 0 or len(plans) == 0:
+            return scores
+
+        versions = dict((plan.id, version if version is not None else
+                         plan.version) for plan in plans)
+
+        cached = ComputedPlanScore.objects.filter(
+            function__in=functions,
+            plan__in=plans,
+            version__in=set(versions.values()))
+        stale = {}
+        for cache in cached:
+            key = (cache.function_id, cache.plan_id)
+            if cache.version != versions[cache.plan_id] or key in scores:
+                continue
             try:
-                score = cPickle.loads(str(cache.value))
+                scores[key] = cPickle.loads(str(cache.value))
+                stale.pop(key, None)
             except:
-                score = function.score(
-                    plan, format='raw', version=plan_version)
-                cache.value = cPickle.dumps(score)
-                cache.save()
-
-        if format != 'raw':
-            calc = function.get_calculator()
-            calc.result = score
-            if format == 'html':
-                return calc.html()
-            elif format == 'json':
-                return calc.json()
-            elif format == 'sort':
-                return calc.sortkey()
-            else:
-                # Unrecognized format!
-                return None
+                stale[key] = cache
+
+        created = []
+        for function in functions:
+            missing = [
+                plan for plan in plans if (function.id, plan.id) not in scores
+            ]
+            if len(missing) > 1:
+                function.prefetch(missing, version=version)
+
+            for plan in missing:
+                key = (function.id, plan.id)
+                scores[key] = function.score(
+                    plan, format='raw', version=versions[plan.id])
+                if key in stale:
+                    stale[key].value = cPickle.dumps(scores[key])
+                    stale[key].save()
+                else:
+                    created.append(
+                        ComputedPlanScore(
+                            function=function,
+                            plan=plan,
+                            version=versions[plan.id],
+                            value=cPickle.dumps(scores[key])))
+
+        try:
+            with transaction.atomic():
+                ComputedPlanScore.objects.bulk_create(created)
+        except IntegrityError:
+            # Another request cached some of these scores first
+            for cache in created:
+                ComputedPlanScore.objects.get_or_create(
+                    function=cache.function,
+                    plan=cache.plan,
+                    version=cache.version,
+                    defaults={'value': cache.value})
+        except Exception as ex:
+            logger.info('Could not cache computed plan scores.')
+            logger.debug('Reason: %s', ex)
 
-        return score
+        return scores
 
     def __unicode__(self):
         name = ''
@@ -4440,6 +5844,21 @@ class ContiguityOverride(models.Model):
                             self.connect_to_geounit.portable_id)
 
 
+def reload_contiguity_graph(sender, **kwargs):
+    """
+    Have every worker reload the contiguity graphs, and discard the cached
+    contiguity terms of districts, whenever a contiguity override is saved
+    or deleted, including from the admin.
+    """
+    contiguity.invalidate_contiguity_graph()
+
+
+# Connect the post_save and post_delete signals from a ContiguityOverride
+# object to the reload_contiguity_graph helper method
+post_save.connect(reload_contiguity_graph, sender=ContiguityOverride)
+post_delete.connect(reload_contiguity_graph, sender=ContiguityOverride)
+
+
 @transaction.atomic
 def configure_views():
     """
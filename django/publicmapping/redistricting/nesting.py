@@ -0,0 +1,202 @@
+"""
+Set-based aggregation of nested geounits.
+
+A geounit is made of the geounits of the smaller geolevel whose tree_code
+starts with its own. Rather than aggregating each geounit in turn, the
+characteristics of every geounit in a geolevel are summed with a single
+grouped statement, and the geometries are unioned by PostGIS in batches.
+The batches may be spread over a pool of worker processes, each with its
+own database connection, by setting RENEST_CONCURRENCY to the number of
+worker processes to use.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# The number of geounits whose geometries are unioned in one statement
+BATCH_SIZE = 500
+
+# The parent geounits of each geounit in a geolevel, for geounits with
+# tree_codes of one length. Parent geounits are matched on the prefix of
+# their tree_code, so that the join is an equality join.
+MEMBERS_SQL = """
+WITH members AS (
+    SELECT c.id AS child_id, p.id AS parent_id
+    FROM redistricting_geounit c
+    JOIN redistricting_geounit_geolevel cl ON cl.geounit_id = c.id
+    JOIN redistricting_geounit p
+        ON left(p.tree_code, %(length)s) = c.tree_code
+    JOIN redistricting_geounit_geolevel pl ON pl.geounit_id = p.id
+    WHERE cl.geolevel_id = %(child)s AND pl.geolevel_id = %(parent)s
+        AND length(c.tree_code) = %(length)s
+        AND (%(ids)s::integer[] IS NULL OR c.id = ANY(%(ids)s::integer[]))
+)
+"""
+
+# Point the parent geounits at the geounit that contains them
+CHILD_SQL = """
+UPDATE redistricting_geounit g
+SET child_id = m.child_id
+FROM members m
+WHERE g.id = m.parent_id AND g.child_id IS DISTINCT FROM m.child_id
+"""
+
+# Sum the characteristics of the parent geounits of each geounit, and
+# write the sums of the subjects that have changed
+CHARACTERISTIC_SQL = """
+, sums AS (
+    SELECT m.child_id AS geounit_id, ch.subject_id, SUM(ch.number) AS number
+    FROM members m
+    JOIN redistricting_characteristic ch ON ch.geounit_id = m.parent_id
+    WHERE ch.subject_id = ANY(%(summed)s::integer[])
+    GROUP BY m.child_id, ch.subject_id
+)
+INSERT INTO redistricting_characteristic
+    (subject_id, geounit_id, number, percentage)
+SELECT s.id, n.geounit_id, COALESCE(v.number, 0),
+    CASE WHEN v.number <> 0 AND d.number > 0 THEN v.number / d.number
+        ELSE 0 END
+FROM (SELECT DISTINCT child_id AS geounit_id FROM members) n
+CROSS JOIN redistricting_subject s
+LEFT JOIN sums v ON v.geounit_id = n.geounit_id AND v.subject_id = s.id
+LEFT JOIN sums d ON d.geounit_id = n.geounit_id
+    AND d.subject_id = s.percentage_denominator_id
+WHERE s.id = ANY(%(subjects)s::integer[])
+ON CONFLICT (subject_id, geounit_id) DO UPDATE
+    SET number = EXCLUDED.number, percentage = EXCLUDED.percentage
+    WHERE redistricting_characteristic.number <> EXCLUDED.number
+"""
+
+# Union the geometries of the parent geounits of each geounit, and write
+# the unions that differ from the geometries of the geounits
+UNION_SQL = """
+, unions AS (
+    SELECT m.child_id,
+        ST_Multi(ST_CollectionExtract(ST_Union(p.geom), 3)) AS geom
+    FROM members m
+    JOIN redistricting_geounit p ON p.id = m.parent_id
+    GROUP BY m.child_id
+)
+UPDATE redistricting_geounit g
+SET geom = u.geom,
+    simple = ST_Multi(ST_SimplifyPreserveTopology(u.geom, %(tolerance)s))
+FROM unions u
+WHERE g.id = u.child_id AND NOT ST_IsEmpty(u.geom)
+    AND ST_Area(ST_Difference(u.geom, g.geom)) <> 0
+"""
+
+
+def get_concurrency():
+    """
+    Get the number of worker processes to union geometries with.
+
+    Returns:
+        The configured RENEST_CONCURRENCY, or 1 if parallel unions are
+        disabled.
+    """
+    return max(1, int(getattr(settings, 'RENEST_CONCURRENCY', 0) or 1))
+
+
+def _union_batch(job):
+    """
+    Union the geometries of a batch of geounits.
+
+    Parameters:
+        job -- A tuple of the geolevel id, the parent geolevel id, the
+            length of the tree_codes, the simplification tolerance, and
+            the ids of the geounits.
+
+    Returns:
+        A tuple of the number of geometries modified and the number of
+        geounits in the batch.
+    """
+    child, parent, length, tolerance, ids = job
+    cursor = connection.cursor()
+    cursor.execute(MEMBERS_SQL + UNION_SQL, {
+        'child': child,
+        'parent': parent,
+        'length': length,
+        'tolerance': tolerance,
+        'ids': ids,
+    })
+    return (
+        cursor.rowcount,
+        len(ids),
+    )
+
+
+def _get_pool(jobs):
+    """
+    Get a pool of worker processes for a list of jobs.
+
+    Returns:
+        A multiprocessing Pool, or None if the jobs should run in this
+        process.
+    """
+    concurrency = get_concurrency()
+    if concurrency < 2 or len(jobs) < 2:
+        return None
+
+    # Workers use their own connections, and can't see uncommitted changes
+    if connection.in_atomic_block:
+        return None
+
+    try:
+        # Don't share this process' connection with the workers
+        connection.close()
+        return Pool(processes=concurrency)
+    except Exception as ex:
+        # Daemonic processes (such as celery workers) can't start a pool
+        logger.info('Could not union geometries in parallel.')
+        logger.debug('Reason: %s', ex)
+        return None
+
+
+def union_geounits(jobs):
+    """
+    Union the geometries of batches of geounits, in parallel if
+    RENEST_CONCURRENCY is greater than 1.
+
+    Parameters:
+        jobs -- A list of job tuples, as accepted by _union_batch.
+
+    Returns:
+        An iterator of the results of the jobs as they complete, each a
+        tuple of the number of geometries modified and the number of
+        geounits in the batch.
+    """
+    pool = _get_pool(jobs)
+    if pool is None:
+        for job in jobs:
+            yield _union_batch(job)
+        return
+
+    try:
+        for result in pool.imap_unordered(_union_batch, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,264 @@
+"""
+Parallel scoring of districts with a process pool.
+
+Calculators that only measure the geometry of a district are CPU bound
+in GEOS, and scoring many districts one after another leaves all but one
+core idle. Calculators that declare themselves parallel_safe may instead
+be fanned out over a pool of worker processes. Districts are passed to
+the workers as WKB, so the workers never touch the database.
+
+Parallel scoring is opt-in, and is enabled by setting SCORE_CONCURRENCY
+to the number of worker processes to use. A pool is started for each
+list of districts and closed once they are scored, after the database
+connection of this process is closed, so that no worker outlives the
+request or task that started it, or shares its connection. Districts
+are scored serially inside a transaction, and in daemonic processes such
+as celery workers, which can't start a pool.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+from multiprocessing import Pool, current_process
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+from django.utils import six
+
+logger = logging.getLogger(__name__)
+
+
+def get_concurrency():
+    """
+    Get the number of worker processes to score districts with.
+
+    Returns:
+        The configured SCORE_CONCURRENCY, or 1 if parallel scoring is
+        disabled.
+    """
+    return max(1, int(getattr(settings, 'SCORE_CONCURRENCY', 0) or 1))
+
+
+def load_calculator(name):
+    """
+    Get a calculator class by name.
+
+    Parameters:
+        name -- The fully qualified name of the calculator class.
+
+    Returns:
+        The calculator class.
+    """
+    parts = name.split('.')
+    module = ".".join(parts[:-1])
+    m = __import__(module)
+    for comp in parts[1:]:
+        m = getattr(m, comp)
+    return m
+
+
+class PortableGeounit(object):
+    """
+    The geometry of a geounit, as used by a ContiguityOverride.
+    """
+
+    def __init__(self, geom):
+        self.geom = geom
+
+
+class PortableOverride(object):
+    """
+    A ContiguityOverride that can be passed to a worker process.
+    """
+
+    def __init__(self, override_geom, connect_to_geom):
+        self.override_geounit = PortableGeounit(override_geom)
+        self.connect_to_geounit = PortableGeounit(connect_to_geom)
+
+
+class PortableDistrict(object):
+    """
+    The parts of a District that a parallel_safe calculator may read,
+    in a form that can be passed to a worker process.
+    """
+
+    def __init__(self, id, district_id, num_members, geom, overrides):
+        self.id = id
+        self.district_id = district_id
+        self.num_members = num_members
+        self.geom = geom
+        self.overrides = overrides
+
+    def get_contiguity_overrides(self):
+        """
+        Get the contiguity overrides of the district.
+        """
+        return list(self.overrides)
+
+    @staticmethod
+    def dump(district, with_overrides=False):
+        """
+        Serialize a District for a worker process.
+
+        Parameters:
+            district -- The District to serialize.
+            with_overrides -- Optional. Include the contiguity overrides
+                that apply to the district.
+
+        Returns:
+            A tuple of plain values and WKB strings.
+        """
+        overrides = []
+        if with_overrides:
+            overrides = [(_dump_geom(o.override_geounit.geom),
+                          _dump_geom(o.connect_to_geounit.geom))
+                         for o in district.get_contiguity_overrides()]
+
+        return (district.id, district.district_id, district.num_members,
+                _dump_geom(district.geom), overrides)
+
+    @staticmethod
+    def load(data):
+        """
+        Deserialize a District in a worker process.
+
+        Parameters:
+            data -- A tuple created by PortableDistrict.dump.
+
+        Returns:
+            A PortableDistrict.
+        """
+        id, district_id, num_members, geom, overrides = data
+        overrides = [
+            PortableOverride(_load_geom(o), _load_geom(c))
+            for o, c in overrides
+        ]
+        return PortableDistrict(id, district_id, num_members,
+                                _load_geom(geom), overrides)
+
+
+def _dump_geom(geom):
+    if geom is None:
+        return None
+    return (geom.wkb.tobytes(), geom.srid)
+
+
+def _load_geom(data):
+    if data is None:
+        return None
+    wkb, srid = data
+    geom = GEOSGeometry(six.memoryview(wkb))
+    geom.srid = srid
+    return geom
+
+
+def _score_district(job):
+    """
+    Score one district in a worker process.
+
+    Parameters:
+        job -- A tuple of the calculator name, the argument dictionary,
+            and the serialized district.
+
+    Returns:
+        The raw result of the calculator.
+    """
+    name, arg_dict, data = job
+    calc = load_calculator(name)()
+    calc.arg_dict = arg_dict
+    calc.compute(district=PortableDistrict.load(data))
+    return calc.result
+
+
+def _get_pool(districts):
+    """
+    Get a pool of worker processes for a list of districts.
+
+    Returns:
+        A multiprocessing Pool, or None if the districts should be scored
+        in this process.
+    """
+    concurrency = get_concurrency()
+    if concurrency < 2 or len(districts) < 2:
+        return None
+
+    # Daemonic processes (such as celery workers) can't start a pool
+    if current_process().daemon:
+        return None
+
+    # The connection can't be closed in the middle of a transaction
+    if connection.in_atomic_block:
+        return None
+
+    try:
+        # Don't share this process' connection with the workers
+        connection.close()
+        return Pool(processes=concurrency)
+    except Exception as ex:
+        logger.info('Could not start a pool to score districts.')
+        logger.debug('Reason: %s', ex)
+        return None
+
+
+def score_districts(calculator, arg_dict, districts):
+    """
+    Score a list of districts in parallel.
+
+    Parameters:
+        calculator -- The fully qualified name of a parallel_safe
+            calculator class.
+        arg_dict -- The argument dictionary of the calculator. Every
+            argument must be a literal.
+        districts -- A list of Districts to score.
+
+    Returns:
+        A list of raw results in the same order as the districts, or None
+        if the districts could not be scored in parallel.
+    """
+    if len(districts) < 2:
+        return None
+
+    calc = load_calculator(calculator)
+    if not getattr(calc, 'parallel_safe', False):
+        return None
+    # Reading the stored measures of the geometry is quicker than sending
+    # the geometry to a worker
+    if not getattr(calc, 'reads_geometry', True):
+        return None
+    if any(argtype != 'literal' for argtype, argval in arg_dict.values()):
+        return None
+
+    pool = _get_pool(districts)
+    if pool is None:
+        return None
+
+    try:
+        with_overrides = getattr(calc, 'uses_contiguity_overrides', False)
+        jobs = [(calculator, dict(arg_dict),
+                 PortableDistrict.dump(d, with_overrides)) for d in districts]
+        chunksize = max(1, len(jobs) // (get_concurrency() * 4))
+        return pool.map(_score_district, jobs, chunksize)
+    except Exception as ex:
+        logger.info('Could not score districts in parallel.')
+        logger.debug('Reason: %s', ex)
+        return None
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,220 @@
+"""
+A registry of the active sessions of DistrictBuilder users.
+
+Limiting users to one session each, and limiting the number of concurrent
+sessions, both need to know which sessions are active, and who they
+belong to. Decoding every session in the database to find out is far too
+slow to do on every request, so instead each session is registered in
+redis whenever activity is noted on it, under the keys starting with the
+SESSION_REGISTRY_PREFIX setting ('sessionregistry' by default):
+
+    sessionregistry:active -- A sorted set of all session keys, scored
+        by the time their activity window ends.
+    sessionregistry:user:<user id> -- A hash of the session keys of a
+        user, to the time their activity window ends.
+    sessionregistry:session:<session key> -- The user id that owns a
+        session, if any.
+
+Times are seconds since the epoch.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+# How long (in seconds) sessions that have gone dormant are kept in the
+# registry, so recent activity can still be reported
+HISTORY = 86400
+
+
+def _active_key():
+    return '%s:active' % settings.SESSION_REGISTRY_PREFIX
+
+
+def _user_key(user_id):
+    return '%s:user:%s' % (settings.SESSION_REGISTRY_PREFIX, user_id)
+
+
+def _owner_key(session_key):
+    return '%s:session:%s' % (settings.SESSION_REGISTRY_PREFIX, session_key)
+
+
+def _window():
+    # SESSION_TIMEOUT is in minutes
+    return settings.SESSION_TIMEOUT * 60
+
+
+def _is_active(expires, now):
+    return expires >= now
+
+
+def _connection():
+    return get_redis_connection('default')
+
+
+def register(session_key, user_id=None, previous_key=None):
+    """
+    Note activity on a session, extending its activity window.
+
+    Parameters:
+        session_key -- The key of the session.
+        user_id -- Optional. The id of the user the session belongs to,
+            or None for anonymous sessions.
+        previous_key -- Optional. The key the session was registered under
+            before it was cycled (at login, for example).
+
+    Returns:
+        The time the activity window of the session ends.
+    """
+    if previous_key and previous_key != session_key:
+        unregister(previous_key)
+
+    now = time.time()
+    expires = now + _window()
+
+    pipe = _connection().pipeline()
+    pipe.zadd(_active_key(), expires, session_key)
+    pipe.zremrangebyscore(_active_key(), '-inf', now - HISTORY)
+    if user_id is not None:
+        pipe.set(_owner_key(session_key), user_id, ex=_window() + HISTORY)
+        pipe.hset(_user_key(user_id), session_key, expires)
+        pipe.expire(_user_key(user_id), _window() + HISTORY)
+    pipe.execute()
+
+    return expires
+
+
+def unregister(session_key):
+    """
+    Remove a session from the registry, for example when it is logged out.
+
+    Parameters:
+        session_key -- The key of the session.
+    """
+    redis = _connection()
+    owner = redis.get(_owner_key(session_key))
+
+    pipe = redis.pipeline()
+    pipe.zrem(_active_key(), session_key)
+    pipe.delete(_owner_key(session_key))
+    if owner is not None:
+        pipe.hdel(_user_key(owner), session_key)
+    pipe.execute()
+
+
+def get_user_sessions(user_id):
+    """
+    Get the registered sessions of a user.
+
+    Parameters:
+        user_id -- The id of the user.
+
+    Returns:
+        A dictionary of session keys to the time their activity windows
+        end, including sessions that have gone dormant.
+    """
+    sessions = _connection().hgetall(_user_key(user_id))
+    return dict((key, float(expires)) for key, expires in sessions.items())
+
+
+def count_user_sessions(user_id):
+    """
+    Count the sessions of a user that are within their activity window.
+
+    Parameters:
+        user_id -- The id of the user.
+
+    Returns:
+        The number of active sessions of the user.
+    """
+    now = time.time()
+    return len([
+        key for key, expires in get_user_sessions(user_id).items()
+        if _is_active(expires, now)
+    ])
+
+
+def prune_user_sessions(user_id):
+    """
+    Split the sessions of a user into active and dormant sessions, and
+    remove the dormant sessions from the registry.
+
+    Parameters:
+        user_id -- The id of the user.
+
+    Returns:
+        A tuple of the list of active session keys, and the list of
+        dormant session keys.
+    """
+    now = time.time()
+    active = []
+    dormant = []
+    for key, expires in get_user_sessions(user_id).items():
+        if _is_active(expires, now):
+            active.append(key)
+        else:
+            dormant.append(key)
+
+    if len(dormant) > 0:
+        pipe = _connection().pipeline()
+        pipe.hdel(_user_key(user_id), *dormant)
+        pipe.zrem(_active_key(), *dormant)
+        pipe.delete(*[_owner_key(key) for key in dormant])
+        pipe.execute()
+
+    return active, dormant
+
+
+def count_active():
+    """
+    Count the sessions that are within their activity window.
+
+    Returns:
+        The number of active sessions.
+    """
+    return _connection().zcount(_active_key(), time.time(), '+inf')
+
+
+def count_active_since(minutes):
+    """
+    Count the sessions with activity over a recent period of time.
+
+    Parameters:
+        minutes -- The length of the period, in minutes.
+
+    Returns:
+        The number of sessions with activity in the period.
+    """
+    since = time.time() - minutes * 60
+    return _connection().zcount(_active_key(), '(%f' % (since + _window()),
+                                '+inf')
+
+
+def clear():
+    """
+    Remove every session from the registry.
+    """
+    redis = _connection()
+    keys = list(
+        redis.scan_iter(match=settings.SESSION_REGISTRY_PREFIX + ':*'))
+    if len(keys) > 0:
+        redis.delete(*keys)
@@ -0,0 +1,231 @@
+"""
+Splits between the districts of plans and the shapes of another layer.
+
+A district splits a shape of the other layer when its boundary crosses
+the interior of the shape, and contains it when the shape lies wholly
+within the district. Both relationships come from a single ST_Relate of
+each pair of shapes whose bounding boxes overlap, so the pairs are found
+with the spatial indexes of the layers, and each pair is related once.
+
+The splits of a plan version are cached by the district rows of the
+version and of the other layer, so many plans may be compared with the
+same layer in one query, and only the plans not yet cached are related.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from collections import namedtuple
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+# The DE-9IM patterns of a split, and of a shape within a district
+SPLIT_PATTERN = '***T*****'
+INTERIOR_PATTERN = 'T*****FF*'
+
+# The districts of plan versions, with the id of their plan
+PLAN_LAYER_SQL = """
+SELECT plan_id, district_id AS key, long_label AS name, geom
+FROM redistricting_district
+WHERE id = ANY(%s::integer[]) AND district_id > 0
+"""
+
+# The geounits of a geolevel
+GEOLEVEL_LAYER_SQL = """
+SELECT g.portable_id AS key, g.name, g.geom
+FROM redistricting_geounit g
+JOIN redistricting_geounit_geolevel gl ON gl.geounit_id = g.id
+WHERE gl.geolevel_id = %s
+"""
+
+# Relate each pair of shapes whose bounding boxes overlap. The OFFSET
+# keeps the planner from flattening the subquery, which would relate each
+# pair once for every ST_RelateMatch.
+RELATE_SQL = """
+SELECT plan_id, above_key, below_key, above_name, below_name,
+    ST_RelateMatch(relation, '%(split)s') AS split
+FROM (
+    SELECT %(subject)s.plan_id, above.key AS above_key,
+        below.key AS below_key, above.name AS above_name,
+        below.name AS below_name,
+        ST_Relate(above.geom, below.geom) AS relation
+    FROM (%(above)s) AS above
+    JOIN (%(below)s) AS below ON above.geom && below.geom
+    OFFSET 0
+) AS pairs
+WHERE ST_RelateMatch(relation, '%(split)s')
+    OR ST_RelateMatch(relation, '%(interior)s')
+ORDER BY plan_id, above_key, below_key
+"""
+
+# A layer of shapes to find splits between. 'kind' is either 'plan' or
+# 'geolevel'. The 'version' and 'district_pks' of a geolevel are None.
+Layer = namedtuple('Layer', ['kind', 'id', 'version', 'district_pks'])
+
+
+def plan_layer(plan, version=None):
+    """
+    Get the layer of the districts of a plan version.
+
+    Parameters:
+        plan -- The Plan.
+        version -- Optional. The version of the Plan, defaults to the
+            current version.
+
+    Returns:
+        A Layer.
+    """
+    version = plan.version if version is None else int(version)
+    return Layer('plan', plan.id, version,
+                 list(plan.get_district_ids_at_version(version)))
+
+
+def geolevel_layer(geolevel_id):
+    """
+    Get the layer of the geounits of a geolevel.
+
+    Parameters:
+        geolevel_id -- The id of the Geolevel.
+
+    Returns:
+        A Layer.
+    """
+    return Layer('geolevel', int(geolevel_id), None, None)
+
+
+def cache_key(subject, target, inverse):
+    """
+    Get the key the splits of a plan version are cached under.
+
+    The primary keys of the districts of both layers are part of the key,
+    so splits can never be mistaken for those of a version that has since
+    been purged and reused.
+
+    Parameters:
+        subject -- The Layer of the plan whose splits are found.
+        target -- The Layer the plan is compared with.
+        inverse -- Whether the target layer is above the plan.
+
+    Returns:
+        A key for the cache.
+    """
+    pks = [subject.district_pks, target.district_pks or []]
+    digest = hashlib.md5('|'.join(','.join(str(pk) for pk in sorted(p))
+                                  for p in pks)).hexdigest()
+    return 'splits:plan:%d:version:%d:%s.%d:%s:%d' % (
+        subject.id, subject.version, target.kind, target.id, digest,
+        int(bool(inverse)))
+
+
+def _layer_sql(layer, district_pks=None):
+    if layer.kind == 'plan':
+        return PLAN_LAYER_SQL, [district_pks or layer.district_pks]
+    return GEOLEVEL_LAYER_SQL, [layer.id]
+
+
+def relate(subjects, target, inverse=False):
+    """
+    Find the splits between the districts of many plan versions and
+    another layer with a single query.
+
+    Parameters:
+        subjects -- A list of the Layers of the plans, with one version
+            of each plan.
+        target -- The Layer that is 'below' the plans hierarchically.
+        inverse -- Optional. If True, the target layer is 'above' the
+            plans instead.
+
+    Returns:
+        A dict of results, keyed on the id of the Plan of each subject.
+        Each result is a dict of 'splits' and 'interiors', which are lists
+        of relationships given as tuples of the id of the shape in the
+        above layer, the id of the shape in the below layer, and the names
+        of the two shapes. Shapes of plans are identified by district_id,
+        and shapes of geolevels by portable_id.
+    """
+    results = dict((s.id, {'splits': [], 'interiors': []}) for s in subjects)
+    district_pks = [pk for s in subjects for pk in s.district_pks]
+    if len(district_pks) == 0:
+        return results
+
+    subject_sql, subject_params = _layer_sql(subjects[0], district_pks)
+    target_sql, target_params = _layer_sql(target)
+    if inverse:
+        above, below = target_sql, subject_sql
+        params = target_params + subject_params
+    else:
+        above, below = subject_sql, target_sql
+        params = subject_params + target_params
+
+    query = RELATE_SQL % {
+        'subject': 'below' if inverse else 'above',
+        'above': above,
+        'below': below,
+        'split': SPLIT_PATTERN,
+        'interior': INTERIOR_PATTERN
+    }
+
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+    for row in cursor.fetchall():
+        relationship = tuple(row[1:5])
+        results[row[0]]['splits' if row[5] else 'interiors'].append(
+            relationship)
+
+    return results
+
+
+def find_splits(subjects, target, inverse=False):
+    """
+    Find the splits between the districts of many plan versions and
+    another layer, reusing cached splits. Plans whose splits are not
+    cached are related with a single query.
+
+    Parameters:
+        subjects -- A list of the Layers of the plans.
+        target -- The Layer that is 'below' the plans hierarchically.
+        inverse -- Optional. If True, the target layer is 'above' the
+            plans instead.
+
+    Returns:
+        A dict of results keyed on the id of the Plan of each subject. See
+        L{relate}.
+    """
+    cache = caches['default']
+    keys = dict((s.id, cache_key(s, target, inverse)) for s in subjects)
+    cached = cache.get_many(keys.values())
+
+    results = {}
+    missing = []
+    for subject in subjects:
+        if keys[subject.id] in cached:
+            results[subject.id] = cached[keys[subject.id]]
+        else:
+            missing.append(subject)
+
+    if len(missing) > 0:
+        computed = relate(missing, target, inverse=inverse)
+        cache.set_many(
+            dict((keys[pk], result) for pk, result in computed.items()),
+            settings.SPLITS_CACHE_TIMEOUT)
+        results.update(computed)
+
+    return results
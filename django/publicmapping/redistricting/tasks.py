@@ -33,11 +33,13 @@ import tempfile
 import time
 import traceback
 import zipfile
+from array import array
 from codecs import open
 from datetime import datetime
 from decimal import Decimal
 from glob import glob
 
+from celery import current_task
 from dict2xml import dict2xml
 import fiona
 from fiona import crs
@@ -46,9 +48,10 @@ import sld_generator as generator
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.gis.geos import GeometryCollection
+from django.contrib.gis.geos import GeometryCollection, GEOSGeometry
 from django.contrib.sites.models import Site
 from django.core import management
+from django.core.cache import caches
 from django.core.mail import EmailMessage, mail_admins, send_mail
 from django.db import connection, transaction
 from django.db.models import Avg, Max, Q, Sum
@@ -59,6 +62,8 @@ from django.utils.translation import activate, get_language
 from django_comments.models import Comment
 from lxml import etree, objectify
 from publicmapping.celery import app
+from redistricting.characteristics import (get_characteristic_matrix,
+                                           invalidate_characteristic_matrix)
 from redistricting.config import PoUtils, SpatialUtils
 from redistricting.models import (
     Characteristic, ComputedCharacteristic, ComputedPlanScore, District,
@@ -71,6 +76,25 @@ from tagging.models import Tag
 logger = logging.getLogger(__name__)
 
 
+def report_progress(message, current, total=None):
+    """
+    Report the progress of the running task in its state, so that it can
+    be polled through the task result.
+
+    Parameters:
+        message - A description of the current step.
+        current - The number of items processed so far.
+        total - Optional. The number of items to process.
+    """
+    if not current_task or current_task.request.id is None:
+        return
+
+    meta = {'message': message, 'current': current}
+    if total is not None:
+        meta['total'] = total
+    current_task.update_state(state='PROGRESS', meta=meta)
+
+
 class DistrictFile():
     """
     A utility class that can check exported file status. DistrictIndexFile and
@@ -114,6 +138,24 @@ class DistrictFile():
         else:
             return 'none'
 
+    @staticmethod
+    def get_file_lock(plan, shape=False):
+        """
+        Given a plan, get a lock that is held while its district file is
+        being written, so that concurrent exports of the same plan
+        version wait for the first one instead of writing it again.
+
+        Parameters:
+            plan - the Plan for which a file has been requested
+            shape - a flag indicating if this is to be a shapefile; defaults to False
+
+        Returns:
+            A lock, to be used as a context manager.
+        """
+        key = 'districtfile:%s:lock' % DistrictFile.get_file_name(plan, shape)
+        return caches['default'].lock(
+            key, timeout=settings.DISTRICT_FILE_LOCK_TIMEOUT)
+
     @staticmethod
     def get_file(plan, shape=False):
         """
@@ -144,6 +186,9 @@ class DistrictIndexFile():
     portable id from the database will be ignored.
     """
 
+    # The number of rows of a district index file read at a time
+    CHUNK_SIZE = 10000
+
     @staticmethod
     @app.task
     def index2plan(name,
@@ -364,29 +409,49 @@ class DistrictIndexFile():
 
             return
 
-        # initialize the dicts we'll use to store the portable_ids,
+        # initialize the dicts we'll use to store the geounit ids,
         # keyed on the district_id of this plan
         new_districts = dict()
         num_members = dict()
         community_labels = dict()
         community_types = dict()
         community_comments = dict()
+        num_rows = 0
         csv_file = open(indexFile)
         reader = csv.DictReader(
             csv_file,
             fieldnames=[
                 'code', 'district', 'num_members', 'label', 'types', 'comments'
             ])
+
+        def import_rows(rows):
+            """
+            Look up the geounits of a chunk of rows in bulk, and add them
+            to their districts.
+            """
+            codes = set(code for code, dist_id in rows)
+            geounit_ids = dict()
+            for code, geounit_id in Geounit.objects.filter(
+                    portable_id__in=codes).values_list('portable_id', 'id'):
+                geounit_ids.setdefault(code, []).append(geounit_id)
+
+            unknown = 0
+            for code, dist_id in rows:
+                if code in geounit_ids:
+                    new_districts[dist_id].extend(geounit_ids[code])
+                else:
+                    unknown += 1
+            if unknown > 0:
+                logger.debug('Ignored %d rows with unknown codes.', unknown)
+
+        rows = []
         for row in reader:
             try:
                 dist_id = int(row['district'])
-                # If the district key is present, add this row's code;
-                # else make a new list
-                if dist_id in new_districts:
-                    new_districts[dist_id].append(str(row['code']))
-                else:
-                    new_districts[dist_id] = list()
-                    new_districts[dist_id].append(str(row['code']))
+                code = str(row['code']).strip()
+                # If the district key is not present, make a new district
+                if not dist_id in new_districts:
+                    new_districts[dist_id] = array('l')
 
                     # num_members may not exist in files exported before the column was added
                     num_members[dist_id] = int(
@@ -400,6 +465,8 @@ class DistrictIndexFile():
                     if row['comments']:
                         community_comments[dist_id] = row['comments']
 
+                rows.append((code, dist_id))
+
             except Exception, ex:
                 if email:
                     context['errors'].append({
@@ -413,6 +480,16 @@ class DistrictIndexFile():
                     logger.debug("Did not import row: '%s'", row)
                     logger.debug(ex)
 
+            if len(rows) >= DistrictIndexFile.CHUNK_SIZE:
+                import_rows(rows)
+                num_rows += len(rows)
+                rows = []
+                report_progress(_('Reading district index file'), num_rows)
+
+        if len(rows) > 0:
+            import_rows(rows)
+            num_rows += len(rows)
+
         csv_file.close()
 
         if purge:
@@ -426,16 +503,22 @@ class DistrictIndexFile():
             app_label='redistricting', model='district')
 
         # Create the district geometry from the lists of geounits
-        for district_id in new_districts.keys():
-            # Get a filter using portable_id
-            code_list = new_districts[district_id]
-            guFilter = Q(portable_id__in=code_list)
+        cursor = connection.cursor()
+        computed = []
+        for count, district_id in enumerate(sorted(new_districts.keys())):
+            report_progress(
+                _('Creating districts'), count, len(new_districts))
+            geounit_ids = list(set(new_districts[district_id]))
 
             try:
                 # Build our new geometry from the union of our geounit geometries
-                new_geom = GeometryCollection([
-                    gu.geom for gu in Geounit.objects.filter(guFilter)
-                ]).unary_union
+                cursor.execute(
+                    'SELECT ST_AsEWKB(ST_Union(geom)) FROM %s '
+                    'WHERE id = ANY(%%s)' % Geounit._meta.db_table,
+                    [geounit_ids])
+                union = cursor.fetchone()[0]
+                new_geom = GEOSGeometry(
+                    union) if union is not None else GeometryCollection([])
 
                 # Create a new district and save it
                 short_label = (community_labels[district_id][:10]
@@ -496,51 +579,47 @@ class DistrictIndexFile():
                 continue
 
             # For each district, create the ComputedCharacteristics
-            geounit_ids = Geounit.objects.filter(guFilter).values_list(
-                'id', flat=True).order_by('id')
+            aggregates = get_characteristic_matrix().aggregate(geounit_ids)
+            district_computed = dict()
             for subject in subjects:
-                try:
-                    cc_value = Characteristic.objects.filter(
-                        geounit__in=geounit_ids, subject=subject).aggregate(
-                            Sum('number'))
-                    value = cc_value['number__sum']
-                    percentage = '0000.00000000'
-
-                    if value is not None:
-                        if subject.percentage_denominator:
-                            # The denominator's CC should've already been saved
-                            denominator_value = ComputedCharacteristic.objects.get(
-                                subject=subject.percentage_denominator,
-                                district=new_district).number
-                            percentage = value / denominator_value
-
-                        cc = ComputedCharacteristic(
-                            subject=subject,
-                            number=value,
-                            percentage=percentage,
-                            district=new_district)
-                        cc.save()
-                    else:
-                        logger.debug(
-                            'Unable to create ComputedCharacteristic for Subject: %s. Skipping subject.',
-                            subject.name)
-                        continue
-                except Exception, ex:
-                    if email:
-                        context['errors'].append({
-                            'message':
-                            _('Unable to create ComputedCharacteristic for district '
-                              '%(district_id)s, subject %(subject_name)s') % {
-                                  'district': district_id,
-                                  'subject_name': subject.name
-                              },
-                            'traceback': None
-                        })
-                    else:
-                        logger.debug(
-                            'Unable to create ComputedCharacteristic for district %s, subject %s',
-                            district_id, subject.name)
-                        logger.debug('Reason:', ex)
+                value = aggregates.get(subject.id)
+                if value is None:
+                    logger.debug(
+                        'Unable to create ComputedCharacteristic for Subject: %s. Skipping subject.',
+                        subject.name)
+                    continue
+
+                percentage = Decimal('0000.00000000')
+                if subject.percentage_denominator_id:
+                    # The denominator's CC should've already been computed
+                    denominator = district_computed.get(
+                        subject.percentage_denominator_id)
+                    if denominator and denominator.number:
+                        percentage = value / denominator.number
+
+                district_computed[subject.id] = ComputedCharacteristic(
+                    subject=subject,
+                    number=value,
+                    percentage=percentage,
+                    district=new_district)
+
+            computed.extend(district_computed.values())
+
+            # Release the geounits of this district
+            del new_districts[district_id]
+
+        try:
+            ComputedCharacteristic.bulk_upsert(computed)
+        except Exception, ex:
+            if email:
+                context['errors'].append({
+                    'message':
+                    _('Unable to create ComputedCharacteristics'),
+                    'traceback': None
+                })
+            else:
+                logger.debug('Unable to create ComputedCharacteristics')
+                logger.debug('Reason:', ex)
 
         # Now that all of our other districts exist, create an unassigned district
         plan.create_unassigned = True
@@ -569,6 +648,66 @@ class DistrictIndexFile():
         if not prev_lang is None:
             activate(prev_lang)
 
+    @staticmethod
+    def write_index(plan):
+        """
+        Write the zipped district index file of a plan. The file is written
+        under a pending name, and renamed when complete.
+
+        Parameters:
+            plan - The plan for which to write an index file
+        """
+        pending = DistrictFile.get_file_name(plan) + '_pending.zip'
+        archive = open(pending, 'w')
+        f = tempfile.NamedTemporaryFile(delete=False)
+        try:
+            units = plan.get_base_geounit_assignments()
+
+            # csv layout: portable id, district id, num members, label, types, comments
+            # the final three are only written when the plan is a community
+            if not plan.is_community():
+                mapping = units
+            else:
+                # create a map of district_id -> tuple of community details
+                dm = {}
+                ct = ContentType.objects.get(
+                    app_label='redistricting', model='district')
+                for district in plan.get_districts_at_version(
+                        plan.version, include_geom=False):
+                    if district.district_id > 0:
+                        types = Tag.objects.get_for_object(district).filter(
+                            name__startswith='type=')
+                        types = '|'.join([t.name[5:] for t in types])
+                        comments = Comment.objects.filter(
+                            object_pk__in=[str(district.id)], content_type=ct)
+                        comments = comments[
+                            0].comment if len(comments) > 0 else ''
+                        dm[district.district_id] = (district.long_label,
+                                                    types, comments)
+                mapping = ((pid, did, members, dm[did][0], dm[did][1],
+                            dm[did][2]) for (pid, did, members) in units)
+
+            # Stream the rows into the csv file
+            difile = csv.writer(f)
+            difile.writerows(mapping)
+            f.close()
+
+            # Zip up the file
+            zipwriter = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED)
+            zipwriter.write(f.name, plan.get_friendly_name() + '.csv')
+            zipwriter.close()
+            archive.close()
+            os.rename(archive.name, DistrictFile.get_file_name(plan) + '.zip')
+        except Exception, ex:
+            logger.warn(
+                'The plan "%s" could not be serialized to a district index file',
+                plan.name)
+            logger.debug('Reason:', ex)
+            os.unlink(archive.name)
+        # delete the temporary csv file
+        finally:
+            os.unlink(f.name)
+
     @staticmethod
     @app.task
     def plan2index(plan_id):
@@ -583,64 +722,11 @@ class DistrictIndexFile():
             A file name pointing to the zipped index file
         """
         plan = Plan.objects.get(id=plan_id)
-        status = DistrictFile.get_file_status(plan)
-        while status == 'pending':
-            time.sleep(15)
-            status = DistrictFile.get_file_status(plan)
-        if status == 'none':
-            pending = DistrictFile.get_file_name(plan) + '_pending.zip'
-            archive = open(pending, 'w')
-            f = tempfile.NamedTemporaryFile(delete=False)
-            try:
-                units = plan.get_base_geounits()
-
-                # csv layout: portable id, district id, num members, label, types, comments
-                # the final three are only written when the plan is a community
-                if not plan.is_community():
-                    mapping = [(pid, did, members)
-                               for (gid, pid, did, members) in units]
-                else:
-                    # create a map of district_id -> tuple of community details
-                    dm = {}
-                    ct = ContentType.objects.get(
-                        app_label='redistricting', model='district')
-                    for district in plan.get_districts_at_version(
-                            plan.version, include_geom=False):
-                        if district.district_id > 0:
-                            types = Tag.objects.get_for_object(
-                                district).filter(name__startswith='type=')
-                            types = '|'.join([t.name[5:] for t in types])
-                            comments = Comment.objects.filter(
-                                object_pk__in=[str(district.id)],
-                                content_type=ct)
-                            comments = comments[
-                                0].comment if len(comments) > 0 else ''
-                            dm[district.district_id] = (district.long_label,
-                                                        types, comments)
-                    mapping = [(pid, did, members, dm[did][0], dm[did][1],
-                                dm[did][2])
-                               for (gid, pid, did, members) in units]
-
-                difile = csv.writer(f)
-                difile.writerows(mapping)
-                f.close()
 
-                # Zip up the file
-                zipwriter = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED)
-                zipwriter.write(f.name, plan.get_friendly_name() + '.csv')
-                zipwriter.close()
-                archive.close()
-                os.rename(archive.name,
-                          DistrictFile.get_file_name(plan) + '.zip')
-            except Exception, ex:
-                logger.warn(
-                    'The plan "%s" could not be serialized to a district index file',
-                    plan.name)
-                logger.debug('Reason:', ex)
-                os.unlink(archive.name)
-            # delete the temporary csv file
-            finally:
-                os.unlink(f.name)
+        # Wait for any other export of this plan version to finish
+        with DistrictFile.get_file_lock(plan):
+            if DistrictFile.get_file_status(plan) != 'done':
+                DistrictIndexFile.write_index(plan)
 
         return DistrictFile.get_file(plan)
 
@@ -1221,11 +1307,13 @@ class CalculatorReport:
 # Reaggregation tasks
 #
 @app.task
-def reaggregate_plan(plan_id):
+def reaggregate_plan(plan_id, latest_only=False):
     """
     Asynchronously reaggregate all computed characteristics for each district in the plan.
 
     @param plan_id: The plan to reaggregate
+    @param latest_only: Optional. Only reaggregate the districts in the
+        current version of the plan.
     @return: An integer count of the number of districts reaggregated
     """
     try:
@@ -1236,7 +1324,7 @@ def reaggregate_plan(plan_id):
         return None
 
     try:
-        count = plan.reaggregate()
+        count = plan.reaggregate(latest_only=latest_only)
 
         logger.debug('Reaggregated %d districts.', count)
 
@@ -1252,6 +1340,46 @@ def reaggregate_plan(plan_id):
         return None
 
 
+@app.task
+def fix_unassigned_plan(plan_id, version=None, threshold=100, language=None):
+    """
+    Asynchronously assign the unassigned base geounits of a plan that are
+    enclosed by or adjacent to a district. The progress of the fix is
+    reported in the state of the task.
+
+    @param plan_id: The plan to fix
+    @param version: Optional. The version of the plan to fix, defaults to
+        the current version.
+    @param threshold: Optional. The distance threshold used for buffer
+        in/out optimization.
+    @param language: Optional. The language of the message.
+    @return: A dict with the 'success' of the fix, a 'message', and the
+        'version' of the plan after the fix.
+    """
+    prev_lang = None
+    if not language is None:
+        prev_lang = get_language()
+        activate(language)
+
+    status = {'success': False}
+    try:
+        plan = Plan.objects.get(id=plan_id)
+        success, message = plan.fix_unassigned(
+            version, threshold=threshold, progress=report_progress)
+        status['success'] = success
+        status['message'] = message
+        status['version'] = plan.version
+    except Exception, ex:
+        logger.warn('Could not fix unassigned in plan %d.', plan_id)
+        logger.debug('Reason: %s', ex)
+        status['message'] = _('Could not fix unassigned')
+
+    if not prev_lang is None:
+        activate(prev_lang)
+
+    return status
+
+
 #
 # Validation tasks
 #
@@ -1601,6 +1729,7 @@ def copy_to_characteristics(upload_id, language=None):
     # Insert or update all the records into the characteristic table
     cursor = connection.cursor()
     cursor.executemany(sql, tuple(args))
+    invalidate_characteristic_matrix()
 
     logger.debug('Loaded new Characteristic values for subject "%s"',
                  the_subject.name)
@@ -1752,7 +1881,10 @@ def renest_uploaded_subject(upload_id, language=None):
                 continue
 
             renested[basename] = geolevel.renest(
-                geolevels[i - 1], subject=subject, spatial=False)
+                geolevels[i - 1],
+                subject=subject,
+                spatial=False,
+                progress=report_progress)
 
             logger.debug('Renesting of "%s" %s', basename, 'succeeded'
                          if renested[basename] else 'failed')
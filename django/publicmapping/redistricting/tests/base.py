@@ -1,6 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 
+from redistricting.characteristics import invalidate_characteristic_matrix
 from redistricting.models import District, Plan
 
 
@@ -20,6 +21,9 @@ class BaseTestCase(TestCase):
         Setup the general tests. This fabricates a set of data in the
         test database for use later.
         """
+        # Each test case loads its own characteristics from fixtures
+        invalidate_characteristic_matrix()
+
         # Get a test Plan
         self.plan = Plan.objects.get(name='testPlan')
         self.plan2 = Plan.objects.get(name='testPlan2')
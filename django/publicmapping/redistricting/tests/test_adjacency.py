@@ -1,25 +1,24 @@
 from base import BaseTestCase
 
-import unittest
-from redisutils import key_gen
 import itertools
-
-import redis
+import os
+import shutil
+import tempfile
 
 from redistricting.models import Geolevel, Geounit, District
+from redistricting import adjacency
+from redistricting.adjacency import AdjacencyStore
 from redistricting.calculators import Adjacency
-from django.conf import settings
+from django.core.cache import caches
+from django.test.utils import override_settings
 
 
-@unittest.skipIf('calculators' not in settings.CACHES,
-                 'Calculator cache is not configured in settings.')
 class AdjacencyTestCase(BaseTestCase):
     """
     Unit tests for the adjacency calculator
 
     Note, this is split off from other scoring test cases since it requires
-    connecting to redis and other functionality not required by any other
-    calculators
+    a compiled adjacency store, which no other calculators use
     """
 
     def setUp(self):
@@ -50,48 +49,173 @@ class AdjacencyTestCase(BaseTestCase):
                 plan=self.plan, district_id=self.district2.district_id),
             key=lambda d: d.version)
 
-        # Get redis in order to set upload values for testing
-        redis_settings = settings.KEY_VALUE_STORE
-        self.r = redis.StrictRedis(
-            host=redis_settings['HOST'],
-            port=int(redis_settings['PORT']),
-            password=redis_settings['PASSWORD'],
-            db=15)
-
+        # Compile the cost of every pair of base geounits into a store
         base_geolevel = Geolevel.objects.get(name='smallest level')
         base_geounits = Geounit.objects.filter(
             geolevel=base_geolevel).order_by('portable_id')
         base_geounit_combos = itertools.combinations(base_geounits, 2)
-        redis_dict = {}
+        rows = []
         region_sum = 0
         geounit_count = 0
         for combo in base_geounit_combos:
             geounit_count += 1
-            key = key_gen(**{
-                'geounit1': combo[0].portable_id,
-                'geounit2': combo[1].portable_id
-            })
             value = round(combo[0].center.distance(combo[1].center) * 100, 12)
-            redis_dict[key] = value
+            rows.append((combo[0].portable_id, combo[1].portable_id, value))
             region_sum += value
-        self.r.mset(redis_dict)
         region_cost = region_sum / geounit_count
-        key = key_gen(**{'region': self.plan.legislative_body.region.name})
-        self.r.set(key, region_cost)
+        regions = {self.plan.legislative_body.region.name: region_cost}
+
+        self.directory = tempfile.mkdtemp()
+        AdjacencyStore.build(rows, regions).save(self.directory)
 
     def tearDown(self):
-        self.r.flushdb()
+        shutil.rmtree(self.directory)
         super(AdjacencyTestCase, self).tearDown()
 
     def testAdjacencyScores(self):
-        adj = Adjacency()
-        adj.compute(**{'district': self.district1, 'db': 15})
-        self.assertAlmostEqual(14.7671977211, adj.result['value'], 9,
-                               'Adjacency score for district was incorrect: %f'
-                               % adj.result['value'])
-
-        # Test computing a plan's score
-        adj.compute(**{'plan': self.plan, 'db': 15})
+        with override_settings(ADJACENCY_STORE=self.directory):
+            adj = Adjacency()
+            adj.compute(**{'district': self.district1})
+            self.assertAlmostEqual(
+                14.7671977211, adj.result['value'], 9,
+                'Adjacency score for district was incorrect: %f' %
+                adj.result['value'])
+
+            # Test computing a plan's score
+            adj.compute(**{'plan': self.plan})
+            self.assertAlmostEqual(
+                0.29712390062, adj.result['value'], 9,
+                'Adjacency score for plan was incorrect %f' %
+                adj.result['value'])
+
+    def testMissingStore(self):
+        """
+        Test that adjacency isn't scored without a compiled store
+        """
+        missing = os.path.join(self.directory, 'missing')
+        with override_settings(ADJACENCY_STORE=missing):
+            adj = Adjacency()
+            adj.compute(**{'plan': self.plan})
+            self.assertEqual('n/a', adj.html())
+
+            adj.compute(**{'district': self.district1})
+            self.assertEqual('n/a', adj.html())
+
+
+class AdjacencyStoreTestCase(BaseTestCase):
+    """
+    Unit tests for the compiled store of adjacency costs
+    """
+
+    def setUp(self):
+        super(AdjacencyStoreTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+        base_geolevel = Geolevel.objects.get(name='smallest level')
+        self.base_geounits = list(
+            Geounit.objects.filter(geolevel=base_geolevel).order_by('id'))
+
+        # Give every other pair a cost, in both orders
+        self.costs = {}
+        rows = []
+        for i, combo in enumerate(
+                itertools.combinations(self.base_geounits, 2)):
+            if i % 2 == 1:
+                continue
+            first, second = combo[0].portable_id, combo[1].portable_id
+            value = round(combo[0].center.distance(combo[1].center), 6)
+            self.costs[tuple(sorted([first, second]))] = value
+            rows.append((second, first, value) if i % 4 else (first, second,
+                                                              value))
+
+        AdjacencyStore.build(rows).save(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(AdjacencyStoreTestCase, self).tearDown()
+
+    def expected_cost(self, portable_ids):
+        return sum(
+            self.costs.get(tuple(sorted(pair)), 0)
+            for pair in itertools.combinations(portable_ids, 2))
+
+    def test_pair_cost(self):
+        """
+        Test that the store sums the costs of every pair of geounits
+        """
+        store = AdjacencyStore.load(self.directory)
+        portable_ids = [g.portable_id for g in self.base_geounits[10:40]]
+
         self.assertAlmostEqual(
-            0.29712390062, adj.result['value'], 9,
-            'Adjacency score for plan was incorrect %f' % adj.result['value'])
+            self.expected_cost(portable_ids), store.pair_cost(portable_ids),
+            9)
+        self.assertEqual(0, store.pair_cost(portable_ids[:1]))
+        self.assertEqual(
+            store.pair_cost(portable_ids),
+            store.pair_cost(portable_ids + ['not a geounit']))
+
+    def test_district_score(self):
+        """
+        Test that the calculator averages the costs in the store
+        """
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id'))
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(g.id) for g in geounits[0:3]],
+                               geolevel.id, self.plan.version)
+        district = max(
+            District.objects.filter(
+                plan=self.plan, district_id=self.district1.district_id),
+            key=lambda d: d.version)
+
+        portable_ids = [pid for gid, pid in district.get_base_geounits()]
+        num_pairs = len(portable_ids) * (len(portable_ids) - 1) / 2
+        expected = self.expected_cost(portable_ids) / num_pairs
+
+        with override_settings(ADJACENCY_STORE=self.directory):
+            adj = Adjacency()
+            adj.compute(district=district)
+            self.assertAlmostEqual(expected, adj.result['value'], 9)
+
+            # The cost of the district version is remembered
+            adj.compute(district=district)
+            self.assertAlmostEqual(expected, adj.result['value'], 9)
+            key = 'adjacency:%s:district:%d' % (
+                adjacency.get_store_version(), district.id)
+            self.assertAlmostEqual(expected, caches['default'].get(key), 9)
+
+    def test_compile(self):
+        """
+        Test that adjacency files are compiled with their region averages,
+        and only compiled again when they change
+        """
+        paths = []
+        for i, rows in enumerate([[('a', 'b', 1), ('b', 'c', 2)],
+                                  [('c', 'd', 6)]]):
+            path = os.path.join(self.directory, 'adjacency%d.txt' % i)
+            with open(path, 'w') as f:
+                for row in rows:
+                    f.write('%s\t%s\t%s\n' % row)
+            paths.append(path)
+
+        store_directory = os.path.join(self.directory, 'store')
+        AdjacencyStore.compile([(paths[0], 'va'), (paths[1], 'dc')],
+                               store_directory)
+
+        store = AdjacencyStore.load(store_directory)
+        self.assertEqual({'va': 1.5, 'dc': 6.0}, store.regions)
+        self.assertEqual(9, store.pair_cost(['a', 'b', 'c', 'd']))
+
+        part = os.path.join(store_directory, adjacency.PARTS_DIRECTORY,
+                            '0.npz')
+        self.assertIsNotNone(adjacency.load_part(part, paths[0], 'va'))
+
+        with open(paths[0], 'a') as f:
+            f.write('a\tc\t10\n')
+        self.assertIsNone(adjacency.load_part(part, paths[0], 'va'))
+
+        AdjacencyStore.compile([(paths[0], 'va'), (paths[1], 'dc')],
+                               store_directory)
+        store = AdjacencyStore.load(store_directory)
+        self.assertEqual(19, store.pair_cost(['a', 'b', 'c', 'd']))
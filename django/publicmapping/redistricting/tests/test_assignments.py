@@ -0,0 +1,74 @@
+from base import BaseTestCase
+
+from redistricting.models import *
+from redistricting.assignments import AssignmentIndex, NO_DISTRICT
+
+
+class AssignmentIndexTestCase(BaseTestCase):
+    """
+    Unit tests for the index of base geounit assignments
+    """
+
+    fixtures = [
+        'redistricting_testdata.json', 'redistricting_testdata_geolevel2.json',
+        'redistricting_testdata_geolevel3.json'
+    ]
+
+    def setUp(self):
+        super(AssignmentIndexTestCase, self).setUp()
+        self.geolevel = Geolevel.objects.get(name='middle level')
+        self.geounits = list(
+            Geounit.objects.filter(geolevel=self.geolevel).order_by('id'))
+
+    def tearDown(self):
+        self.geolevel = None
+        self.geounits = None
+        super(AssignmentIndexTestCase, self).tearDown()
+
+    def test_lookup_and_assign(self):
+        """
+        Test looking up and moving geounits in an index
+        """
+        index = AssignmentIndex([30, 10, 20], [2, 1, 0])
+
+        self.assertEqual([1, 0, 2, NO_DISTRICT],
+                         index.lookup([10, 20, 30, 40]).tolist(),
+                         'Lookup returned the wrong districts')
+
+        moved = index.assign([20, 40], 2)
+        self.assertEqual([1, 2, 2, 2],
+                         moved.lookup([10, 20, 30, 40]).tolist(),
+                         'Assign did not move the geounits')
+        self.assertEqual([20, 30, 40],
+                         moved.get_geounits(2).tolist(),
+                         'Assign did not move the geounits')
+        self.assertEqual([1, 0, 2, NO_DISTRICT],
+                         index.lookup([10, 20, 30, 40]).tolist(),
+                         'Assign modified the previous index')
+
+    def test_incremental_matches_built(self):
+        """
+        Test that an index carried forward by edits matches one built
+        from the district geometries
+        """
+        district1 = self.district1.district_id
+        district2 = self.district2.district_id
+
+        self.plan.add_geounits(district1, [str(self.geounits[0].id)],
+                               self.geolevel.id, self.plan.version)
+        self.plan.add_geounits(district2, [str(self.geounits[1].id)],
+                               self.geolevel.id, self.plan.version)
+        self.plan.add_geounits(district1, [str(self.geounits[1].id)],
+                               self.geolevel.id, self.plan.version)
+
+        incremental = self.plan.get_assignment_index()
+        built = self.plan.build_assignment_index()
+
+        self.assertEqual(built.geounit_ids.tolist(),
+                         incremental.geounit_ids.tolist(),
+                         'Indexes contain different geounits')
+        self.assertEqual(built.district_ids.tolist(),
+                         incremental.district_ids.tolist(),
+                         'Indexes contain different assignments')
+        self.assertEqual(18, len(incremental.get_geounits(district1)),
+                         'Wrong number of geounits in district 1')
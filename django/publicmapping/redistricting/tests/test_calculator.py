@@ -1,16 +1,17 @@
 from base import BaseTestCase
 
 from django.db.models import Sum
-from django.contrib.gis.geos import Polygon, Point
+from django.contrib.gis.geos import MultiPolygon, Polygon, Point
 from math import sin, cos, pi
 from redistricting.models import (Geolevel, Subject, Characteristic, District,
-                                  ContiguityOverride)
+                                  ContiguityOverride, Plan)
+from redistricting import contiguity
 from redistricting.calculators import (
     SumValues, Percent, Threshold, Range, Schwartzberg, Roeck, Average,
     PolsbyPopper, ConvexHullRatio, SplitCounter, DistrictSplitCounter,
     Interval, MajorityMinority, Equipopulation, Contiguity, Competitiveness,
     LengthWidthCompactness, Equivalence, RepresentationalFairness,
-    CountDistricts, Gravelius)
+    CountDistricts, Gravelius, AllContiguous, NonContiguous)
 from copy import copy
 
 
@@ -842,7 +843,7 @@ class CalculatorTestCase(BaseTestCase):
         darea = pi * disk.r * disk.r
 
         # Testing to 3 decimal places, since this is an approximation of
-        # the circle's area -- actual ratio is 0.50014
+        # the circle's area -- actual ratio is 0.49977
         self.assertAlmostEquals(
             0.5, parea / darea, 3,
             'Roeck half-circle district was incorrect. (e:%0.6f,a:%0.6f)' %
@@ -1340,6 +1341,93 @@ class CalculatorTestCase(BaseTestCase):
                          'Incorrect value during contiguity. (e:%d,a:%d)' %
                          (2, actual))
 
+    def test_contiguity_graph(self):
+        # Overrides are linked through the nesting of the geounits
+        for gl in Geolevel.objects.all():
+            gl.build_hierarchy()
+
+        base = Geolevel.objects.get(
+            id=self.plan.legislative_body.get_base_geolevel())
+        self.assertTrue(base.build_adjacency() > 0,
+                        'No adjacency was built for the base geolevel')
+        # Later tests must not see the adjacency rolled back with this one
+        self.addCleanup(contiguity.invalidate_contiguity_graph)
+
+        dist1ids = self.geounits[0:4] + self.geounits[5:9]
+        dist2ids = [self.geounits[9], self.geounits[19]]
+        dist1ids = map(lambda x: str(x.id), dist1ids)
+        dist2ids = map(lambda x: str(x.id), dist2ids)
+
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               self.geolevel.id, self.plan.version)
+        self.plan.add_geounits(self.district2.district_id, dist2ids,
+                               self.geolevel.id, self.plan.version)
+
+        cntcalc = Contiguity()
+        cntcalc.compute(plan=self.plan)
+        self.assertEqual(0, cntcalc.result['value'],
+                         'Both districts should be discontiguous')
+
+        noncalc = NonContiguous()
+        noncalc.compute(plan=self.plan)
+        self.assertEqual(2, noncalc.result['value'],
+                         'Both districts should be non-contiguous')
+
+        # The two geounits of district 2 meet at a single point
+        cntcalc.arg_dict['allow_single_point'] = ('literal', '1')
+        cntcalc.compute(plan=self.plan)
+        self.assertEqual(1, cntcalc.result['value'],
+                         'District 2 is contiguous at a single point')
+        district2 = self.plan.district_set.get(
+            district_id=self.district2.district_id, version=self.plan.version)
+        cntcalc.compute(district=district2)
+        self.assertEqual(1, cntcalc.result['value'],
+                         'District 2 is contiguous at a single point')
+
+        # Fill the gap in district 1
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(self.geounits[4].id)], self.geolevel.id,
+                               self.plan.version)
+
+        # A district is one piece of the graph, even if its geometry has
+        # parts that don't touch, as when a base geounit has islands
+        district1 = self.plan.district_set.get(
+            district_id=self.district1.district_id, version=self.plan.version)
+        xmin, ymin, xmax, ymax = district1.geom.extent
+        island = Polygon.from_bbox((xmax + 1000, ymin, xmax + 1001, ymin + 1))
+        island.srid = district1.geom.srid
+        district1.geom = MultiPolygon(
+            [p for p in district1.geom] + [island], srid=island.srid)
+        cntcalc = Contiguity()
+        cntcalc.compute(district=district1)
+        self.assertEqual(1, cntcalc.result['value'],
+                         'District 1 is one piece of the adjacency graph')
+
+        allcalc = AllContiguous()
+        allcalc.compute(plan=self.plan)
+        self.assertFalse(allcalc.result['value'],
+                         'District 2 is only contiguous at a single point')
+        allcalc.arg_dict['allow_single_point'] = ('literal', '1')
+        allcalc.compute(plan=self.plan)
+        self.assertTrue(allcalc.result['value'],
+                        'All districts are contiguous at a single point')
+
+        # An override links the two geounits of district 2
+        override = ContiguityOverride(
+            override_geounit=self.geounits[9],
+            connect_to_geounit=self.geounits[19])
+        override.save()
+
+        cntcalc = Contiguity()
+        cntcalc.compute(plan=self.plan)
+        self.assertEqual(2, cntcalc.result['value'],
+                         'The override should make district 2 contiguous')
+
+        override.delete()
+        cntcalc.compute(plan=self.plan)
+        self.assertEqual(1, cntcalc.result['value'],
+                         'District 2 is discontiguous without the override')
+
     def test_equivalence1(self):
         dist1ids = self.geounits[0:3] + self.geounits[9:12]
         dist2ids = self.geounits[18:21] + self.geounits[27:
@@ -1958,6 +2046,48 @@ class CalculatorTestCase(BaseTestCase):
                          'Did not find expected district splits. e:%d, a:%d' %
                          (num_plan_splits, num_dist_splits))
 
+    def test_splitcounter_many(self):
+        geolevel = Geolevel.objects.get(name='biggest level')
+        geounits = list(geolevel.geounit_set.all().order_by('id'))
+
+        p1 = self.plan
+        p1.add_geounits(1, [str(geounits[4].id)], geolevel.id, p1.version)
+        p1.add_geounits(2, [str(geounits[7].id)], geolevel.id, p1.version)
+
+        p2 = self.plan2
+        dist1ids = self.geounits[20:23] + self.geounits[29:32] + \
+            self.geounits[38:41] + self.geounits[47:50] + \
+            self.geounits[56:59]
+        dist1ids = map(lambda x: str(x.id), dist1ids)
+        p2.add_geounits(3, dist1ids, self.geolevel.id, p2.version)
+
+        # Both plans are related to the biggest geolevel at once
+        target = 'geolevel.%d' % geolevel.id
+        found = Plan.find_many_splits([p1, p2], target)
+        self.assertEqual([p1.id, p2.id], sorted(found.keys()),
+                         'Splits were not found for both plans')
+        self.assertEqual(0, len(found[p1.id]['splits']),
+                         'Found splits of geounits equal to districts')
+        self.assertEqual(2, len(found[p1.id]['interiors']),
+                         'Did not find the geounits equal to districts')
+        self.assertTrue(len(found[p2.id]['splits']) > 0,
+                        'Did not find the splits of the second plan')
+
+        # Each plan gets the same splits when computed on its own
+        for plan in [p1, p2]:
+            splits = plan.compute_splits(target, extended=True)
+            self.assertEqual(found[plan.id]['splits'], splits['splits'],
+                             'Splits differ from the batch')
+            self.assertEqual(found[plan.id]['interiors'],
+                             splits['interiors'],
+                             'Interiors differ from the batch')
+
+        # The splits of a new version are found again
+        p1.add_geounits(1, dist1ids, self.geolevel.id, p1.version)
+        found = Plan.find_many_splits([p1], target)
+        self.assertNotEqual(2, len(found[p1.id]['interiors']),
+                            'Splits of a previous version were reused')
+
     def test_convexhull_l1(self):
         """
         Test the convex hull calculator for the middle geolevel
@@ -0,0 +1,63 @@
+from base import BaseTestCase
+
+from django.db.models import Sum
+
+from redistricting.models import *
+from redistricting.characteristics import get_characteristic_matrix
+
+
+class CharacteristicMatrixTestCase(BaseTestCase):
+    """
+    Unit tests for the in-memory matrix of characteristic values
+    """
+
+    fixtures = [
+        'redistricting_testdata.json', 'redistricting_testdata_geolevel2.json',
+        'redistricting_testdata_geolevel3.json'
+    ]
+
+    def test_aggregate_matches_database(self):
+        """
+        Test that sums from the matrix match sums in the database
+        """
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounit_ids = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id')
+            .values_list('id', flat=True)[:5])
+
+        aggregates = get_characteristic_matrix().aggregate(
+            geounit_ids + geounit_ids[:2])
+
+        for subject in Subject.objects.all():
+            expected = Characteristic.objects.filter(
+                geounit__in=geounit_ids, subject=subject).aggregate(
+                    Sum('number'))['number__sum']
+            self.assertEqual(expected, aggregates.get(subject.id),
+                             'Aggregate for %s did not match' % subject.name)
+
+    def test_aggregate_empty(self):
+        """
+        Test that aggregating no geounits has no values
+        """
+        self.assertEqual({}, get_characteristic_matrix().aggregate([]),
+                         'Aggregating nothing returned values')
+
+    def test_delta_stats_round_trip(self):
+        """
+        Test that adding and removing geounits leaves the stats unchanged
+        """
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(Geounit.objects.filter(geolevel=geolevel)[:3])
+
+        before = dict((cc.subject_id, cc.number)
+                      for cc in self.district1.computedcharacteristic_set.all())
+
+        self.assertTrue(self.district1.delta_stats(geounits, True),
+                        'Adding geounits did not change the stats')
+        self.assertTrue(self.district1.delta_stats(geounits, False),
+                        'Removing geounits did not change the stats')
+
+        for cc in self.district1.computedcharacteristic_set.all():
+            self.assertEqual(
+                before.get(cc.subject_id, 0), cc.number,
+                'Stats for subject %d changed' % cc.subject_id)
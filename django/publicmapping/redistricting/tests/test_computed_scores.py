@@ -132,3 +132,67 @@ class ComputedScoresTestCase(BaseTestCase):
             2, numscores,
             'The number of computed plan scores is incorrect. (e:2, a:%d)' %
             numscores)
+
+    def test_district_batch(self):
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id'))
+
+        dist1ids = map(lambda x: str(x.id), geounits[0:3])
+        dist2ids = map(lambda x: str(x.id), geounits[6:9])
+
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               geolevel.id, self.plan.version)
+        self.plan.add_geounits(self.district2.district_id, dist2ids,
+                               geolevel.id, self.plan.version)
+
+        functions = list(
+            ScoreFunction.objects.filter(
+                calculator__endswith='SumValues', is_planscore=False))
+        districts = list(
+            self.plan.get_districts_at_version(
+                self.plan.version, include_geom=False))
+
+        # Cache one of the scores before computing the batch
+        ComputedDistrictScore.compute(functions[0], districts[0])
+
+        scores = ComputedDistrictScore.compute_many(functions, districts)
+
+        self.assertEqual(
+            len(functions) * len(districts), len(scores),
+            'The number of batch computed scores is incorrect.')
+        for function in functions:
+            for district in districts:
+                expected = function.score(district)
+                self.assertEqual(
+                    expected['value'],
+                    scores[(function.id, district.id)]['value'],
+                    'The batch score computed is incorrect.')
+
+        numscores = ComputedDistrictScore.objects.all().count()
+        self.assertEqual(
+            len(functions) * len(districts), numscores,
+            'The number of computed district scores is incorrect. (e:%d, a:%d)'
+            % (len(functions) * len(districts), numscores))
+
+        # A second batch only reads from the cache
+        cached = ComputedDistrictScore.compute_many(functions, districts)
+        self.assertEqual(scores, cached, 'The cached scores changed.')
+        self.assertEqual(numscores,
+                         ComputedDistrictScore.objects.all().count(),
+                         'Computing a cached batch added scores.')
+
+    def test_plan_batch(self):
+        function = ScoreFunction.objects.get(
+            calculator__endswith='SumValues', is_planscore=True)
+
+        expected = function.score(self.plan)
+
+        scores = ComputedPlanScore.compute_many([function], [self.plan])
+        self.assertEqual(expected['value'],
+                         scores[(function.id, self.plan.id)]['value'],
+                         'The batch score computed is incorrect.')
+
+        scores = ComputedPlanScore.compute_many([function], [self.plan])
+        self.assertEqual(1, ComputedPlanScore.objects.all().count(),
+                         'Computing a cached batch added scores.')
@@ -0,0 +1,97 @@
+from base import BaseTestCase
+
+from math import cos, pi, sin
+
+from django.contrib.gis.geos import MultiPolygon, Polygon
+
+from redistricting import geometrymetrics
+from redistricting.models import District, Geolevel
+
+
+class GeometryMetricsTestCase(BaseTestCase):
+    """
+    Unit tests for the measures of district geometries
+    """
+
+    def test_minimum_enclosing_circle(self):
+        """
+        Test the minimum enclosing circle of simple sets of points
+        """
+        circle = geometrymetrics.minimum_enclosing_circle([(0, 0), (2, 0),
+                                                           (2, 2), (0, 2)])
+        self.assertAlmostEqual(1, circle.cx, 9)
+        self.assertAlmostEqual(1, circle.cy, 9)
+        self.assertAlmostEqual(2**0.5, circle.r, 9)
+
+        # The middle point of colinear points is inside the circle
+        circle = geometrymetrics.minimum_enclosing_circle([(0, 0), (1, 1),
+                                                           (3, 3)])
+        self.assertAlmostEqual(1.5, circle.cx, 9)
+        self.assertAlmostEqual(18**0.5 / 2, circle.r, 9)
+
+        circle = geometrymetrics.minimum_enclosing_circle([(5, 5)])
+        self.assertEqual((5, 5, 0), circle)
+        self.assertEqual(None, geometrymetrics.minimum_enclosing_circle([]))
+
+    def test_minimum_enclosing_circle_many(self):
+        """
+        Test that every point is in the minimum enclosing circle of points
+        around a circle
+        """
+        coords = [(3 + 2 * cos(pi * i / 500.0), -1 + 2 * sin(pi * i / 500.0))
+                  for i in range(1000)]
+        circle = geometrymetrics.minimum_enclosing_circle(coords)
+        self.assertAlmostEqual(3, circle.cx, 9)
+        self.assertAlmostEqual(-1, circle.cy, 9)
+        self.assertAlmostEqual(2, circle.r, 9)
+
+    def test_measure(self):
+        """
+        Test the measures of a geometry
+        """
+        geom = MultiPolygon(
+            Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0))),
+            Polygon(((2, 0), (2, 1), (3, 1), (3, 0), (2, 0))))
+        coords = geometrymetrics.hull_coordinates(geom)
+        self.assertEqual(4, len(coords))
+
+        metrics = geometrymetrics.measure(geom)
+        self.assertAlmostEqual(2, metrics.area, 9)
+        self.assertAlmostEqual(8, metrics.perimeter, 9)
+        self.assertAlmostEqual(geom.convex_hull.area, metrics.hull_area, 9)
+        self.assertAlmostEqual(10**0.5 / 2, metrics.circle_radius, 9)
+        self.assertEqual((3, 1), (metrics.width, metrics.height))
+
+        self.assertEqual((0, 0, 0, 0, 0, 0),
+                         geometrymetrics.measure(MultiPolygon([])))
+
+    def test_district_metrics(self):
+        """
+        Test that districts store the measures of their geometry
+        """
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(geolevel.geounit_set.all().order_by('id'))
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(g.id) for g in geounits[0:3]],
+                               geolevel.id, self.plan.version)
+
+        district = self.plan.district_set.defer('geom', 'simple').get(
+            district_id=self.district1.district_id, version=self.plan.version)
+        metrics = geometrymetrics.get_metrics(district)
+        self.assertTrue('geom' in district.get_deferred_fields(),
+                        'The geometry was read instead of its measures')
+
+        expected = geometrymetrics.measure(
+            District.objects.get(id=district.id).geom)
+        for field, value in zip(geometrymetrics.GeometryMetrics._fields,
+                                expected):
+            self.assertAlmostEqual(value, getattr(metrics, field), 9)
+
+        # Measures missing from older districts are stored when first used
+        District.objects.filter(id=district.id).update(geom_area=None)
+        district = District.objects.get(id=district.id)
+        self.assertAlmostEqual(expected.area,
+                               district.get_geometry_metrics().area, 9)
+        self.assertAlmostEqual(expected.area,
+                               District.objects.get(id=district.id).geom_area,
+                               9)
@@ -270,3 +270,38 @@ class GeounitMixTestCase(BaseTestCase):
             63, numunits,
             'Number of geounits outside boundary is incorrect. (%d)' %
             numunits)
+
+    def test_get_mixed_hierarchy(self):
+        """
+        Test that searching the geounit hierarchy finds the same mixed
+        geounits as the spatial search.
+        """
+        for gl in self.geolevels:
+            gl.build_hierarchy()
+
+        level = self.geolevels[0]
+        bigunits = self.geounits[level.id]
+        ltlunits = self.geounits[self.geolevels[1].id]
+        triangle = MultiPolygon(
+            Polygon(
+                LinearRing(
+                    Point((0, 0)), Point((1, 0)), Point((1, 1)), Point((0,
+                                                                        0)))))
+        triangle.srid = 3785
+        boundaries = [bigunits[0].geom.difference(ltlunits[9].geom), triangle]
+        selections = [[str(bigunits[0].id)],
+                      [str(bigunits[0].id),
+                       str(bigunits[4].id),
+                       str(bigunits[8].id)]]
+
+        for boundary in boundaries:
+            for selection in selections:
+                for inside in [True, False]:
+                    expected = Geounit.get_mixed_geounits_spatial(
+                        selection, self.legbod, level.id, boundary, inside)
+                    actual = Geounit.get_mixed_geounits(
+                        selection, self.legbod, level.id, boundary, inside)
+                    self.assertEqual(
+                        sorted([u.id for u in expected]),
+                        sorted([u.id for u in actual]),
+                        'Hierarchy search found different geounits')
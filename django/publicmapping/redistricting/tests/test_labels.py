@@ -0,0 +1,95 @@
+from base import BaseTestCase
+
+import os
+import shutil
+import tempfile
+
+import polib
+from django.test.utils import override_settings
+from django.utils import translation
+
+from redistricting import labels
+from redistricting.models import Subject
+
+
+class LabelCatalogTestCase(BaseTestCase):
+    """
+    Unit tests for the catalog of translated labels
+    """
+
+    def setUp(self):
+        super(LabelCatalogTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(
+            STATIC_ROOT=os.path.join(self.directory, 'static'))
+        self.settings.enable()
+
+        os.makedirs(os.path.join(self.directory, 'locale/xx/LC_MESSAGES'))
+        self.popath = os.path.join(self.directory,
+                                   'locale/xx/LC_MESSAGES/xmlconfig.po')
+        self.write_catalog({u'first label': u'First'})
+        labels.invalidate_catalog('xx')
+
+    def tearDown(self):
+        labels.invalidate_catalog('xx')
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        super(LabelCatalogTestCase, self).tearDown()
+
+    def write_catalog(self, messages):
+        pofile = polib.POFile()
+        for msgid, msgstr in messages.items():
+            pofile.append(polib.POEntry(msgid=msgid, msgstr=msgstr))
+        pofile.save(self.popath)
+
+    def test_translate(self):
+        """
+        Test that labels are translated, and fall back to their msgid
+        """
+        self.assertEqual(u'First', labels.translate(u'first label', 'xx'))
+        self.assertEqual(u'second label',
+                         labels.translate(u'second label', 'xx'))
+        self.assertEqual([u'second label', u'First'],
+                         labels.translate_many(
+                             [u'second label', u'first label'], 'xx'))
+
+    def test_reload(self):
+        """
+        Test that a catalog is loaded again when its message file changes
+        """
+        catalog = labels.get_catalog('xx')
+        self.assertTrue(labels.get_catalog('xx') is catalog,
+                        'The catalog was not kept')
+
+        self.write_catalog({u'first label': u'Premier'})
+        os.utime(self.popath, (catalog.mtime + 10, catalog.mtime + 10))
+
+        # Changes are only noticed once the check interval has passed
+        self.assertEqual(u'First', labels.translate(u'first label', 'xx'))
+        catalog.checked -= labels.CHECK_INTERVAL
+        self.assertEqual(u'Premier', labels.translate(u'first label', 'xx'))
+
+    def test_invalidate(self):
+        """
+        Test that an invalidated catalog is loaded again when next used
+        """
+        self.assertEqual(u'First', labels.translate(u'first label', 'xx'))
+        self.write_catalog({u'first label': u'Premier'})
+        labels.invalidate_catalog('xx')
+        self.assertEqual(u'Premier', labels.translate(u'first label', 'xx'))
+
+    def test_get_labels(self):
+        """
+        Test that the labels of a model are fetched at once
+        """
+        subject = Subject.objects.all()[0]
+        self.write_catalog({
+            u'%s short label' % subject.name: u'Short',
+            u'%s label' % subject.name: u'Label'
+        })
+        labels.invalidate_catalog('xx')
+        with translation.override('xx'):
+            self.assertEqual((u'Short', u'Label',
+                              u'%s long description' % subject.name),
+                             subject.get_labels())
+            self.assertEqual(u'Short', subject.get_short_label())
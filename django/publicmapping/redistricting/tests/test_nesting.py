@@ -1,7 +1,9 @@
 from base import BaseTestCase
 
+from decimal import Decimal
+from django.contrib.gis.geos import MultiPolygon, Polygon
 from redistricting.models import (Geolevel, Geounit, Region, LegislativeBody,
-                                  District, Plan)
+                                  District, Plan, Subject, Characteristic)
 
 
 class NestingTestCase(BaseTestCase):
@@ -268,3 +270,93 @@ class NestingTestCase(BaseTestCase):
         self.assertEqual(
             len(contains), 0,
             "Found contained districts when there should be none.")
+
+
+class RenestTestCase(BaseTestCase):
+    """
+    Unit tests to test renesting geolevels
+    """
+    fixtures = ['redistricting_testdata.json']
+
+    def setUp(self):
+        super(RenestTestCase, self).setUp()
+        self.subject1 = Subject.objects.get(name='TestSubject')
+        self.subject2 = Subject.objects.get(name='TestSubject2')
+        self.subject2.percentage_denominator = self.subject1
+        self.subject2.save()
+
+        self.small = Geolevel(name='renest small', sort_key=10)
+        self.small.save()
+        self.big = Geolevel(name='renest big', sort_key=11, tolerance=1)
+        self.big.save()
+
+        # Two big geounits, made of three small geounits
+        for code, x in [('R10', 0), ('R11', 10), ('R20', 20)]:
+            unit = self.create_geounit(self.small, code, x, x + 10)
+            Characteristic(
+                subject=self.subject1, geounit=unit, number=x + 10).save()
+            Characteristic(
+                subject=self.subject2, geounit=unit, number=x / 2).save()
+
+        # The geometries of the big geounits are out of date
+        self.create_geounit(self.big, 'R1', 0, 1)
+        self.create_geounit(self.big, 'R2', 20, 21)
+
+    def create_geounit(self, geolevel, tree_code, xmin, xmax):
+        geom = MultiPolygon(
+            Polygon.from_bbox((xmin, 0, xmax, 10)), srid=3785)
+        unit = Geounit(
+            name=tree_code,
+            tree_code=tree_code,
+            geom=geom,
+            simple=geom,
+            center=geom.centroid)
+        unit.save()
+        unit.geolevel.add(geolevel)
+        return unit
+
+    def get_aggregates(self):
+        aggregates = {}
+        for unit in self.big.geounit_set.all():
+            chars = dict((c.subject_id, (c.number, c.percentage))
+                         for c in unit.characteristic_set.all())
+            aggregates[unit.tree_code] = (unit.geom.area, chars)
+        return aggregates
+
+    def test_renest_bulk(self):
+        """
+        Test that renesting sums characteristics and unions geometries
+        by tree_code prefix
+        """
+        self.assertTrue(self.big.renest(self.small))
+
+        aggregates = self.get_aggregates()
+        area, chars = aggregates['R1']
+        self.assertEqual(200, area, 'R1 geometry was not unioned')
+        self.assertEqual(Decimal(30), chars[self.subject1.id][0])
+        self.assertEqual(Decimal(5), chars[self.subject2.id][0])
+        self.assertAlmostEqual(5.0 / 30,
+                               float(chars[self.subject2.id][1]), 6)
+
+        area, chars = aggregates['R2']
+        self.assertEqual(100, area, 'R2 geometry was not unioned')
+        self.assertEqual(Decimal(30), chars[self.subject1.id][0])
+        self.assertEqual(Decimal(10), chars[self.subject2.id][0])
+
+        parents = Geounit.objects.filter(geolevel=self.small)
+        for unit in parents:
+            self.assertEqual(unit.tree_code[:2], unit.child.tree_code,
+                             'Small geounit not pointed at its big geounit')
+
+    def test_renest_bulk_matches_each(self):
+        """
+        Test that renesting in bulk matches aggregating each geounit
+        """
+        self.big.renest(self.small)
+        bulk = self.get_aggregates()
+
+        Characteristic.objects.filter(geounit__geolevel=self.big).delete()
+        self.big.renest(self.small, bulk=False)
+        each = self.get_aggregates()
+
+        self.assertEqual(each, bulk)
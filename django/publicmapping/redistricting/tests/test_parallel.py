@@ -0,0 +1,88 @@
+from base import BaseTestCase
+
+from django.test.utils import override_settings
+
+from redistricting import parallel
+from redistricting.models import (Geolevel, Geounit, ScoreArgument,
+                                  ScoreFunction)
+from redistricting.parallel import PortableDistrict
+
+
+class ParallelScoringTestCase(BaseTestCase):
+    """
+    Unit tests for scoring districts over a process pool
+    """
+    fixtures = [
+        'redistricting_testdata.json', 'redistricting_testdata_geolevel2.json',
+        'redistricting_testdata_scoring.json'
+    ]
+
+    def setUp(self):
+        super(ParallelScoringTestCase, self).setUp()
+
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id'))
+
+        dist1ids = map(lambda x: str(x.id), geounits[0:3] + geounits[9:12])
+        dist2ids = map(lambda x: str(x.id), geounits[18:21] + geounits[36:39])
+
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               geolevel.id, self.plan.version)
+        self.plan.add_geounits(self.district2.district_id, dist2ids,
+                               geolevel.id, self.plan.version)
+
+        self.districts = list(
+            self.plan.get_districts_at_version(
+                self.plan.version, include_geom=True))
+
+    def tearDown(self):
+        self.districts = None
+        super(ParallelScoringTestCase, self).tearDown()
+
+    def test_portable_district(self):
+        """
+        Test that a district survives being passed to a worker
+        """
+        district = self.districts[-1]
+        portable = PortableDistrict.load(PortableDistrict.dump(district))
+
+        self.assertEqual(district.district_id, portable.district_id)
+        self.assertEqual(district.geom.srid, portable.geom.srid)
+        self.assertTrue(
+            district.geom.equals_exact(portable.geom),
+            'Portable geometry differs from the district geometry')
+
+    def test_parallel_matches_serial(self):
+        """
+        Test that the workers give the same scores as scoring serially
+        """
+        for name in ['Compactness', 'Contiguity']:
+            function = ScoreFunction.objects.get(name=name)
+            calc = function.get_calculator()
+            arg_dict = dict(
+                (arg.argument, (arg.type, arg.value))
+                for arg in ScoreArgument.objects.filter(function=function))
+            with_overrides = getattr(calc, 'uses_contiguity_overrides', False)
+
+            serial = function.score(self.districts, format='raw')
+            scores = [
+                parallel._score_district(
+                    (function.calculator, arg_dict,
+                     PortableDistrict.dump(d, with_overrides)))
+                for d in self.districts
+            ]
+
+            self.assertEqual(serial, scores,
+                             'Parallel %s scores differ' % name)
+
+    def test_transaction(self):
+        """
+        Test that no pool is started in the middle of a transaction, which
+        would have to close its connection
+        """
+        function = ScoreFunction.objects.get(name='Compactness')
+        with override_settings(SCORE_CONCURRENCY=2):
+            self.assertIsNone(
+                parallel.score_districts(function.calculator, {},
+                                         self.districts))
@@ -158,6 +158,132 @@ class PlanTestCase(BaseTestCase):
         self.assertEqual(numunits, numunitscopy,
                          'Geounits between original and copy are different')
 
+    def test_clone_version(self):
+        """
+        Test that districts are copied to new versions in the database
+        """
+        geounitids = [str(self.geounits[self.geolevel.id][0].id)]
+        self.plan.add_geounits(self.district1.district_id, geounitids,
+                               self.geolevel.id, self.plan.version)
+        district = max(
+            District.objects.filter(
+                plan=self.plan, district_id=self.district1.district_id),
+            key=lambda d: d.version)
+
+        edited = Plan.objects.get(id=self.plan.id).edited
+        clone = district.clone_version(version=self.plan.version + 1)
+
+        self.assertNotEqual(district.id, clone.id, 'District was not cloned')
+        self.assertTrue(edited < Plan.objects.get(id=self.plan.id).edited,
+                        'Cloning a district did not mark the plan edited')
+        self.assertEqual(self.plan.version + 1, clone.version,
+                         'Clone has the wrong version')
+        self.assertEqual(district.district_id, clone.district_id,
+                         'Clone has the wrong district_id')
+        self.assertTrue(
+            district.geom.equals(clone.geom), 'Clone has a different shape')
+
+        # The characteristics are cloned with the district
+        expected = sorted(
+            district.computedcharacteristic_set.values_list(
+                'subject_id', 'number'))
+        actual = sorted(
+            clone.computedcharacteristic_set.values_list(
+                'subject_id', 'number'))
+        self.assertTrue(len(expected) > 0, 'District has no characteristics')
+        self.assertEqual(expected, actual,
+                         'Clone has different characteristics')
+
+    def test_clone_version_shares_shape(self):
+        """
+        Test that clones share the shape of a district until they are edited
+        """
+        district = District.objects.get(id=self.district1.id)
+        clone = district.clone_version(version=self.plan.version + 1)
+
+        self.assertEqual(district.shape_id, clone.shape_id,
+                         'Clone does not share the shape of the district')
+        expected = sorted(
+            district.computedcharacteristic_set.values_list(
+                'id', 'subject_id', 'number'))
+        actual = sorted(
+            clone.computedcharacteristic_set.values_list(
+                'id', 'subject_id', 'number'))
+        self.assertEqual(expected, actual,
+                         'Clone does not share the characteristics')
+
+        # Changing the geometry of the clone gives it a shape of its own
+        clone = District.objects.get(id=clone.id)
+        geounit = next(g for g in self.geounits[self.geolevel.id]
+                       if not clone.geom.contains(g.geom))
+        clone.geom = enforce_multi(clone.geom.union(geounit.geom))
+        clone.simplify()
+
+        clone = District.objects.get(id=clone.id)
+        district = District.objects.get(id=district.id)
+        self.assertNotEqual(district.shape_id, clone.shape_id,
+                            'Edited clone still shares the shape')
+        self.assertTrue(clone.geom.contains(geounit.geom.point_on_surface),
+                        'Edited clone did not keep its geometry')
+        self.assertFalse(
+            district.geom.equals(clone.geom),
+            'Editing the clone changed the geometry of the district')
+        self.assertEqual(
+            sorted(
+                district.computedcharacteristic_set.values_list(
+                    'subject_id', 'number')),
+            sorted(
+                clone.computedcharacteristic_set.values_list(
+                    'subject_id', 'number')),
+            'Edited clone did not copy the characteristics')
+
+        # The shape is kept while another district shares it
+        clone.delete()
+        district.clone_version(version=self.plan.version + 1).delete()
+        self.assertEqual(
+            len(expected), district.computedcharacteristic_set.count(),
+            'Deleting a clone deleted the shared characteristics')
+
+    def test_district_ids_at_version(self):
+        """
+        Test resolving the districts of current and historical versions
+        """
+        geounits = self.geounits[self.geolevel.id]
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(geounits[0].id)], self.geolevel.id,
+                               self.plan.version)
+        first = self.plan.version
+        self.plan.add_geounits(self.district2.district_id,
+                               [str(geounits[1].id)], self.geolevel.id,
+                               self.plan.version)
+        second = self.plan.version
+
+        def latest_ids(version):
+            ids = []
+            districts = self.plan.district_set.filter(version__lte=version)
+            for district_id in set(d.district_id for d in districts):
+                ids.append(
+                    max(d.id for d in districts
+                        if d.district_id == district_id))
+            return sorted(ids)
+
+        # The pointers track the latest row of each district
+        self.assertEqual(
+            latest_ids(second),
+            sorted(
+                CurrentDistrict.objects.filter(plan=self.plan).values_list(
+                    'latest_id', flat=True)))
+
+        self.assertEqual(latest_ids(second),
+                         sorted(self.plan.get_district_ids_at_version(second)))
+        self.assertEqual(latest_ids(first),
+                         sorted(self.plan.get_district_ids_at_version(first)))
+
+        # After an undo, the newer rows aren't part of the current version
+        self.plan.version = first
+        self.assertEqual(latest_ids(first),
+                         sorted(self.plan.get_district_ids_at_version(first)))
+
     def test_district_locking(self):
         """
         Test the logic for locking/unlocking a district.
@@ -463,6 +589,69 @@ class PlanTestCase(BaseTestCase):
         self.assertEqual(1053, len(strz),
                          'Index file was the wrong length: %d' % len(strz))
 
+    def test_base_geounit_assignments(self):
+        """
+        Test that base geounits crossing a district boundary are exported
+        with the district containing their centroid
+        """
+        base = self.plan.legislative_body.get_base_geolevel()
+        unit = Geounit.objects.filter(geolevel=base).order_by('id')[0]
+        xmin, ymin, xmax, ymax = unit.geom.extent
+        split = unit.center.x + (xmax - unit.center.x) / 4.0
+
+        # The boundary runs through the geounit, just east of its centroid
+        west = MultiPolygon(Polygon.from_bbox((xmin, ymin, split, ymax)))
+        east = MultiPolygon(Polygon.from_bbox((split, ymin, xmax, ymax)))
+        for district, geom in [(self.district1, west), (self.district2,
+                                                         east)]:
+            geom.srid = unit.geom.srid
+            district.geom = geom
+            district.save()
+
+        self.assertTrue(unit.geom.intersection(east).area > 0,
+                        'The geounit is not split by the districts')
+
+        assignments = dict((pid, did) for (pid, did, members) in
+                           self.plan.get_base_geounit_assignments())
+        self.assertEqual(self.district1.district_id,
+                         assignments[unit.portable_id],
+                         'A split geounit was not assigned by its centroid')
+
+    def test_index2plan(self):
+        """
+        Test importing an exported plan
+        """
+        geounits = self.geounits[self.geolevels[0].id]
+        dist1ids = [str(geounits[0].id)]
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               self.geolevels[0].id, self.plan.version)
+
+        archive = DistrictIndexFile.plan2index(self.plan.id)
+        DistrictIndexFile.index2plan(
+            'Imported Plan',
+            self.plan.legislative_body.id,
+            archive,
+            owner_id=self.user.id,
+            purge=True)
+
+        imported = Plan.objects.get(name='Imported Plan')
+        self.assertEqual(ProcessingState.READY, imported.processing_state,
+                         'Imported plan is not ready')
+
+        district = imported.district_set.get(
+            district_id=self.district1.district_id)
+        original = self.plan.district_set.filter(
+            district_id=self.district1.district_id).order_by('-version')[0]
+        self.assertAlmostEqual(original.geom.area, district.geom.area, 3,
+                               'Imported district has the wrong area')
+
+        for cc in original.computedcharacteristic_set.all():
+            self.assertEqual(
+                cc.number,
+                district.computedcharacteristic_set.get(
+                    subject=cc.subject).number,
+                'Imported district has the wrong %s' % cc.subject.name)
+
     def test_community_plan2index(self):
         """
         Test exporting a community plan
@@ -668,6 +857,56 @@ class PlanTestCase(BaseTestCase):
         self.assertEqual(18, get_cc_val(self.district2),
                          "District2 aggregated when it shouldn't have been")
 
+    def test_reaggregate_latest(self):
+        """
+        Test set-based reaggregation of the current version of a plan
+        """
+        for gl in self.geolevels:
+            gl.build_hierarchy()
+
+        geolevelid = self.geolevels[1].id
+        geounits = self.geounits[geolevelid]
+        subject = Subject.objects.get(name='TestSubject')
+
+        dist1ids = map(lambda x: str(x.id), geounits[0:3] + geounits[9:12])
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               geolevelid, self.plan.version)
+        dist1ids = map(lambda x: str(x.id), geounits[18:21])
+        self.plan.add_geounits(self.district1.district_id, dist1ids,
+                               geolevelid, self.plan.version)
+
+        versions = District.objects.filter(
+            plan=self.plan,
+            district_id=self.district1.district_id).order_by('version')
+        previous, latest = list(versions)[-2:]
+
+        def get_cc_val(district):
+            return ComputedCharacteristic.objects.get(
+                district=district, subject=subject).number
+
+        previous_val = get_cc_val(previous)
+        latest_val = get_cc_val(latest)
+
+        c = Characteristic.objects.get(geounit=geounits[0], subject=subject)
+        c.number += 100
+        c.save()
+
+        updated = self.plan.reaggregate(latest_only=True)
+        self.assertEqual(
+            len(
+                self.plan.get_districts_at_version(
+                    self.plan.version, filter_empty=False)), updated,
+            'Incorrect number of districts updated')
+        self.assertEqual(latest_val + 100, get_cc_val(latest),
+                         'Latest district not aggregated properly')
+        self.assertEqual(previous_val, get_cc_val(previous),
+                         'Previous version aggregated when it shouldn\'t be')
+
+        # The set-based aggregate matches searching for the mixed geounits
+        latest.reaggregate()
+        self.assertEqual(latest_val + 100, get_cc_val(latest),
+                         'Set-based aggregate differs from the district')
+
     def test_paste_districts(self):
         # Set up the test using geounits in the 2nd level
         geolevelid = self.geolevels[1].id
@@ -1317,3 +1556,38 @@ class PlanTestCase(BaseTestCase):
         self.assertEqual(
             729 - 18 - 36 + 22 + 10, num,
             ("District 1 has the wrong number of the geounits", num, result))
+
+    def test_fix_unassigned_task(self):
+        """
+        Test fixing unassigned geounits in a task, with progress
+        """
+        plan = self.plan
+        geounits = list(
+            Geounit.objects.filter(geolevel=self.geolevel).order_by('id'))
+
+        settings.FIX_UNASSIGNED_MIN_PERCENT = 15
+        settings.FIX_UNASSIGNED_COMPARATOR_SUBJECT = 'TestSubject2'
+        leg_body = plan.legislative_body
+        leg_body.max_districts = 1
+        leg_body.save()
+
+        # Create a hole in district 1
+        plan.add_geounits(self.district1.district_id,
+                          [str(x.id) for x in geounits], self.geolevel.id,
+                          plan.version)
+        plan.add_geounits(0, [str(x.id) for x in geounits[10:12]],
+                          self.geolevel.id, plan.version)
+
+        steps = []
+        result = plan.fix_unassigned(
+            threshold=0.1,
+            progress=lambda message, current, total: steps.append(current))
+        self.assertTrue(result[0], ('Hole should have been closed', result))
+        self.assertEqual([0, 1, 2, 3, 4], steps,
+                         'Progress was not reported for each step')
+
+        # Nothing is left to fix in the task
+        result = fix_unassigned_plan(plan.id, threshold=0.1)
+        self.assertFalse(result['success'], ('No unassigned geounits', result))
+        self.assertEqual(plan.version, result['version'],
+                         'The version of the plan was not returned')
@@ -2,7 +2,8 @@ from base import BaseTestCase
 
 from redistricting.models import (Geolevel, Geounit, District, LegislativeBody,
                                   ScoreDisplay, ScorePanel, Subject,
-                                  ScoreFunction, ScoreArgument)
+                                  ScoreFunction, ScoreArgument,
+                                  ContiguityOverride)
 from decimal import Decimal
 
 import json
@@ -542,3 +543,67 @@ class ScoringTestCase(BaseTestCase):
         score = planSumFunction2.score(self.plan)
         self.assertEqual(36, score['value'],
                          'planSumFunction was incorrect: %d' % score['value'])
+
+    def testIncrementalPlanScore(self):
+        """
+        Test that plan scores built from cached district terms match a
+        full computation after the plan is edited
+        """
+        schwartzFunction = ScoreFunction(
+            calculator='redistricting.calculators.Schwartzberg',
+            name='SchwartzbergPlanFn',
+            is_planscore=True)
+        calc = schwartzFunction.get_calculator()
+
+        score = schwartzFunction.score(self.plan)
+        calc.compute(plan=self.plan, version=self.plan.version)
+        self.assertAlmostEquals(calc.result['value'], score['value'], 9,
+                                'Incremental Schwartzberg was incorrect')
+
+        # Change one district, and score from the cached terms of the other
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id'))
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(geounits[12].id)], geolevel.id,
+                               self.plan.version)
+
+        score = schwartzFunction.score(self.plan)
+        calc.compute(plan=self.plan, version=self.plan.version)
+        self.assertAlmostEquals(
+            calc.result['value'], score['value'], 9,
+            'Incremental Schwartzberg was incorrect after an edit')
+
+    def testContiguityTermsOverride(self):
+        """
+        Test that the cached contiguity terms of districts are discarded
+        when a contiguity override is saved or deleted
+        """
+        contiguityFunction = ScoreFunction(
+            calculator='redistricting.calculators.Contiguity',
+            name='ContiguityPlanFn',
+            is_planscore=True)
+
+        # Add a geounit to district 2 that doesn't touch the others
+        geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=geolevel).order_by('id'))
+        self.plan.add_geounits(self.district2.district_id,
+                               [str(geounits[24].id)], geolevel.id,
+                               self.plan.version)
+
+        score = contiguityFunction.score(self.plan)
+        self.assertEqual(1, score['value'],
+                         'District 2 should be discontiguous')
+
+        override = ContiguityOverride(
+            override_geounit=geounits[24], connect_to_geounit=geounits[20])
+        override.save()
+        score = contiguityFunction.score(self.plan)
+        self.assertEqual(2, score['value'],
+                         'The override should make district 2 contiguous')
+
+        override.delete()
+        score = contiguityFunction.score(self.plan)
+        self.assertEqual(1, score['value'],
+                         'District 2 is discontiguous without the override')
@@ -0,0 +1,82 @@
+from base import BaseTestCase
+
+from django.test.utils import override_settings
+
+from redistricting import sessionregistry
+
+
+@override_settings(
+    SESSION_TIMEOUT=15, SESSION_REGISTRY_PREFIX='test:sessionregistry')
+class SessionRegistryTestCase(BaseTestCase):
+    """
+    Unit tests for the registry of active sessions
+    """
+    fixtures = ['redistricting_testdata.json']
+
+    def setUp(self):
+        super(SessionRegistryTestCase, self).setUp()
+        sessionregistry.clear()
+
+    def tearDown(self):
+        sessionregistry.clear()
+        super(SessionRegistryTestCase, self).tearDown()
+
+    def test_register(self):
+        """
+        Test that sessions are counted once registered
+        """
+        sessionregistry.register('anonymous')
+        sessionregistry.register('first', 1)
+        sessionregistry.register('second', 1)
+        sessionregistry.register('other', 2)
+
+        self.assertEqual(4, sessionregistry.count_active())
+        self.assertEqual(4, sessionregistry.count_active_since(10))
+        self.assertEqual(
+            set(['first', 'second']),
+            set(sessionregistry.get_user_sessions(1).keys()))
+
+        sessionregistry.unregister('second')
+        self.assertEqual(3, sessionregistry.count_active())
+        self.assertEqual(['first'], sessionregistry.get_user_sessions(1).keys())
+
+    def test_cycled_key(self):
+        """
+        Test that a session is registered once when its key is cycled
+        """
+        sessionregistry.register('before', 1)
+        sessionregistry.register('after', 1, 'before')
+
+        self.assertEqual(1, sessionregistry.count_active())
+        self.assertEqual(['after'], sessionregistry.get_user_sessions(1).keys())
+
+    def test_prune_dormant(self):
+        """
+        Test that dormant sessions are pruned from the registry
+        """
+        sessionregistry.register('active', 1)
+        with override_settings(SESSION_TIMEOUT=-1):
+            sessionregistry.register('dormant', 1)
+
+        self.assertEqual(1, sessionregistry.count_user_sessions(1))
+
+        active, dormant = sessionregistry.prune_user_sessions(1)
+        self.assertEqual(['active'], active)
+        self.assertEqual(['dormant'], dormant)
+        self.assertEqual(1, sessionregistry.count_active())
+        self.assertEqual(['active'],
+                         sessionregistry.get_user_sessions(1).keys())
+
+    def test_isolated_prefix(self):
+        """
+        Test that the registry only clears keys under its own prefix
+        """
+        with override_settings(SESSION_REGISTRY_PREFIX='test:other'):
+            sessionregistry.register('elsewhere', 1)
+        sessionregistry.register('here', 1)
+
+        sessionregistry.clear()
+        self.assertEqual(0, sessionregistry.count_active())
+        with override_settings(SESSION_REGISTRY_PREFIX='test:other'):
+            self.assertEqual(1, sessionregistry.count_active())
+            sessionregistry.clear()
@@ -0,0 +1,88 @@
+from base import BaseTestCase
+
+from decimal import Decimal
+
+from django.contrib.gis.geos import Polygon
+
+from redistricting.models import Characteristic, Geolevel, Geounit, Subject
+from redistricting.management.commands.setup import Command
+
+
+class SetupImportTestCase(BaseTestCase):
+    """
+    Unit tests for the bulk import of geounits by the setup command
+    """
+
+    fixtures = ['redistricting_testdata.json']
+
+    def setUp(self):
+        super(SetupImportTestCase, self).setUp()
+        self.cmd = Command()
+        self.config = {'tolerance': '1'}
+        self.subject = Subject.objects.all().order_by('id')[0]
+
+        # A U shape, with its centroid in the gap between its arms
+        self.geom = Polygon(((0, 0), (30, 0), (30, 30), (20, 30), (20, 10),
+                             (10, 10), (10, 30), (0, 30), (0, 0)),
+                            srid=3785)
+        self.key = ('setup test unit', 'SETUP001', 'SETUP001')
+
+    def tearDown(self):
+        self.cmd = None
+        self.config = None
+        self.subject = None
+        self.geom = None
+        self.key = None
+        super(SetupImportTestCase, self).tearDown()
+
+    def get_feature(self, levels, number):
+        return {
+            'fid': 1,
+            'key': self.key,
+            'levels': levels,
+            'geom': (bytes(self.geom.wkb), self.geom.srid),
+            'values': [(self.subject.id, Decimal(number), Decimal('0.5'))],
+        }
+
+    def test_import_batch(self):
+        """
+        Test that a batch of features is copied into geounits, with their
+        geolevels and characteristics
+        """
+        biggest = Geolevel.objects.get(name='biggest level')
+        middle = Geolevel.objects.get(name='middle level')
+        existing = {}
+
+        self.cmd.import_batch([self.get_feature([biggest.id], '12')],
+                              existing, self.config, None)
+
+        geounit = Geounit.objects.get(
+            name=self.key[0], portable_id=self.key[1], tree_code=self.key[2])
+        self.assertEqual({self.key: geounit.id}, existing)
+        self.assertAlmostEqual(self.geom.area, geounit.geom.area, 6)
+        self.assertTrue(geounit.simple.valid, 'Simple geometry is invalid')
+        self.assertTrue(
+            geounit.center.within(geounit.geom),
+            'The center of the geounit is outside of its geometry')
+        self.assertEqual([biggest.id],
+                         list(geounit.geolevel.values_list('id', flat=True)))
+
+        characteristic = Characteristic.objects.get(
+            geounit=geounit, subject=self.subject)
+        self.assertEqual(Decimal('12'), characteristic.number)
+        self.assertEqual(Decimal('0.5'), characteristic.percentage)
+
+        # Importing the feature again updates the existing geounit
+        self.cmd.import_batch([self.get_feature([middle.id], '15')],
+                              existing, self.config, None)
+
+        self.assertEqual(1,
+                         Geounit.objects.filter(
+                             name=self.key[0],
+                             portable_id=self.key[1]).count(),
+                         'The geounit was imported twice')
+        self.assertEqual([middle.id],
+                         list(geounit.geolevel.values_list('id', flat=True)))
+        self.assertEqual(Decimal('15'),
+                         Characteristic.objects.get(
+                             geounit=geounit, subject=self.subject).number)
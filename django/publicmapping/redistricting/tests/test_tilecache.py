@@ -0,0 +1,94 @@
+from base import BaseTestCase
+
+import os
+import shutil
+import tempfile
+
+from django.test.utils import override_settings
+
+from redistricting import tilecache
+
+
+class TileCacheTestCase(BaseTestCase):
+    """
+    Unit tests for the cache of district vector tiles
+    """
+
+    def setUp(self):
+        super(TileCacheTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(
+            TILE_CACHE_DIR=self.directory, TILE_CACHE_MAX_SIZE=1000)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        super(TileCacheTestCase, self).tearDown()
+
+    def test_versions(self):
+        """
+        Test that tiles are cached for each version of a plan
+        """
+        layer = 'districts_1'
+        tilecache.put('v1', 1, 1, layer, 'subject_1', 1, 0, 1)
+        tilecache.put('v2', 1, 2, layer, 'subject_1', 1, 0, 1)
+
+        self.assertEqual('v1',
+                         tilecache.get(1, 1, layer, 'subject_1', 1, 0, 1))
+        self.assertEqual('v2',
+                         tilecache.get(1, 2, layer, 'subject_1', 1, 0, 1))
+        self.assertIsNone(tilecache.get(1, 1, layer, 'subject_2', 1, 0, 1))
+        self.assertIsNone(tilecache.get(2, 1, layer, 'subject_1', 1, 0, 1))
+
+        tilecache.purge_plan(1, before=2)
+        self.assertIsNone(tilecache.get(1, 1, layer, 'subject_1', 1, 0, 1))
+        self.assertEqual('v2',
+                         tilecache.get(1, 2, layer, 'subject_1', 1, 0, 1))
+
+        tilecache.purge_plan(1, after=1)
+        self.assertIsNone(tilecache.get(1, 2, layer, 'subject_1', 1, 0, 1))
+
+    def test_purge_plan(self):
+        """
+        Test that purging a plan removes the tiles of the purged versions
+        """
+        version = self.plan.version
+        tilecache.put('tile', self.plan.id, version, 'districts_1',
+                      'subject_1', 0, 0, 0)
+
+        self.plan.purge(after=version - 1)
+        self.assertIsNone(
+            tilecache.get(self.plan.id, version, 'districts_1', 'subject_1',
+                          0, 0, 0))
+
+    def test_evict(self):
+        """
+        Test that the least recently used tiles are evicted
+        """
+        # Fill the cache past its size without evicting anything yet
+        with override_settings(TILE_CACHE_MAX_SIZE=10000):
+            for i in range(4):
+                key = (1, 1, 'districts_1', 'subject_1', 1, i, 0)
+                tilecache.put('d' * 300, *key)
+                os.utime(tilecache.get_tile_path(*key), (i + 1, i + 1))
+
+        tilecache.evict()
+
+        remaining = [
+            i for i in range(4)
+            if tilecache.get(1, 1, 'districts_1', 'subject_1', 1, i, 0)
+            is not None
+        ]
+        self.assertEqual([2, 3], remaining)
+
+    def test_reaggregate(self):
+        """
+        Test that reaggregating a plan removes its cached tiles
+        """
+        key = (self.plan.id, self.plan.version, 'districts_1', 'subject_1',
+               0, 0, 0)
+        tilecache.put('tile', *key)
+
+        self.plan.reaggregate()
+        self.assertIsNone(tilecache.get(*key))
@@ -0,0 +1,131 @@
+from base import BaseTestCase
+
+import shutil
+import tempfile
+
+from django.contrib.gis.geos import Polygon
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from redistricting.models import Geolevel, Geounit, ScoreFunction, Subject
+from redistricting import vectortiles
+
+
+class VectorTileTestCase(BaseTestCase):
+    """
+    Unit tests for vector tiles of versioned districts
+    """
+
+    fixtures = [
+        'redistricting_testdata.json', 'redistricting_testdata_geolevel2.json'
+    ]
+
+    def setUp(self):
+        super(VectorTileTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(TILE_CACHE_DIR=self.directory)
+        self.settings.enable()
+
+        ScoreFunction(
+            name='district_schwartzberg',
+            calculator='redistricting.calculators.Schwartzberg').save()
+        ScoreFunction(
+            name='district_contiguous',
+            calculator='redistricting.calculators.Contiguity').save()
+
+        self.geolevel = Geolevel.objects.get(name='middle level')
+        geounits = list(
+            Geounit.objects.filter(geolevel=self.geolevel).order_by('id'))
+        self.plan.add_geounits(self.district1.district_id,
+                               [str(g.id) for g in geounits[0:3]],
+                               self.geolevel.id, self.plan.version)
+
+    def tearDown(self):
+        self.geolevel = None
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        super(VectorTileTestCase, self).tearDown()
+
+    def test_tile_bounds(self):
+        """
+        Test the web mercator extents of tiles
+        """
+        world = vectortiles.tile_bounds(0, 0, 0)
+        self.assertAlmostEqual(-vectortiles.ORIGIN_SHIFT, world[0])
+        self.assertAlmostEqual(vectortiles.ORIGIN_SHIFT, world[3])
+
+        xmin, ymin, xmax, ymax = vectortiles.tile_bounds(1, 1, 0)
+        self.assertAlmostEqual(0, xmin)
+        self.assertAlmostEqual(0, ymin)
+
+    def test_encode_polygon(self):
+        """
+        Test the geometry commands of a polygon
+        """
+        square = Polygon(((0, 0), (10, 0), (10, 10), (0, 10), (0, 0)))
+
+        # Exterior rings wind clockwise on the tile grid
+        self.assertEqual([9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15],
+                         vectortiles.encode_polygons(square))
+
+        # Polygons smaller than a grid cell are dropped
+        tiny = Polygon(((0, 0), (0.2, 0), (0.2, 0.2), (0, 0)))
+        self.assertEqual([], vectortiles.encode_polygons(tiny))
+
+    @override_settings(CONVEX_CHOROPLETH=False, ADJACENCY=False)
+    def test_district_tile(self):
+        """
+        Test that district tiles are encoded and cached by version
+        """
+        subject_id = self.plan.legislative_body.get_default_subject().id
+        tile = self.plan.get_district_tile(
+            self.plan.version, subject_id, self.geolevel.id, 0, 0, 0)
+
+        self.assertTrue(len(tile) > 0, 'District tile is empty')
+        self.assertTrue('districts' in tile, 'District layer is missing')
+        self.assertEqual(tile,
+                         self.plan.get_district_tile(
+                             self.plan.version, subject_id, self.geolevel.id,
+                             0, 0, 0), 'Cached tile differs')
+
+        # Districts of a version with no assigned districts aren't encoded
+        empty = self.plan.get_district_tile(0, subject_id, self.geolevel.id,
+                                            0, 0, 0)
+        self.assertTrue(len(empty) < len(tile),
+                        'Tile of an empty version has districts')
+
+    @override_settings(CONVEX_CHOROPLETH=False, ADJACENCY=False)
+    def test_district_tile_view(self):
+        """
+        Test that the tile view rejects filters it can't draw
+        """
+        client = Client()
+        url = '/districtmapping/plan/%d/tiles/0/0/0.pbf' % self.plan.id
+        subject_id = self.plan.legislative_body.get_default_subject().id
+
+        response = client.get(url, {
+            'subject__eq': subject_id,
+            'level__eq': self.geolevel.id
+        })
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(vectortiles.CONTENT_TYPE, response['Content-Type'])
+
+        missing_subject = Subject.objects.order_by('-id')[0].id + 1
+        for params in [{
+                'level__eq': 'middle'
+        }, {
+                'level__eq': Geolevel.objects.order_by('-id')[0].id + 1
+        }, {
+                'subject__eq': 'population'
+        }, {
+                'subject__eq': missing_subject
+        }, {
+                'version__eq': 'latest'
+        }]:
+            response = client.get(url, params)
+            self.assertEqual(400, response.status_code,
+                             'Tile filter %s was accepted' % params)
+
+        response = client.get(
+            '/districtmapping/plan/%d/tiles/1/2/0.pbf' % self.plan.id)
+        self.assertEqual(404, response.status_code)
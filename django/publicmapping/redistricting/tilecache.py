@@ -0,0 +1,205 @@
+"""
+A cache of district vector tiles on local disk.
+
+Districts change with every edit of a plan, so their tiles are cached for
+each version of a plan, and removed when the version is purged, or when
+the plan is reaggregated. The least recently used tiles are evicted when
+the cache grows beyond TILE_CACHE_MAX_SIZE bytes.
+
+The tiles are kept in the TILE_CACHE_DIR directory:
+
+    plans/<plan id>/<version>/<layer>/<style>/<z>/<x>/<y>
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The directory of the tiles of plans
+PLANS_DIRECTORY = 'plans'
+
+# Once this share of the cache size has been written, look for tiles
+# to evict
+EVICTION_INTERVAL = 0.1
+
+# Evict tiles until the cache is this share of its size
+EVICTION_TARGET = 0.8
+
+# The number of bytes written since tiles were last evicted
+_written = 0
+
+
+def _safe(name):
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def get_tile_path(plan_id, version, layer, style, z, x, y):
+    """
+    Get the path of a tile in the cache.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+        version -- The version of the Plan.
+        layer -- The name of the layer.
+        style -- The variant of the layer, such as the subject of its
+            properties. Long styles are hashed.
+        z -- The zoom level of the tile.
+        x -- The column of the tile.
+        y -- The row of the tile.
+
+    Returns:
+        The path of the tile.
+    """
+    style = style or 'default'
+    if len(style) > 32 or _safe(style) != style:
+        style = hashlib.md5(style.encode('utf-8')).hexdigest()
+
+    return os.path.join(settings.TILE_CACHE_DIR, PLANS_DIRECTORY,
+                        '%d' % plan_id, '%d' % version, _safe(layer), style,
+                        '%d' % z, '%d' % x, '%d' % y)
+
+
+def get(*args, **kwargs):
+    """
+    Get a tile from the cache. Takes the same arguments as get_tile_path.
+
+    Returns:
+        The content of the tile, or None if it isn't cached.
+    """
+    path = get_tile_path(*args, **kwargs)
+    try:
+        with open(path, 'rb') as f:
+            tile = f.read()
+    except IOError:
+        return None
+
+    # Mark the tile as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return tile
+
+
+def put(tile, *args, **kwargs):
+    """
+    Put a tile in the cache. Takes the tile content, followed by the same
+    arguments as get_tile_path.
+    """
+    global _written
+
+    path = get_tile_path(*args, **kwargs)
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Write to a temporary file, so readers never see partial tiles
+        handle, temp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(tile)
+        os.rename(temp, path)
+    except (IOError, OSError), ex:
+        logger.info('Could not cache tile %s.', path)
+        logger.debug('Reason: %s', ex)
+        return
+
+    _written += len(tile)
+    if _written > settings.TILE_CACHE_MAX_SIZE * EVICTION_INTERVAL:
+        _written = 0
+        evict()
+
+
+def evict():
+    """
+    Remove the least recently used tiles until the cache is below its
+    size.
+
+    Returns:
+        The number of tiles removed.
+    """
+    tiles = []
+    total = 0
+    root = settings.TILE_CACHE_DIR
+    for directory, subdirectories, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= settings.TILE_CACHE_MAX_SIZE:
+        return 0
+
+    target = settings.TILE_CACHE_MAX_SIZE * EVICTION_TARGET
+    removed = 0
+    for mtime, size, path in sorted(tiles):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    logger.debug('Evicted %d tiles from the tile cache', removed)
+    return removed
+
+
+def purge_plan(plan_id, before=None, after=None):
+    """
+    Remove the cached tiles of versions of a plan. If neither 'before'
+    nor 'after' is given, the tiles of every version are removed.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+        before -- Optional. Remove the tiles of versions before this one.
+        after -- Optional. Remove the tiles of versions after this one.
+    """
+    root = os.path.join(settings.TILE_CACHE_DIR, PLANS_DIRECTORY,
+                        '%d' % plan_id)
+    if not os.path.exists(root):
+        return
+
+    if before is None and after is None:
+        shutil.rmtree(root, ignore_errors=True)
+        return
+
+    for name in os.listdir(root):
+        try:
+            version = int(name)
+        except ValueError:
+            continue
+        if (before is not None and version < before) or \
+                (before is None and version > after):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
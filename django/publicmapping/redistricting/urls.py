@@ -70,8 +70,12 @@ urlpatterns = [
         redistricting_views.combine_districts),
     url(r'plan/(?P<planid>\d*)/fixunassigned/$',
         redistricting_views.fix_unassigned),
+    url(r'plan/(?P<planid>\d*)/fixunassigned/(?P<task_id>[\w-]+)/$',
+        redistricting_views.fix_unassigned_status),
     url(r'plan/(?P<planid>\d*)/district/versioned/$',
         redistricting_views.simple_district_versioned),
+    url(r'plan/(?P<planid>\d*)/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf$',
+        redistricting_views.district_tile),
     url(r'plan/(?P<planid>\d*)/unlockedgeometries/$',
         redistricting_views.get_unlocked_simple_geometries),
     url(r'plan/(?P<planid>\d*)/districtfile/$',
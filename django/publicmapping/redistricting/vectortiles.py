@@ -0,0 +1,255 @@
+"""
+Encode district geometries as Mapbox Vector Tiles.
+
+A vector tile holds the geometries that intersect one web mercator tile,
+clipped to the tile and quantized to an integer grid, along with the
+properties of each feature. The geometries are clipped, scaled and
+snapped in the database; this module only encodes the protocol buffer
+described by the Mapbox Vector Tile specification, version 2:
+
+    https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from decimal import Decimal
+import struct
+
+# The size of the integer grid of a tile
+EXTENT = 4096
+
+# The number of grid cells that geometries extend past the tile edge,
+# so the outlines of neighboring tiles overlap
+BUFFER = 64
+
+# Half of the width of the web mercator world, in meters
+ORIGIN_SHIFT = 20037508.342789244
+
+# Content type of an encoded tile
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Protocol buffer wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# Geometry types and commands
+POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+
+def tile_bounds(z, x, y):
+    """
+    Get the web mercator extent of a tile.
+
+    Parameters:
+        z -- The zoom level of the tile.
+        x -- The column of the tile.
+        y -- The row of the tile, counted from the top.
+
+    Returns:
+        A tuple of (xmin, ymin, xmax, ymax).
+    """
+    size = 2 * ORIGIN_SHIFT / (2**z)
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return (xmin, ymax - size, xmin + size, ymax)
+
+
+def _varint(value):
+    parts = []
+    while value > 0x7f:
+        parts.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    parts.append(chr(value))
+    return ''.join(parts)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wiretype, payload):
+    key = _varint((number << 3) | wiretype)
+    if wiretype == LENGTH_DELIMITED:
+        return key + _varint(len(payload)) + payload
+    return key + payload
+
+
+def _packed(number, values):
+    return _field(number, LENGTH_DELIMITED, ''.join(_varint(v) for v in values))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _field(7, VARINT, _varint(int(value)))
+    elif isinstance(value, (int, long)):
+        if value < 0:
+            return _field(6, VARINT, _varint(_zigzag(value)))
+        return _field(5, VARINT, _varint(value))
+    elif isinstance(value, (float, Decimal)):
+        return _field(3, FIXED64, struct.pack('<d', float(value)))
+    else:
+        if not isinstance(value, unicode):
+            value = unicode(value)
+        return _field(1, LENGTH_DELIMITED, value.encode('utf-8'))
+
+
+def _ring_area(ring):
+    area = 0
+    for i in range(len(ring) - 1):
+        area += ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1]
+    return area
+
+
+def _encode_ring(ring, exterior, cursor):
+    # Drop repeated points, and the closing point
+    points = []
+    for x, y in ring:
+        point = (int(round(x)), int(round(y)))
+        if len(points) == 0 or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    if len(points) < 3:
+        return None
+
+    # Exterior rings have a positive area on the tile grid, and
+    # interior rings have a negative area
+    area = _ring_area(points + points[:1])
+    if area == 0:
+        return None
+    if (area > 0) != exterior:
+        points.reverse()
+
+    commands = []
+    for i, (x, y) in enumerate(points):
+        if i == 0:
+            commands.append(MOVE_TO | (1 << 3))
+        elif i == 1:
+            commands.append(LINE_TO | ((len(points) - 1) << 3))
+        commands.append(_zigzag(x - cursor[0]))
+        commands.append(_zigzag(y - cursor[1]))
+        cursor[0], cursor[1] = x, y
+    commands.append(CLOSE_PATH | (1 << 3))
+    return commands
+
+
+def encode_polygons(geom):
+    """
+    Encode the geometry commands of a polygon or multipolygon.
+
+    Parameters:
+        geom -- A Polygon or MultiPolygon in tile grid coordinates.
+
+    Returns:
+        A list of geometry command integers, which is empty if nothing
+        in the geometry is larger than a grid cell.
+    """
+    if geom.geom_type == 'Polygon':
+        polygons = [geom]
+    elif geom.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        polygons = [g for g in geom if g.geom_type == 'Polygon']
+    else:
+        return []
+
+    commands = []
+    cursor = [0, 0]
+    for polygon in polygons:
+        exterior = _encode_ring(polygon[0].coords, True, cursor)
+        if exterior is None:
+            continue
+        commands.extend(exterior)
+        for ring in polygon[1:]:
+            interior = _encode_ring(ring.coords, False, cursor)
+            if interior is not None:
+                commands.extend(interior)
+
+    return commands
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """
+    Encode a layer of polygon features.
+
+    Parameters:
+        name -- The name of the layer.
+        features -- A list of (id, geometry, properties) tuples, with the
+            geometries in tile grid coordinates. Properties that are None
+            are omitted.
+        extent -- Optional. The size of the tile grid.
+
+    Returns:
+        The encoded layer message.
+    """
+    keys = []
+    key_index = {}
+    values = []
+    value_index = {}
+
+    encoded = []
+    for id, geom, properties in features:
+        commands = encode_polygons(geom)
+        if len(commands) == 0:
+            continue
+
+        tags = []
+        for key in sorted(properties.keys()):
+            value = properties[key]
+            if value is None:
+                continue
+            if not key in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            value = _encode_value(value)
+            if not value in value_index:
+                value_index[value] = len(values)
+                values.append(value)
+            tags.extend([key_index[key], value_index[value]])
+
+        feature = _field(1, VARINT, _varint(id))
+        if len(tags) > 0:
+            feature += _packed(2, tags)
+        feature += _field(3, VARINT, _varint(POLYGON))
+        feature += _packed(4, commands)
+        encoded.append(_field(2, LENGTH_DELIMITED, feature))
+
+    layer = _field(15, VARINT, _varint(2))
+    layer += _field(1, LENGTH_DELIMITED, name.encode('utf-8'))
+    layer += ''.join(encoded)
+    layer += ''.join(
+        _field(3, LENGTH_DELIMITED, key.encode('utf-8')) for key in keys)
+    layer += ''.join(_field(4, LENGTH_DELIMITED, value) for value in values)
+    layer += _field(5, VARINT, _varint(extent))
+    return layer
+
+
+def encode_tile(layers):
+    """
+    Encode a vector tile.
+
+    Parameters:
+        layers -- A list of encoded layers.
+
+    Returns:
+        The encoded tile.
+    """
+    return ''.join(_field(3, LENGTH_DELIMITED, layer) for layer in layers)
@@ -0,0 +1,115 @@
+"""
+A memo of the districts that make up each version of a plan.
+
+Resolving which district rows belong to a version of a plan is needed
+several times while handling a single request or scoring a plan. While a
+memo is active, each version is resolved once, and remembered until any
+district of the plan changes. Memos are only active within a request (see
+L{redistricting.middleware.VersionMemoMiddleware}), an explicit
+L{memoize} block or a L{memoized} function, so nothing is remembered
+across requests or tasks.
+
+This file is part of The Public Mapping Project
+https://github.com/PublicMapping/
+
+License:
+    Copyright 2010-2012 Micah Altman, Michael McDonald
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import threading
+
+_local = threading.local()
+
+
+def _memo():
+    return getattr(_local, 'memo', None)
+
+
+@contextmanager
+def memoize():
+    """
+    Remember resolved plan versions within a block. Nested blocks share
+    the memo of the outermost block.
+    """
+    if _memo() is not None:
+        yield
+        return
+
+    _local.memo = {}
+    try:
+        yield
+    finally:
+        _local.memo = None
+
+
+def get(plan_id, version):
+    """
+    Get the remembered district ids of a version of a plan.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+        version -- The version of the Plan.
+
+    Returns:
+        A list of District ids, or None if the version isn't remembered.
+    """
+    memo = _memo()
+    if memo is None:
+        return None
+    return memo.get((plan_id, version))
+
+
+def remember(plan_id, version, district_ids):
+    """
+    Remember the district ids of a version of a plan, if a memo is active.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+        version -- The version of the Plan.
+        district_ids -- A list of the ids of the Districts in the version.
+    """
+    memo = _memo()
+    if memo is not None:
+        memo[(plan_id, version)] = district_ids
+
+
+def forget(plan_id):
+    """
+    Forget every remembered version of a plan, because its districts have
+    changed.
+
+    Parameters:
+        plan_id -- The id of the Plan.
+    """
+    memo = _memo()
+    if memo is not None:
+        for key in [key for key in memo if key[0] == plan_id]:
+            del memo[key]
+
+
+def memoized(function):
+    """
+    A decorator that remembers resolved plan versions while the decorated
+    function runs, for work such as scoring that happens outside of a
+    request as well as within one.
+    """
+
+    def decorator(*args, **kwargs):
+        with memoize():
+            return function(*args, **kwargs)
+
+    return wraps(function)(decorator)
@@ -29,7 +29,7 @@ Author:
 
 from django.http import *
 from django.core import serializers
-from django.core.exceptions import ValidationError, SuspiciousOperation, ObjectDoesNotExist
+from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.db import IntegrityError, connection, transaction
 from django.shortcuts import render
 from django.core.urlresolvers import reverse
@@ -38,7 +38,6 @@ from django_comments.forms import CommentForm
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.sessions.models import Session
-from django.contrib.sessions.backends.db import SessionStore
 from django.contrib.gis.db.models import Collect
 from django.contrib.gis.geos.collections import MultiPolygon
 from django.contrib.gis.geos import GEOSGeometry
@@ -60,6 +59,7 @@ from functools import wraps
 from redistricting.calculators import *
 from redistricting.models import *
 from redistricting.tasks import *
+from redistricting import sessionregistry, vectortiles
 import json
 import random
 import string
@@ -94,8 +94,8 @@ UNASSIGNED_DISTRICT_ID = 0
 def using_unique_session(u):
     """
     A test to determine if the user of the application is using a unique
-    session. Each user is permitted one unique session (one session in the
-    django_session table that has not yet expired). If the user exceeds
+    session. Each user is permitted one unique session (one registered
+    session that is still within its activity window). If the user exceeds
     this quota, this test fails, and the user will get bounced to the login
     url.
 
@@ -110,41 +110,12 @@ def using_unique_session(u):
     if u.is_anonymous() or u.is_superuser:
         return True
 
-    sessions = Session.objects.all()
-    count = 0
-    for session in sessions:
-        try:
-            decoded = session.get_decoded()
-
-            if '_auth_user_id' in decoded and decoded['_auth_user_id'] == u.id:
-                if 'activity_time' in decoded and decoded['activity_time'] < datetime.now(
-                ):
-                    # delete this session of mine; it is dormant
-                    Session.objects.filter(
-                        session_key=session.session_key).delete()
-                else:
-                    count += 1
-        except SuspiciousOperation:
-            logger.debug(
-                "SuspiciousOperation caught while checking the number of sessions a user has open. Session key: %s",
-                session.session_key)
-
-    # after counting all the open and active sessions, go back through
-    # the session list and assign the session count to all web sessions
-    # for this user. (do this for inactive sessions, too)
-    for session in sessions:
-        try:
-            decoded = session.get_decoded()
-            if '_auth_user_id' in decoded and decoded['_auth_user_id'] == u.id:
-                websession = SessionStore(session_key=session.session_key)
-                websession['count'] = count
-                websession.save()
-        except SuspiciousOperation:
-            logger.debug(
-                "SuspiciousOperation caught while setting the session count on all user sessions. Session key: %s",
-                session.session_key)
+    active, dormant = sessionregistry.prune_user_sessions(u.id)
+    if len(dormant) > 0:
+        # delete these sessions of mine; they are dormant
+        Session.objects.filter(session_key__in=dormant).delete()
 
-    return (count <= 1)
+    return (len(active) <= 1)
 
 
 def unique_session_or_json_redirect(function):
@@ -186,21 +157,9 @@ def is_session_available(req):
     if req.user.is_superuser or req.user.is_staff:
         return True
 
-    sessions = Session.objects.filter(expire_date__gt=datetime.now())
     count = 0
-    for session in sessions:
-        try:
-            decoded = session.get_decoded()
-            activity_time = decoded.get('activity_time')
-            activity_time_datetime = activity_time and \
-                dateutil.parser.parse(activity_time)
-            if not req.user.is_anonymous() and activity_time_datetime and \
-                    activity_time_datetime > datetime.now():
-                count += 1
-        except SuspiciousOperation:
-            logger.debug(
-                "SuspiciousOperation caught while checking the last activity time in a user's session. Session key: %s",
-                session.session_key)
+    if not req.user.is_anonymous():
+        count = sessionregistry.count_active()
 
     avail = count < settings.CONCURRENT_SESSIONS
     req.session['avail'] = avail
@@ -221,6 +180,15 @@ def note_session_activity(req):
     window = timedelta(0, 0, 0, 0, settings.SESSION_TIMEOUT)
     req.session['activity_time'] = (datetime.now() + window).isoformat()
 
+    # Register the session, so its activity can be checked without
+    # decoding every session in the database
+    if req.session.session_key is None:
+        req.session.save()
+    user_id = None if req.user.is_anonymous() else req.user.id
+    sessionregistry.register(req.session.session_key, user_id,
+                             req.session.get('registered_key'))
+    req.session['registered_key'] = req.session.session_key
+
 
 @login_required
 def unloadplan(request, planid):
@@ -321,27 +289,19 @@ def copyplan(request, planid):
 
     # Get all the districts in the original plan at the most recent version
     # of the original plan.
-    districts = p.get_districts_at_version(p.version, include_geom=True)
+    districts = p.get_districts_at_version(p.version, include_geom=False)
     for district in districts:
-        district_copy = copy.copy(district)
-
-        district_copy.id = None
-        district_copy.version = 0
-        district_copy.is_locked = False
-        district_copy.plan = plan_copy
-
         try:
-            district_copy.save()
+            # copy the district, along with its characteristics, comments,
+            # and tags, without transferring its geometry
+            district.clone_version(
+                version=0, is_locked=False, plan_id=plan_copy.id)
         except Exception as inst:
             status["message"] = _("Could not save district copies")
             status["exception"] = inst.message
             return HttpResponse(
                 json.dumps(status), content_type='application/json')
 
-        # clone the characteristics, comments, and tags from the original
-        # district to the copy
-        district_copy.clone_relations_from(district)
-
     # Serialize the plan object to the response.
     data = serializers.serialize("json", [plan_copy])
 
@@ -1431,10 +1391,10 @@ def fix_unassigned(request, planid):
 
     try:
         version = int(request.POST.get('version', plan.version))
-        result = plan.fix_unassigned(version)
-        status['success'] = result[0]
-        status['message'] = result[1]
-        status['version'] = plan.version
+        task = fix_unassigned_plan.delay(
+            plan.id, version, language=translation.get_language())
+        status['success'] = True
+        status['task_id'] = task.task_id
     except Exception, ex:
         status['message'] = _('Could not fix unassigned')
         status['exception'] = traceback.format_exc()
@@ -1443,6 +1403,41 @@ def fix_unassigned(request, planid):
     return HttpResponse(json.dumps(status), content_type='application/json')
 
 
+@login_required
+@unique_session_or_json_redirect
+def fix_unassigned_status(request, planid, task_id):
+    """
+    Get the status of fixing the unassigned geounits of a plan. While
+    the fix is running, the state is 'PROGRESS', along with the current
+    step. Once it is done, the state is 'SUCCESS', along with the result.
+    """
+    status = {'success': False}
+
+    try:
+        plan = Plan.objects.get(pk=planid)
+    except:
+        status['message'] = _('No plan with the given id')
+        return HttpResponse(
+            json.dumps(status), content_type='application/json')
+
+    if not can_edit(request.user, plan):
+        status['message'] = _("User can't edit the given plan")
+        return HttpResponse(
+            json.dumps(status), content_type='application/json')
+
+    task = fix_unassigned_plan.AsyncResult(task_id)
+    status['success'] = True
+    status['state'] = task.state
+    if task.state == 'SUCCESS':
+        status['result'] = task.result
+    elif task.state == 'PROGRESS':
+        status['progress'] = task.info
+    elif task.state == 'FAILURE':
+        status['success'] = False
+        status['message'] = _('Could not fix unassigned')
+    return HttpResponse(json.dumps(status), content_type='application/json')
+
+
 @unique_session_or_json_redirect
 def get_splits(request, planid, otherid, othertype):
     """
@@ -1837,6 +1832,73 @@ def simple_district_versioned(request, planid, district_ids=None):
     return HttpResponse(json.dumps(status), content_type='application/json')
 
 
+def district_tile(request, planid, z, x, y):
+    """
+    Serve the versioned districts of a plan as a vector tile.
+
+    This view serves the same districts and properties as
+    simple_district_versioned, encoded as a Mapbox Vector Tile with a
+    single 'districts' layer.
+
+    This method accepts 'version__eq', 'subject__eq' and 'level__eq' URL
+    parameters.
+
+    Parameters:
+        request -- An HttpRequest, with the current user.
+        planid -- The plan ID from which to get the districts.
+        z -- The zoom level of the tile.
+        x -- The column of the tile.
+        y -- The row of the tile.
+
+    Returns:
+        An HttpResponse containing the encoded tile.
+    """
+    note_session_activity(request)
+
+    try:
+        plan = Plan.objects.get(id=planid)
+    except Plan.DoesNotExist:
+        return HttpResponseNotFound()
+
+    z, x, y = int(z), int(x), int(y)
+    if x >= 2**z or y >= 2**z:
+        return HttpResponseNotFound()
+
+    try:
+        version = int(request.GET.get('version__eq', plan.version))
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    subject_id = request.GET.get('subject__eq')
+    if subject_id is None and plan.legislative_body.get_default_subject():
+        subject_id = plan.legislative_body.get_default_subject().id
+    if subject_id is None:
+        return HttpResponseBadRequest(
+            _('Subject for districts is required.'))
+    try:
+        subject_id = int(subject_id)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not Subject.objects.filter(id=subject_id).exists():
+        return HttpResponseBadRequest()
+
+    # The simplified geometries of a district are indexed by the geolevels
+    # of its legislative body, so only those geolevels can be drawn
+    geolevels = [g.id for g in plan.legislative_body.get_geolevels()]
+    geolevel = geolevels[0]
+    if 'level__eq' in request.GET:
+        try:
+            geolevel = int(request.GET['level__eq'])
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not geolevel in geolevels:
+            return HttpResponseBadRequest()
+
+    tile = plan.get_district_tile(version, subject_id, geolevel, z, x, y)
+
+    return HttpResponse(tile, content_type=vectortiles.CONTENT_TYPE)
+
+
 def get_unlocked_simple_geometries(request, planid):
     """
     Emulate a WFS service for selecting unlocked geometries.
@@ -2179,15 +2241,18 @@ def getleaderboardcsv(request):
         writer.writerow(['Plan ID', 'Plan Name', 'User Name'] +
                         [p.__unicode__() for p in panels])
 
+        # fetch or compute the scores of all the plans at once
+        plans = list(plans)
+        functions = [panel.score_functions.all()[0] for panel in panels]
+        scores = ComputedPlanScore.compute_many(functions, plans)
+
         # write row for each plan
         for plan in plans:
             row = [plan.id, plan.name, plan.owner.username]
 
             # add each score
-            for panel in panels:
-                function = panel.score_functions.all()[0]
-                score = ComputedPlanScore.compute(function, plan)
-                row.append(score['value'])
+            for function in functions:
+                row.append(scores[(function.id, plan.id)]['value'])
 
             # write the row
             writer.writerow(row)
@@ -2468,24 +2533,6 @@ def reaggregateplan(request, planid):
 
 
 def get_health(request):
-    def num_users(minutes):
-        users = 0
-        for session in Session.objects.all():
-            try:
-                decoded = session.get_decoded()
-            except:
-                #There's a problem with this session, remove it
-                session.delete()
-                continue
-
-            if 'activity_time' in decoded:
-                activity_delta = decoded['activity_time'] - timedelta(
-                    0, 0, 0, 0, settings.SESSION_TIMEOUT)
-                if activity_delta > (
-                        datetime.now() - timedelta(0, 0, 0, 0, minutes)):
-                    users += 1
-        return users
-
     try:
         result = _('Health retrieved at %(time)s\n') % {'time': datetime.now()}
         result += _('%(plan_count)d plans in database\n') % \
@@ -2494,7 +2541,7 @@ def get_health(request):
                 {'session_count': Session.objects.all().count(),
                 'session_limit': settings.CONCURRENT_SESSIONS}
         result += _('%(num_users)d active users over the last 10 minutes\n') % \
-                {'num_users':  num_users(10)}
+                {'num_users':  sessionregistry.count_active_since(10)}
         space = os.statvfs(settings.BASE_DIR)
         result += _('%(mb_free)s MB of disk space free\n') % \
                 {'mb_free': ((space.f_bsize * space.f_bavail) / (1024*1024))}
@@ -2733,16 +2780,13 @@ def district_info(request, planid, district_id):
                 # version if there were no edits for a while. If this
                 # is the case the district must be copied to the
                 # currently edited version.
-                district_copy = copy.copy(district)
-                district_copy.id = None
-                district_copy.version = version
-
-                district_copy.save()
-
-                # clone the characteristics, comments, and tags from
-                # the original district to the copy
-                district_copy.clone_relations_from(district)
-                district = district_copy
+                #
+                # The characteristics, comments, and tags are cloned
+                # along with the district.
+                district = district.clone_version(
+                    version=version,
+                    short_label=district.short_label,
+                    long_label=district.long_label)
             else:
                 # save the changes to the district -- maybe name change
                 district.save()
@@ -0,0 +1,563 @@
+/*
+   Copyright 2010 Micah Altman, Michael McDonald
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   This file is part of The Public Mapping Project
+   https://github.com/PublicMapping/
+
+   Purpose:
+       This script file defines a protocol that reads the districts of a
+       plan from the vector tiles of the plan, so the district layer can
+       load cached tiles instead of all of its districts after every edit.
+*/
+
+/**
+ * Decode the districts in a Mapbox Vector Tile.
+ *
+ * The tile is a protocol buffer, described by the Mapbox Vector Tile
+ * specification, version 2:
+ *     https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+ */
+OpenLayers.Format.DistrictTile = OpenLayers.Class(OpenLayers.Format, {
+
+    /**
+     * The name of the layer of districts in the tile.
+     */
+    layerName: 'districts',
+
+    /**
+     * Read the polygon features of a tile.
+     *
+     * Parameters:
+     *   buffer -- An ArrayBuffer of the encoded tile.
+     *   bounds -- The OpenLayers.Bounds of the tile, in map coordinates.
+     *
+     * Returns:
+     *   A list of OpenLayers.Feature.Vector, with their geometries clipped
+     *   to the bounds of the tile.
+     */
+    read: function(buffer, bounds) {
+        var reader = new OpenLayers.Format.DistrictTile.Reader(buffer);
+        var features = [];
+
+        while (reader.more()) {
+            var key = reader.key();
+            if (key.field != 3) {
+                reader.skip(key.type);
+                continue;
+            }
+            var layer = this.readLayer(reader.message());
+            if (layer.name == this.layerName) {
+                for (var i = 0; i < layer.features.length; i++) {
+                    var feature = this.createFeature(layer,
+                        layer.features[i], bounds);
+                    if (feature) {
+                        features.push(feature);
+                    }
+                }
+            }
+        }
+
+        return features;
+    },
+
+    /**
+     * Read a layer message.
+     */
+    readLayer: function(reader) {
+        var layer = { name: '', features: [], keys: [], values: [], extent: 4096 };
+
+        while (reader.more()) {
+            var key = reader.key();
+            if (key.field == 1) {
+                layer.name = reader.string();
+            } else if (key.field == 2) {
+                layer.features.push(this.readFeature(reader.message()));
+            } else if (key.field == 3) {
+                layer.keys.push(reader.string());
+            } else if (key.field == 4) {
+                layer.values.push(this.readValue(reader.message()));
+            } else if (key.field == 5) {
+                layer.extent = reader.varint();
+            } else {
+                reader.skip(key.type);
+            }
+        }
+
+        return layer;
+    },
+
+    /**
+     * Read a feature message.
+     */
+    readFeature: function(reader) {
+        var feature = { id: null, tags: [], type: 0, geometry: [] };
+
+        while (reader.more()) {
+            var key = reader.key();
+            if (key.field == 1) {
+                feature.id = reader.varint();
+            } else if (key.field == 2) {
+                feature.tags = reader.packed();
+            } else if (key.field == 3) {
+                feature.type = reader.varint();
+            } else if (key.field == 4) {
+                feature.geometry = reader.packed();
+            } else {
+                reader.skip(key.type);
+            }
+        }
+
+        return feature;
+    },
+
+    /**
+     * Read a value message.
+     */
+    readValue: function(reader) {
+        var value = null;
+
+        while (reader.more()) {
+            var key = reader.key();
+            if (key.field == 1) {
+                value = reader.string();
+            } else if (key.field == 2) {
+                value = reader.float32();
+            } else if (key.field == 3) {
+                value = reader.float64();
+            } else if (key.field == 4 || key.field == 5) {
+                value = reader.varint();
+            } else if (key.field == 6) {
+                value = reader.zigzag(reader.varint());
+            } else if (key.field == 7) {
+                value = reader.varint() == 1;
+            } else {
+                reader.skip(key.type);
+            }
+        }
+
+        return value;
+    },
+
+    /**
+     * Create a vector feature from a decoded polygon feature.
+     */
+    createFeature: function(layer, feature, bounds) {
+        // Only polygons are encoded in district tiles
+        if (feature.type != 3) {
+            return null;
+        }
+
+        var attributes = {};
+        for (var i = 0; i + 1 < feature.tags.length; i += 2) {
+            attributes[layer.keys[feature.tags[i]]] = layer.values[feature.tags[i + 1]];
+        }
+
+        var scale = layer.extent / (bounds.right - bounds.left);
+        var toPoint = function(coord) {
+            return new OpenLayers.Geometry.Point(
+                bounds.left + coord[0] / scale,
+                bounds.top - coord[1] / scale
+            );
+        };
+
+        var polygons = [];
+        var rings = this.readRings(feature.geometry);
+        for (i = 0; i < rings.length; i++) {
+            // Exterior rings have a positive area on the tile grid
+            var area = this.ringArea(rings[i]);
+            if (area == 0) {
+                continue;
+            }
+            var ring = this.clipRing(rings[i], layer.extent);
+            if (ring.length < 3) {
+                continue;
+            }
+            var points = [];
+            for (var j = 0; j < ring.length; j++) {
+                points.push(toPoint(ring[j]));
+            }
+            ring = new OpenLayers.Geometry.LinearRing(points);
+            if (area > 0) {
+                polygons.push(new OpenLayers.Geometry.Polygon([ring]));
+            } else if (polygons.length > 0) {
+                polygons[polygons.length - 1].addComponent(ring);
+            }
+        }
+        if (polygons.length == 0) {
+            return null;
+        }
+
+        var vector = new OpenLayers.Feature.Vector(
+            new OpenLayers.Geometry.MultiPolygon(polygons), attributes);
+        vector.fid = feature.id;
+        return vector;
+    },
+
+    /**
+     * Read the rings of polygon geometry commands, as lists of [x, y]
+     * tile grid coordinates.
+     */
+    readRings: function(commands) {
+        var rings = [];
+        var ring = null;
+        var x = 0, y = 0;
+        var i = 0;
+
+        while (i < commands.length) {
+            var command = commands[i] & 0x7;
+            var count = commands[i] >> 3;
+            i++;
+
+            if (command == 7) {
+                if (ring && ring.length > 2) {
+                    rings.push(ring);
+                }
+                ring = null;
+                continue;
+            }
+
+            for (var j = 0; j < count; j++) {
+                x += OpenLayers.Format.DistrictTile.Reader.prototype.zigzag(commands[i]);
+                y += OpenLayers.Format.DistrictTile.Reader.prototype.zigzag(commands[i + 1]);
+                i += 2;
+                if (command == 1) {
+                    ring = [[x, y]];
+                } else if (ring) {
+                    ring.push([x, y]);
+                }
+            }
+        }
+
+        return rings;
+    },
+
+    /**
+     * Get twice the signed area of a ring on the tile grid.
+     */
+    ringArea: function(ring) {
+        var area = 0;
+        for (var i = 0, j = ring.length - 1; i < ring.length; j = i++) {
+            area += ring[j][0] * ring[i][1] - ring[i][0] * ring[j][1];
+        }
+        return area;
+    },
+
+    /**
+     * Clip a ring to the tile, so the parts of districts in neighboring
+     * tiles meet at the tile edge instead of overlapping in the buffer
+     * around each tile.
+     */
+    clipRing: function(ring, extent) {
+        var edges = [
+            function(p) { return p[0] >= 0; },
+            function(p) { return p[0] <= extent; },
+            function(p) { return p[1] >= 0; },
+            function(p) { return p[1] <= extent; }
+        ];
+        var crossings = [
+            function(a, b) { return [0, a[1] + (b[1] - a[1]) * (0 - a[0]) / (b[0] - a[0])]; },
+            function(a, b) { return [extent, a[1] + (b[1] - a[1]) * (extent - a[0]) / (b[0] - a[0])]; },
+            function(a, b) { return [a[0] + (b[0] - a[0]) * (0 - a[1]) / (b[1] - a[1]), 0]; },
+            function(a, b) { return [a[0] + (b[0] - a[0]) * (extent - a[1]) / (b[1] - a[1]), extent]; }
+        ];
+
+        for (var e = 0; e < edges.length && ring.length > 0; e++) {
+            var inside = edges[e];
+            var clipped = [];
+            var previous = ring[ring.length - 1];
+            for (var i = 0; i < ring.length; i++) {
+                var current = ring[i];
+                if (inside(current)) {
+                    if (!inside(previous)) {
+                        clipped.push(crossings[e](previous, current));
+                    }
+                    clipped.push(current);
+                } else if (inside(previous)) {
+                    clipped.push(crossings[e](previous, current));
+                }
+                previous = current;
+            }
+            ring = clipped;
+        }
+
+        return ring;
+    },
+
+    CLASS_NAME: 'OpenLayers.Format.DistrictTile'
+});
+
+/**
+ * Read the fields of a protocol buffer message.
+ */
+OpenLayers.Format.DistrictTile.Reader = OpenLayers.Class({
+
+    initialize: function(buffer, start, end) {
+        this.view = new DataView(buffer);
+        this.bytes = new Uint8Array(buffer);
+        this.pos = start || 0;
+        this.end = (end === undefined) ? buffer.byteLength : end;
+    },
+
+    more: function() {
+        return this.pos < this.end;
+    },
+
+    varint: function() {
+        var value = 0, shift = 1, b;
+        do {
+            b = this.bytes[this.pos++];
+            value += (b & 0x7f) * shift;
+            shift *= 128;
+        } while (b >= 0x80);
+        return value;
+    },
+
+    zigzag: function(value) {
+        return (value % 2 == 1) ? -(value + 1) / 2 : value / 2;
+    },
+
+    key: function() {
+        var value = this.varint();
+        return { field: Math.floor(value / 8), type: value & 0x7 };
+    },
+
+    float32: function() {
+        var value = this.view.getFloat32(this.pos, true);
+        this.pos += 4;
+        return value;
+    },
+
+    float64: function() {
+        var value = this.view.getFloat64(this.pos, true);
+        this.pos += 8;
+        return value;
+    },
+
+    message: function() {
+        var length = this.varint();
+        var reader = new OpenLayers.Format.DistrictTile.Reader(
+            this.view.buffer, this.pos, this.pos + length);
+        this.pos += length;
+        return reader;
+    },
+
+    packed: function() {
+        var reader = this.message();
+        var values = [];
+        while (reader.more()) {
+            values.push(reader.varint());
+        }
+        return values;
+    },
+
+    string: function() {
+        var length = this.varint();
+        var chars = [];
+        for (var i = this.pos; i < this.pos + length; i++) {
+            chars.push(String.fromCharCode(this.bytes[i]));
+        }
+        this.pos += length;
+        return decodeURIComponent(escape(chars.join('')));
+    },
+
+    skip: function(type) {
+        if (type == 0) {
+            this.varint();
+        } else if (type == 1) {
+            this.pos += 8;
+        } else if (type == 2) {
+            this.pos += this.varint();
+        } else if (type == 5) {
+            this.pos += 4;
+        }
+    },
+
+    CLASS_NAME: 'OpenLayers.Format.DistrictTile.Reader'
+});
+
+/**
+ * A protocol that reads the districts of a plan from its vector tiles.
+ *
+ * It reads the same filters as the versioned district protocol: the
+ * 'version', 'subject' and 'level' comparisons and a BBOX, so it can be
+ * used with the BBOX and Refresh strategies of the district layer. The
+ * tiles covering the BBOX are fetched at a zoom level where a few tiles
+ * span it, and the parts of each district are joined into one feature.
+ */
+OpenLayers.Protocol.DistrictTiles = OpenLayers.Class(OpenLayers.Protocol, {
+
+    /**
+     * The url of the tiles of the plan, to which 'z/x/y.pbf' is appended.
+     */
+    url: null,
+
+    /**
+     * The largest zoom level of the tiles to fetch.
+     */
+    maxZoom: 20,
+
+    /**
+     * Half of the width of the web mercator world, in meters.
+     */
+    originShift: 20037508.342789244,
+
+    initialize: function(options) {
+        OpenLayers.Protocol.prototype.initialize.apply(this, [options]);
+        this.format = new OpenLayers.Format.DistrictTile();
+    },
+
+    /**
+     * Read the districts matching a filter.
+     */
+    read: function(options) {
+        OpenLayers.Protocol.prototype.read.apply(this, arguments);
+        options = OpenLayers.Util.applyDefaults(options, this.options);
+
+        var params = {};
+        var bbox = null;
+        var collect = function(filter) {
+            if (filter.CLASS_NAME == 'OpenLayers.Filter.Logical') {
+                for (var i = 0; i < filter.filters.length; i++) {
+                    collect(filter.filters[i]);
+                }
+            } else if (filter.CLASS_NAME == 'OpenLayers.Filter.Spatial') {
+                bbox = filter.value;
+            } else if (filter.CLASS_NAME == 'OpenLayers.Filter.Comparison') {
+                params[filter.property + '__eq'] = filter.value;
+            }
+        };
+        if (options.filter) {
+            collect(options.filter);
+        }
+
+        var response = new OpenLayers.Protocol.Response({requestType: 'read'});
+        response.priv = [];
+        if (!bbox) {
+            bbox = new OpenLayers.Bounds(-this.originShift, -this.originShift,
+                this.originShift, this.originShift);
+        }
+
+        var tiles = this.getTiles(bbox);
+        var pending = tiles.length;
+        var features = {};
+        var order = [];
+        var failed = false;
+        var self = this;
+
+        var done = function() {
+            if (response.aborted) {
+                return;
+            }
+            var merged = [];
+            for (var i = 0; i < order.length; i++) {
+                merged.push(features[order[i]]);
+            }
+            response.features = merged;
+            response.code = failed ? OpenLayers.Protocol.Response.FAILURE :
+                OpenLayers.Protocol.Response.SUCCESS;
+            if (options.callback) {
+                options.callback.call(options.scope, response);
+            }
+        };
+
+        $(tiles).each(function(i, tile) {
+            var request = new XMLHttpRequest();
+            request.open('GET', self.url + tile.z + '/' + tile.x + '/' + tile.y +
+                '.pbf?' + OpenLayers.Util.getParameterString(params), true);
+            request.responseType = 'arraybuffer';
+            request.onload = function() {
+                if (request.status == 200) {
+                    var read = self.format.read(request.response, tile.bounds);
+                    for (var j = 0; j < read.length; j++) {
+                        var feature = features[read[j].fid];
+                        if (feature) {
+                            feature.geometry.addComponents(read[j].geometry.components);
+                        } else {
+                            features[read[j].fid] = read[j];
+                            order.push(read[j].fid);
+                        }
+                    }
+                } else {
+                    failed = true;
+                }
+                if (--pending == 0) {
+                    done();
+                }
+            };
+            request.onerror = function() {
+                failed = true;
+                if (--pending == 0) {
+                    done();
+                }
+            };
+            request.send();
+            response.priv.push(request);
+        });
+
+        return response;
+    },
+
+    /**
+     * Get the tiles covering a bounding box, at the zoom level where two
+     * or three tiles span its width.
+     */
+    getTiles: function(bbox) {
+        var world = this.originShift * 2;
+        var width = Math.max(bbox.right - bbox.left, bbox.top - bbox.bottom, 1);
+        var z = Math.floor(Math.log(world / width) / Math.LN2) + 1;
+        z = Math.max(0, Math.min(this.maxZoom, z));
+
+        var size = world / Math.pow(2, z);
+        var last = Math.pow(2, z) - 1;
+        var column = function(x) {
+            return Math.max(0, Math.min(last, Math.floor((x + this.originShift) / size)));
+        };
+        var row = function(y) {
+            return Math.max(0, Math.min(last, Math.floor((this.originShift - y) / size)));
+        };
+
+        var tiles = [];
+        for (var x = column.call(this, bbox.left); x <= column.call(this, bbox.right); x++) {
+            for (var y = row.call(this, bbox.top); y <= row.call(this, bbox.bottom); y++) {
+                tiles.push({
+                    z: z,
+                    x: x,
+                    y: y,
+                    bounds: new OpenLayers.Bounds(
+                        x * size - this.originShift,
+                        this.originShift - (y + 1) * size,
+                        (x + 1) * size - this.originShift,
+                        this.originShift - y * size
+                    )
+                });
+            }
+        }
+        return tiles;
+    },
+
+    /**
+     * Abort the requests of a read.
+     */
+    abort: function(response) {
+        if (response) {
+            response.aborted = true;
+            $(response.priv).each(function(i, request) {
+                request.abort();
+            });
+        }
+    },
+
+    CLASS_NAME: 'OpenLayers.Protocol.DistrictTiles'
+});
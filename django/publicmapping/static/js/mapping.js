@@ -466,33 +466,65 @@ function mapinit(srs,maxExtent) {
             open: function() { $(".ui-dialog-titlebar-close", $(this).parent()).hide(); }
         });
 
+        var fixError = function(xhr, textStatus, error) {
+            pleaseWait.remove();
+            $('<div />').text(gettext('Error encountered while fixing unassigned')).dialog({
+                modal: true, autoOpen: true, title: gettext('Error'), resizable:false
+            });
+        };
+
+        var fixDone = function(data) {
+            pleaseWait.remove();
+            if (data.success) {
+                var updateAssignments = true;
+                $('#map').trigger('version_changed', [data.version, updateAssignments]);
+            }
+            $('<div>' + data.message + '</div>').dialog({
+                modal: false,
+                autoOpen: true,
+                resizable:false,
+                title: (data.success ? gettext('Success') : gettext('Error')),
+                buttons: [{
+                    text: gettext('OK'),
+                    click: function() { $(this).dialog('close'); }
+                }]
+            });
+        };
+
+        // The fix runs in the background; check on it until it's done
+        var pollFix = function(taskId) {
+            $.ajax({
+                type: 'GET',
+                url: '/districtmapping/plan/' + PLAN_ID + '/fixunassigned/' + taskId + '/',
+                success: function(data, textStatus, xhr) {
+                    if (!data.success) {
+                        fixDone(data);
+                    } else if (data.state === 'SUCCESS') {
+                        fixDone(data.result);
+                    } else {
+                        if (data.state === 'PROGRESS' && data.progress.total) {
+                            pleaseWait.text(gettext('Please wait. Fixing unassigned blocks.') + ' ' +
+                                data.progress.current + ' / ' + data.progress.total);
+                        }
+                        setTimeout(function() { pollFix(taskId); }, 1000);
+                    }
+                },
+                error: fixError
+            });
+        };
+
         $.ajax({
             type: 'POST',
             url: '/districtmapping/plan/' + PLAN_ID + '/fixunassigned/',
             data: { version: getPlanVersion() },
             success: function(data, textStatus, xhr) {
-                pleaseWait.remove();
                 if (data.success) {
-                    var updateAssignments = true;
-                    $('#map').trigger('version_changed', [data.version, updateAssignments]);
+                    pollFix(data.task_id);
+                } else {
+                    fixDone(data);
                 }
-                $('<div>' + data.message + '</div>').dialog({
-                    modal: false,
-                    autoOpen: true,
-                    resizable:false,
-                    title: (data.success ? gettext('Success') : gettext('Error')),
-                    buttons: [{
-                        text: gettext('OK'),
-                        click: function() { $(this).dialog('close'); }
-                    }]
-                });
             },
-            error: function(xhr, textStatus, error) {
-                pleaseWait.remove();
-                $('<div />').text(gettext('Error encountered while fixing unassigned')).dialog({
-                    modal: true, autoOpen: true, title: gettext('Error'), resizable:false
-                });
-            }
+            error: fixError
         });
     });
 
@@ -715,7 +747,9 @@ function mapinit(srs,maxExtent) {
     };
 
     // A vector layer that holds all the districts in
-    // the current plan.
+    // the current plan. The districts are read from the cached
+    // vector tiles of the plan, so only the tiles of districts
+    // changed by an edit are drawn again by the server.
     var districtLayer = new OpenLayers.Layer.Vector(
         'Current Plan',
         {
@@ -723,9 +757,8 @@ function mapinit(srs,maxExtent) {
                 districtStrategy,
                 refreshStrategy
             ],
-            protocol: new OpenLayers.Protocol.HTTP({
-                url: '/districtmapping/plan/' + PLAN_ID + '/district/versioned/',
-                format: new OpenLayers.Format.GeoJSON()
+            protocol: new OpenLayers.Protocol.DistrictTiles({
+                url: '/districtmapping/plan/' + PLAN_ID + '/tiles/'
             }),
             styleMap: new OpenLayers.StyleMap({'default':new OpenLayers.Style(districtStyle)}),
             projection: projection,